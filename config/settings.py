@@ -18,6 +18,11 @@ GEMINI_API_KEY_STATE_FILE = os.path.join(_CONFIG_DIR, '.api_key_last_index.txt')
 OPENROUTER_API_KEY_BASE_NAME = "OPENROUTER_API_KEY"
 OPENROUTER_NUM_API_KEYS = int(os.getenv("OPENROUTER_NUM_API_KEYS", 0)) # Leído de .env, default 0
 OPENROUTER_API_KEY_STATE_FILE = os.path.join(_CONFIG_DIR, '.openrouter_api_key_last_index.txt')
+# Factores de calibración del estimador local de tokens (ver nucleo/estimadorTokens.py)
+ESTIMADOR_TOKENS_STATE_FILE = os.path.join(_CONFIG_DIR, '.calibracion_tokens.json')
+# Ventana de tokens por minuto compartida por todos los procesos del agente en esta máquina
+RUTA_LIMITADOR_TOKENS = os.getenv("RUTA_LIMITADOR_TOKENS", os.path.join(_CONFIG_DIR, '.limitador_tokens.sqlite3'))
+LIMITADOR_TOKENS_PERSISTENTE = os.getenv("LIMITADOR_TOKENS_PERSISTENTE", "true").lower() in ("1", "true", "si", "yes") # false: ventana solo en memoria del proceso
 
 # --- Función para leer el último índice usado (Reutilizable) ---
 def _read_last_key_index(state_file, num_keys, provider_name="API"):
@@ -138,6 +143,21 @@ else:
     if not OPENROUTER_API_KEY:
          print(f"settings (OpenRouter): Clave base '{OPENROUTER_API_KEY_BASE_NAME}' tampoco encontrada.")
 
+# --- Pool de Claves API ---
+def _cargar_todas_las_claves(base_name, num_keys, clave_preferida=None):
+    """Devuelve todas las claves configuradas (sin duplicados), empezando por la elegida en la rotación."""
+    claves = [clave_preferida] if clave_preferida else []
+    for i in range(max(num_keys, 1)):
+        valor = os.getenv(_get_key_env_var_name(base_name, i))
+        if valor and valor not in claves:
+            claves.append(valor)
+    return claves
+
+GEMINI_API_KEYS = _cargar_todas_las_claves(GEMINI_API_KEY_BASE_NAME, GEMINI_NUM_API_KEYS, GEMINIAPIKEY) if GEMINI_NUM_API_KEYS > 0 else []
+OPENROUTER_API_KEYS = _cargar_todas_las_claves(OPENROUTER_API_KEY_BASE_NAME, OPENROUTER_NUM_API_KEYS, OPENROUTER_API_KEY)
+API_KEY_ENFRIAMIENTO_SEGUNDOS = int(os.getenv("API_KEY_ENFRIAMIENTO_SEGUNDOS", 60)) # Pausa de una clave tras un error de cuota
+API_KEY_ENFRIAMIENTO_INVALIDA_SEGUNDOS = int(os.getenv("API_KEY_ENFRIAMIENTO_INVALIDA_SEGUNDOS", 3600)) # Pausa de una clave rechazada (permiso/autenticación)
+
 # --- Configuración OpenRouter ---
 OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
 OPENROUTER_REFERER = os.getenv("OPENROUTER_REFERER", "<YOUR_SITE_URL>") # Reemplazar si es necesario
@@ -157,6 +177,7 @@ RAMATRABAJO = os.getenv("RAMATRABAJO", "Orion")
 # --- Configuracion de Modelos IA ---
 MODELO_GOOGLE_GEMINI = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-preview-05-20")
 MODELO_GOOGLE_GEMINI_MAX_OUTPUT_TOKENS = int(os.getenv("MODELO_GOOGLE_GEMINI_MAX_OUTPUT_TOKENS", 60000)) # Default 8192
+STREAMING_IA = os.getenv("STREAMING_IA", "false").lower() in ("1", "true", "si", "yes") # Streaming + parseo incremental en la ejecución de tareas
 
 # --- Configuración del Agente Adaptativo y Límites de API ---
 N_HISTORIAL_CONTEXTO = int(os.getenv("N_HISTORIAL_CONTEXTO", 10)) # Reducido de 30 a 10
@@ -164,10 +185,36 @@ TOKEN_LIMIT_PER_MINUTE = int(os.getenv("TOKEN_LIMIT_PER_MINUTE", 250000)) # Lím
 MAX_CICLOS_PRINCIPALES_AGENTE = int(os.getenv("MAX_CICLOS_PRINCIPALES_AGENTE", 5)) # Número máximo de ciclos principales
 DELAY_ENTRE_CICLOS_AGENTE = int(os.getenv("DELAY_ENTRE_CICLOS_AGENTE", 3)) # Segundos de pausa entre ciclos
 SCRIPT_EXECUTION_TIMEOUT_SECONDS = int(os.getenv("SCRIPT_EXECUTION_TIMEOUT_SECONDS", 30 * 60)) # Default 30 minutos
+MAX_REINTENTOS_TAREA = int(os.getenv("MAX_REINTENTOS_TAREA", 3)) # Reintentos de una tarea FALLIDA_TEMPORALMENTE (la misión puede fijar el suyo con '- **Máximo Reintentos:** N')
+TAREAS_PARALELAS = int(os.getenv("TAREAS_PARALELAS", 1)) # Tareas independientes de una misión ejecutadas a la vez (1 = una por ejecución, en orden)
+MAX_TAREAS_POR_FASE = int(os.getenv("MAX_TAREAS_POR_FASE", 1)) # Tareas de la misión activa ejecutadas por fase antes de salir (1 = salir tras cada tarea; un lote paralelo cuenta como una)
+PRESUPUESTO_SEGUNDOS_FASE = int(os.getenv("PRESUPUESTO_SEGUNDOS_FASE", 0)) # No empezar otra tarea si no cabe en este tiempo de fase (0 = solo el timeout global)
+PRESUPUESTO_TOKENS_FASE = int(os.getenv("PRESUPUESTO_TOKENS_FASE", 0)) # No empezar otra tarea tras consumir estos tokens en la fase (0 = sin límite)
+IA_MAX_CONCURRENCIA_GLOBAL = int(os.getenv("IA_MAX_CONCURRENCIA_GLOBAL", 4)) # Llamadas a la IA en vuelo a la vez (todas)
+IA_MAX_CONCURRENCIA_GOOGLE = int(os.getenv("IA_MAX_CONCURRENCIA_GOOGLE", 4)) # Llamadas simultáneas a Gemini
+IA_MAX_CONCURRENCIA_OPENROUTER = int(os.getenv("IA_MAX_CONCURRENCIA_OPENROUTER", 2)) # Llamadas simultáneas a OpenRouter
+IA_MAX_REINTENTOS = int(os.getenv("IA_MAX_REINTENTOS", 3)) # Reintentos por proveedor ante errores transitorios (503, 429, timeouts)
+IA_BACKOFF_BASE_SEGUNDOS = float(os.getenv("IA_BACKOFF_BASE_SEGUNDOS", 2)) # Espera base del backoff exponencial
+IA_BACKOFF_MAX_SEGUNDOS = float(os.getenv("IA_BACKOFF_MAX_SEGUNDOS", 60)) # Tope de espera entre reintentos
+IA_FAILOVER_HABILITADO = os.getenv("IA_FAILOVER_HABILITADO", "false").lower() in ("1", "true", "si", "yes") # Cambiar google <-> openrouter si se agotan los reintentos
 
 # --- Configuracion de Analisis de Código ---
 EXTENSIONESPERMITIDAS = os.getenv("EXTENSIONESPERMITIDAS", ".php,.js,.py,").split(',')
 DIRECTORIOS_IGNORADOS = os.getenv("DIRECTORIOS_IGNORADOS", "vendor,node_modules,.git,.github,docs,assets,Tests,languages,cache,logs,uploads,tmp,temp").split(',')
+LISTADO_ARCHIVOS_GIT = os.getenv("LISTADO_ARCHIVOS_GIT", "true").lower() in ("1", "true", "si", "yes") # Listar con 'git ls-files' (respeta .gitignore) en lugar de recorrer el disco
+LECTURA_ARCHIVOS_HILOS = int(os.getenv("LECTURA_ARCHIVOS_HILOS", 8)) # Hilos para leer archivos de contexto en paralelo
+PRESUPUESTO_TOKENS_CONTEXTO = int(os.getenv("PRESUPUESTO_TOKENS_CONTEXTO", 0)) # Máx. tokens de archivos de contexto por prompt (0 = sin límite)
+REANCLAJE_BLOQUES = os.getenv("REANCLAJE_BLOQUES", "true").lower() in ("1", "true", "si", "yes") # Corregir los rangos de los bloques objetivo desplazados por tareas previas
+PRESUPUESTO_TOKENS_ESTRUCTURA = int(os.getenv("PRESUPUESTO_TOKENS_ESTRUCTURA", 3000)) # Máx. tokens del árbol del proyecto en prompts; se resume lejos del archivo elegido (0 = árbol completo)
+CONTEXTO_GRAFO_TOP_K = int(os.getenv("CONTEXTO_GRAFO_TOP_K", 5)) # Archivos relacionados por imports que se añaden como contexto al crear la misión (0 = desactivado)
+PRESUPUESTO_TOKENS_RECUPERACION = int(os.getenv("PRESUPUESTO_TOKENS_RECUPERACION", 4000)) # Máx. tokens de fragmentos de código (búsqueda BM25 local) en misiones desde TODO.md (0 = desactivado)
+
+# --- Configuracion de Cache de Respuestas IA ---
+# Fuera de RUTACLON para sobrevivir a 'git clean -fdx' y no acabar en los commits del repo objetivo.
+RUTA_CACHE_IA = os.getenv("RUTA_CACHE_IA", os.path.join(RUTA_BASE_PROYECTO, '.cache_ia'))
+CACHE_IA_HABILITADA = os.getenv("CACHE_IA_HABILITADA", "true").lower() in ("1", "true", "si", "yes")
+CACHE_IA_TTL_SEGUNDOS = int(os.getenv("CACHE_IA_TTL_SEGUNDOS", 7 * 24 * 3600)) # Default 7 días
+CACHE_IA_MAX_MB = int(os.getenv("CACHE_IA_MAX_MB", 200)) # Tamaño máximo en disco antes de desalojar (LRU)
 
 # --- Logging de Configuracion ---
 # Usar print para los logs iniciales de settings porque el logger puede no estar configurado aún
@@ -183,6 +230,7 @@ else:
     print("settings (Gemini): Rotación desactivada (GEMINI_NUM_API_KEYS=0).")
 print(f"settings (Gemini): Modelo: {MODELO_GOOGLE_GEMINI}")
 print(f"settings (Gemini): Max Output Tokens: {MODELO_GOOGLE_GEMINI_MAX_OUTPUT_TOKENS}")
+print(f"settings: Streaming IA en ejecución de tareas: {'Activado' if STREAMING_IA else 'Desactivado'}")
 
 # OpenRouter
 if OPENROUTER_NUM_API_KEYS > 0:
@@ -202,6 +250,7 @@ print(f"settings (OpenRouter): Base URL: {OPENROUTER_BASE_URL}")
 print(f"settings (OpenRouter): Referer: {OPENROUTER_REFERER}")
 print(f"settings (OpenRouter): Title: {OPENROUTER_TITLE}")
 print(f"settings (OpenRouter): Model: {OPENROUTER_MODEL}")
+print(f"settings: Pool de claves API: Gemini {len(GEMINI_API_KEYS)}, OpenRouter {len(OPENROUTER_API_KEYS)} (enfriamiento por cuota: {API_KEY_ENFRIAMIENTO_SEGUNDOS}s)")
 
 # Generales
 print(f"settings: Repositorio URL: {REPOSITORIOURL}")
@@ -212,13 +261,28 @@ print(f"settings: Rama de Trabajo: {RAMATRABAJO}")
 # Agente y Límites
 print(f"settings: Entradas de Historial para Contexto: {N_HISTORIAL_CONTEXTO}")
 print(f"settings: Límite de Tokens por Minuto: {TOKEN_LIMIT_PER_MINUTE}")
+print(f"settings: Ventana de Tokens: {RUTA_LIMITADOR_TOKENS if LIMITADOR_TOKENS_PERSISTENTE else 'en memoria'}")
 print(f"settings: Máx Ciclos Principales Agente: {MAX_CICLOS_PRINCIPALES_AGENTE}")
 print(f"settings: Delay Entre Ciclos Agente: {DELAY_ENTRE_CICLOS_AGENTE}s")
 print(f"settings: Timeout Global del Script: {SCRIPT_EXECUTION_TIMEOUT_SECONDS} segundos")
+print(f"settings: Reintentos por tarea fallida temporalmente: {MAX_REINTENTOS_TAREA}")
+print(f"settings: Tareas de misión en paralelo: {TAREAS_PARALELAS}")
+print(f"settings: Tareas por fase: {MAX_TAREAS_POR_FASE} (presupuesto: {PRESUPUESTO_SEGUNDOS_FASE or SCRIPT_EXECUTION_TIMEOUT_SECONDS}s, {PRESUPUESTO_TOKENS_FASE or 'sin límite de'} tokens)")
+print(f"settings: Concurrencia IA: Global {IA_MAX_CONCURRENCIA_GLOBAL}, Gemini {IA_MAX_CONCURRENCIA_GOOGLE}, OpenRouter {IA_MAX_CONCURRENCIA_OPENROUTER}")
+print(f"settings: Reintentos IA: {IA_MAX_REINTENTOS} (backoff {IA_BACKOFF_BASE_SEGUNDOS}s-{IA_BACKOFF_MAX_SEGUNDOS}s), Failover: {'Activado' if IA_FAILOVER_HABILITADO else 'Desactivado'}")
 
 # Análisis
 print(f"settings: Extensiones Permitidas: {EXTENSIONESPERMITIDAS}")
 print(f"settings: Directorios Ignorados: {DIRECTORIOS_IGNORADOS}")
+print(f"settings: Listado de archivos vía git ls-files: {'Activado' if LISTADO_ARCHIVOS_GIT else 'Desactivado'}")
+print(f"settings: Lectura de archivos: {LECTURA_ARCHIVOS_HILOS} hilos, presupuesto de contexto: {PRESUPUESTO_TOKENS_CONTEXTO or 'sin límite'} tokens")
+print(f"settings: Re-anclaje de bloques objetivo: {'Activado' if REANCLAJE_BLOQUES else 'Desactivado'}")
+print(f"settings: Presupuesto de la estructura del proyecto: {PRESUPUESTO_TOKENS_ESTRUCTURA or 'árbol completo'} tokens")
+print(f"settings: Contexto por grafo de dependencias: {CONTEXTO_GRAFO_TOP_K or 'desactivado'} archivos")
+print(f"settings: Fragmentos recuperados para misiones desde TODO.md: {PRESUPUESTO_TOKENS_RECUPERACION or 'desactivado'} tokens")
+
+# Cache IA
+print(f"settings: Cache IA: {'Activada' if CACHE_IA_HABILITADA else 'Desactivada'} (Ruta: {RUTA_CACHE_IA}, TTL: {CACHE_IA_TTL_SEGUNDOS}s, Máx: {CACHE_IA_MAX_MB} MB)")
 
 
 # Configuración del logger (esto es para que 'settings.py' pueda loguear si se importa después de configurar logging)
@@ -5,13 +5,21 @@ import json
 import random
 import re
 import datetime
+import time
+import asyncio
+import concurrent.futures
 import google.generativeai as genai
-import google.generativeai.types as types
 import google.api_core.exceptions
-# Mantenido por si se usa OpenRouter directamente
-from openai import OpenAI, APIError
+from openai import APIError
 from config import settings
-# from google.generativeai import types # types está en genai.types
+from nucleo import cacheRespuestasIA
+from nucleo import estimadorTokens
+from nucleo import parserJsonIncremental
+from nucleo import proveedoresIA
+from nucleo import politicaReintentos
+from nucleo import indiceArchivos
+from nucleo import arbolProyecto
+from nucleo import indiceBusqueda
 
 log = logging.getLogger(__name__)
 geminiConfigurado = False
@@ -70,19 +78,12 @@ def listarArchivosProyecto(rutaProyecto, extensionesPermitidas=None, directorios
     try:
         log.info(
             f"{logPrefix} Listando archivos en: {rutaBaseParaListar} (Ignorando: {directoriosIgnorados})")
-        for raiz, dirs, archivos in os.walk(rutaBaseParaListar, topdown=True):
-            # Aplicar directoriosIgnorados también a las subcarpetas encontradas durante el walk
-            dirs[:] = [
-                d for d in dirs if d not in directoriosIgnorados and not d.startswith('.')]
-
-            for nombreArchivo in archivos:
-                if nombreArchivo.startswith('.'):
-                    continue
-
-                _, ext = os.path.splitext(nombreArchivo)
-                if not extensionesPermitidas or ext.lower() in extensionesPermitidas:
-                    rutaCompleta = os.path.join(raiz, nombreArchivo)
-                    archivosProyecto.append(os.path.normpath(rutaCompleta))
+        # Índice incremental persistido en .orion_meta/ (ver nucleo/indiceArchivos.py) en lugar de os.walk
+        archivosProyecto = indiceArchivos.listarArchivos(
+            rutaBaseParaListar, extensionesPermitidas, directoriosIgnorados,
+            os.path.join(rutaProyecto, '.orion_meta'))
+        if archivosProyecto is None:
+            return None
 
         log.info(
             f"{logPrefix} Archivos relevantes encontrados ({len(archivosProyecto)}) desde '{rutaBaseParaListar}'.")
@@ -92,21 +93,36 @@ def listarArchivosProyecto(rutaProyecto, extensionesPermitidas=None, directorios
             f"{logPrefix} Error listando archivos en {rutaBaseParaListar}: {e}", exc_info=True)
 
 
-def leerArchivos(listaArchivos, rutaBase, api_provider='google'):  # Añadido api_provider
+def _leerArchivoBytes(rutaAbsNorm):
+    """Lee un archivo en binario; devuelve (bytes, None) o (None, error)."""
+    try:
+        with open(rutaAbsNorm, 'rb') as f:
+            return f.read(), None
+    except Exception as e:
+        return None, e
+
+
+def leerArchivos(listaArchivos, rutaBase, api_provider='google', max_bytes=None, max_tokens=None,
+                 obligatorios=0):  # Añadido api_provider
+    """
+    Lee y concatena los archivos (en el orden dado) con marcadores START/END FILE.
+    La lectura se hace en paralelo (LECTURA_ARCHIVOS_HILOS hilos). Con `max_bytes` / `max_tokens`
+    se deja de añadir archivos en cuanto el siguiente no cabría en el presupuesto; los que
+    quedan fuera se cuentan en 'omitidos_por_presupuesto'. Los `obligatorios` primeros archivos
+    de la lista se incluyen siempre (cuentan para el presupuesto pero no se recortan).
+    'archivos' lista las rutas relativas incluidas en 'contenido'.
+    """
     logPrefix = "leerArchivos:"
 
     if not listaArchivos:
         log.info(f"{logPrefix} La lista de archivos a leer estaba vacía.")
-        return {'contenido': "", 'bytes': 0, 'tokens': 0, 'archivos_leidos': 0}
+        return {'contenido': "", 'bytes': 0, 'tokens': 0, 'archivos_leidos': 0, 'omitidos_por_presupuesto': 0,
+                'archivos': []}
 
-    contenidoConcatenado = ""
-    archivosLeidos = 0
-    bytesTotales = 0
-    tokensTotales = 0  # Nuevo para contar tokens
     archivosFallidos = []
-
-    for rutaAbsoluta in listaArchivos:
-        rutaBaseNorm = os.path.normpath(os.path.abspath(rutaBase))
+    rutaBaseNorm = os.path.normpath(os.path.abspath(rutaBase))
+    candidatos = []  # (rutaAbsoluta, rutaAbsNorm, rutaRelativa, tamano, obligatorio)
+    for posicion, rutaAbsoluta in enumerate(listaArchivos):
         rutaAbsNorm = os.path.normpath(os.path.abspath(rutaAbsoluta))
 
         if not rutaAbsNorm.startswith(rutaBaseNorm + os.sep) and rutaAbsNorm != rutaBaseNorm:
@@ -114,81 +130,105 @@ def leerArchivos(listaArchivos, rutaBase, api_provider='google'):  # Añadido ap
                 f"{logPrefix} Archivo '{rutaAbsoluta}' parece estar fuera de la ruta base '{rutaBase}'. Se omitirá.")
             archivosFallidos.append(rutaAbsoluta)
             continue
-        if not os.path.exists(rutaAbsNorm) or not os.path.isfile(rutaAbsNorm):
+        try:
+            stat = os.stat(rutaAbsNorm)
+        except OSError:
+            stat = None
+        if stat is None or not os.path.isfile(rutaAbsNorm):
             log.warning(
                 f"{logPrefix} Archivo no encontrado o no es un archivo válido en '{rutaAbsNorm}'. Se omitirá.")
             archivosFallidos.append(rutaAbsoluta)
             continue
-
-        try:
-            rutaRelativa = os.path.relpath(
-                rutaAbsNorm, rutaBaseNorm).replace(os.sep, '/')
-
-            with open(rutaAbsNorm, 'r', encoding='utf-8', errors='ignore') as f:
-                contenido = f.read()
-                bytesArchivo = len(contenido.encode('utf-8'))
-                contenidoConcatenado += f"########## START FILE: {rutaRelativa} ##########\n"
-                contenidoConcatenado += contenido
-                contenidoConcatenado += f"\n########## END FILE: {rutaRelativa} ##########\n\n"
+        rutaRelativa = os.path.relpath(rutaAbsNorm, rutaBaseNorm).replace(os.sep, '/')
+        candidatos.append((rutaAbsoluta, rutaAbsNorm, rutaRelativa, stat.st_size, posicion < obligatorios))
+
+    # Con presupuesto de bytes, los tamaños de os.stat permiten descartar archivos sin leerlos.
+    omitidosPorPresupuesto = 0
+    if max_bytes is not None:
+        acumulado = 0
+        dentro = []
+        for candidato in candidatos:
+            if not candidato[4] and acumulado + candidato[3] > max_bytes:
+                omitidosPorPresupuesto = len(candidatos) - len(dentro)
+                break
+            acumulado += candidato[3]
+            dentro.append(candidato)
+        candidatos = dentro
+
+    partes = []
+    rutasLeidas = []
+    archivosLeidos = 0
+    bytesTotales = 0
+    tokensTotales = 0
+    if candidatos:
+        hilos = max(1, min(settings.LECTURA_ARCHIVOS_HILOS, len(candidatos)))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=hilos) as ejecutor:
+            futuros = [ejecutor.submit(_leerArchivoBytes, c[1]) for c in candidatos]
+            for posicion, (candidato, futuro) in enumerate(zip(candidatos, futuros)):
+                rutaAbsoluta, rutaAbsNorm, rutaRelativa, _, obligatorio = candidato
+                datos, error = futuro.result()
+                if error is not None:
+                    log.error(
+                        f"{logPrefix} Error leyendo '{rutaAbsNorm}' (Relativa: '{rutaRelativa}'): {error}")
+                    archivosFallidos.append(rutaAbsoluta)
+                    continue
+                # Mismo texto que la lectura en modo texto: saltos de línea normalizados a '\n'
+                texto = datos.decode('utf-8', errors='ignore').replace('\r\n', '\n').replace('\r', '\n')
+                bloque = (f"########## START FILE: {rutaRelativa} ##########\n"
+                          f"{texto}"
+                          f"\n########## END FILE: {rutaRelativa} ##########\n\n")
+                tokensBloque = contarTokensTexto(bloque, api_provider)
+                if not obligatorio and max_tokens is not None and tokensTotales + tokensBloque > max_tokens:
+                    omitidosPorPresupuesto += len(candidatos) - posicion
+                    for pendiente in futuros[posicion + 1:]:
+                        pendiente.cancel()
+                    log.info(
+                        f"{logPrefix} Presupuesto de {max_tokens} tokens alcanzado; se omiten {len(candidatos) - posicion} archivo(s) desde '{rutaRelativa}'.")
+                    break
+                partes.append(bloque)
+                rutasLeidas.append(rutaRelativa)
+                tokensTotales += tokensBloque
+                bytesTotales += len(datos)
                 archivosLeidos += 1
-                bytesTotales += bytesArchivo
-        except Exception as e:
-            log.error(
-                f"{logPrefix} Error leyendo '{rutaAbsNorm}' (Relativa: '{rutaRelativa if 'rutaRelativa' in locals() else 'N/A'}'): {e}")
-            archivosFallidos.append(rutaAbsoluta)
 
     if archivosFallidos:
         log.warning(
             f"{logPrefix} No se pudieron leer {len(archivosFallidos)} archivos: {archivosFallidos[:5]}{'...' if len(archivosFallidos) > 5 else ''}")
+    if omitidosPorPresupuesto:
+        log.warning(
+            f"{logPrefix} {omitidosPorPresupuesto} archivo(s) omitidos por presupuesto (max_bytes={max_bytes}, max_tokens={max_tokens}).")
 
     if archivosLeidos > 0:
         tamanoKB = bytesTotales / 1024
-        log_msg_base = f"{logPrefix} Leídos {archivosLeidos} archivos. Tamaño total: {tamanoKB:.2f} KB."
-
-        if contenidoConcatenado:
-            tokensTotales = contarTokensTexto(
-                contenidoConcatenado, api_provider)
-            log.info(f"{log_msg_base} Tokens estimados: {tokensTotales}.")
-        else:
-            log.info(log_msg_base + " Contenido vacío, 0 tokens.")
-
-        return {'contenido': contenidoConcatenado, 'bytes': bytesTotales, 'tokens': tokensTotales, 'archivos_leidos': archivosLeidos}
+        log.info(f"{logPrefix} Leídos {archivosLeidos} archivos. Tamaño total: {tamanoKB:.2f} KB. "
+                 f"Tokens estimados: {tokensTotales}.")
+        return {'contenido': "".join(partes), 'bytes': bytesTotales, 'tokens': tokensTotales,
+                'archivos_leidos': archivosLeidos, 'omitidos_por_presupuesto': omitidosPorPresupuesto,
+                'archivos': rutasLeidas}
     else:
         log.warning(
             f"{logPrefix} No se leyó ningún archivo. Total de rutas intentadas: {len(listaArchivos)}.")
-        return {'contenido': "", 'bytes': 0, 'tokens': 0, 'archivos_leidos': 0}
+        return {'contenido': "", 'bytes': 0, 'tokens': 0, 'archivos_leidos': 0,
+                'omitidos_por_presupuesto': omitidosPorPresupuesto, 'archivos': []}
 
 
 def contarTokensTexto(texto, api_provider='google'):
-    logPrefix = "contarTokensTexto:"
-    tokens = 0
+    """
+    Estima los tokens de `texto` localmente (sin llamadas a la API) con nucleo/estimadorTokens,
+    calibrado con el uso real que reportan las respuestas de cada proveedor.
+    """
     if not texto:
         return 0
-
-    if api_provider == 'google':
-        try:
-            modelo_gemini_para_conteo = getattr(
-                settings, 'MODELO_GOOGLE_GEMINI', None)
-            if modelo_gemini_para_conteo:
-                if not geminiConfigurado:
-                    configurarGemini()
-                model = genai.GenerativeModel(modelo_gemini_para_conteo)
-                respuesta_conteo = model.count_tokens(texto)
-                tokens = respuesta_conteo.total_tokens
-            else:
-                log.warning(
-                    f"{logPrefix} MODELO_GOOGLE_GEMINI no definido. Tokens no contados para Google.")
-                tokens = len(texto) // 4  # Aproximación muy general
-        except Exception as e_count_tokens:
-            log.error(
-                f"{logPrefix} Error contando tokens con Gemini: {e_count_tokens}", exc_info=True)
-            tokens = len(texto) // 4
-    else:  # OpenRouter u otros
-        tokens = len(texto) // 4  # Aproximación general
-    return tokens
+    modelo = settings.MODELO_GOOGLE_GEMINI if api_provider == 'google' else settings.OPENROUTER_MODEL
+    return estimadorTokens.estimarTokens(texto, api_provider, modelo)
 
 
-def generarEstructuraDirectorio(ruta_base, directorios_ignorados=None, max_depth=8, incluir_archivos=True, indent_char="    "):
+def generarEstructuraDirectorio(ruta_base, directorios_ignorados=None, max_depth=8, incluir_archivos=True, indent_char="    ", subruta=None):
+    """
+    Árbol de directorios de `ruta_base` como texto. Todas las variantes (profundidad, solo
+    directorios con incluir_archivos=False, o solo el subárbol `subruta`) salen de un único modelo
+    en memoria (nucleo/arbolProyecto.py) y se cachean hasta que cambia el árbol.
+    """
     logPrefix = "generarEstructuraDirectorio:"
     if not os.path.isdir(ruta_base):
         log.error(
@@ -202,69 +242,42 @@ def generarEstructuraDirectorio(ruta_base, directorios_ignorados=None, max_depth
 
     directorios_ignorados.add('.git')
 
-    estructura_lines = [os.path.basename(ruta_base) + "/"]
-    processed_paths = set()
-
-    def _walk_recursive(current_path, depth, prefix=""):
-        if depth > max_depth:
-            if depth == max_depth + 1:
-                estructura_lines.append(
-                    prefix + "└── ... (Profundidad máxima alcanzada)")
-            return
+    try:
+        estructura = arbolProyecto.generarEstructura(
+            ruta_base, directorios_ignorados, os.path.join(ruta_base, '.orion_meta'),
+            max_depth=max_depth, incluir_archivos=incluir_archivos, indent_char=indent_char, subruta=subruta)
+    except Exception as e:
+        log.error(
+            f"{logPrefix} Error inesperado generando estructura: {e}", exc_info=True)
+        return None
+    if estructura is not None:
+        log.info(
+            f"{logPrefix} Estructura de directorios generada para '{ruta_base}' (hasta {max_depth} niveles).")
+    return estructura
 
-        real_path = os.path.realpath(current_path)
-        if real_path in processed_paths:
-            estructura_lines.append(
-                prefix + f"└── -> ... (Enlace circular o repetido a {os.path.basename(real_path)})")
-            return
-        processed_paths.add(real_path)
 
-        try:
-            entries = sorted(os.listdir(current_path))
-        except OSError as e:
-            estructura_lines.append(
-                prefix + f"└── [Error al listar: {e.strerror}]")
-            return
-
-        items = []
-        for entry in entries:
-            if entry.startswith('.') or entry in directorios_ignorados:
-                continue
-
-            entry_path = os.path.join(current_path, entry)
-            is_dir = False
-            try:
-                is_dir = os.path.isdir(entry_path)
-            except OSError:
-                continue
-
-            if is_dir:
-                if os.path.basename(entry_path) not in directorios_ignorados:
-                    items.append(
-                        {'name': entry, 'is_dir': True, 'path': entry_path})
-            elif incluir_archivos and os.path.isfile(entry_path):
-                items.append(
-                    {'name': entry, 'is_dir': False, 'path': entry_path})
-
-        count = len(items)
-        for i, item in enumerate(items):
-            is_last = (i == count - 1)
-            connector = "└── " if is_last else "├── "
-            line_prefix = prefix + connector
-
-            if item['is_dir']:
-                estructura_lines.append(line_prefix + item['name'] + "/")
-                new_prefix = prefix + \
-                    (indent_char if is_last else "│" + indent_char[1:])
-                _walk_recursive(item['path'], depth + 1, new_prefix)
-            else:
-                estructura_lines.append(line_prefix + item['name'])
+def generarEstructuraRelevante(ruta_base, rutas_foco, directorios_ignorados=None, presupuesto_tokens=None, api_provider='google', indent_char="    "):
+    """
+    Árbol de directorios de `ruta_base` con todo el detalle cerca de `rutas_foco` (el archivo
+    elegido y los que se sepa que están relacionados) y los directorios lejanos resumidos como
+    `lib/ (143 archivos)`, hasta caber en `presupuesto_tokens` (PRESUPUESTO_TOKENS_ESTRUCTURA por
+    defecto). Con presupuesto 0 devuelve el árbol completo de generarEstructuraDirectorio.
+    """
+    logPrefix = "generarEstructuraRelevante:"
+    presupuesto = settings.PRESUPUESTO_TOKENS_ESTRUCTURA if presupuesto_tokens is None else presupuesto_tokens
+    if not presupuesto:
+        return generarEstructuraDirectorio(ruta_base, directorios_ignorados=directorios_ignorados, indent_char=indent_char)
+    if not os.path.isdir(ruta_base):
+        log.error(
+            f"{logPrefix} La ruta base '{ruta_base}' no es un directorio válido.")
+        return None
 
+    directorios_ignorados = set(directorios_ignorados or [])
+    directorios_ignorados.add('.git')
     try:
-        _walk_recursive(ruta_base, 0)
-        log.info(
-            f"{logPrefix} Estructura de directorios generada para '{ruta_base}' (hasta {max_depth} niveles).")
-        return "\n".join(estructura_lines)
+        return arbolProyecto.generarEstructuraRelevante(
+            ruta_base, directorios_ignorados, os.path.join(ruta_base, '.orion_meta'), rutas_foco, presupuesto,
+            lambda texto: contarTokensTexto(texto, api_provider), indent_char=indent_char)
     except Exception as e:
         log.error(
             f"{logPrefix} Error inesperado generando estructura: {e}", exc_info=True)
@@ -279,13 +292,29 @@ def generar_contenido_mision_desde_texto_guia(ruta_repo: str, contenido_texto_gu
     logging.info(
         f"{logPrefix} Generando misión a partir del contenido de '{nombre_archivo_guia}'.")
 
-    timestamp_actual = datetime.now().strftime("%Y%m%d%H%M%S")
+    timestamp_actual = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+
+    contexto_codigo = ""
+    if settings.PRESUPUESTO_TOKENS_RECUPERACION:
+        # Fragmentos del proyecto relevantes para cada punto del texto guía (BM25 local, sin IA)
+        consultas = indiceBusqueda.dividirConsultas(contenido_texto_guia) or [contenido_texto_guia]
+        contexto_codigo, _ = indiceBusqueda.construirContexto(
+            ruta_repo, consultas, settings.PRESUPUESTO_TOKENS_RECUPERACION,
+            lambda texto: contarTokensTexto(texto, api_provider))
 
     promptPartes = [
         f"Eres un asistente de IA que planifica misiones de refactorización de código. Tu tarea es analizar el siguiente texto guía (proveniente del archivo '{nombre_archivo_guia}') y generar una misión de refactorización completa.",
         "El texto guía NO tiene una estructura fija, debes interpretarlo para extraer tareas de desarrollo o refactorización.",
         "\n--- CONTENIDO DEL TEXTO GUÍA A ANALIZAR ---",
         contenido_texto_guia,
+    ]
+    if contexto_codigo:
+        promptPartes.extend([
+            "\n--- FRAGMENTOS DE CÓDIGO DEL PROYECTO RELACIONADOS CON EL TEXTO GUÍA ---",
+            "Recuperados por búsqueda léxica; pueden no ser todos relevantes. Úsalos para elegir las rutas reales de 'Archivos de Contexto (Ejecución)' y 'Archivos Implicados Específicos'.",
+            contexto_codigo,
+        ])
+    promptPartes.extend([
         "\n--- TU TAREA: GENERAR LA MISIÓN ---",
         "Debes generar ÚNICAMENTE un objeto JSON con la siguiente estructura:",
         """
@@ -316,6 +345,7 @@ def generar_contenido_mision_desde_texto_guia(ruta_repo: str, contenido_texto_gu
         "   - **Estado:** PENDIENTE",
         "   - **Descripción:** [Descripción detallada, clara y accionable de la primera tarea derivada del texto guía. ¿Qué se debe hacer? ¿En qué archivo(s) específicamente si el texto lo sugiere? ¿Cuál es el objetivo? Sé explícito.]",
         "   - **Archivos Implicados Específicos (Opcional):** [ruta/al/archivo1.py, otra/ruta/archivo2.php] (Si la tarea se enfoca en archivos específicos mencionados en el texto guía. Lista separada por comas. IMPORTANTE: cada ruta aquí NO DEBE contener corchetes `[` o `]` ni otros caracteres inválidos para rutas. Si no, escribe textualmente: `Ninguno`.)",
+        "   - **Depende De (Opcional):** [ID_TAREA_PREVIA] (IDs de tareas de esta misión que deben completarse antes, separados por comas. Si no depende de ninguna, escribe textualmente: `Ninguno`.)",
         "   - **Intentos:** 0",
         "   ---",
         "   (Si se necesitan más tareas, usa el mismo formato exacto, separadas por ---. Recuerda: genera entre 1 y 5 tareas. Es OBLIGATORIO generar al menos UNA tarea si el texto guía contiene directrices.)",
@@ -326,43 +356,16 @@ def generar_contenido_mision_desde_texto_guia(ruta_repo: str, contenido_texto_gu
         "   - Los IDs de las tareas deben ser únicos dentro de la misión.",
         "   - **RUTAS DE ARCHIVO:** Para CUALQUIER ruta de archivo que generes (en 'Archivos de Contexto (Ejecución)' o en 'Archivos Implicados Específicos' de una tarea), ASEGÚRATE de que sean rutas relativas válidas. NO uses corchetes `[` o `]` DENTRO de las rutas individuales. Usa `/` como separador de directorios.",
         "No añadas explicaciones fuera del JSON. El `nombre_clave_mision` en el JSON y en el Markdown (título y metadato) DEBEN COINCIDIR."
-    ]
+    ])
     promptCompleto = "\n".join(promptPartes)
 
     textoRespuesta = None
     respuestaJson = None
 
     try:
-        if api_provider == 'google':
-            if not configurarGemini():
-                return None
-            modelo = genai.GenerativeModel(settings.MODELO_GOOGLE_GEMINI)
-            respuesta = modelo.generate_content(
-                promptCompleto,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=0.6, response_mime_type="application/json", max_output_tokens=settings.MODELO_GOOGLE_GEMINI_MAX_OUTPUT_TOKENS),
-                safety_settings={'HATE': 'BLOCK_MEDIUM_AND_ABOVE', 'HARASSMENT': 'BLOCK_MEDIUM_AND_ABOVE',
-                                 'SEXUAL': 'BLOCK_MEDIUM_AND_ABOVE', 'DANGEROUS': 'BLOCK_MEDIUM_AND_ABOVE'}
-            )
-            textoRespuesta = _extraerTextoRespuesta(respuesta, logPrefix)
-        elif api_provider == 'openrouter':
-            if not settings.OPENROUTER_API_KEY:
-                logging.error(f"{logPrefix} Falta OPENROUTER_API_KEY.")
-                return None
-            client = OpenAI(base_url=settings.OPENROUTER_BASE_URL,
-                            api_key=settings.OPENROUTER_API_KEY)
-            mensajes = [{"role": "user", "content": promptCompleto}]
-            completion = client.chat.completions.create(
-                extra_headers={"HTTP-Referer": settings.OPENROUTER_REFERER,
-                               "X-Title": settings.OPENROUTER_TITLE},
-                model=settings.OPENROUTER_MODEL, messages=mensajes, temperature=0.6, max_tokens=settings.MODELO_GOOGLE_GEMINI_MAX_OUTPUT_TOKENS, timeout=API_TIMEOUT_SECONDS
-            )
-            if completion.choices:
-                textoRespuesta = completion.choices[0].message.content
-        else:
-            logging.error(
-                f"{logPrefix} Proveedor API '{api_provider}' no soportado.")
-            return None
+        textoRespuesta, usoApi = _generarTextoIA(
+            promptCompleto, api_provider, logPrefix, temperatura=0.6,
+            max_tokens=settings.MODELO_GOOGLE_GEMINI_MAX_OUTPUT_TOKENS)
 
         if not textoRespuesta:
             logging.error(f"{logPrefix} No se obtuvo texto de la IA.")
@@ -389,6 +392,7 @@ def generar_contenido_mision_desde_texto_guia(ruta_repo: str, contenido_texto_gu
 
         logging.info(
             f"{logPrefix} Contenido de misión generado desde '{nombre_archivo_guia}'. Nombre clave: {nombre_clave_json}")
+        respuestaJson["uso_api"] = usoApi
         return respuestaJson
 
     except Exception as e:
@@ -451,43 +455,8 @@ def obtenerDecisionRefactor(contextoCodigoCompleto, historialCambiosTexto=None,
     respuestaJson = None
 
     try:
-        if api_provider == 'google':
-            log.info(
-                f"{logPrefix} Usando Google Gemini API (Modelo: {settings.MODELO_GOOGLE_GEMINI}).")
-            if not configurarGemini():
-                return None
-            modelo = genai.GenerativeModel(settings.MODELO_GOOGLE_GEMINI)
-            respuesta = modelo.generate_content(
-                promptCompleto,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=0.4, response_mime_type="application/json", max_output_tokens=60000),
-                safety_settings={'HATE': 'BLOCK_MEDIUM_AND_ABOVE', 'HARASSMENT': 'BLOCK_MEDIUM_AND_ABOVE',
-                                 'SEXUAL': 'BLOCK_MEDIUM_AND_ABOVE', 'DANGEROUS': 'BLOCK_MEDIUM_AND_ABOVE'}
-            )
-            textoRespuesta = _extraerTextoRespuesta(respuesta, logPrefix)
-        elif api_provider == 'openrouter':
-            # ... (Lógica OpenRouter como en el original)
-            log.info(
-                f"{logPrefix} Usando OpenRouter API (Modelo: {settings.OPENROUTER_MODEL}).")
-            if not settings.OPENROUTER_API_KEY:
-                log.error(
-                    f"{logPrefix} Falta OPENROUTER_API_KEY en la configuración.")
-                return None
-            client = OpenAI(base_url=settings.OPENROUTER_BASE_URL,
-                            api_key=settings.OPENROUTER_API_KEY)
-            mensajes = [{"role": "user", "content": promptCompleto}]
-            completion = client.chat.completions.create(
-                extra_headers={"HTTP-Referer": settings.OPENROUTER_REFERER,
-                               "X-Title": settings.OPENROUTER_TITLE},
-                # Ajustar max_tokens según necesidad
-                model=settings.OPENROUTER_MODEL, messages=mensajes, temperature=0.4, max_tokens=60000, timeout=API_TIMEOUT_SECONDS
-            )
-            if completion.choices:
-                textoRespuesta = completion.choices[0].message.content
-        else:
-            log.error(
-                f"{logPrefix} Proveedor de API no soportado: {api_provider}")
-            return None
+        textoRespuesta, usoApi = _generarTextoIA(
+            promptCompleto, api_provider, logPrefix, temperatura=0.4, max_tokens=60000)
 
         if not textoRespuesta:
             log.error(
@@ -497,6 +466,7 @@ def obtenerDecisionRefactor(contextoCodigoCompleto, historialCambiosTexto=None,
         respuestaJson = _limpiarYParsearJson(textoRespuesta, logPrefix)
         # (Validaciones del JSON como en el original)
         if respuestaJson and respuestaJson.get("tipo_analisis") == "refactor_decision":
+            respuestaJson["uso_api"] = usoApi
             return respuestaJson
         else:
             log.error(
@@ -590,44 +560,10 @@ def ejecutarAccionConGemini(decisionParseada, contextoCodigoReducido, api_provid
     respuestaJson = None
 
     try:
-        if api_provider == 'google':
-            log.info(
-                f"{logPrefix} Usando Google Gemini API (Modelo: {settings.MODELO_GOOGLE_GEMINI}).")
-            if not configurarGemini():
-                return None
-            modelo = genai.GenerativeModel(settings.MODELO_GOOGLE_GEMINI)
-            respuesta = modelo.generate_content(
-                promptCompleto,
-                generation_config=genai.types.GenerationConfig(temperature=0.5, response_mime_type="application/json", max_output_tokens=settings.MODELO_GOOGLE_GEMINI_MAX_OUTPUT_TOKENS if hasattr(
-                    # Usar 8192 si no está definido
-                    settings, 'MODELO_GOOGLE_GEMINI_MAX_OUTPUT_TOKENS') else 60000),
-                safety_settings={'HATE': 'BLOCK_ONLY_HIGH', 'HARASSMENT': 'BLOCK_ONLY_HIGH',
-                                 'SEXUAL': 'BLOCK_ONLY_HIGH', 'DANGEROUS': 'BLOCK_ONLY_HIGH'}
-            )
-            textoRespuesta = _extraerTextoRespuesta(respuesta, logPrefix)
-        elif api_provider == 'openrouter':
-            # ... (Lógica OpenRouter como en el original)
-            log.info(
-                f"{logPrefix} Usando OpenRouter API (Modelo: {settings.OPENROUTER_MODEL}).")
-            if not settings.OPENROUTER_API_KEY:
-                log.error(
-                    f"{logPrefix} Falta OPENROUTER_API_KEY en la configuración.")
-                return None
-            client = OpenAI(base_url=settings.OPENROUTER_BASE_URL,
-                            api_key=settings.OPENROUTER_API_KEY)
-            mensajes = [{"role": "user", "content": promptCompleto}]
-            completion = client.chat.completions.create(
-                extra_headers={"HTTP-Referer": settings.OPENROUTER_REFERER,
-                               "X-Title": settings.OPENROUTER_TITLE},
-                model=settings.OPENROUTER_MODEL, messages=mensajes, temperature=0.4, max_tokens=60000, timeout=API_TIMEOUT_SECONDS  # Ajustar max_tokens
-            )  # Aumentar max_tokens para generación de código
-            if completion.choices:
-                textoRespuesta = completion.choices[0].message.content
-
-        else:
-            log.error(
-                f"{logPrefix} Proveedor de API no soportado: {api_provider}")
-            return None
+        textoRespuesta, usoApi = _generarTextoIA(
+            promptCompleto, api_provider, logPrefix, temperatura=0.5,
+            max_tokens=settings.MODELO_GOOGLE_GEMINI_MAX_OUTPUT_TOKENS, nivel_seguridad='BLOCK_ONLY_HIGH',
+            temperatura_openrouter=0.4, max_tokens_openrouter=60000)
 
         if not textoRespuesta:
             log.error(
@@ -637,6 +573,7 @@ def ejecutarAccionConGemini(decisionParseada, contextoCodigoReducido, api_provid
         respuestaJson = _limpiarYParsearJson(textoRespuesta, logPrefix)
         # (Validaciones del JSON como en el original)
         if respuestaJson and respuestaJson.get("tipo_resultado") == "ejecucion_cambio" and "archivos_modificados" in respuestaJson:
+            respuestaJson["uso_api"] = usoApi
             return respuestaJson
         else:
             log.error(
@@ -652,9 +589,10 @@ def ejecutarAccionConGemini(decisionParseada, contextoCodigoReducido, api_provid
 
 # --- Nuevas Funciones para el Flujo Adaptativo ---
 
-def solicitar_evaluacion_archivo(ruta_archivo_seleccionado_rel: str, contenido_archivo: str, estructura_proyecto: str, api_provider: str, reglas_refactor: str = ""):
+def solicitar_evaluacion_archivo(ruta_archivo_seleccionado_rel: str, contenido_archivo: str, estructura_proyecto: str, api_provider: str, reglas_refactor: str = "", archivos_relacionados: list = None):
     """
     Paso 1.1: IA decide si un archivo necesita refactorización y qué contexto adicional podría necesitar.
+    `archivos_relacionados` (del grafo de dependencias) ya se incluirán como contexto; la IA solo sugiere otros.
     """
     logPrefix = f"solicitar_evaluacion_archivo (Paso 1.1/{api_provider.upper()}):"
     log.info(
@@ -670,6 +608,14 @@ def solicitar_evaluacion_archivo(ruta_archivo_seleccionado_rel: str, contenido_a
         "\n--- CONTENIDO DEL ARCHIVO SELECCIONADO A EVALUAR ---",
         f"Ruta Relativa: {ruta_archivo_seleccionado_rel}",
         contenido_archivo,
+    ]
+    if archivos_relacionados:
+        promptPartes.extend([
+            "\n--- ARCHIVOS RELACIONADOS POR IMPORTS (se incluirán automáticamente como contexto) ---",
+            "\n".join(f"- {ruta}" for ruta in archivos_relacionados),
+            "No los repitas en `archivos_contexto_sugeridos`; sugiere solo archivos adicionales que no estén en esta lista.",
+        ])
+    promptPartes.extend([
         "\n--- TU ANÁLISIS Y DECISIÓN ---",
         "Analiza el archivo y responde ÚNICAMENTE con un objeto JSON con la siguiente estructura:",
         """
@@ -687,7 +633,7 @@ def solicitar_evaluacion_archivo(ruta_archivo_seleccionado_rel: str, contenido_a
         "- `archivos_contexto_sugeridos`: (lista de strings) Si `necesita_contexto_adicional` es true, lista las rutas RELATIVAS de los archivos que sugieres leer. Elige archivos que parezcan relacionados por nombre o por la lógica del archivo evaluado, basándote en la estructura del proyecto. No más de 3-5 archivos.",
         "- `razonamiento`: (string) Explica tu decisión. Si no necesita refactor, explica por qué. Si necesita, explica qué tipo de refactorización visualizas y por qué el contexto adicional (si lo pides) sería útil.",
         "Sé conciso pero claro en tu razonamiento. No generes código, solo el JSON de evaluación."
-    ]
+    ])
     promptCompleto = "\n".join(promptPartes)
 
     tokens_estimados_prompt = len(promptCompleto) // 4  # Estimación muy burda
@@ -698,37 +644,8 @@ def solicitar_evaluacion_archivo(ruta_archivo_seleccionado_rel: str, contenido_a
     respuestaJson = None
 
     try:
-        if api_provider == 'google':
-            if not configurarGemini():
-                return None
-            modelo = genai.GenerativeModel(settings.MODELO_GOOGLE_GEMINI)
-            respuesta = modelo.generate_content(
-                promptCompleto,
-                generation_config=genai.types.GenerationConfig(
-                    # Max tokens más bajo para decisión
-                    temperature=0.5, response_mime_type="application/json", max_output_tokens=60000),
-                safety_settings={'HATE': 'BLOCK_MEDIUM_AND_ABOVE', 'HARASSMENT': 'BLOCK_MEDIUM_AND_ABOVE',
-                                 'SEXUAL': 'BLOCK_MEDIUM_AND_ABOVE', 'DANGEROUS': 'BLOCK_MEDIUM_AND_ABOVE'}
-            )
-            textoRespuesta = _extraerTextoRespuesta(respuesta, logPrefix)
-        elif api_provider == 'openrouter':
-            if not settings.OPENROUTER_API_KEY:
-                log.error(f"{logPrefix} Falta OPENROUTER_API_KEY.")
-                return None
-            client = OpenAI(base_url=settings.OPENROUTER_BASE_URL,
-                            api_key=settings.OPENROUTER_API_KEY)
-            mensajes = [{"role": "user", "content": promptCompleto}]
-            completion = client.chat.completions.create(
-                extra_headers={"HTTP-Referer": settings.OPENROUTER_REFERER,
-                               "X-Title": settings.OPENROUTER_TITLE},
-                model=settings.OPENROUTER_MODEL, messages=mensajes, temperature=0.5, max_tokens=60000, timeout=API_TIMEOUT_SECONDS
-            )
-            if completion.choices:
-                textoRespuesta = completion.choices[0].message.content
-        else:
-            log.error(
-                f"{logPrefix} Proveedor API '{api_provider}' no soportado.")
-            return None
+        textoRespuesta, usoApi = _generarTextoIA(
+            promptCompleto, api_provider, logPrefix, temperatura=0.5, max_tokens=60000)
 
         if not textoRespuesta:
             log.error(f"{logPrefix} No se obtuvo texto de la IA.")
@@ -745,6 +662,7 @@ def solicitar_evaluacion_archivo(ruta_archivo_seleccionado_rel: str, contenido_a
             return None
 
         log.info(f"{logPrefix} Evaluación recibida para '{ruta_archivo_seleccionado_rel}'. Necesita refactor: {respuestaJson.get('necesita_refactor')}")
+        respuestaJson["uso_api"] = usoApi
         return respuestaJson
 
     except Exception as e:
@@ -809,6 +727,7 @@ def generar_contenido_mision_orion(archivo_a_refactorizar_rel: str, contexto_arc
         "   - **Estado:** PENDIENTE",
         "   - **Descripción:** [Descripción detallada, clara y accionable de la primera tarea. ¿Qué se debe hacer? ¿En qué archivo(s) específicamente? ¿Cuál es el objetivo? Sé explícito. Por ejemplo: \"Refactorizar la función `getUserDetails` en `user_module.py` para usar el nuevo servicio `AuthService` en lugar de acceso directo a DB. Actualizar llamadas en `profile_view.py`.\"]",
         "   - **Archivos Implicados Específicos:** [ruta/al/archivo1.py, otra/ruta/archivo2.php] (Si la tarea se enfoca en archivos específicos ADICIONALES al principal o al contexto general, o si la tarea es CREAR un nuevo archivo, incluye su ruta aquí. Lista separada por comas. IMPORTANTE: cada ruta aquí NO DEBE contener corchetes `[` o `]` ni otros caracteres inválidos para rutas. Si no, escribe textualmente: `Ninguno`.)",
+        "   - **Depende De (Opcional):** [ID_TAREA_PREVIA] (IDs de tareas de esta misión que deben completarse antes, separados por comas. Si no depende de ninguna, escribe textualmente: `Ninguno`.)",
         "   - **Intentos:** 0",
         "   - **Bloques de Código Objetivo:** (OBLIGATORIO para cada tarea. Describe los fragmentos de código específicos que la tarea modificará, creará o eliminará.)",
         "     - **Archivo:** `ruta/relativa/al/archivo_afectado.ext` (Ruta relativa al archivo afectado. DEBE coincidir con una ruta en 'Archivo Principal', 'Archivos de Contexto (Ejecución)' o 'Archivos Implicados Específicos').",
@@ -833,36 +752,9 @@ def generar_contenido_mision_orion(archivo_a_refactorizar_rel: str, contexto_arc
     respuestaJson = None
 
     try:
-        if api_provider == 'google':
-            if not configurarGemini():
-                return None
-            modelo = genai.GenerativeModel(settings.MODELO_GOOGLE_GEMINI)
-            respuesta = modelo.generate_content(
-                promptCompleto,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=0.6, response_mime_type="application/json", max_output_tokens=settings.MODELO_GOOGLE_GEMINI_MAX_OUTPUT_TOKENS), 
-                safety_settings={'HATE': 'BLOCK_MEDIUM_AND_ABOVE', 'HARASSMENT': 'BLOCK_MEDIUM_AND_ABOVE',
-                                 'SEXUAL': 'BLOCK_MEDIUM_AND_ABOVE', 'DANGEROUS': 'BLOCK_MEDIUM_AND_ABOVE'}
-            )
-            textoRespuesta = _extraerTextoRespuesta(respuesta, logPrefix)
-        elif api_provider == 'openrouter':
-            if not settings.OPENROUTER_API_KEY:
-                log.error(f"{logPrefix} Falta OPENROUTER_API_KEY.")
-                return None
-            client = OpenAI(base_url=settings.OPENROUTER_BASE_URL,
-                            api_key=settings.OPENROUTER_API_KEY)
-            mensajes = [{"role": "user", "content": promptCompleto}]
-            completion = client.chat.completions.create(
-                extra_headers={"HTTP-Referer": settings.OPENROUTER_REFERER,
-                               "X-Title": settings.OPENROUTER_TITLE},
-                model=settings.OPENROUTER_MODEL, messages=mensajes, temperature=0.6, max_tokens=settings.MODELO_GOOGLE_GEMINI_MAX_OUTPUT_TOKENS, timeout=API_TIMEOUT_SECONDS
-            )
-            if completion.choices:
-                textoRespuesta = completion.choices[0].message.content
-        else:
-            log.error(
-                f"{logPrefix} Proveedor API '{api_provider}' no soportado.")
-            return None
+        textoRespuesta, usoApi = _generarTextoIA(
+            promptCompleto, api_provider, logPrefix, temperatura=0.6,
+            max_tokens=settings.MODELO_GOOGLE_GEMINI_MAX_OUTPUT_TOKENS)
 
         if not textoRespuesta:
             log.error(f"{logPrefix} No se obtuvo texto de la IA.")
@@ -892,6 +784,7 @@ def generar_contenido_mision_orion(archivo_a_refactorizar_rel: str, contexto_arc
 
         log.info(
             f"{logPrefix} Contenido de misión generado. Nombre clave: {nombre_clave_json}")
+        respuestaJson["uso_api"] = usoApi
         return respuestaJson
 
     except Exception as e:
@@ -901,7 +794,87 @@ def generar_contenido_mision_orion(archivo_a_refactorizar_rel: str, contexto_arc
                                locals().get('respuesta'))
         return None
 
-def ejecutar_tarea_especifica_mision(tarea_info: dict, mision_markdown_completa: str, bloques_codigo_input: list, api_provider: str):
+def _validarOperacionGranular(op, i, bloques_codigo_input, logPrefix):
+    """
+    Valida (y autocorrige `linea_fin` cuando se puede inferir de los bloques de entrada) una
+    operación granular devuelta por la IA. Devuelve None si es válida o el mensaje de error.
+    """
+    if not isinstance(op, dict) or "tipo_operacion" not in op or "ruta_archivo" not in op:
+        log.error(f"{logPrefix} Operación de modificación inválida #{i+1}: {op}. Faltan campos clave (tipo_operacion o ruta_archivo).")
+        return f"Operación de modificación inválida #{i+1}: {op}. Faltan campos clave."
+    
+    tipo_op = op.get("tipo_operacion")
+
+    if tipo_op == "REEMPLAZAR_BLOQUE":
+        if "linea_fin" not in op and "linea_inicio" in op:
+            op_linea_inicio = op.get("linea_inicio")
+            autocorregido_con_exito_desde_input = False
+
+            if isinstance(op_linea_inicio, int):
+                for bloque_in in bloques_codigo_input:
+                    if bloque_in.get("ruta_archivo") == op.get("ruta_archivo") and \
+                       bloque_in.get("linea_inicio_original") == op_linea_inicio and \
+                       "linea_fin_original" in bloque_in:
+                        op["linea_fin"] = bloque_in.get("linea_fin_original")
+                        log.warning(f"{logPrefix} Operación REEMPLAZAR_BLOQUE #{i+1} en '{op.get('ruta_archivo')}' L{op_linea_inicio} no tenía 'linea_fin'. "
+                                    f"Autocorregido a '{op['linea_fin']}' basado en el bloque de entrada original (L{bloque_in.get('linea_inicio_original')}-L{bloque_in.get('linea_fin_original')}).")
+                        autocorregido_con_exito_desde_input = True
+                        break
+                
+                if not autocorregido_con_exito_desde_input and op_linea_inicio == 1:
+                    op["linea_fin"] = 1 
+                    log.warning(f"{logPrefix} Operación REEMPLAZAR_BLOQUE #{i+1} en '{op.get('ruta_archivo')}' (potencial creación/L1) no tenía 'linea_fin'. "
+                                f"No se pudo inferir de un bloque de entrada exacto (o el bloque de entrada no tenía 'linea_fin_original'). Autocorregido 'linea_fin' a '1' como fallback.")
+                    autocorregido_con_exito_desde_input = True
+                elif not autocorregido_con_exito_desde_input:
+                    log.warning(f"{logPrefix} Operación REEMPLAZAR_BLOQUE #{i+1} en '{op.get('ruta_archivo')}' L{op_linea_inicio} no tenía 'linea_fin' y no se pudo inferir del bloque de entrada. "
+                                "Esto probablemente causará un error en la validación de campos faltantes.")
+            else:
+                 log.warning(f"{logPrefix} Operación REEMPLAZAR_BLOQUE #{i+1} en '{op.get('ruta_archivo')}' no tenía 'linea_fin' y 'linea_inicio' ('{op_linea_inicio}') no es un entero válido. No se puede autocorregir.")
+        
+        campos_necesarios_reemplazar = ["linea_inicio", "linea_fin", "nuevo_contenido"]
+        campos_faltantes = [k for k in campos_necesarios_reemplazar if k not in op]
+        if campos_faltantes:
+            log.error(f"{logPrefix} Operación REEMPLAZAR_BLOQUE inválida #{i+1} en '{op.get('ruta_archivo')}': {op}. Faltan campos: {campos_faltantes} (post-autocorrección).")
+            return f"Operación REEMPLAZAR_BLOQUE inválida #{i+1} en '{op.get('ruta_archivo')}', faltan campos: {campos_faltantes}."
+    
+    elif tipo_op == "AGREGAR_BLOQUE":
+        campos_necesarios_agregar = ["insertar_despues_de_linea", "nuevo_contenido"]
+        campos_faltantes = [k for k in campos_necesarios_agregar if k not in op]
+        if campos_faltantes:
+            log.error(f"{logPrefix} Operación AGREGAR_BLOQUE inválida #{i+1}: {op}. Faltan campos: {campos_faltantes}.")
+            return f"Operación AGREGAR_BLOQUE inválida #{i+1}, faltan campos: {campos_faltantes}."
+    
+    elif tipo_op == "ELIMINAR_BLOQUE":
+        if "linea_fin" not in op and "linea_inicio" in op: 
+            autocorregido_linea_fin_eliminar = False
+            op_linea_inicio = op.get("linea_inicio")
+            if isinstance(op_linea_inicio, int): 
+                for bloque_in in bloques_codigo_input:
+                    if bloque_in.get("ruta_archivo") == op.get("ruta_archivo") and \
+                       bloque_in.get("linea_inicio_original") == op_linea_inicio and \
+                       "linea_fin_original" in bloque_in:
+                        op["linea_fin"] = bloque_in.get("linea_fin_original")
+                        log.warning(f"{logPrefix} Operación ELIMINAR_BLOQUE #{i+1} en '{op.get('ruta_archivo')}' L{op_linea_inicio} no tenía 'linea_fin'. "
+                                    f"Autocorregido a '{op['linea_fin']}' basado en el bloque de entrada original (L{bloque_in.get('linea_inicio_original')}-L{bloque_in.get('linea_fin_original')}).")
+                        autocorregido_linea_fin_eliminar = True
+                        break
+                if not autocorregido_linea_fin_eliminar:
+                     log.warning(f"{logPrefix} Operación ELIMINAR_BLOQUE #{i+1} en '{op.get('ruta_archivo')}' L{op_linea_inicio} no tenía 'linea_fin' y no se pudo inferir del bloque de entrada. Esto probablemente causará un error.")
+        
+        campos_necesarios_eliminar = ["linea_inicio", "linea_fin"]
+        campos_faltantes = [k for k in campos_necesarios_eliminar if k not in op]
+        if campos_faltantes:
+            log.error(f"{logPrefix} Operación ELIMINAR_BLOQUE inválida #{i+1} en '{op.get('ruta_archivo')}': {op}. Faltan campos: {campos_faltantes} (post-autocorrección).")
+            return f"Operación ELIMINAR_BLOQUE inválida #{i+1} en '{op.get('ruta_archivo')}', faltan campos: {campos_faltantes}."
+    
+    elif tipo_op is None:
+         log.error(f"{logPrefix} Operación inválida #{i+1}: 'tipo_operacion' es None o no está. Operación: {op}")
+         return f"Operación inválida #{i+1}, 'tipo_operacion' es None o falta."
+    return None
+
+
+def ejecutar_tarea_especifica_mision(tarea_info: dict, mision_markdown_completa: str, bloques_codigo_input: list, api_provider: str, al_recibir_modificacion=None):
     """
     Paso 2 (Modo Granular): IA ejecuta una tarea específica de la misión, operando sobre bloques de código.
     Devuelve un JSON con una lista de operaciones de modificación.
@@ -921,6 +894,9 @@ def ejecutar_tarea_especifica_mision(tarea_info: dict, mision_markdown_completa:
                 # ... más bloques
             ]
         api_provider (str): Proveedor de API a utilizar ('google' o 'openrouter').
+        al_recibir_modificacion (callable, opcional): Si se pasa (o si settings.STREAMING_IA está activo), la respuesta
+            se pide en streaming y cada operación de `modificaciones` se valida y se entrega a este callback en cuanto
+            llega completa. Si la validación o el callback fallan, la generación se aborta.
 
     Returns:
         dict: Un diccionario parseado desde el JSON de respuesta de la IA, con la estructura de operaciones de modificación,
@@ -1040,47 +1016,34 @@ def ejecutar_tarea_especifica_mision(tarea_info: dict, mision_markdown_completa:
         'required': ['modificaciones']
     }
 
+    parser_streaming = None
+    modificaciones_streaming = []
+    al_recibir_fragmento = None
+    if al_recibir_modificacion or settings.STREAMING_IA:
+        parser_streaming = parserJsonIncremental.ParserListaIncremental("modificaciones")
+
+        def al_recibir_fragmento(fragmento):
+            for op in parser_streaming.alimentar(fragmento):
+                error_op = _validarOperacionGranular(
+                    op, len(modificaciones_streaming), bloques_codigo_input, logPrefix)
+                if error_op:
+                    raise parserJsonIncremental.RespuestaMalformadaError(error_op)
+                modificaciones_streaming.append(op)
+                log.info(f"{logPrefix} Operación #{len(modificaciones_streaming)} recibida en streaming: "
+                         f"{op.get('tipo_operacion')} en '{op.get('ruta_archivo')}'.")
+                if al_recibir_modificacion:
+                    try:
+                        al_recibir_modificacion(op)
+                    except Exception as e_callback:
+                        raise parserJsonIncremental.RespuestaMalformadaError(
+                            f"Operación #{len(modificaciones_streaming)} rechazada durante el streaming: {e_callback}") from e_callback
+
     try:
-        if api_provider == 'google':
-            if not configurarGemini():
-                return None
-            modelo = genai.GenerativeModel(settings.MODELO_GOOGLE_GEMINI)
-            
-            generation_config_dict = {
-                "temperature": 0.3, 
-                "response_mime_type": "application/json",
-                "max_output_tokens": settings.MODELO_GOOGLE_GEMINI_MAX_OUTPUT_TOKENS if hasattr(settings, 'MODELO_GOOGLE_GEMINI_MAX_OUTPUT_TOKENS') else 60000
-            }
-            generation_config_dict["response_schema"] = response_schema_granular
-            log.debug(f"{logPrefix} Incluyendo response_schema granular en GenerationConfig para Gemini.")
-
-            respuesta = modelo.generate_content(
-                promptCompleto,
-                generation_config=types.GenerationConfig(**generation_config_dict),
-                safety_settings={'HATE': 'BLOCK_ONLY_HIGH', 'HARASSMENT': 'BLOCK_ONLY_HIGH',
-                                 'SEXUAL': 'BLOCK_ONLY_HIGH', 'DANGEROUS': 'BLOCK_ONLY_HIGH'}
-            )
-            textoRespuesta = _extraerTextoRespuesta(respuesta, logPrefix)
-        elif api_provider == 'openrouter':
-            if not settings.OPENROUTER_API_KEY:
-                log.error(f"{logPrefix} Falta OPENROUTER_API_KEY.")
-                return None
-            client = OpenAI(base_url=settings.OPENROUTER_BASE_URL,
-                            api_key=settings.OPENROUTER_API_KEY)
-            mensajes = [{"role": "user", "content": promptCompleto}]
-            completion = client.chat.completions.create(
-                extra_headers={"HTTP-Referer": settings.OPENROUTER_REFERER,
-                               "X-Title": settings.OPENROUTER_TITLE},
-                model=settings.OPENROUTER_MODEL, messages=mensajes, temperature=0.3, 
-                max_tokens=settings.MODELO_GOOGLE_GEMINI_MAX_OUTPUT_TOKENS, 
-                timeout=API_TIMEOUT_SECONDS,
-                response_format={"type": "json_object"} 
-            )
-            if completion.choices:
-                textoRespuesta = completion.choices[0].message.content
-        else:
-            log.error(f"{logPrefix} Proveedor API '{api_provider}' no soportado.")
-            return None
+        textoRespuesta, usoApi = _generarTextoIA(
+            promptCompleto, api_provider, logPrefix, temperatura=0.3,
+            max_tokens=settings.MODELO_GOOGLE_GEMINI_MAX_OUTPUT_TOKENS,
+            nivel_seguridad='BLOCK_ONLY_HIGH', response_schema=response_schema_granular,
+            forzar_json_openrouter=True, al_recibir_fragmento=al_recibir_fragmento)
 
         if not textoRespuesta:
             log.error(f"{logPrefix} No se obtuvo texto de la IA.")
@@ -1089,189 +1052,188 @@ def ejecutar_tarea_especifica_mision(tarea_info: dict, mision_markdown_completa:
         respuestaJson = _limpiarYParsearJson(textoRespuesta, logPrefix)
 
         if not respuestaJson:
-            tokens_prompt_estimados_error = contarTokensTexto(promptCompleto, api_provider)
-            return {"modificaciones": [], "advertencia_ejecucion": "Fallo al parsear JSON de la IA.", "tokens_consumidos_api": tokens_prompt_estimados_error }
+            return {"modificaciones": [], "advertencia_ejecucion": "Fallo al parsear JSON de la IA.", "uso_api": usoApi}
 
         if "modificaciones" not in respuestaJson or not isinstance(respuestaJson["modificaciones"], list):
             log.error(f"{logPrefix} Respuesta JSON no tiene 'modificaciones' como lista o falta. Recibido: {respuestaJson}")
             adv = respuestaJson.get("advertencia_ejecucion", "Respuesta JSON no tiene 'modificaciones' como lista o falta.")
             if not isinstance(adv, str): adv = str(adv) 
-            tokens_prompt_estimados_error = contarTokensTexto(promptCompleto, api_provider)
-            return {"modificaciones": [], "advertencia_ejecucion": adv, "tokens_consumidos_api": tokens_prompt_estimados_error}
+            return {"modificaciones": [], "advertencia_ejecucion": adv, "uso_api": usoApi}
 
         for i, op in enumerate(respuestaJson["modificaciones"]):
-            if not isinstance(op, dict) or "tipo_operacion" not in op or "ruta_archivo" not in op:
-                log.error(f"{logPrefix} Operación de modificación inválida #{i+1}: {op}. Faltan campos clave (tipo_operacion o ruta_archivo).")
-                tokens_prompt_estimados_error = contarTokensTexto(promptCompleto, api_provider)
-                return {"modificaciones": [], "advertencia_ejecucion": f"Operación de modificación inválida #{i+1}: {op}. Faltan campos clave.", "tokens_consumidos_api": tokens_prompt_estimados_error}
-            
-            tipo_op = op.get("tipo_operacion")
-
-            if tipo_op == "REEMPLAZAR_BLOQUE":
-                if "linea_fin" not in op and "linea_inicio" in op:
-                    op_linea_inicio = op.get("linea_inicio")
-                    autocorregido_con_exito_desde_input = False
-
-                    if isinstance(op_linea_inicio, int):
-                        for bloque_in in bloques_codigo_input:
-                            if bloque_in.get("ruta_archivo") == op.get("ruta_archivo") and \
-                               bloque_in.get("linea_inicio_original") == op_linea_inicio and \
-                               "linea_fin_original" in bloque_in:
-                                op["linea_fin"] = bloque_in.get("linea_fin_original")
-                                log.warning(f"{logPrefix} Operación REEMPLAZAR_BLOQUE #{i+1} en '{op.get('ruta_archivo')}' L{op_linea_inicio} no tenía 'linea_fin'. "
-                                            f"Autocorregido a '{op['linea_fin']}' basado en el bloque de entrada original (L{bloque_in.get('linea_inicio_original')}-L{bloque_in.get('linea_fin_original')}).")
-                                autocorregido_con_exito_desde_input = True
-                                break
-                        
-                        if not autocorregido_con_exito_desde_input and op_linea_inicio == 1:
-                            op["linea_fin"] = 1 
-                            log.warning(f"{logPrefix} Operación REEMPLAZAR_BLOQUE #{i+1} en '{op.get('ruta_archivo')}' (potencial creación/L1) no tenía 'linea_fin'. "
-                                        f"No se pudo inferir de un bloque de entrada exacto (o el bloque de entrada no tenía 'linea_fin_original'). Autocorregido 'linea_fin' a '1' como fallback.")
-                            autocorregido_con_exito_desde_input = True
-                        elif not autocorregido_con_exito_desde_input:
-                            log.warning(f"{logPrefix} Operación REEMPLAZAR_BLOQUE #{i+1} en '{op.get('ruta_archivo')}' L{op_linea_inicio} no tenía 'linea_fin' y no se pudo inferir del bloque de entrada. "
-                                        "Esto probablemente causará un error en la validación de campos faltantes.")
-                    else:
-                         log.warning(f"{logPrefix} Operación REEMPLAZAR_BLOQUE #{i+1} en '{op.get('ruta_archivo')}' no tenía 'linea_fin' y 'linea_inicio' ('{op_linea_inicio}') no es un entero válido. No se puede autocorregir.")
-                
-                campos_necesarios_reemplazar = ["linea_inicio", "linea_fin", "nuevo_contenido"]
-                campos_faltantes = [k for k in campos_necesarios_reemplazar if k not in op]
-                if campos_faltantes:
-                    log.error(f"{logPrefix} Operación REEMPLAZAR_BLOQUE inválida #{i+1} en '{op.get('ruta_archivo')}': {op}. Faltan campos: {campos_faltantes} (post-autocorrección).")
-                    tokens_prompt_estimados_error = contarTokensTexto(promptCompleto, api_provider)
-                    return {"modificaciones": [], "advertencia_ejecucion": f"Operación REEMPLAZAR_BLOQUE inválida #{i+1} en '{op.get('ruta_archivo')}', faltan campos: {campos_faltantes}.", "tokens_consumidos_api": tokens_prompt_estimados_error}
-            
-            elif tipo_op == "AGREGAR_BLOQUE":
-                campos_necesarios_agregar = ["insertar_despues_de_linea", "nuevo_contenido"]
-                campos_faltantes = [k for k in campos_necesarios_agregar if k not in op]
-                if campos_faltantes:
-                    log.error(f"{logPrefix} Operación AGREGAR_BLOQUE inválida #{i+1}: {op}. Faltan campos: {campos_faltantes}.")
-                    tokens_prompt_estimados_error = contarTokensTexto(promptCompleto, api_provider)
-                    return {"modificaciones": [], "advertencia_ejecucion": f"Operación AGREGAR_BLOQUE inválida #{i+1}, faltan campos: {campos_faltantes}.", "tokens_consumidos_api": tokens_prompt_estimados_error}
-            
-            elif tipo_op == "ELIMINAR_BLOQUE":
-                if "linea_fin" not in op and "linea_inicio" in op: 
-                    autocorregido_linea_fin_eliminar = False
-                    op_linea_inicio = op.get("linea_inicio")
-                    if isinstance(op_linea_inicio, int): 
-                        for bloque_in in bloques_codigo_input:
-                            if bloque_in.get("ruta_archivo") == op.get("ruta_archivo") and \
-                               bloque_in.get("linea_inicio_original") == op_linea_inicio and \
-                               "linea_fin_original" in bloque_in:
-                                op["linea_fin"] = bloque_in.get("linea_fin_original")
-                                log.warning(f"{logPrefix} Operación ELIMINAR_BLOQUE #{i+1} en '{op.get('ruta_archivo')}' L{op_linea_inicio} no tenía 'linea_fin'. "
-                                            f"Autocorregido a '{op['linea_fin']}' basado en el bloque de entrada original (L{bloque_in.get('linea_inicio_original')}-L{bloque_in.get('linea_fin_original')}).")
-                                autocorregido_linea_fin_eliminar = True
-                                break
-                        if not autocorregido_linea_fin_eliminar:
-                             log.warning(f"{logPrefix} Operación ELIMINAR_BLOQUE #{i+1} en '{op.get('ruta_archivo')}' L{op_linea_inicio} no tenía 'linea_fin' y no se pudo inferir del bloque de entrada. Esto probablemente causará un error.")
-                
-                campos_necesarios_eliminar = ["linea_inicio", "linea_fin"]
-                campos_faltantes = [k for k in campos_necesarios_eliminar if k not in op]
-                if campos_faltantes:
-                    log.error(f"{logPrefix} Operación ELIMINAR_BLOQUE inválida #{i+1} en '{op.get('ruta_archivo')}': {op}. Faltan campos: {campos_faltantes} (post-autocorrección).")
-                    tokens_prompt_estimados_error = contarTokensTexto(promptCompleto, api_provider)
-                    return {"modificaciones": [], "advertencia_ejecucion": f"Operación ELIMINAR_BLOQUE inválida #{i+1} en '{op.get('ruta_archivo')}', faltan campos: {campos_faltantes}.", "tokens_consumidos_api": tokens_prompt_estimados_error}
-            
-            elif tipo_op is None:
-                 log.error(f"{logPrefix} Operación inválida #{i+1}: 'tipo_operacion' es None o no está. Operación: {op}")
-                 tokens_prompt_estimados_error = contarTokensTexto(promptCompleto, api_provider)
-                 return {"modificaciones": [], "advertencia_ejecucion": f"Operación inválida #{i+1}, 'tipo_operacion' es None o falta.", "tokens_consumidos_api": tokens_prompt_estimados_error}
+            error_op = _validarOperacionGranular(op, i, bloques_codigo_input, logPrefix)
+            if error_op:
+                return {"modificaciones": [], "advertencia_ejecucion": error_op, "uso_api": usoApi}
+
+        if parser_streaming and len(modificaciones_streaming) == len(respuestaJson["modificaciones"]):
+            # Mismas operaciones, pero conservando los objetos ya entregados al callback.
+            respuestaJson["modificaciones"] = modificaciones_streaming
 
         num_modificaciones = len(respuestaJson["modificaciones"])
         adv = respuestaJson.get("advertencia_ejecucion")
         log.info(f"{logPrefix} Ejecución de tarea completada por IA. Modificaciones: {num_modificaciones}. Advertencia: {adv if adv else 'Ninguna'}")
         
-        tokens_prompt = contarTokensTexto(promptCompleto, api_provider)
-        tokens_respuesta_estimados = contarTokensTexto(json.dumps(respuestaJson), api_provider)
-        respuestaJson["tokens_consumidos_api"] = tokens_prompt + tokens_respuesta_estimados 
+        respuestaJson["uso_api"] = usoApi
         
         return respuestaJson
 
+    except parserJsonIncremental.RespuestaMalformadaError as e:
+        log.error(f"{logPrefix} Generación abortada durante el streaming tras {len(modificaciones_streaming)} operación(es) válidas: {e}")
+        return {"modificaciones": [],
+                "advertencia_ejecucion": f"Respuesta de la IA abortada durante el streaming: {e}",
+                "uso_api": _estimarUsoApi(promptCompleto, api_provider, parser_streaming.texto_completo())}
     except Exception as e:
         log.error(f"{logPrefix} Error en ejecución de tarea específica (granular): {e}", exc_info=True)
         _manejar_excepcion_api(e, api_provider, logPrefix, locals().get('respuesta'))
-        tokens_prompt = contarTokensTexto(promptCompleto, api_provider)
+        # Si la llamada falló no hay metadatos de uso; se registra al menos el prompt enviado.
         return {"modificaciones": [], 
                 "advertencia_ejecucion": f"Error interno procesando la tarea: {str(e)}",
-                "tokens_consumidos_api": tokens_prompt }
+                "uso_api": locals().get('usoApi') or _estimarUsoApi(promptCompleto, api_provider)}
 
 # --- Funciones de Ayuda Internas (ya existen en el original, asegurarse de que estén completas) ---
-def _extraerTextoRespuesta(respuesta, logPrefix):
-    textoRespuesta = ""
-    try:
-        # Priorizar el atributo 'text' si existe directamente en la respuesta (Gemini V1 Pro)
-        if hasattr(respuesta, 'text') and respuesta.text:
-            textoRespuesta = respuesta.text
-        # Estructura de Gemini V1.5 (candidates -> content -> parts)
-        elif hasattr(respuesta, 'candidates') and respuesta.candidates:
-            candidate = respuesta.candidates[0]
-            if hasattr(candidate, 'content') and hasattr(candidate.content, 'parts') and candidate.content.parts:
-                textoRespuesta = "".join(
-                    part.text for part in candidate.content.parts if hasattr(part, 'text'))
-            # Fallback por si 'content' no tiene 'parts' pero sí 'text' (menos común)
-            elif hasattr(candidate, 'content') and hasattr(candidate.content, 'text') and candidate.content.text:
-                textoRespuesta = candidate.content.text
-        # Estructura más antigua de Gemini (parts directamente en la respuesta)
-        elif hasattr(respuesta, 'parts') and respuesta.parts:
-            textoRespuesta = "".join(
-                part.text for part in respuesta.parts if hasattr(part, 'text'))
-
-        if not textoRespuesta:
-            finish_reason_str = "N/A"
-            safety_ratings_str = "N/A"
-            block_reason_str = "N/A"
+def _construirUsoApi(api_provider, modelo, tokens_prompt, tokens_respuesta, latencia_segundos,
+                     tokens_totales=None, desde_cache=False, estimado=False):
+    """Sobre unificado de uso de una llamada a la IA (tokens reportados por la API y latencia)."""
+    tokens_prompt = int(tokens_prompt or 0)
+    tokens_respuesta = int(tokens_respuesta or 0)
+    return {
+        "proveedor": api_provider,
+        "modelo": modelo,
+        "tokens_prompt": tokens_prompt,
+        "tokens_respuesta": tokens_respuesta,
+        "tokens_totales": int(tokens_totales) if tokens_totales else tokens_prompt + tokens_respuesta,
+        "latencia_segundos": round(latencia_segundos, 3),
+        "desde_cache": desde_cache,
+        "estimado": estimado,
+    }
 
-            if hasattr(respuesta, 'prompt_feedback'):
-                feedback = respuesta.prompt_feedback
-                if hasattr(feedback, 'block_reason'):
-                    block_reason_str = str(feedback.block_reason)
-                if hasattr(feedback, 'safety_ratings'):  # Lista de SafetyRating
-                    safety_ratings_str = ", ".join(
-                        [f"{r.category}: {r.probability}" for r in feedback.safety_ratings])
-
-            if hasattr(respuesta, 'candidates') and isinstance(respuesta.candidates, (list, tuple)) and respuesta.candidates:
-                candidate = respuesta.candidates[0]
-                if hasattr(candidate, 'finish_reason'):
-                    finish_reason_str = str(candidate.finish_reason)
-                # Lista de SafetyRating
-                if hasattr(candidate, 'safety_ratings') and safety_ratings_str == "N/A":
-                    safety_ratings_str = ", ".join(
-                        [f"{r.category}: {r.probability}" for r in candidate.safety_ratings])
 
-            log.error(f"{logPrefix} Respuesta de IA vacía o no se pudo extraer texto. "
-                      f"FinishReason: {finish_reason_str}, BlockReason: {block_reason_str}, SafetyRatings: {safety_ratings_str}")
-            log.debug(f"{logPrefix} Respuesta completa (objeto): {respuesta}")
-            return None
+def _estimarUsoApi(promptCompleto, api_provider, textoRespuesta=None, latencia_segundos=0.0):
+    """Sobre de uso estimado localmente, para cuando la API no devolvió metadatos de uso."""
+    modelo = settings.MODELO_GOOGLE_GEMINI if api_provider == 'google' else settings.OPENROUTER_MODEL
+    return _construirUsoApi(api_provider, modelo,
+                            contarTokensTexto(promptCompleto, api_provider),
+                            contarTokensTexto(textoRespuesta, api_provider),
+                            latencia_segundos, estimado=True)
 
-        return textoRespuesta.strip()
 
-    except (AttributeError, IndexError, ValueError, TypeError) as e:
-        log.error(
-            f"{logPrefix} Error extrayendo texto de la respuesta: {e}. Respuesta obj: {respuesta}", exc_info=True)
-        return None
-    except Exception as e:  # Captura general para errores inesperados
-        log.error(
-            f"{logPrefix} Error inesperado extrayendo texto: {e}. Respuesta obj: {respuesta}", exc_info=True)
-        return None
+def _configuracionProveedor(api_provider, temperatura, max_tokens, nivel_seguridad, response_schema,
+                            forzar_json_openrouter, temperatura_openrouter, max_tokens_openrouter):
+    """(modelo, configuracion) de la llamada para el proveedor; (None, None) si no está soportado."""
+    if api_provider == 'google':
+        return settings.MODELO_GOOGLE_GEMINI, {
+            'temperatura': temperatura, 'max_tokens': max_tokens,
+            'seguridad': nivel_seguridad, 'response_schema': response_schema}
+    if api_provider == 'openrouter':
+        return settings.OPENROUTER_MODEL, {
+            'temperatura': temperatura if temperatura_openrouter is None else temperatura_openrouter,
+            'max_tokens': max_tokens if max_tokens_openrouter is None else max_tokens_openrouter,
+            'json': forzar_json_openrouter}
+    return None, None
+
+
+async def _generarTextoIAAsync(promptCompleto, api_provider, logPrefix, temperatura, max_tokens,
+                              nivel_seguridad='BLOCK_MEDIUM_AND_ABOVE', response_schema=None,
+                              forzar_json_openrouter=False, temperatura_openrouter=None,
+                              max_tokens_openrouter=None, usar_cache=True, al_recibir_fragmento=None):
+    """
+    Punto único de llamada de generación a la IA (Gemini u OpenRouter), versión asíncrona.
+    Consulta antes la cache de respuestas en disco. Devuelve (texto, uso_api), donde
+    uso_api es el sobre de _construirUsoApi; (None, None) si no se pudo llamar.
+    Si se pasa `al_recibir_fragmento`, la respuesta se pide en streaming y se le entrega
+    cada fragmento de texto según llega; si el callback lanza una excepción se corta el
+    stream y la excepción se propaga.
+    Los errores transitorios se reintentan según nucleo/politicaReintentos.py (con failover
+    opcional al otro proveedor); si no hay éxito la excepción de la API se propaga.
+    """
+    def _configuracion(proveedor):
+        return _configuracionProveedor(proveedor, temperatura, max_tokens, nivel_seguridad, response_schema,
+                                       forzar_json_openrouter, temperatura_openrouter, max_tokens_openrouter)
+
+    modeloNombre, configuracion = _configuracion(api_provider)
+    if modeloNombre is None:
+        log.error(f"{logPrefix} Proveedor API '{api_provider}' no soportado.")
+        return None, None
+
+    inicio = time.monotonic()
+    if usar_cache:
+        claveCache = cacheRespuestasIA.calcularClave(
+            api_provider, modeloNombre, configuracion, promptCompleto)
+        textoCacheado = await asyncio.to_thread(cacheRespuestasIA.obtener, claveCache)
+        if textoCacheado:
+            log.info(
+                f"{logPrefix} Respuesta obtenida de la cache IA (sin llamada a la API).")
+            if al_recibir_fragmento:
+                al_recibir_fragmento(textoCacheado)
+            return textoCacheado, _construirUsoApi(
+                api_provider, modeloNombre, 0, 0, time.monotonic() - inicio, desde_cache=True)
+
+    # En streaming solo se puede reintentar mientras el consumidor no haya recibido nada.
+    fragmentosEntregados = []
+    entregarFragmento = None
+    if al_recibir_fragmento:
+        def entregarFragmento(fragmento):
+            fragmentosEntregados.append(True)
+            al_recibir_fragmento(fragmento)
+
+    async def _llamar(proveedor, timeout):
+        modelo, conf = _configuracion(proveedor)
+        return await _llamarProveedorIA(promptCompleto, proveedor, modelo, conf, logPrefix,
+                                        usar_cache, entregarFragmento, timeout, time.monotonic())
+
+    return await politicaReintentos.ejecutarConReintentos(
+        _llamar, [api_provider] + politicaReintentos.proveedoresAlternativos(api_provider), logPrefix,
+        API_TIMEOUT_SECONDS, puedeReintentar=lambda: not fragmentosEntregados)
+
+
+async def _llamarProveedorIA(promptCompleto, api_provider, modeloNombre, configuracion, logPrefix,
+                             usar_cache, al_recibir_fragmento, timeout, inicio):
+    """Un intento de llamada a un proveedor concreto; devuelve (texto, uso_api) y guarda en cache."""
+    if api_provider == 'google':
+        log.info(
+            f"{logPrefix} Usando Google Gemini API (Modelo: {modeloNombre}).")
+        if not configurarGemini():
+            return None, None
+    else:
+        log.info(
+            f"{logPrefix} Usando OpenRouter API (Modelo: {modeloNombre}).")
+    resultado = await proveedoresIA.generarAsync(
+        api_provider, modeloNombre, promptCompleto, configuracion, logPrefix,
+        al_recibir_fragmento=al_recibir_fragmento, timeout=timeout)
+    textoRespuesta = resultado['texto']
+    tokensPrompt = resultado['tokens_prompt']
+    tokensRespuesta = resultado['tokens_respuesta']
+    tokensTotales = resultado['tokens_totales']
+
+    latencia = time.monotonic() - inicio
+    if isinstance(tokensPrompt, int) and tokensPrompt > 0:
+        estimadorTokens.calibrar(api_provider, modeloNombre, promptCompleto, tokensPrompt)
+        usoApi = _construirUsoApi(api_provider, modeloNombre, tokensPrompt, tokensRespuesta,
+                                  latencia, tokens_totales=tokensTotales)
+    else:
+        log.debug(f"{logPrefix} La API no devolvió metadatos de uso; se estiman localmente.")
+        usoApi = _estimarUsoApi(promptCompleto, api_provider, textoRespuesta, latencia)
+    log.info(f"{logPrefix} Uso API: {usoApi['tokens_prompt']} prompt + {usoApi['tokens_respuesta']} respuesta "
+             f"= {usoApi['tokens_totales']} tokens en {usoApi['latencia_segundos']}s"
+             f"{' (estimado)' if usoApi['estimado'] else ''}.")
 
+    # Solo se cachean respuestas cuyo JSON se puede parsear: una truncada o inválida quedaría fijada
+    # y se repetiría en cada ejecución hasta que expirase el TTL.
+    if usar_cache and _esJsonParseable(textoRespuesta):
+        claveCache = cacheRespuestasIA.calcularClave(
+            api_provider, modeloNombre, configuracion, promptCompleto)
+        await asyncio.to_thread(cacheRespuestasIA.guardar, claveCache, textoRespuesta,
+                                {'proveedor': api_provider, 'modelo': modeloNombre, 'origen': logPrefix})
+    return textoRespuesta, usoApi
 
-def _limpiarYParsearJson(textoRespuesta, logPrefix):
-    # Para asegurar que 'log' exista si no está definido globalmente, 
-    # podrías pasarlo como argumento o instanciar uno básico aquí.
-    # Por simplicidad, se asume que 'log' ya está configurado y disponible.
-    # Ejemplo de fallback si no estuviera disponible:
-    # log_temp = logging.getLogger(f"{__name__}._limpiarYParsearJson")
-    # if not hasattr(log_temp, 'debug'): # Una forma simple de chequear si ya está configurado
-    #     logging.basicConfig(level=logging.INFO) # Configuración básica
-    # log = log_temp # Usar log local si no hay uno global
 
-    if not textoRespuesta: # Manejar caso de textoRespuesta vacío o None tempranamente
-        log.error(f"{logPrefix} No se recibió texto de respuesta de la IA (None o vacío).")
-        return None
+def _generarTextoIA(*args, **kwargs):
+    """Envoltorio síncrono de _generarTextoIAAsync (mismos argumentos y retorno)."""
+    return proveedoresIA.ejecutarSincrono(_generarTextoIAAsync(*args, **kwargs))
 
-    log.debug(f"{logPrefix} Respuesta cruda de IA (antes de cualquier limpieza/parseo):\n{textoRespuesta}")
 
+def _extraerCandidatoJson(textoRespuesta):
+    """(texto sin vallas ```json, bloque {...} candidato o None)."""
     textoLimpio = textoRespuesta.strip()
 
     # Quitar ```json ... ``` o ``` ... ``` si existen
@@ -1286,15 +1248,47 @@ def _limpiarYParsearJson(textoRespuesta, logPrefix):
 
     start_brace = textoLimpio.find('{')
     end_brace = textoLimpio.rfind('}')
-
     if start_brace == -1 or end_brace == -1 or start_brace >= end_brace:
+        return textoLimpio, None
+    return textoLimpio, textoLimpio[start_brace: end_brace + 1]
+
+
+def _esJsonParseable(textoRespuesta):
+    """True si _limpiarYParsearJson obtendría un objeto JSON del texto (sin loguear nada)."""
+    if not textoRespuesta:
+        return False
+    _, json_candidate = _extraerCandidatoJson(textoRespuesta)
+    if json_candidate is None:
+        return False
+    try:
+        return isinstance(json.loads(json_candidate), dict)
+    except (json.JSONDecodeError, ValueError):
+        return False
+
+
+def _limpiarYParsearJson(textoRespuesta, logPrefix):
+    # Para asegurar que 'log' exista si no está definido globalmente, 
+    # podrías pasarlo como argumento o instanciar uno básico aquí.
+    # Por simplicidad, se asume que 'log' ya está configurado y disponible.
+    # Ejemplo de fallback si no estuviera disponible:
+    # log_temp = logging.getLogger(f"{__name__}._limpiarYParsearJson")
+    # if not hasattr(log_temp, 'debug'): # Una forma simple de chequear si ya está configurado
+    #     logging.basicConfig(level=logging.INFO) # Configuración básica
+    # log = log_temp # Usar log local si no hay uno global
+
+    if not textoRespuesta: # Manejar caso de textoRespuesta vacío o None tempranamente
+        log.error(f"{logPrefix} No se recibió texto de respuesta de la IA (None o vacío).")
+        return None
+
+    log.debug(f"{logPrefix} Respuesta cruda de IA (antes de cualquier limpieza/parseo):\n{textoRespuesta}")
+
+    textoLimpio, json_candidate = _extraerCandidatoJson(textoRespuesta)
+    if json_candidate is None:
         log.error(
             f"{logPrefix} Respuesta de IA no parece contener un bloque JSON válido {{...}}. Respuesta (limpia inicial): {textoLimpio[:500]}...")
         # El log de la respuesta original ya se hizo arriba.
         return None
 
-    json_candidate = textoLimpio[start_brace: end_brace + 1]
-
     try:
         log.debug(
             f"{logPrefix} Intentando parsear JSON candidato (tamaño: {len(json_candidate)})...")
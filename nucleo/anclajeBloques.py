@@ -0,0 +1,253 @@
+# nucleo/anclajeBloques.py
+import os
+import re
+import json
+import hashlib
+import logging
+from nucleo import manejadorGit
+from nucleo import lectorLineas
+from nucleo import indiceSimbolos
+
+log = logging.getLogger(__name__)
+
+# Re-anclaje de los "Bloques de Código Objetivo" de una misión.
+# Las tareas anteriores de la misma misión desplazan líneas, así que los rangos escritos en el
+# .md al crear la misión dejan de apuntar al bloque. Al crear la misión se guarda, por bloque, una
+# huella de su contenido y el commit base (en .orion_meta/anclas_bloques/<nombre_clave>.json;
+# si se pierde, se reconstruye desde git). Antes de construir el prompt de cada tarea se resuelve
+# la ubicación actual de cada bloque, por este orden:
+#   1. El rango sigue teniendo el mismo contenido: no se toca.
+#   2. El mismo contenido está en otro sitio del archivo (el más cercano a la posición esperada).
+#   3. Un símbolo del índice de símbolos con el nombre del bloque (el más cercano).
+#   4. Remapeo de líneas con `git diff -U0` entre el commit base y el árbol de trabajo.
+
+VERSION_ANCLAS = 1
+DIRECTORIO_ANCLAS = "anclas_bloques"
+
+_PATRON_HUNK = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+_estadisticas = {'sin_cambios': 0, 'contenido': 0, 'simbolo': 0, 'diff': 0, 'sin_resolver': 0}
+
+
+def _normalizar(linea):
+    return " ".join(linea.split())
+
+
+def huellaLineas(lineas):
+    """Huella del contenido de un bloque, insensible a cambios de indentación y espacios."""
+    return hashlib.sha1("\n".join(_normalizar(l) for l in lineas).encode('utf-8')).hexdigest()
+
+
+def _claveBloque(tarea_id, bloque):
+    return f"{tarea_id}|{bloque.get('archivo')}|{bloque.get('nombre_bloque')}|{bloque.get('linea_inicio')}|{bloque.get('linea_fin')}"
+
+
+def _rutaAnclas(ruta_repo, nombre_clave):
+    return os.path.join(ruta_repo, '.orion_meta', DIRECTORIO_ANCLAS, f"{nombre_clave}.json")
+
+
+def _commitActual(ruta_repo):
+    exito, salida = manejadorGit.ejecutarComando(
+        ['git', 'rev-parse', 'HEAD'], cwd=ruta_repo, check=False, return_output=True)
+    return salida.strip() if exito and salida else None
+
+
+def _commitBaseDesdeGit(ruta_repo, nombre_clave):
+    """Commit que añadió <nombre_clave>.md: en él los archivos están como al crear la misión."""
+    exito, salida = manejadorGit.ejecutarComando(
+        ['git', 'log', '--diff-filter=A', '--format=%H', '-n', '1', '--', f"{nombre_clave}.md"],
+        cwd=ruta_repo, check=False, return_output=True)
+    return salida.strip() if exito and salida else None
+
+
+def _lineasEnCommit(ruta_repo, commit, archivo):
+    exito, salida = manejadorGit.ejecutarComando(
+        ['git', 'show', f"{commit}:{archivo}"], cwd=ruta_repo, check=False, return_output=True)
+    return salida.split('\n') if exito else None
+
+
+def _anclaDeLineas(lineas):
+    return {'huella': huellaLineas(lineas), 'primera_linea': _normalizar(lineas[0]) if lineas else "",
+            'num_lineas': len(lineas)}
+
+
+def registrarAnclas(ruta_repo, nombre_clave, tareas):
+    """Guarda la huella de cada bloque de la misión recién creada junto al commit base. True si se guardó."""
+    logPrefix = "registrarAnclas:"
+    anclas = {'version': VERSION_ANCLAS, 'commit_base': _commitActual(ruta_repo), 'bloques': {}}
+    for tarea in tareas or []:
+        if not isinstance(tarea, dict):
+            continue
+        for bloque in tarea.get('bloques_codigo_objetivo') or []:
+            ini, fin = bloque.get('linea_inicio'), bloque.get('linea_fin')
+            if not bloque.get('archivo') or not isinstance(ini, int) or not isinstance(fin, int):
+                continue
+            texto = lectorLineas.leerRangoLineas(os.path.join(ruta_repo, bloque['archivo']), ini, fin)
+            if texto is None:
+                continue  # Bloque de creación o rango inválido: no hay nada que anclar
+            anclas['bloques'][_claveBloque(tarea.get('id'), bloque)] = _anclaDeLineas(texto.splitlines())
+    ruta = _rutaAnclas(ruta_repo, nombre_clave)
+    try:
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(ruta, 'w', encoding='utf-8') as f:
+            json.dump(anclas, f, ensure_ascii=False, indent=1)
+    except OSError as e:
+        log.warning(f"{logPrefix} No se pudieron guardar las anclas de '{nombre_clave}': {e}")
+        return False
+    log.info(f"{logPrefix} {len(anclas['bloques'])} bloque(s) anclados para la misión '{nombre_clave}' (base {str(anclas['commit_base'])[:10]}).")
+    return True
+
+
+def _cargarAnclas(ruta_repo, nombre_clave):
+    ruta = _rutaAnclas(ruta_repo, nombre_clave)
+    if os.path.exists(ruta):
+        try:
+            with open(ruta, 'r', encoding='utf-8') as f:
+                datos = json.load(f)
+            if isinstance(datos, dict) and datos.get('version') == VERSION_ANCLAS:
+                return datos
+        except (OSError, ValueError) as e:
+            log.warning(f"_cargarAnclas: Anclas ilegibles en '{ruta}', se reconstruirán desde git: {e}")
+    return {'version': VERSION_ANCLAS, 'commit_base': _commitBaseDesdeGit(ruta_repo, nombre_clave), 'bloques': {}}
+
+
+def _hunksDiff(ruta_repo, commit, archivo):
+    """Hunks (inicio_viejo, num_viejo, inicio_nuevo, num_nuevo) de `archivo` entre `commit` y el árbol de trabajo."""
+    exito, salida = manejadorGit.ejecutarComando(
+        ['git', 'diff', '-U0', '--no-color', '--no-ext-diff', commit, '--', archivo],
+        cwd=ruta_repo, check=False, return_output=True)
+    if not exito:
+        return None
+    hunks = []
+    for linea in salida.splitlines():
+        m = _PATRON_HUNK.match(linea)
+        if m:
+            hunks.append((int(m.group(1)), int(m.group(2) or 1), int(m.group(3)), int(m.group(4) or 1)))
+    return hunks
+
+
+def remapearLinea(hunks, linea, esFin=False):
+    """
+    Número de línea actual de la `linea` del commit base según los hunks del diff. Si la línea
+    cayó dentro de un cambio se lleva al principio (o al final, con `esFin`) del código nuevo.
+    """
+    delta = 0
+    for inicioViejo, numViejo, inicioNuevo, numNuevo in hunks:
+        if (numViejo and linea < inicioViejo) or (not numViejo and linea <= inicioViejo):
+            break
+        if numViejo and linea < inicioViejo + numViejo:
+            if not numNuevo:  # Líneas borradas: queda el hueco tras inicioNuevo
+                return inicioNuevo if esFin else inicioNuevo + 1
+            return inicioNuevo + numNuevo - 1 if esFin else inicioNuevo
+        # Primera línea posterior al hunk, en el archivo viejo y en el nuevo
+        delta = (inicioNuevo + numNuevo if numNuevo else inicioNuevo + 1) - \
+                (inicioViejo + numViejo if numViejo else inicioViejo + 1)
+    return linea + delta
+
+
+def _buscarPorContenido(lineasActuales, ancla):
+    """Líneas de inicio (1-based) donde aparece un bloque con la misma huella."""
+    n = ancla['num_lineas']
+    normalizadas = [_normalizar(l) for l in lineasActuales]
+    return [i + 1 for i, linea in enumerate(normalizadas)
+            if linea == ancla['primera_linea'] and i + n <= len(lineasActuales)
+            and huellaLineas(lineasActuales[i:i + n]) == ancla['huella']]
+
+
+def _buscarPorSimbolo(ruta_repo, archivo, nombre_bloque):
+    """Símbolos del archivo cuyo nombre aparece en `nombre_bloque` (prioriza los que casan también el contenedor)."""
+    identificadores = set(re.findall(r"[A-Za-z_]\w*", nombre_bloque or ""))
+    simbolos = indiceSimbolos.obtenerSimbolosArchivo(ruta_repo, archivo, os.path.join(ruta_repo, '.orion_meta'))
+    candidatos = [s for s in simbolos if s[1] in identificadores]
+    conContenedor = [s for s in candidatos if s[2] and s[2] in identificadores]
+    return conContenedor or candidatos
+
+
+def _resolverBloque(ruta_repo, bloque, ancla, commit_base, hunksPorArchivo):
+    """(linea_inicio, linea_fin, motivo) de la ubicación actual del bloque, o None si no se pudo resolver."""
+    archivo = bloque['archivo']
+    ini, fin = bloque['linea_inicio'], bloque['linea_fin']
+    rutaAbs = os.path.join(ruta_repo, archivo)
+
+    if ancla is None and commit_base:
+        lineasBase = _lineasEnCommit(ruta_repo, commit_base, archivo)
+        if lineasBase and 1 <= ini <= fin <= len(lineasBase):
+            ancla = _anclaDeLineas(lineasBase[ini - 1:fin])
+    if ancla:
+        texto = lectorLineas.leerRangoLineas(rutaAbs, ini, fin)
+        if texto is not None and huellaLineas(texto.splitlines()) == ancla['huella']:
+            return ini, fin, 'sin_cambios'
+
+    # Posición esperada según el diff desde el commit base
+    esperado = None
+    if commit_base:
+        if archivo not in hunksPorArchivo:
+            hunksPorArchivo[archivo] = _hunksDiff(ruta_repo, commit_base, archivo)
+        hunks = hunksPorArchivo[archivo]
+        if hunks is not None:
+            nuevoIni, nuevoFin = remapearLinea(hunks, ini), remapearLinea(hunks, fin, esFin=True)
+            if 1 <= nuevoIni <= nuevoFin:
+                esperado = (nuevoIni, nuevoFin)
+    referencia = esperado[0] if esperado else ini
+
+    if ancla:
+        try:
+            with open(rutaAbs, 'r', encoding='utf-8', errors='replace') as f:
+                lineasActuales = f.read().splitlines()
+        except OSError:
+            return None
+        inicios = _buscarPorContenido(lineasActuales, ancla)
+        if inicios:
+            inicio = min(inicios, key=lambda i: abs(i - referencia))
+            return inicio, inicio + ancla['num_lineas'] - 1, 'contenido'
+
+    simbolos = _buscarPorSimbolo(ruta_repo, archivo, bloque.get('nombre_bloque'))
+    if simbolos:
+        simbolo = min(simbolos, key=lambda s: abs(s[3] - referencia))
+        return simbolo[3], simbolo[4], 'simbolo'
+
+    if esperado:
+        return esperado[0], esperado[1], 'diff'
+    return None
+
+
+def reanclarBloques(ruta_repo, nombre_clave, tarea_id, bloques):
+    """
+    Copia de `bloques` (bloques_codigo_objetivo de la tarea) con linea_inicio/linea_fin movidos a la
+    ubicación actual de cada bloque. Los bloques de creación o que no se pueden resolver se dejan igual.
+    """
+    logPrefix = "reanclarBloques:"
+    anclas = _cargarAnclas(ruta_repo, nombre_clave)
+    commit_base = anclas.get('commit_base')
+    hunksPorArchivo = {}
+    resultado = []
+    for bloque in bloques or []:
+        nuevo = dict(bloque)
+        resultado.append(nuevo)
+        ini, fin = bloque.get('linea_inicio'), bloque.get('linea_fin')
+        if (not bloque.get('archivo') or not isinstance(ini, int) or not isinstance(fin, int) or ini < 1 or fin < ini
+                or not os.path.isfile(os.path.join(ruta_repo, bloque['archivo']))):
+            continue
+        try:
+            resuelto = _resolverBloque(ruta_repo, bloque, anclas['bloques'].get(_claveBloque(tarea_id, bloque)),
+                                       commit_base, hunksPorArchivo)
+        except Exception as e:
+            log.warning(f"{logPrefix} Error re-anclando bloque '{bloque.get('nombre_bloque')}': {e}", exc_info=True)
+            resuelto = None
+        if resuelto is None:
+            _estadisticas['sin_resolver'] += 1
+            log.warning(f"{logPrefix} No se pudo confirmar la ubicación del bloque '{bloque.get('nombre_bloque')}' "
+                        f"en '{bloque['archivo']}'; se mantiene L{ini}-{fin}.")
+            continue
+        nuevoIni, nuevoFin, motivo = resuelto
+        _estadisticas[motivo] += 1
+        if (nuevoIni, nuevoFin) != (ini, fin):
+            nuevo['linea_inicio'], nuevo['linea_fin'] = nuevoIni, nuevoFin
+            log.info(f"{logPrefix} Bloque '{bloque.get('nombre_bloque')}' en '{bloque['archivo']}' re-anclado "
+                     f"L{ini}-{fin} -> L{nuevoIni}-{nuevoFin} (por {motivo}).")
+    return resultado
+
+
+def obtenerEstadisticas():
+    """Bloques resueltos por cada método (sin_cambios, contenido, simbolo, diff) y sin resolver."""
+    return dict(_estadisticas)
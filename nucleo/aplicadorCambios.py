@@ -7,6 +7,7 @@ import codecs
 import re
 from difflib import unified_diff
 from typing import Optional
+from nucleo import lectorLineas
 
 # Obtener logger
 log = logging.getLogger(__name__)
@@ -618,16 +619,15 @@ def aplicarCambiosGranulares(respuesta_ia_modificaciones: dict, ruta_base_repo:
             (operacion.get("linea_fin") == 1 or operacion.get("linea_fin") == 0)
         )
 
-        lineas_archivo_original = []
+        # Solo se indexan los saltos de línea del archivo existente; el cambio se empalma por offsets
+        total_lineas = 0
         archivo_existia = os.path.exists(archivo_abs)
 
         if archivo_existia:
-            try:
-                with open(archivo_abs, 'r', encoding='utf-8') as f:
-                    lineas_archivo_original = f.readlines() 
-            except Exception as e:
-                msg = f"Operación #{i+1}: Error leyendo archivo existente '{ruta_archivo_rel}': {e}. Se omite."
-                log.error(f"{logPrefix} {msg}", exc_info=True)
+            total_lineas = lectorLineas.contarLineas(archivo_abs)
+            if total_lineas is None:
+                msg = f"Operación #{i+1}: Error leyendo archivo existente '{ruta_archivo_rel}'. Se omite."
+                log.error(f"{logPrefix} {msg}")
                 errores_aplicacion.append(msg)
                 continue
         elif not es_creacion_archivo_con_reemplazar and tipo_operacion != "REEMPLAZAR_BLOQUE": # REEMPLAZAR_BLOQUE puede crear
@@ -656,7 +656,7 @@ def aplicarCambiosGranulares(respuesta_ia_modificaciones: dict, ruta_base_repo:
             # Caso especial: si nuevo_contenido_str es "" (ya cubierto arriba)
             # Caso especial: si nuevo_contenido_str no tiene \n, split da [contenido]. Luego [contenido\n]. Ok.
 
-        lineas_modificadas = list(lineas_archivo_original)
+        empalme = None # (idx_inicio, idx_fin) a sustituir; None = sobrescribir el archivo entero
 
         if tipo_operacion == "REEMPLAZAR_BLOQUE":
             linea_inicio = operacion.get("linea_inicio")
@@ -679,19 +679,16 @@ def aplicarCambiosGranulares(respuesta_ia_modificaciones: dict, ruta_base_repo:
                 idx_inicio_slice = 0
 
             if es_creacion_archivo_con_reemplazar or not archivo_existia :
-                lineas_modificadas = lineas_nuevo_contenido
                 log.info(f"{logPrefix} REEMPLAZAR_BLOQUE (creación/sobrescritura total) en '{ruta_archivo_rel}'.")
-            elif idx_inicio_slice > len(lineas_modificadas) or idx_fin_slice > len(lineas_modificadas) or idx_inicio_slice > idx_fin_slice:
+            elif idx_inicio_slice > total_lineas or idx_fin_slice > total_lineas or idx_inicio_slice > idx_fin_slice:
                 msg = (f"Operación #{i+1} (REEMPLAZAR_BLOQUE): Rango de líneas [{linea_inicio}-{linea_fin}] "
                        f"(slice [{idx_inicio_slice}-{idx_fin_slice}]) fuera de los límites del archivo '{ruta_archivo_rel}' "
-                       f"(total líneas: {len(lineas_modificadas)}).")
+                       f"(total líneas: {total_lineas}).")
                 log.error(f"{logPrefix} {msg}")
                 errores_aplicacion.append(msg)
                 continue
             else:
-                lineas_modificadas = lineas_modificadas[:idx_inicio_slice] + \
-                                     lineas_nuevo_contenido + \
-                                     lineas_modificadas[idx_fin_slice:]
+                empalme = (idx_inicio_slice, idx_fin_slice)
                 log.info(f"{logPrefix} REEMPLAZAR_BLOQUE en '{ruta_archivo_rel}' líneas {linea_inicio}-{linea_fin}.")
 
         elif tipo_operacion == "AGREGAR_BLOQUE":
@@ -704,16 +701,14 @@ def aplicarCambiosGranulares(respuesta_ia_modificaciones: dict, ruta_base_repo:
 
             idx_insercion = insertar_despues_de_linea 
             
-            if idx_insercion > len(lineas_modificadas):
+            if idx_insercion > total_lineas:
                 msg = (f"Operación #{i+1} (AGREGAR_BLOQUE): 'insertar_despues_de_linea' ({insertar_despues_de_linea}) "
-                       f"fuera de los límites del archivo '{ruta_archivo_rel}' (total líneas: {len(lineas_modificadas)}). "
+                       f"fuera de los límites del archivo '{ruta_archivo_rel}' (total líneas: {total_lineas}). "
                        f"Se agregará al final.")
                 log.warning(f"{logPrefix} {msg}")
-                idx_insercion = len(lineas_modificadas) 
+                idx_insercion = total_lineas 
             
-            lineas_modificadas = lineas_modificadas[:idx_insercion] + \
-                                 lineas_nuevo_contenido + \
-                                 lineas_modificadas[idx_insercion:]
+            empalme = (idx_insercion, idx_insercion)
             log.info(f"{logPrefix} AGREGAR_BLOQUE en '{ruta_archivo_rel}' después de línea {insertar_despues_de_linea} (índice {idx_insercion}).")
 
         elif tipo_operacion == "ELIMINAR_BLOQUE":
@@ -728,16 +723,16 @@ def aplicarCambiosGranulares(respuesta_ia_modificaciones: dict, ruta_base_repo:
             idx_inicio_slice = linea_inicio - 1
             idx_fin_slice = linea_fin
 
-            if idx_inicio_slice >= len(lineas_modificadas) or idx_fin_slice > len(lineas_modificadas) or idx_inicio_slice > idx_fin_slice :
+            if idx_inicio_slice >= total_lineas or idx_fin_slice > total_lineas or idx_inicio_slice > idx_fin_slice :
                 msg = (f"Operación #{i+1} (ELIMINAR_BLOQUE): Rango de líneas [{linea_inicio}-{linea_fin}] "
                        f"(slice [{idx_inicio_slice}-{idx_fin_slice}]) fuera de los límites del archivo '{ruta_archivo_rel}' "
-                       f"(total líneas: {len(lineas_modificadas)}).")
+                       f"(total líneas: {total_lineas}).")
                 log.error(f"{logPrefix} {msg}")
                 errores_aplicacion.append(msg)
                 continue
             
-            lineas_modificadas = lineas_modificadas[:idx_inicio_slice] + \
-                                 lineas_modificadas[idx_fin_slice:]
+            lineas_nuevo_contenido = []
+            empalme = (idx_inicio_slice, idx_fin_slice)
             log.info(f"{logPrefix} ELIMINAR_BLOQUE en '{ruta_archivo_rel}' líneas {linea_inicio}-{linea_fin}.")
         
         else:
@@ -747,12 +742,17 @@ def aplicarCambiosGranulares(respuesta_ia_modificaciones: dict, ruta_base_repo:
             continue
 
         try:
-            dir_padre = os.path.dirname(archivo_abs)
-            if dir_padre: 
-                os.makedirs(dir_padre, exist_ok=True)
-                
-            with open(archivo_abs, 'w', encoding='utf-8') as f_write:
-                f_write.writelines(lineas_modificadas)
+            if empalme is not None:
+                if not lectorLineas.empalmarLineas(archivo_abs, empalme[0], empalme[1], "".join(lineas_nuevo_contenido)):
+                    raise OSError("no se pudo empalmar el rango de líneas")
+            else:
+                dir_padre = os.path.dirname(archivo_abs)
+                if dir_padre: 
+                    os.makedirs(dir_padre, exist_ok=True)
+                    
+                with open(archivo_abs, 'w', encoding='utf-8') as f_write:
+                    f_write.writelines(lineas_nuevo_contenido)
+                lectorLineas.invalidar(archivo_abs)
             log.info(f"{logPrefix} Archivo '{ruta_archivo_rel}' (Abs: '{archivo_abs}') modificado y guardado exitosamente.")
         except Exception as e:
             msg = f"Operación #{i+1}: Error escribiendo archivo modificado '{ruta_archivo_rel}': {e}."
@@ -0,0 +1,305 @@
+# nucleo/arbolProyecto.py
+import os
+import json
+import heapq
+import hashlib
+import logging
+import threading
+from nucleo import indiceArchivos
+
+log = logging.getLogger(__name__)
+
+# Modelo en memoria del árbol de directorios del proyecto y su representación en texto.
+# El árbol se construye una sola vez a partir de las rutas que da `git ls-files` o, si no hay
+# git, del índice incremental de nucleo/indiceArchivos (que ya recorre el disco con os.scandir).
+# La huella del árbol (hash de sus rutas) identifica la instantánea: el modelo se guarda en
+# memoria y los textos renderizados se cachean por huella y variante (profundidad, solo
+# directorios, subárbol) en <ruta_proyecto>/.orion_meta/, así solo se regeneran si cambia el árbol.
+# generarEstructuraRelevante da además una vista ajustada a un presupuesto de tokens: detalle
+# completo alrededor de los archivos de foco y directorios lejanos colapsados como `lib/ (143 archivos)`.
+
+VERSION_CACHE = 1
+NOMBRE_ARCHIVO_CACHE = "estructura_proyecto.json"
+MAX_VARIANTES_CACHE = 16
+
+_lock = threading.Lock()
+_modelos = {}  # claveRaiz -> (huella, arbol)
+_estadisticas = {'arboles_construidos': 0, 'renderizados': 0, 'aciertos_cache': 0}
+
+
+def construirArbol(rutasArchivos, rutasDirectorios=()):
+    """Árbol anidado {nombre: subárbol | None (archivo)} a partir de rutas relativas con '/'."""
+    arbol = {}
+    for rel in rutasDirectorios:
+        nodo = arbol
+        for parte in rel.split('/'):
+            nodo = nodo.setdefault(parte, {})
+    for rel in rutasArchivos:
+        partes = rel.split('/')
+        nodo = arbol
+        for parte in partes[:-1]:
+            nodo = nodo.setdefault(parte, {})
+        nodo.setdefault(partes[-1], None)
+    return arbol
+
+
+def _huella(rutasArchivos, rutasDirectorios):
+    h = hashlib.sha1()
+    h.update("\n".join(rutasArchivos).encode('utf-8', 'surrogateescape'))
+    h.update(b"\0")
+    h.update("\n".join(rutasDirectorios).encode('utf-8', 'surrogateescape'))
+    return h.hexdigest()
+
+
+def obtenerModelo(rutaBase, directoriosIgnorados, rutaMeta):
+    """(huella, arbol) de la instantánea actual de `rutaBase`, o (None, None) si no se pudo listar."""
+    # Los ocultos ya los descartan git y el índice; sin ellos los filtros coinciden con los de
+    # listarArchivosProyecto y ambos comparten la misma entrada del índice.
+    ignorados = {d for d in (directoriosIgnorados or []) if not d.startswith('.')}
+    rutasArchivos, rutasDirectorios = indiceArchivos.listarRutasYDirectorios(rutaBase, ignorados, rutaMeta)
+    if rutasArchivos is None:
+        return None, None
+    huella = _huella(rutasArchivos, rutasDirectorios)
+    claveRaiz = os.path.normpath(os.path.abspath(rutaBase))
+    with _lock:
+        guardado = _modelos.get(claveRaiz)
+        if guardado and guardado[0] == huella:
+            return guardado
+    arbol = construirArbol(rutasArchivos, rutasDirectorios)
+    with _lock:
+        _modelos[claveRaiz] = (huella, arbol)
+        _estadisticas['arboles_construidos'] += 1
+    return huella, arbol
+
+
+def obtenerSubarbol(arbol, subruta):
+    """Nodo del árbol en `subruta` (relativa, con '/' o os.sep), o None si no es un directorio del árbol."""
+    nodo = arbol
+    for parte in (subruta or "").replace(os.sep, '/').strip('/').split('/'):
+        if not parte:
+            continue
+        nodo = nodo.get(parte) if isinstance(nodo, dict) else None
+        if nodo is None:
+            return None
+    return nodo
+
+
+def _renderizarNivel(arbol, lineas, depth, prefix, max_depth, incluir_archivos, indent_char, directorios_ignorados):
+    if depth > max_depth:
+        if depth == max_depth + 1:
+            lineas.append(prefix + "└── ... (Profundidad máxima alcanzada)")
+        return
+    items = [(nombre, hijo) for nombre, hijo in sorted(arbol.items())
+             if not nombre.startswith('.') and nombre not in directorios_ignorados
+             and (hijo is not None or incluir_archivos)]
+    count = len(items)
+    for i, (nombre, hijo) in enumerate(items):
+        is_last = (i == count - 1)
+        line_prefix = prefix + ("└── " if is_last else "├── ")
+        if hijo is not None:
+            lineas.append(line_prefix + nombre + "/")
+            new_prefix = prefix + (indent_char if is_last else "│" + indent_char[1:])
+            _renderizarNivel(hijo, lineas, depth + 1, new_prefix,
+                             max_depth, incluir_archivos, indent_char, directorios_ignorados)
+        else:
+            lineas.append(line_prefix + nombre)
+
+
+def renderizar(arbol, nombreRaiz, max_depth=8, incluir_archivos=True, indent_char="    ", directorios_ignorados=()):
+    """Texto del árbol con conectores ├──/└── (formato histórico de generarEstructuraDirectorio)."""
+    lineas = [nombreRaiz + "/"]
+    _renderizarNivel(arbol, lineas, 0, "", max_depth, incluir_archivos, indent_char, set(directorios_ignorados))
+    with _lock:
+        _estadisticas['renderizados'] += 1
+    return "\n".join(lineas)
+
+
+def _cargarCache(rutaMeta):
+    ruta = os.path.join(rutaMeta, NOMBRE_ARCHIVO_CACHE)
+    if not os.path.exists(ruta):
+        return {}
+    try:
+        with open(ruta, 'r', encoding='utf-8') as f:
+            datos = json.load(f)
+        if isinstance(datos, dict) and datos.get('version') == VERSION_CACHE:
+            return datos.get('raices', {})
+    except (OSError, ValueError) as e:
+        log.warning(f"_cargarCache: Caché de estructura ilegible en '{ruta}', se regenerará: {e}")
+    return {}
+
+
+def _guardarCache(rutaMeta, raices):
+    ruta = os.path.join(rutaMeta, NOMBRE_ARCHIVO_CACHE)
+    try:
+        os.makedirs(rutaMeta, exist_ok=True)
+        temporal = ruta + ".tmp"
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump({'version': VERSION_CACHE, 'raices': raices}, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temporal, ruta)
+    except OSError as e:
+        log.warning(f"_guardarCache: No se pudo guardar la caché de estructura en '{ruta}': {e}")
+
+
+def generarEstructura(rutaBase, directoriosIgnorados, rutaMeta, max_depth=8, incluir_archivos=True,
+                      indent_char="    ", subruta=None):
+    """
+    Texto del árbol de `rutaBase` (o solo del directorio `subruta`), servido desde la caché si el
+    árbol no ha cambiado desde la última vez que se pidió la misma variante. None si no se pudo listar
+    o `subruta` no existe en el árbol.
+    """
+    logPrefix = "generarEstructura:"
+    directoriosIgnorados = set(directoriosIgnorados or [])
+    huella, arbol = obtenerModelo(rutaBase, directoriosIgnorados, rutaMeta)
+    if huella is None:
+        return None
+    subruta = (subruta or "").replace(os.sep, '/').strip('/')
+    claveVariante = json.dumps([max_depth, bool(incluir_archivos), indent_char, subruta,
+                                sorted(directoriosIgnorados)], ensure_ascii=False)
+    claveRaiz = os.path.normpath(os.path.abspath(rutaBase))
+    raices = _cargarCache(rutaMeta)
+    entrada = raices.get(claveRaiz)
+    if not entrada or entrada.get('huella') != huella:
+        entrada = {'huella': huella, 'variantes': {}}
+    texto = entrada['variantes'].get(claveVariante)
+    if texto is not None:
+        with _lock:
+            _estadisticas['aciertos_cache'] += 1
+        log.debug(f"{logPrefix} Estructura de '{rutaBase}' servida desde caché (huella {huella[:10]}).")
+        return texto
+
+    nodo = obtenerSubarbol(arbol, subruta)
+    if not isinstance(nodo, dict):
+        log.warning(f"{logPrefix} '{subruta}' no es un directorio del árbol de '{rutaBase}'.")
+        return None
+    nombreRaiz = os.path.basename(os.path.normpath(rutaBase)) + (f"/{subruta}" if subruta else "")
+    texto = renderizar(nodo, nombreRaiz, max_depth, incluir_archivos, indent_char, directoriosIgnorados)
+
+    variantes = entrada['variantes']
+    variantes.pop(claveVariante, None)
+    variantes[claveVariante] = texto
+    while len(variantes) > MAX_VARIANTES_CACHE:
+        variantes.pop(next(iter(variantes)))
+    raices[claveRaiz] = entrada
+    _guardarCache(rutaMeta, raices)
+    return texto
+
+
+def _visibles(nodo, directoriosIgnorados):
+    return [(nombre, hijo) for nombre, hijo in sorted(nodo.items())
+            if not nombre.startswith('.') and nombre not in directoriosIgnorados]
+
+
+def _contarArchivos(nodo, directoriosIgnorados, memo):
+    clave = id(nodo)
+    if clave not in memo:
+        memo[clave] = sum(1 if hijo is None else _contarArchivos(hijo, directoriosIgnorados, memo)
+                          for _, hijo in _visibles(nodo, directoriosIgnorados))
+    return memo[clave]
+
+
+def _distancia(partes, directoriosFoco):
+    """Aristas del árbol entre el directorio `partes` y el directorio de foco más cercano."""
+    mejor = None
+    for foco in directoriosFoco:
+        comun = 0
+        while comun < min(len(partes), len(foco)) and partes[comun] == foco[comun]:
+            comun += 1
+        d = len(partes) + len(foco) - 2 * comun
+        mejor = d if mejor is None else min(mejor, d)
+    return mejor
+
+
+def _renderizarRelevante(nodo, partes, lineas, prefix, expandidos, directoriosIgnorados, indent_char, memo):
+    items = _visibles(nodo, directoriosIgnorados)
+    count = len(items)
+    for i, (nombre, hijo) in enumerate(items):
+        is_last = (i == count - 1)
+        line_prefix = prefix + ("└── " if is_last else "├── ")
+        if hijo is None:
+            lineas.append(line_prefix + nombre)
+            continue
+        rutaHijo = partes + (nombre,)
+        if rutaHijo in expandidos:
+            lineas.append(line_prefix + nombre + "/")
+            new_prefix = prefix + (indent_char if is_last else "│" + indent_char[1:])
+            _renderizarRelevante(hijo, rutaHijo, lineas, new_prefix, expandidos, directoriosIgnorados, indent_char, memo)
+        else:
+            total = _contarArchivos(hijo, directoriosIgnorados, memo)
+            lineas.append(line_prefix + nombre + "/" + (f" ({total} archivo{'s' if total != 1 else ''})" if total else ""))
+
+
+def generarEstructuraRelevante(rutaBase, directoriosIgnorados, rutaMeta, rutasFoco, presupuestoTokens,
+                               contarTokens, indent_char="    "):
+    """
+    Árbol de `rutaBase` resumido según su relevancia para `rutasFoco` (archivos o directorios
+    relativos): los directorios que llevan a un foco se muestran enteros y el resto se despliega
+    por cercanía (en aristas del árbol) mientras quepa en `presupuestoTokens` según `contarTokens(texto)`.
+    Los directorios que no caben se colapsan en una línea con su número de archivos.
+    """
+    logPrefix = "generarEstructuraRelevante:"
+    directoriosIgnorados = set(directoriosIgnorados or [])
+    huella, arbol = obtenerModelo(rutaBase, directoriosIgnorados, rutaMeta)
+    if huella is None:
+        return None
+
+    directoriosFoco = {()}
+    for rel in rutasFoco or []:
+        partes = tuple(p for p in str(rel).replace(os.sep, '/').strip('/').split('/') if p)
+        if not partes:
+            continue
+        directoriosFoco.update(partes[:i] for i in range(len(partes)))
+        if isinstance(obtenerSubarbol(arbol, "/".join(partes)), dict):
+            directoriosFoco.add(partes)
+    directoriosFoco = {partes for partes in directoriosFoco if isinstance(obtenerSubarbol(arbol, "/".join(partes)), dict)}
+
+    memo = {}
+    nombreRaiz = os.path.basename(os.path.normpath(rutaBase)) + "/"
+
+    def _texto(expandidos):
+        lineas = [nombreRaiz]
+        _renderizarRelevante(arbol, (), lineas, "", expandidos, directoriosIgnorados, indent_char, memo)
+        return "\n".join(lineas)
+
+    expandidos = set(directoriosFoco)
+    orden = []  # Directorios desplegados por presupuesto, en orden (para deshacer desde el final)
+    total = contarTokens(_texto(expandidos))
+    candidatos = []
+
+    def _encolarHijos(partes, nodo):
+        for nombre, hijo in _visibles(nodo, directoriosIgnorados):
+            rutaHijo = partes + (nombre,)
+            if hijo is not None and rutaHijo not in expandidos:
+                heapq.heappush(candidatos, (_distancia(rutaHijo, directoriosFoco), len(rutaHijo), rutaHijo))
+
+    for partes in sorted(directoriosFoco):
+        _encolarHijos(partes, obtenerSubarbol(arbol, "/".join(partes)))
+    while candidatos:
+        _, profundidad, partes = heapq.heappop(candidatos)
+        nodo = obtenerSubarbol(arbol, "/".join(partes))
+        hijos = _visibles(nodo, directoriosIgnorados)
+        # Estimación: nombres de los hijos más el prefijo de árbol de cada línea
+        coste = contarTokens(" ".join(nombre for nombre, _ in hijos)) + len(hijos) * (profundidad + 2)
+        if total + coste > presupuestoTokens:
+            break  # Lo que queda está más lejos; se corta aquí para que el detalle decrezca con la distancia
+        expandidos.add(partes)
+        orden.append(partes)
+        total += coste
+        _encolarHijos(partes, nodo)
+
+    texto = _texto(expandidos)
+    tokens = contarTokens(texto)
+    while tokens > presupuestoTokens and orden:
+        expandidos.discard(orden.pop())
+        texto = _texto(expandidos)
+        tokens = contarTokens(texto)
+    if tokens > presupuestoTokens:
+        log.warning(f"{logPrefix} La vista mínima de '{rutaBase}' ({tokens} tokens) supera el presupuesto de {presupuestoTokens}.")
+    log.info(f"{logPrefix} Estructura relevante de '{rutaBase}': {len(expandidos)} directorios desplegados, "
+             f"~{tokens} tokens (presupuesto {presupuestoTokens}).")
+    return texto
+
+
+def obtenerEstadisticas():
+    """Árboles construidos, textos renderizados y aciertos de la caché de estructura."""
+    with _lock:
+        return dict(_estadisticas)
@@ -0,0 +1,165 @@
+# nucleo/cacheRespuestasIA.py
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from config import settings
+
+log = logging.getLogger(__name__)
+
+# Cache en disco de respuestas de la IA, direccionada por contenido.
+# Cada entrada es un archivo '<sha256>.json' en settings.RUTA_CACHE_IA. El mtime del
+# archivo se usa como "último acceso" para el desalojo LRU, así no hace falta un índice aparte.
+
+_lock = threading.Lock()
+_bypass = not settings.CACHE_IA_HABILITADA
+_estadisticas = {'aciertos': 0, 'fallos': 0,
+                 'expiradas': 0, 'guardadas': 0, 'desalojadas': 0}
+_bytesEnDisco = None  # Se calcula perezosamente en el primer guardado
+
+
+def establecerBypass(valor: bool):
+    """Activa/desactiva el bypass de la cache (p.ej. desde el argumento --sin-cache-ia)."""
+    global _bypass
+    _bypass = bool(valor)
+    log.info(
+        f"establecerBypass: Cache de respuestas IA {'desactivada' if _bypass else 'activada'}.")
+
+
+def calcularClave(proveedor: str, modelo: str, configuracion: dict, prompt: str) -> str:
+    """Hash estable de (proveedor, modelo, configuración de generación, prompt completo)."""
+    material = json.dumps({'proveedor': proveedor, 'modelo': modelo, 'configuracion': configuracion},
+                          sort_keys=True, ensure_ascii=False, default=str)
+    h = hashlib.sha256()
+    h.update(material.encode('utf-8'))
+    h.update(b'\x00')
+    h.update(prompt.encode('utf-8'))
+    return h.hexdigest()
+
+
+def _rutaEntrada(clave):
+    return os.path.join(settings.RUTA_CACHE_IA, f"{clave}.json")
+
+
+def obtener(clave: str):
+    """Devuelve el texto cacheado para la clave, o None si no existe, expiró o hay bypass."""
+    logPrefix = "obtener:"
+    if _bypass:
+        return None
+    ruta = _rutaEntrada(clave)
+    with _lock:
+        try:
+            with open(ruta, 'r', encoding='utf-8') as f:
+                entrada = json.load(f)
+        except FileNotFoundError:
+            _estadisticas['fallos'] += 1
+            return None
+        except (OSError, json.JSONDecodeError) as e:
+            log.warning(
+                f"{logPrefix} Entrada de cache corrupta '{clave[:12]}': {e}. Se descarta.")
+            _eliminarEntrada(ruta)
+            _estadisticas['fallos'] += 1
+            return None
+
+        if time.time() - entrada.get('creado', 0) > settings.CACHE_IA_TTL_SEGUNDOS:
+            _eliminarEntrada(ruta)
+            _estadisticas['expiradas'] += 1
+            _estadisticas['fallos'] += 1
+            return None
+
+        try:
+            os.utime(ruta, None)  # Marca el acceso para el LRU
+        except OSError:
+            pass
+        _estadisticas['aciertos'] += 1
+    log.info(f"{logPrefix} Acierto de cache IA ({clave[:12]}).")
+    return entrada.get('texto')
+
+
+def guardar(clave: str, texto: str, metadatos: dict = None):
+    """Guarda el texto de respuesta bajo la clave y desaloja entradas si se supera el tamaño máximo."""
+    global _bytesEnDisco
+    logPrefix = "guardar:"
+    if _bypass or not texto:
+        return
+    entrada = {'creado': time.time(), 'texto': texto,
+               'metadatos': metadatos or {}}
+    ruta = _rutaEntrada(clave)
+    with _lock:
+        try:
+            os.makedirs(settings.RUTA_CACHE_IA, exist_ok=True)
+            if _bytesEnDisco is None:
+                _bytesEnDisco = sum(t for _, _, t in _listarEntradas())
+            tamAnterior = os.path.getsize(ruta) if os.path.exists(ruta) else 0
+            rutaTmp = ruta + ".tmp"
+            with open(rutaTmp, 'w', encoding='utf-8') as f:
+                json.dump(entrada, f, ensure_ascii=False)
+            os.replace(rutaTmp, ruta)
+            _bytesEnDisco += os.path.getsize(ruta) - tamAnterior
+            _estadisticas['guardadas'] += 1
+            _desalojarSiNecesario()
+        except OSError as e:
+            log.warning(
+                f"{logPrefix} No se pudo guardar la entrada de cache '{clave[:12]}': {e}")
+
+
+def _listarEntradas():
+    """Lista (ruta, mtime, tamaño) de las entradas existentes."""
+    entradas = []
+    try:
+        with os.scandir(settings.RUTA_CACHE_IA) as it:
+            for e in it:
+                if e.is_file() and e.name.endswith('.json'):
+                    st = e.stat()
+                    entradas.append((e.path, st.st_mtime, st.st_size))
+    except FileNotFoundError:
+        pass
+    return entradas
+
+
+def _eliminarEntrada(ruta):
+    global _bytesEnDisco
+    try:
+        tam = os.path.getsize(ruta)
+        os.remove(ruta)
+        if _bytesEnDisco is not None:
+            _bytesEnDisco -= tam
+        return True
+    except OSError:
+        return False
+
+
+def _desalojarSiNecesario():
+    # Llamar con _lock tomado.
+    limite = settings.CACHE_IA_MAX_MB * 1024 * 1024
+    if _bytesEnDisco is None or _bytesEnDisco <= limite:
+        return
+    # Se desaloja hasta el 90% del límite para no recorrer el directorio en cada guardado.
+    objetivo = int(limite * 0.9)
+    for ruta, _, _ in sorted(_listarEntradas(), key=lambda x: x[1]):
+        if _bytesEnDisco <= objetivo:
+            break
+        if _eliminarEntrada(ruta):
+            _estadisticas['desalojadas'] += 1
+    log.info(
+        f"_desalojarSiNecesario: Cache IA reducida a {_bytesEnDisco / (1024 * 1024):.1f} MB.")
+
+
+def limpiar():
+    """Elimina todas las entradas de la cache."""
+    global _bytesEnDisco
+    with _lock:
+        for ruta, _, _ in _listarEntradas():
+            _eliminarEntrada(ruta)
+        _bytesEnDisco = 0
+
+
+def obtenerEstadisticas():
+    """Devuelve contadores de aciertos/fallos/desalojos y el tamaño actual en disco."""
+    with _lock:
+        stats = dict(_estadisticas)
+        stats['bytes_en_disco'] = _bytesEnDisco
+        stats['bypass'] = _bypass
+        return stats
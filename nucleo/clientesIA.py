@@ -0,0 +1,170 @@
+# nucleo/clientesIA.py
+import atexit
+import logging
+import threading
+import google.generativeai as genai
+import google.ai.generativelanguage as glm
+from google.generativeai.types import content_types, generation_types, safety_types
+from openai import OpenAI, AsyncOpenAI
+from config import settings
+
+log = logging.getLogger(__name__)
+
+# Registro de clientes por proveedor. Cada entrada vive durante todo el proceso para
+# reutilizar el pool de conexiones keep-alive (httpx en OpenAI, canal gRPC en Gemini)
+# en lugar de abrir conexiones y hacer handshake TLS en cada llamada.
+_lockRegistro = threading.Lock()
+_registroClientes = {}  # (proveedor, clave_registro) -> objeto cliente/modelo
+_estadisticasPool = {
+    'google': {'clientes_creados': 0, 'reutilizaciones': 0},
+    'openrouter': {'clientes_creados': 0, 'reutilizaciones': 0},
+    'openrouter_async': {'clientes_creados': 0, 'reutilizaciones': 0},
+}
+
+
+def _obtenerOCrear(proveedor, claveRegistro, fabrica):
+    """Devuelve el cliente registrado para (proveedor, claveRegistro) o lo crea con `fabrica`."""
+    clave = (proveedor, claveRegistro)
+    with _lockRegistro:
+        cliente = _registroClientes.get(clave)
+        if cliente is not None:
+            _estadisticasPool[proveedor]['reutilizaciones'] += 1
+            return cliente
+        cliente = fabrica()
+        _registroClientes[clave] = cliente
+        _estadisticasPool[proveedor]['clientes_creados'] += 1
+        log.info(
+            f"_obtenerOCrear: Nuevo cliente '{proveedor}' registrado para '{claveRegistro}'.")
+        return cliente
+
+
+class ModeloGeminiConClave:
+    """
+    Equivalente mínimo de `genai.GenerativeModel.generate_content_async` ligado a una API key.
+    `genai.configure` es global al proceso, así que cada clave del pool lleva su propio
+    `GenerativeServiceAsyncClient` (client_options) y la petición se construye con las
+    utilidades públicas de `google.generativeai.types`; la respuesta es del mismo tipo.
+    """
+
+    def __init__(self, nombreModelo, apiKey):
+        self.model_name = genai.GenerativeModel(nombreModelo).model_name
+        self.cliente = glm.GenerativeServiceAsyncClient(client_options={"api_key": apiKey})
+
+    async def generate_content_async(self, contents, *, generation_config=None, safety_settings=None,
+                                     stream=False, request_options=None):
+        peticion = glm.GenerateContentRequest(
+            model=self.model_name,
+            contents=content_types.to_contents(contents),
+            generation_config=generation_types.to_generation_config_dict(generation_config),
+            safety_settings=safety_types.normalize_safety_settings(
+                safety_types.to_easy_safety_dict(safety_settings)),
+        )
+        if peticion.contents and not peticion.contents[-1].role:
+            peticion.contents[-1].role = "user"
+        request_options = request_options or {}
+        if stream:
+            iterador = await self.cliente.stream_generate_content(peticion, **request_options)
+            return await generation_types.AsyncGenerateContentResponse.from_aiterator(iterador)
+        respuesta = await self.cliente.generate_content(peticion, **request_options)
+        return generation_types.AsyncGenerateContentResponse.from_response(respuesta)
+
+
+def obtenerModeloGemini(nombreModelo=None, apiKey=None):
+    """Devuelve un modelo Gemini reutilizable para el modelo indicado.
+
+    Sin `apiKey` es un `genai.GenerativeModel` y se asume que `genai.configure` ya fue llamado
+    (ver analizadorCodigo.configurarGemini). Con `apiKey` es un `ModeloGeminiConClave` con su
+    propio cliente asíncrono ligado a esa clave (pool de claves).
+    """
+    nombreModelo = nombreModelo or settings.MODELO_GOOGLE_GEMINI
+    if not apiKey:
+        return _obtenerOCrear('google', nombreModelo, lambda: genai.GenerativeModel(nombreModelo))
+    return _obtenerOCrear('google', f"{nombreModelo}|...{apiKey[-4:]}",
+                          lambda: ModeloGeminiConClave(nombreModelo, apiKey))
+
+
+def obtenerClienteOpenRouter(apiKey=None):
+    """Devuelve un cliente `OpenAI` reutilizable apuntando a OpenRouter."""
+    apiKey = apiKey or settings.OPENROUTER_API_KEY
+    if not apiKey:
+        log.error("obtenerClienteOpenRouter: Falta OPENROUTER_API_KEY.")
+        return None
+    # La clave de registro no guarda la API key completa para no exponerla en logs.
+    claveRegistro = f"{settings.OPENROUTER_BASE_URL}|...{apiKey[-4:]}"
+    return _obtenerOCrear('openrouter', claveRegistro,
+                          lambda: OpenAI(base_url=settings.OPENROUTER_BASE_URL, api_key=apiKey))
+
+
+def obtenerClienteOpenRouterAsync(apiKey=None):
+    """
+    Devuelve un cliente `AsyncOpenAI` reutilizable apuntando a OpenRouter.
+    Su pool de conexiones queda ligado al bucle de eventos donde se use por primera vez;
+    usarlo solo desde el bucle de nucleo/proveedoresIA.py.
+    """
+    apiKey = apiKey or settings.OPENROUTER_API_KEY
+    if not apiKey:
+        log.error("obtenerClienteOpenRouterAsync: Falta OPENROUTER_API_KEY.")
+        return None
+    claveRegistro = f"{settings.OPENROUTER_BASE_URL}|...{apiKey[-4:]}"
+    return _obtenerOCrear('openrouter_async', claveRegistro,
+                          lambda: AsyncOpenAI(base_url=settings.OPENROUTER_BASE_URL, api_key=apiKey))
+
+
+def _contarConexionesAbiertas(cliente):
+    """
+    Cuenta las conexiones del pool httpx del cliente, o None si no se puede saber.
+    Ese pool no es API pública: cada paso se recorre con getattr para que un cambio
+    interno de openai/httpx solo deje la cifra en None.
+    """
+    objeto = cliente
+    for atributo in ('_client', '_transport', '_pool', 'connections'):
+        objeto = getattr(objeto, atributo, None)
+        if objeto is None:
+            return None
+    try:
+        return len(objeto)
+    except TypeError:
+        return None
+
+
+def obtenerEstadisticasPool():
+    """
+    Devuelve estadísticas del registro de clientes por proveedor:
+    clientes creados, reutilizaciones y conexiones abiertas (si se pueden inspeccionar).
+    """
+    with _lockRegistro:
+        resultado = {}
+        for proveedor, stats in _estadisticasPool.items():
+            clientes = [c for (p, _), c in _registroClientes.items() if p == proveedor]
+            conexiones = None
+            if proveedor.startswith('openrouter'):
+                conteos = [_contarConexionesAbiertas(c) for c in clientes]
+                conteos = [n for n in conteos if n is not None]
+                conexiones = sum(conteos) if conteos else None
+            resultado[proveedor] = {
+                'clientes_activos': len(clientes),
+                'clientes_creados': stats['clientes_creados'],
+                'reutilizaciones': stats['reutilizaciones'],
+                'conexiones_abiertas': conexiones,
+            }
+        return resultado
+
+
+def cerrarPool():
+    """Cierra los clientes registrados y vacía el registro."""
+    with _lockRegistro:
+        for (proveedor, claveRegistro), cliente in list(_registroClientes.items()):
+            cerrar = getattr(cliente, 'close', None)
+            if proveedor == 'openrouter_async':
+                # close() es una corrutina ligada al bucle de proveedoresIA; se descarta con el proceso.
+                continue
+            if callable(cerrar):
+                try:
+                    cerrar()
+                except Exception as e:
+                    log.debug(
+                        f"cerrarPool: Error cerrando cliente '{proveedor}' ({claveRegistro}): {e}")
+        _registroClientes.clear()
+
+
+atexit.register(cerrarPool)
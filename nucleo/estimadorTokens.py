@@ -0,0 +1,179 @@
+# nucleo/estimadorTokens.py
+import os
+import re
+import json
+import math
+import atexit
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from config import settings
+
+log = logging.getLogger(__name__)
+
+# Estimador local de tokens (sin llamadas de red).
+# El estimador base trocea el texto en palabras, números, puntuación y espacios, y
+# asigna tokens según un ratio de caracteres por token. Encima se aplica un factor de
+# corrección por (proveedor, modelo) que se ajusta con el uso real que devuelven las APIs.
+
+CARACTERES_POR_TOKEN_DEFECTO = {
+    'google': 4.0,
+    'openrouter': 3.8,
+}
+_PATRON_PIEZAS = re.compile(r"[^\W\d_]+|\d+|\s+|.", re.UNICODE | re.DOTALL)
+_MAX_MEMO = 4096
+_ALFA_CALIBRACION = 0.2  # Peso de cada observación real en la media móvil del factor
+_LIMITES_FACTOR = (0.5, 2.0)
+_UMBRAL_GUARDADO = 0.02  # Cambio relativo del factor respecto al guardado que obliga a reescribir el archivo
+
+_lock = threading.Lock()
+_memo = OrderedDict()  # (hash, proveedor) -> estimación base (sin factor)
+_estimadoresRegistrados = {}  # proveedor -> callable(texto) -> int
+_factores = None  # "proveedor|modelo" -> factor de corrección; se carga perezosamente
+_factoresGuardados = {}  # Últimos valores escritos en disco
+_lockArchivo = threading.Lock()  # Serializa las escrituras (fuera de _lock)
+_estadisticas = {'memo_aciertos': 0, 'memo_fallos': 0, 'calibraciones': 0, 'guardados': 0}
+
+
+def registrarEstimador(proveedor: str, funcion):
+    """Sustituye el estimador base de un proveedor (p.ej. un tokenizador real). `funcion(texto) -> int`."""
+    with _lock:
+        _estimadoresRegistrados[proveedor] = funcion
+        _memo.clear()
+    log.info(f"registrarEstimador: Estimador personalizado registrado para '{proveedor}'.")
+
+
+def _estimacionBase(texto, proveedor):
+    funcion = _estimadoresRegistrados.get(proveedor)
+    if funcion:
+        return int(funcion(texto))
+    ratio = CARACTERES_POR_TOKEN_DEFECTO.get(proveedor, 4.0)
+    tokens = 0
+    for m in _PATRON_PIEZAS.finditer(texto):
+        pieza = m.group()
+        c = pieza[0]
+        if c.isspace():
+            # Un espacio simple suele ir pegado a la palabra siguiente; indentación y saltos no.
+            if len(pieza) > 1 or c == '\n':
+                tokens += 1
+        elif c.isdigit():
+            tokens += math.ceil(len(pieza) / 3)
+        elif c.isalpha():
+            tokens += math.ceil(len(pieza) / ratio)
+        else:
+            tokens += 1
+    return tokens
+
+
+def _claveFactor(proveedor, modelo):
+    return f"{proveedor}|{modelo or ''}"
+
+
+def _cargarFactores():
+    global _factores, _factoresGuardados
+    if _factores is not None:
+        return _factores
+    _factores = {}
+    try:
+        if os.path.exists(settings.ESTIMADOR_TOKENS_STATE_FILE):
+            with open(settings.ESTIMADOR_TOKENS_STATE_FILE, 'r', encoding='utf-8') as f:
+                datos = json.load(f)
+            if isinstance(datos, dict):
+                _factores = {k: float(v) for k, v in datos.items()}
+                _factoresGuardados = dict(_factores)
+    except (OSError, ValueError, TypeError) as e:
+        log.warning(f"_cargarFactores: No se pudo leer la calibración de tokens: {e}")
+    return _factores
+
+
+def _guardarFactores():
+    """Escribe los factores actuales (atómicamente). Se llama sin tener _lock."""
+    with _lockArchivo:
+        with _lock:
+            factores = dict(_factores or {})
+        rutaTemporal = settings.ESTIMADOR_TOKENS_STATE_FILE + '.tmp'
+        try:
+            with open(rutaTemporal, 'w', encoding='utf-8') as f:
+                json.dump(factores, f, indent=2)
+            os.replace(rutaTemporal, settings.ESTIMADOR_TOKENS_STATE_FILE)
+        except OSError as e:
+            log.warning(f"_guardarFactores: No se pudo guardar la calibración de tokens: {e}")
+
+
+def _guardarPendientesAlSalir():
+    """Persiste al cerrar los ajustes que quedaron por debajo del umbral de guardado."""
+    with _lock:
+        pendientes = _factores is not None and _factores != _factoresGuardados
+    if pendientes:
+        _guardarFactores()
+
+
+atexit.register(_guardarPendientesAlSalir)
+
+
+def _estimacionBaseMemo(texto, proveedor):
+    clave = (hashlib.sha1(texto.encode('utf-8', 'surrogatepass')).hexdigest(), proveedor)
+    with _lock:
+        if clave in _memo:
+            _memo.move_to_end(clave)
+            _estadisticas['memo_aciertos'] += 1
+            return _memo[clave]
+        _estadisticas['memo_fallos'] += 1
+    base = _estimacionBase(texto, proveedor)
+    with _lock:
+        _memo[clave] = base
+        if len(_memo) > _MAX_MEMO:
+            _memo.popitem(last=False)
+    return base
+
+
+def estimarTokens(texto: str, proveedor: str = 'google', modelo: str = None) -> int:
+    """Estima el número de tokens de `texto` para el proveedor/modelo indicado, sin red."""
+    if not texto:
+        return 0
+    base = _estimacionBaseMemo(texto, proveedor)
+    with _lock:
+        factor = _cargarFactores().get(_claveFactor(proveedor, modelo), 1.0)
+    return max(1, int(round(base * factor)))
+
+
+def calibrar(proveedor: str, modelo: str, texto: str, tokensReales: int):
+    """
+    Ajusta el factor de corrección de (proveedor, modelo) con el conteo real de tokens
+    de `texto` (p.ej. prompt_token_count del usage de una respuesta).
+    """
+    logPrefix = "calibrar:"
+    if not texto or not isinstance(tokensReales, int) or tokensReales <= 0:
+        return
+    base = _estimacionBaseMemo(texto, proveedor)
+    if base <= 0:
+        return
+    observado = min(max(tokensReales / base, _LIMITES_FACTOR[0]), _LIMITES_FACTOR[1])
+    with _lock:
+        factores = _cargarFactores()
+        clave = _claveFactor(proveedor, modelo)
+        anterior = factores.get(clave)
+        nuevo = observado if anterior is None else (
+            (1 - _ALFA_CALIBRACION) * anterior + _ALFA_CALIBRACION * observado)
+        factores[clave] = round(nuevo, 4)
+        _estadisticas['calibraciones'] += 1
+        # Solo se reescribe el archivo si el factor se ha movido lo suficiente desde lo guardado
+        guardado = _factoresGuardados.get(clave)
+        debeGuardar = guardado is None or abs(factores[clave] - guardado) > _UMBRAL_GUARDADO * guardado
+        if debeGuardar:
+            _factoresGuardados.update(factores)
+            _estadisticas['guardados'] += 1
+    if debeGuardar:
+        _guardarFactores()
+    log.debug(
+        f"{logPrefix} Factor '{clave}': {anterior} -> {factores[clave]} (real={tokensReales}, base={base})")
+
+
+def obtenerEstadisticas():
+    """Devuelve contadores de memoización/calibración y los factores actuales."""
+    with _lock:
+        stats = dict(_estadisticas)
+        stats['memo_entradas'] = len(_memo)
+        stats['factores'] = dict(_cargarFactores())
+        return stats
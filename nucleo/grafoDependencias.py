@@ -0,0 +1,336 @@
+# nucleo/grafoDependencias.py
+import os
+import re
+import ast
+import json
+import time
+import logging
+import threading
+from collections import defaultdict
+from config import settings
+from nucleo import indiceArchivos
+from nucleo import estimadorTokens
+
+log = logging.getLogger(__name__)
+
+# Grafo de dependencias entre archivos del proyecto clonado (require/include/use en PHP,
+# import/require en JS e imports de Python), persistido en <ruta_proyecto>/.orion_meta/ junto
+# al índice de archivos. Por archivo se guardan las referencias tal como aparecen en el código
+# y solo se vuelven a extraer las de los archivos cuyo tamaño o mtime cambió; la resolución a
+# rutas del proyecto se hace al cargar (así un archivo nuevo resuelve referencias antiguas).
+# Las referencias que no apuntan a un archivo del proyecto (paquetes externos) se descartan.
+#
+# Formato de referencia: ['ruta', texto] (require/include/import relativo), ['clase', 'A\\B\\C']
+# (use de PHP) o ['modulo', 'a.b', nivel] (import de Python; nivel = nº de puntos relativos).
+
+VERSION_GRAFO = 1
+NOMBRE_ARCHIVO_GRAFO = "grafo_dependencias.json"
+EXTENSIONES_SOPORTADAS = ('.py', '.php', '.js')
+PESO_IMPORTADO = 1.0  # El archivo depende del vecino
+PESO_IMPORTADOR = 0.7  # El vecino depende del archivo
+ATENUACION_NIVEL = 0.5  # Peso relativo de cada salto adicional
+
+_lock = threading.Lock()
+_estadisticas = {'archivos_analizados': 0, 'archivos_reutilizados': 0, 'errores_analisis': 0,
+                 'referencias_resueltas': 0, 'referencias_externas': 0}
+
+_COMENTARIOS_PHP_JS = re.compile(r"/\*.*?\*/|(?<![:\\'\"])//[^\n]*", re.S)
+_PATRON_INCLUDE_PHP = re.compile(
+    r"\b(?:require|include)(?:_once)?\b\s*\(?\s*"
+    r"(?P<base>(?:__DIR__|dirname\s*\(\s*__FILE__\s*\))\s*\.\s*)?"
+    r"(?P<q>['\"])(?P<ruta>[^'\"\n]+)(?P=q)", re.I)
+_PATRON_USE_PHP = re.compile(r"^[ \t]*use\s+(?!function\b|const\b)(?P<decl>[\w\\]+(?:\s*\{[^}]*\})?[^;]*);", re.M | re.I)
+_PATRON_IMPORT_JS = re.compile(
+    r"(?:\bimport\s+(?:[\w$*{}\s,]+?\s+from\s+)?|\bexport\s+[\w$*{}\s,]+?\s+from\s+|\b(?:require|import)\s*\(\s*)"
+    r"(?P<q>['\"])(?P<ruta>[^'\"\n]+)(?P=q)")
+
+
+def _referenciasPhp(texto):
+    texto = _COMENTARIOS_PHP_JS.sub('', texto)
+    referencias = []
+    for m in _PATRON_INCLUDE_PHP.finditer(texto):
+        ruta = m.group('ruta')
+        # Con __DIR__ . '/x.php' la ruta es relativa al archivo aunque empiece por '/'
+        referencias.append(['ruta', ruta.lstrip('/') if m.group('base') else ruta])
+    for m in _PATRON_USE_PHP.finditer(texto):
+        decl = m.group('decl')
+        if '{' in decl:
+            prefijo, _, grupo = decl.partition('{')
+            prefijo = prefijo.strip().rstrip('\\')
+            nombres = [f"{prefijo}\\{n.strip()}" for n in grupo.rstrip('} \t').split(',') if n.strip()]
+        else:
+            nombres = decl.split(',')
+        for nombre in nombres:
+            nombre = re.split(r"\s+as\s+", nombre.strip(), flags=re.I)[0].strip().strip('\\')
+            if nombre:
+                referencias.append(['clase', nombre])
+    return referencias
+
+
+def _referenciasJs(texto):
+    texto = _COMENTARIOS_PHP_JS.sub('', texto)
+    return [['ruta', m.group('ruta')] for m in _PATRON_IMPORT_JS.finditer(texto)
+            if m.group('ruta').startswith(('.', '/'))]
+
+
+def _referenciasPython(texto):
+    referencias = []
+    for nodo in ast.walk(ast.parse(texto)):
+        if isinstance(nodo, ast.Import):
+            referencias.extend(['modulo', alias.name, 0] for alias in nodo.names)
+        elif isinstance(nodo, ast.ImportFrom):
+            base = nodo.module or ''
+            referencias.append(['modulo', base, nodo.level])
+            # `from paquete import modulo` también puede referirse a un submódulo
+            for alias in nodo.names:
+                if alias.name != '*':
+                    referencias.append(['modulo', f"{base}.{alias.name}" if base else alias.name, nodo.level])
+    return referencias
+
+
+def extraerReferencias(texto, extension):
+    """Referencias a otros archivos de `texto` según la extensión (.py, .php o .js), sin resolver."""
+    extension = extension.lower()
+    if extension == '.py':
+        return _referenciasPython(texto)
+    if extension == '.php':
+        return _referenciasPhp(texto)
+    if extension == '.js':
+        return _referenciasJs(texto)
+    return []
+
+
+def _rutaArchivoGrafo(rutaMeta):
+    return os.path.join(rutaMeta, NOMBRE_ARCHIVO_GRAFO)
+
+
+def _cargarIndices(rutaMeta):
+    rutaGrafo = _rutaArchivoGrafo(rutaMeta)
+    if not os.path.exists(rutaGrafo):
+        return {}
+    try:
+        with open(rutaGrafo, 'r', encoding='utf-8') as f:
+            datos = json.load(f)
+        if isinstance(datos, dict) and datos.get('version') == VERSION_GRAFO:
+            return datos.get('indices', {})
+    except (OSError, ValueError) as e:
+        log.warning(f"_cargarIndices: Grafo de dependencias ilegible en '{rutaGrafo}', se reconstruirá: {e}")
+    return {}
+
+
+def _guardarIndices(rutaMeta, indices):
+    rutaGrafo = _rutaArchivoGrafo(rutaMeta)
+    try:
+        os.makedirs(rutaMeta, exist_ok=True)
+        temporal = rutaGrafo + ".tmp"
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump({'version': VERSION_GRAFO, 'indices': indices}, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temporal, rutaGrafo)
+    except OSError as e:
+        log.warning(f"_guardarIndices: No se pudo guardar el grafo de dependencias en '{rutaGrafo}': {e}")
+
+
+def _analizarArchivo(rutaBase, rel, entradaAnterior):
+    """Entrada del grafo para `rel`, reutilizando `entradaAnterior` si no cambió. None si no existe."""
+    rutaAbs = os.path.join(rutaBase, rel)
+    try:
+        stat = os.stat(rutaAbs)
+    except OSError:
+        return None
+    if entradaAnterior and entradaAnterior.get('tam') == stat.st_size and entradaAnterior.get('mtime_ns') == stat.st_mtime_ns:
+        with _lock:
+            _estadisticas['archivos_reutilizados'] += 1
+        return entradaAnterior
+    referencias = []
+    try:
+        with open(rutaAbs, 'r', encoding='utf-8', errors='replace') as f:
+            texto = f.read()
+        referencias = extraerReferencias(texto, os.path.splitext(rel)[1])
+    except (OSError, SyntaxError, ValueError, RecursionError) as e:
+        log.debug(f"_analizarArchivo: No se pudieron extraer dependencias de '{rel}': {e}")
+        with _lock:
+            _estadisticas['errores_analisis'] += 1
+    with _lock:
+        _estadisticas['archivos_analizados'] += 1
+    return {'tam': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'refs': referencias}
+
+
+def _normalizar(ruta):
+    ruta = os.path.normpath(ruta).replace(os.sep, '/')
+    return None if ruta.startswith('..') or ruta == '.' else ruta
+
+
+def _resolverReferencia(rel, referencia, archivos, porNombre):
+    """Archivo del proyecto al que apunta `referencia` desde `rel`, o None si es externa."""
+    tipo, valor = referencia[0], referencia[1]
+    directorio = os.path.dirname(rel)
+    candidatos = []
+    if tipo == 'ruta':
+        bases = [valor.lstrip('/')] if valor.startswith('/') else [os.path.join(directorio, valor), valor]
+        for base in bases:
+            candidatos.extend([base, base + '.js', base + '/index.js'] if rel.endswith('.js') else [base])
+    elif tipo == 'modulo':
+        nivel = referencia[2]
+        partes = [p for p in valor.split('.') if p]
+        if nivel:
+            base = directorio
+            for _ in range(nivel - 1):
+                base = os.path.dirname(base)
+            raices = [base]
+        else:
+            # Imports absolutos: desde la raíz del proyecto o desde la carpeta del propio script
+            raices = ['', directorio]
+        for raiz in raices:
+            ruta = os.path.join(raiz, *partes) if partes else raiz
+            candidatos.extend([ruta + '.py', os.path.join(ruta, '__init__.py')] if partes else [os.path.join(ruta, '__init__.py')])
+    elif tipo == 'clase':
+        # PSR-4 sin leer composer.json: gana el archivo cuya ruta coincide con más segmentos finales
+        # del nombre cualificado; si solo coincide el nombre del archivo, tiene que ser único.
+        partes = [p.lower() for p in valor.split('\\') if p]
+        if not partes:
+            return None
+        mejores, mejorPuntuacion = [], 0
+        for candidato in porNombre.get(partes[-1] + '.php', ()):
+            segmentos = candidato.lower()[:-len('.php')].split('/')
+            puntuacion = 0
+            while puntuacion < min(len(segmentos), len(partes)) and segmentos[-1 - puntuacion] == partes[-1 - puntuacion]:
+                puntuacion += 1
+            if puntuacion > mejorPuntuacion:
+                mejores, mejorPuntuacion = [candidato], puntuacion
+            elif puntuacion == mejorPuntuacion:
+                mejores.append(candidato)
+        if mejores and (mejorPuntuacion > 1 or len(mejores) == 1):
+            candidatos.append(min(mejores))
+    for candidato in candidatos:
+        ruta = _normalizar(candidato)
+        if ruta and ruta != rel and ruta in archivos:
+            return ruta
+    return None
+
+
+def _construirGrafo(entradas):
+    archivos = set(entradas)
+    porNombre = defaultdict(list)
+    for rel in archivos:
+        porNombre[os.path.basename(rel).lower()].append(rel)
+    salientes, entrantes = {}, defaultdict(set)
+    resueltas = externas = 0
+    for rel, entrada in entradas.items():
+        destinos = set()
+        for referencia in entrada['refs']:
+            destino = _resolverReferencia(rel, referencia, archivos, porNombre)
+            if destino:
+                destinos.add(destino)
+                resueltas += 1
+            else:
+                externas += 1
+        salientes[rel] = sorted(destinos)
+        for destino in destinos:
+            entrantes[destino].add(rel)
+    with _lock:
+        _estadisticas['referencias_resueltas'] += resueltas
+        _estadisticas['referencias_externas'] += externas
+    return {'salientes': salientes, 'entrantes': {rel: sorted(origenes) for rel, origenes in entrantes.items()}}
+
+
+def actualizarGrafo(rutaBase, rutaMeta, directoriosIgnorados=None, extensiones=None):
+    """
+    Devuelve {'salientes': {rel: [rel...]}, 'entrantes': {rel: [rel...]}} con las dependencias
+    entre archivos del proyecto, volviendo a analizar solo los que cambiaron, y persiste las
+    referencias en `rutaMeta`. None si no se pudo listar el proyecto.
+    """
+    logPrefix = "actualizarGrafo:"
+    inicio = time.monotonic()
+    if directoriosIgnorados is None:
+        directoriosIgnorados = settings.DIRECTORIOS_IGNORADOS
+    if extensiones is None:
+        extensiones = [e for e in settings.EXTENSIONESPERMITIDAS if e]
+    extensiones = {e.lower() for e in extensiones} & set(EXTENSIONES_SOPORTADAS)
+    ignorados = {d for d in directoriosIgnorados if not d.startswith('.')}
+    rutas = indiceArchivos.listarRutasProyecto(rutaBase, ignorados, rutaMeta)
+    if rutas is None:
+        log.error(f"{logPrefix} No se pudieron listar los archivos de '{rutaBase}'.")
+        return None
+
+    claveIndice = os.path.normpath(os.path.abspath(rutaBase))
+    indices = _cargarIndices(rutaMeta)
+    anterior = indices.get(claveIndice, {})
+    entradas = {}
+    for rel in rutas:
+        if os.path.splitext(rel)[1].lower() not in extensiones:
+            continue
+        entrada = _analizarArchivo(rutaBase, rel, anterior.get(rel))
+        if entrada is not None:
+            entradas[rel] = entrada
+    indices[claveIndice] = entradas
+    _guardarIndices(rutaMeta, indices)
+    grafo = _construirGrafo(entradas)
+    log.info(f"{logPrefix} Grafo de dependencias de '{rutaBase}': {len(entradas)} archivos, "
+             f"{sum(len(d) for d in grafo['salientes'].values())} aristas en {time.monotonic() - inicio:.2f}s.")
+    return grafo
+
+
+def archivosRelacionados(grafo, rel, k=None, profundidadMax=2):
+    """
+    Archivos relacionados con `rel` ordenados por relevancia: lo que importa pesa más que lo que
+    lo importa, y cada salto adicional atenúa el peso. A igual puntuación, orden alfabético.
+    """
+    rel = rel.replace(os.sep, '/').lstrip('/')
+    puntuaciones = defaultdict(float)
+    frontera = {rel: 1.0}
+    visitados = {rel}
+    for nivel in range(profundidadMax):
+        siguiente = defaultdict(float)
+        for origen, peso in frontera.items():
+            for vecino in grafo['salientes'].get(origen, ()):
+                siguiente[vecino] += peso * PESO_IMPORTADO
+            for vecino in grafo['entrantes'].get(origen, ()):
+                siguiente[vecino] += peso * PESO_IMPORTADOR
+        frontera = {}
+        for vecino, peso in siguiente.items():
+            if vecino in visitados:
+                continue
+            puntuaciones[vecino] += peso * ATENUACION_NIVEL ** nivel
+            frontera[vecino] = peso
+        visitados.update(frontera)
+    ordenados = sorted(puntuaciones, key=lambda r: (-puntuaciones[r], r))
+    return ordenados[:k] if k is not None else ordenados
+
+
+def seleccionarContexto(rutaBase, rel, k, presupuestoTokens=None, api_provider='google', rutaMeta=None, directoriosIgnorados=None):
+    """
+    Hasta `k` archivos relacionados con `rel` por el grafo de dependencias, en orden de relevancia
+    y sin pasar de `presupuestoTokens` (estimado por tamaño; 0/None = sin límite). Lista vacía si
+    no se pudo construir el grafo.
+    """
+    logPrefix = "seleccionarContexto:"
+    if not k:
+        return []
+    rutaMeta = rutaMeta or os.path.join(rutaBase, '.orion_meta')
+    grafo = actualizarGrafo(rutaBase, rutaMeta, directoriosIgnorados)
+    if grafo is None:
+        return []
+    caracteresPorToken = estimadorTokens.CARACTERES_POR_TOKEN_DEFECTO.get(api_provider, 4.0)
+    seleccionados, tokensUsados = [], 0
+    for candidato in archivosRelacionados(grafo, rel):
+        if len(seleccionados) >= k:
+            break
+        try:
+            tamano = os.path.getsize(os.path.join(rutaBase, candidato))
+        except OSError:
+            continue
+        if not tamano:
+            continue  # p.ej. __init__.py vacíos: no aportan contexto
+        tokens = int(tamano / caracteresPorToken)
+        if presupuestoTokens and tokensUsados + tokens > presupuestoTokens:
+            continue
+        seleccionados.append(candidato)
+        tokensUsados += tokens
+    log.info(f"{logPrefix} {len(seleccionados)} archivo(s) de contexto para '{rel}' (~{tokensUsados} tokens): {seleccionados}")
+    return seleccionados
+
+
+def obtenerEstadisticas():
+    """Archivos analizados, reutilizados y con errores, y referencias resueltas frente a externas."""
+    with _lock:
+        return dict(_estadisticas)
@@ -0,0 +1,277 @@
+# nucleo/indiceArchivos.py
+import os
+import json
+import time
+import hashlib
+import logging
+from config import settings
+from nucleo import manejadorGit
+
+log = logging.getLogger(__name__)
+
+# Índice persistente de archivos del proyecto, guardado en <ruta_proyecto>/.orion_meta/.
+# Guarda por cada archivo su tamaño, mtime y extensión, y por cada directorio su mtime.
+# En cada fase se refresca de forma incremental en lugar de recorrer todo el árbol:
+#   1. Si el índice conoce el commit con el que se construyó y HEAD ha cambiado, se actualizan
+#      las rutas que da `git diff --name-status` entre ambos (contenido modificado).
+#   2. Se comprueba el mtime de cada directorio conocido; solo los que cambiaron (archivos o
+#      subdirectorios creados, borrados o renombrados) se vuelven a listar, y los subdirectorios
+#      nuevos se escanean enteros.
+# Si cambian la raíz o los directorios ignorados el índice se reconstruye desde cero.
+# Los enlaces simbólicos a directorios no se recorren (igual que git), así no hay ciclos.
+#
+# Si la ruta está dentro de un repositorio git (LISTADO_ARCHIVOS_GIT), el listado se pide a
+# git en una sola llamada (`git ls-files`: versionados + no versionados no ignorados), con la
+# semántica de .gitignore incluida, y no hace falta tocar el sistema de archivos.
+
+VERSION_INDICE = 2
+NOMBRE_ARCHIVO_INDICE = "indice_archivos.json"
+
+_estadisticas = {'reconstrucciones': 0, 'actualizaciones_incrementales': 0,
+                 'directorios_reescaneados': 0, 'rutas_desde_git': 0, 'listados_git_ls_files': 0}
+
+
+def _rutaArchivoIndice(rutaMeta):
+    return os.path.join(rutaMeta, NOMBRE_ARCHIVO_INDICE)
+
+
+def _huellaFiltros(directoriosIgnorados):
+    return hashlib.sha1("|".join(sorted(directoriosIgnorados or [])).encode('utf-8')).hexdigest()[:12]
+
+
+def _ignorarRuta(rel, directoriosIgnorados):
+    """Mismo criterio que el os.walk original: ocultos fuera y directorios ignorados por nombre."""
+    partes = rel.split('/')
+    return any(p.startswith('.') for p in partes) or any(p in directoriosIgnorados for p in partes[:-1])
+
+
+def _cargarIndices(rutaMeta):
+    rutaIndice = _rutaArchivoIndice(rutaMeta)
+    if not os.path.exists(rutaIndice):
+        return {}
+    try:
+        with open(rutaIndice, 'r', encoding='utf-8') as f:
+            datos = json.load(f)
+        if isinstance(datos, dict) and datos.get('version') == VERSION_INDICE:
+            return datos.get('indices', {})
+    except (OSError, ValueError) as e:
+        log.warning(f"_cargarIndices: Índice de archivos ilegible en '{rutaIndice}', se reconstruirá: {e}")
+    return {}
+
+
+def _guardarIndices(rutaMeta, indices):
+    rutaIndice = _rutaArchivoIndice(rutaMeta)
+    try:
+        os.makedirs(rutaMeta, exist_ok=True)
+        temporal = rutaIndice + ".tmp"
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump({'version': VERSION_INDICE, 'indices': indices}, f, separators=(',', ':'))
+        os.replace(temporal, rutaIndice)
+    except OSError as e:
+        log.warning(f"_guardarIndices: No se pudo guardar el índice de archivos en '{rutaIndice}': {e}")
+
+
+def _commitActual(rutaBase):
+    exito, salida = manejadorGit.ejecutarComando(
+        ['git', 'rev-parse', 'HEAD'], cwd=rutaBase, check=False, return_output=True)
+    return salida.strip() if exito and salida else None
+
+
+def _entradaArchivo(stat, nombre):
+    return {'tam': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'ext': os.path.splitext(nombre)[1].lower()}
+
+
+def _escanearDirectorio(rutaBase, relDir, indice, directoriosIgnorados, recursivo):
+    """
+    Lista un directorio (relativo a rutaBase) y actualiza sus archivos y subdirectorios en el índice.
+    Con `recursivo` también escanea todos los subdirectorios; si no, solo los que no estaban indexados.
+    """
+    archivos = indice['archivos']
+    directorios = indice['directorios']
+    pendientes = [relDir]
+    while pendientes:
+        actual = pendientes.pop()
+        rutaAbs = os.path.join(rutaBase, actual) if actual else rutaBase
+        try:
+            statDir = os.stat(rutaAbs)
+            entradas = list(os.scandir(rutaAbs))
+        except OSError as e:
+            log.debug(f"_escanearDirectorio: No se pudo listar '{rutaAbs}': {e}")
+            _olvidarSubarbol(indice, actual)
+            continue
+        _estadisticas['directorios_reescaneados'] += 1
+        directorios[actual] = statDir.st_mtime_ns
+        prefijo = f"{actual}/" if actual else ""
+        vistos = set()
+        for entrada in entradas:
+            if entrada.name.startswith('.'):
+                continue
+            rel = prefijo + entrada.name
+            try:
+                if entrada.is_dir(follow_symlinks=False):
+                    if entrada.name in directoriosIgnorados:
+                        continue
+                    vistos.add(rel)
+                    if recursivo or actual != relDir or rel not in directorios:
+                        pendientes.append(rel)
+                elif entrada.is_file():
+                    vistos.add(rel)
+                    archivos[rel] = _entradaArchivo(entrada.stat(), entrada.name)
+            except OSError:
+                continue
+        if recursivo or actual != relDir:
+            continue  # Directorio nuevo en el índice: no hay entradas antiguas que limpiar
+        # Hijos directos que ya no existen (archivos o subárboles enteros)
+        for rel in [r for r in archivos if r.startswith(prefijo) and '/' not in r[len(prefijo):]]:
+            if rel not in vistos:
+                del archivos[rel]
+        for rel in [d for d in directorios if d and d.startswith(prefijo) and '/' not in d[len(prefijo):]]:
+            if rel not in vistos:
+                _olvidarSubarbol(indice, rel)
+
+
+def _olvidarSubarbol(indice, relDir):
+    prefijo = f"{relDir}/" if relDir else ""
+    indice['directorios'].pop(relDir, None)
+    for clave in ('archivos', 'directorios'):
+        for rel in [r for r in indice[clave] if r.startswith(prefijo)]:
+            del indice[clave][rel]
+
+
+def _aplicarCambiosGit(rutaBase, indice, commitActual, directoriosIgnorados):
+    """Actualiza las rutas cambiadas entre el commit indexado y HEAD. Devuelve False si git no pudo."""
+    exito, salida = manejadorGit.ejecutarComando(
+        ['git', 'diff', '--name-status', '--no-renames', '--relative', indice['commit'], commitActual],
+        cwd=rutaBase, check=False, return_output=True)
+    if not exito:
+        return False
+    for linea in salida.splitlines():
+        partes = linea.split('\t', 1)
+        if len(partes) != 2:
+            continue
+        rel = partes[1].strip()
+        if _ignorarRuta(rel, directoriosIgnorados):
+            continue
+        _estadisticas['rutas_desde_git'] += 1
+        rutaAbs = os.path.join(rutaBase, rel)
+        try:
+            indice['archivos'][rel] = _entradaArchivo(os.stat(rutaAbs), rel)
+        except OSError:
+            indice['archivos'].pop(rel, None)
+    return True
+
+
+def _refrescarPorMtimeDirectorios(rutaBase, indice, directoriosIgnorados):
+    """Vuelve a listar solo los directorios cuyo mtime ha cambiado desde la última vez."""
+    for relDir, mtimeGuardado in list(indice['directorios'].items()):
+        if relDir not in indice['directorios']:
+            continue  # Eliminado al reescanear su padre
+        rutaAbs = os.path.join(rutaBase, relDir) if relDir else rutaBase
+        try:
+            mtimeActual = os.stat(rutaAbs).st_mtime_ns
+        except OSError:
+            _olvidarSubarbol(indice, relDir)
+            continue
+        if mtimeActual != mtimeGuardado:
+            _escanearDirectorio(rutaBase, relDir, indice, directoriosIgnorados, recursivo=False)
+
+
+def actualizarIndice(rutaBase, directoriosIgnorados, rutaMeta):
+    """
+    Devuelve el índice de `rutaBase` ({'archivos': {rel: {...}}, 'directorios': {...}, 'commit': ...})
+    refrescado incrementalmente y persistido en `rutaMeta`. None si la ruta no es un directorio.
+    """
+    logPrefix = "actualizarIndice:"
+    if not os.path.isdir(rutaBase):
+        log.error(f"{logPrefix} '{rutaBase}' no es un directorio.")
+        return None
+    inicio = time.monotonic()
+    directoriosIgnorados = set(directoriosIgnorados or [])
+    claveIndice = os.path.normpath(os.path.abspath(rutaBase))
+    indices = _cargarIndices(rutaMeta)
+    indice = indices.get(claveIndice)
+    huella = _huellaFiltros(directoriosIgnorados)
+    commitActual = _commitActual(rutaBase)
+
+    if not indice or indice.get('filtros') != huella:
+        indice = {'filtros': huella, 'commit': None, 'archivos': {}, 'directorios': {}}
+        _escanearDirectorio(rutaBase, "", indice, directoriosIgnorados, recursivo=True)
+        _estadisticas['reconstrucciones'] += 1
+        modo = "completo"
+    else:
+        if indice.get('commit') and commitActual and indice['commit'] != commitActual:
+            if not _aplicarCambiosGit(rutaBase, indice, commitActual, directoriosIgnorados):
+                log.debug(f"{logPrefix} git diff no disponible; solo se usarán los mtime de directorios.")
+        _refrescarPorMtimeDirectorios(rutaBase, indice, directoriosIgnorados)
+        _estadisticas['actualizaciones_incrementales'] += 1
+        modo = "incremental"
+
+    indice['commit'] = commitActual
+    indices[claveIndice] = indice
+    _guardarIndices(rutaMeta, indices)
+    log.info(f"{logPrefix} Índice {modo} de '{rutaBase}': {len(indice['archivos'])} archivos, "
+             f"{len(indice['directorios'])} directorios en {time.monotonic() - inicio:.2f}s.")
+    return indice
+
+
+def listarRutasGit(rutaBase):
+    """
+    Rutas relativas a `rutaBase` (con '/') de los archivos versionados y de los no versionados
+    que .gitignore no excluye, en una sola llamada a git. None si no es un repositorio git.
+    """
+    if not settings.LISTADO_ARCHIVOS_GIT or not os.path.isdir(rutaBase):
+        return None
+    # -t etiqueta cada ruta: 'R' = versionada pero borrada del árbol de trabajo (se descarta)
+    exito, salida = manejadorGit.ejecutarComando(
+        ['git', 'ls-files', '-z', '-t', '--cached', '--others', '--deleted', '--exclude-standard'],
+        cwd=rutaBase, check=False, return_output=True)
+    if not exito:
+        return None
+    rutas = set()
+    borradas = set()
+    for registro in salida.split('\0'):
+        if len(registro) < 3:
+            continue
+        etiqueta, rel = registro[0], registro[2:]
+        (borradas if etiqueta == 'R' else rutas).add(rel)
+    _estadisticas['listados_git_ls_files'] += 1
+    return sorted(rutas - borradas)
+
+
+def listarRutasYDirectorios(rutaBase, directoriosIgnorados, rutaMeta):
+    """
+    (archivos, directorios): rutas relativas y ordenadas del proyecto, sin ocultos ni directorios
+    ignorados. Vía `git ls-files` si es posible (git no conoce directorios vacíos, así que la
+    segunda lista va vacía) y, si no, desde el índice incremental. (None, None) si no se pudo.
+    """
+    directoriosIgnorados = set(directoriosIgnorados or [])
+    rutasGit = listarRutasGit(rutaBase)
+    if rutasGit is not None:
+        return [rel for rel in rutasGit if not _ignorarRuta(rel, directoriosIgnorados)], []
+    indice = actualizarIndice(rutaBase, directoriosIgnorados, rutaMeta)
+    if indice is None:
+        return None, None
+    return sorted(indice['archivos']), sorted(d for d in indice['directorios'] if d)
+
+
+def listarRutasProyecto(rutaBase, directoriosIgnorados, rutaMeta):
+    """
+    Rutas relativas de los archivos del proyecto (sin ocultos ni DIRECTORIOS_IGNORADOS):
+    vía `git ls-files` si es posible y, si no, desde el índice incremental.
+    """
+    return listarRutasYDirectorios(rutaBase, directoriosIgnorados, rutaMeta)[0]
+
+
+def listarArchivos(rutaBase, extensionesPermitidas, directoriosIgnorados, rutaMeta):
+    """Rutas absolutas (normalizadas y ordenadas) de los archivos del proyecto con extensión permitida."""
+    rutas = listarRutasProyecto(rutaBase, directoriosIgnorados, rutaMeta)
+    if rutas is None:
+        return None
+    extensiones = {ext.lower() for ext in (extensionesPermitidas or [])}
+    return [os.path.normpath(os.path.join(rutaBase, rel)) for rel in rutas
+            if not extensiones or os.path.splitext(rel)[1].lower() in extensiones]
+
+
+def obtenerEstadisticas():
+    """Reconstrucciones completas, actualizaciones incrementales, directorios reescaneados y rutas tomadas de git."""
+    return dict(_estadisticas)
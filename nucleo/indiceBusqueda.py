@@ -0,0 +1,311 @@
+# nucleo/indiceBusqueda.py
+import os
+import re
+import json
+import math
+import time
+import logging
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from config import settings
+from nucleo import indiceArchivos
+from nucleo import indiceSimbolos
+from nucleo import lectorLineas
+
+log = logging.getLogger(__name__)
+
+# Índice léxico local (BM25) sobre fragmentos de código del proyecto clonado, para recuperar
+# el código relevante para un texto libre (un punto de TODO.md, la descripción de una tarea)
+# sin llamar a ningún modelo.
+#   - Fragmentos: cada función o método de primer nivel (rangos de indiceSimbolos), las clases
+#     sin métodos y, para las líneas fuera de todo símbolo, ventanas de LINEAS_POR_VENTANA.
+#   - Términos: identificadores partidos por camelCase/snake_case, en minúsculas, sin tildes y
+#     sin 's' final, más el identificador completo. La ruta y el nombre del símbolo cuentan
+#     PESO_NOMBRE veces.
+# En <ruta_proyecto>/.orion_meta/ se guardan por archivo (tamaño, mtime y frecuencias de cada
+# fragmento), y solo se reanalizan los archivos que cambiaron; las listas invertidas se montan
+# en memoria al cargar.
+
+VERSION_INDICE = 1
+NOMBRE_ARCHIVO_INDICE = "indice_busqueda.json"
+LINEAS_POR_VENTANA = 60
+PESO_NOMBRE = 3
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_FRAGMENTOS_POR_ARCHIVO = 3  # En un mismo resultado, para no llenar el presupuesto con un solo archivo
+
+_lock = threading.Lock()
+_estadisticas = {'archivos_analizados': 0, 'archivos_reutilizados': 0, 'busquedas': 0}
+
+_PATRON_IDENTIFICADOR = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|[^\W\d_]+", re.UNICODE)
+_PATRON_PARTES = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[^\W\d_]+", re.UNICODE)
+_PALABRAS_VACIAS = frozenset("""
+    a al an and as con de del el en es for from if in is la las lo los no o of on or para por que
+    the this to un una y self var let const return function def class public private protected
+    static new null none true false else elif php echo import export require
+""".split())
+
+
+def _sinTildes(texto):
+    return ''.join(c for c in unicodedata.normalize('NFKD', texto) if not unicodedata.combining(c))
+
+
+def _raiz(termino):
+    # Plural simple (pedidos/pedido, files/file) para acercar el texto libre a los identificadores
+    return termino[:-1] if len(termino) > 3 and termino.endswith('s') and not termino.endswith('ss') else termino
+
+
+def tokenizar(texto):
+    """Términos de búsqueda de `texto` (con repeticiones, en orden de aparición)."""
+    terminos = []
+    for m in _PATRON_IDENTIFICADOR.finditer(_sinTildes(texto)):
+        identificador = m.group()
+        partes = [p.lower() for p in _PATRON_PARTES.findall(identificador)]
+        completo = identificador.lower().strip('_')
+        if len(partes) > 1 and completo not in _PALABRAS_VACIAS and len(completo) > 2:
+            terminos.append(completo.replace('_', ''))
+        for parte in partes:
+            if len(parte) > 1 and parte not in _PALABRAS_VACIAS:
+                terminos.append(_raiz(parte))
+    return terminos
+
+
+def _rangosFragmentos(simbolos, numLineas):
+    """[(inicio, fin, nombre)] sin solapes: funciones/métodos de primer nivel, clases sin métodos y ventanas."""
+    funciones = []
+    for tipo, nombre, contenedor, inicio, fin in sorted(simbolos, key=lambda s: (s[3], -s[4])):
+        if tipo not in ('funcion', 'metodo'):
+            continue
+        if funciones and inicio <= funciones[-1][1]:
+            continue  # Anidada en la anterior
+        funciones.append((inicio, fin, f"{contenedor}::{nombre}" if tipo == 'metodo' and contenedor else nombre))
+    rangos = list(funciones)
+    for tipo, nombre, _, inicio, fin in simbolos:
+        if tipo not in ('funcion', 'metodo') and not any(inicio <= f[0] <= fin for f in funciones):
+            if not any(r[0] <= inicio and fin <= r[1] for r in rangos):
+                rangos.append((inicio, fin, nombre))
+    cubiertas = bytearray(numLineas + 2)
+    for inicio, fin, _ in rangos:
+        cubiertas[inicio:fin + 1] = b'\x01' * (fin + 1 - inicio)
+    linea = 1
+    while linea <= numLineas:
+        if cubiertas[linea]:
+            linea += 1
+            continue
+        inicio = linea
+        while linea <= numLineas and not cubiertas[linea] and linea - inicio < LINEAS_POR_VENTANA:
+            linea += 1
+        rangos.append((inicio, linea - 1, None))
+    return sorted(rangos)
+
+
+def _analizarArchivo(rutaBase, rel, entradaAnterior):
+    """Entrada del índice para `rel`, reutilizando `entradaAnterior` si no cambió. None si no existe."""
+    rutaAbs = os.path.join(rutaBase, rel)
+    try:
+        stat = os.stat(rutaAbs)
+    except OSError:
+        return None
+    if entradaAnterior and entradaAnterior.get('tam') == stat.st_size and entradaAnterior.get('mtime_ns') == stat.st_mtime_ns:
+        with _lock:
+            _estadisticas['archivos_reutilizados'] += 1
+        return entradaAnterior
+    try:
+        with open(rutaAbs, 'r', encoding='utf-8', errors='replace') as f:
+            lineas = f.read().split('\n')
+    except OSError as e:
+        log.debug(f"_analizarArchivo: No se pudo leer '{rel}': {e}")
+        return None
+    if lineas and lineas[-1] == '':
+        lineas.pop()
+    try:
+        simbolos = indiceSimbolos.extraerSimbolos('\n'.join(lineas), os.path.splitext(rel)[1])
+    except (SyntaxError, ValueError, RecursionError):
+        simbolos = []
+    terminosRuta = tokenizar(rel)
+    fragmentos = []
+    for inicio, fin, nombre in _rangosFragmentos(simbolos, len(lineas)):
+        frecuencias = Counter(tokenizar('\n'.join(lineas[inicio - 1:fin])))
+        if not frecuencias:
+            continue  # Solo espacios o símbolos
+        for termino in terminosRuta + (tokenizar(nombre) if nombre else []):
+            frecuencias[termino] += PESO_NOMBRE
+        fragmentos.append([inicio, fin, nombre, dict(frecuencias)])
+    with _lock:
+        _estadisticas['archivos_analizados'] += 1
+    return {'tam': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'fragmentos': fragmentos}
+
+
+def _rutaArchivoIndice(rutaMeta):
+    return os.path.join(rutaMeta, NOMBRE_ARCHIVO_INDICE)
+
+
+def _cargarIndices(rutaMeta):
+    rutaIndice = _rutaArchivoIndice(rutaMeta)
+    if not os.path.exists(rutaIndice):
+        return {}
+    try:
+        with open(rutaIndice, 'r', encoding='utf-8') as f:
+            datos = json.load(f)
+        if isinstance(datos, dict) and datos.get('version') == VERSION_INDICE:
+            return datos.get('indices', {})
+    except (OSError, ValueError) as e:
+        log.warning(f"_cargarIndices: Índice de búsqueda ilegible en '{rutaIndice}', se reconstruirá: {e}")
+    return {}
+
+
+def _guardarIndices(rutaMeta, indices):
+    rutaIndice = _rutaArchivoIndice(rutaMeta)
+    try:
+        os.makedirs(rutaMeta, exist_ok=True)
+        temporal = rutaIndice + ".tmp"
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump({'version': VERSION_INDICE, 'indices': indices}, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temporal, rutaIndice)
+    except OSError as e:
+        log.warning(f"_guardarIndices: No se pudo guardar el índice de búsqueda en '{rutaIndice}': {e}")
+
+
+def _construirInvertido(entradas):
+    fragmentos = []  # (rel, inicio, fin, nombre, longitud)
+    invertido = defaultdict(list)  # termino -> [(idFragmento, frecuencia)]
+    for rel in sorted(entradas):
+        for inicio, fin, nombre, frecuencias in entradas[rel]['fragmentos']:
+            idFragmento = len(fragmentos)
+            fragmentos.append((rel, inicio, fin, nombre, sum(frecuencias.values())))
+            for termino, frecuencia in frecuencias.items():
+                invertido[termino].append((idFragmento, frecuencia))
+    longitudMedia = sum(f[4] for f in fragmentos) / len(fragmentos) if fragmentos else 0.0
+    return {'fragmentos': fragmentos, 'invertido': dict(invertido), 'longitud_media': longitudMedia}
+
+
+def actualizarIndice(rutaBase, rutaMeta, directoriosIgnorados=None, extensiones=None):
+    """
+    Índice BM25 de los fragmentos del proyecto: {'fragmentos', 'invertido', 'longitud_media'}.
+    Vuelve a analizar solo los archivos que cambiaron y persiste el resultado en `rutaMeta`.
+    None si no se pudo listar el proyecto.
+    """
+    logPrefix = "actualizarIndice:"
+    inicio = time.monotonic()
+    if directoriosIgnorados is None:
+        directoriosIgnorados = settings.DIRECTORIOS_IGNORADOS
+    if extensiones is None:
+        extensiones = [e for e in settings.EXTENSIONESPERMITIDAS if e]
+    extensiones = {e.lower() for e in extensiones}
+    ignorados = {d for d in directoriosIgnorados if not d.startswith('.')}
+    rutas = indiceArchivos.listarRutasProyecto(rutaBase, ignorados, rutaMeta)
+    if rutas is None:
+        log.error(f"{logPrefix} No se pudieron listar los archivos de '{rutaBase}'.")
+        return None
+
+    claveIndice = os.path.normpath(os.path.abspath(rutaBase))
+    indices = _cargarIndices(rutaMeta)
+    anterior = indices.get(claveIndice, {})
+    entradas = {}
+    for rel in rutas:
+        if os.path.splitext(rel)[1].lower() not in extensiones:
+            continue
+        entrada = _analizarArchivo(rutaBase, rel, anterior.get(rel))
+        if entrada is not None:
+            entradas[rel] = entrada
+    indices[claveIndice] = entradas
+    _guardarIndices(rutaMeta, indices)
+    indice = _construirInvertido(entradas)
+    log.info(f"{logPrefix} Índice de búsqueda de '{rutaBase}': {len(entradas)} archivos, "
+             f"{len(indice['fragmentos'])} fragmentos en {time.monotonic() - inicio:.2f}s.")
+    return indice
+
+
+def buscar(indice, consulta, k=10, maxPorArchivo=MAX_FRAGMENTOS_POR_ARCHIVO):
+    """
+    Los `k` fragmentos con mayor puntuación BM25 para `consulta`, como dicts con archivo,
+    nombre, linea_inicio, linea_fin y puntuacion. A igual puntuación, orden por ruta y línea.
+    """
+    with _lock:
+        _estadisticas['busquedas'] += 1
+    fragmentos = indice['fragmentos']
+    total = len(fragmentos)
+    if not total:
+        return []
+    puntuaciones = defaultdict(float)
+    for termino in set(tokenizar(consulta)):
+        apariciones = indice['invertido'].get(termino)
+        if not apariciones:
+            continue
+        idf = math.log(1 + (total - len(apariciones) + 0.5) / (len(apariciones) + 0.5))
+        for idFragmento, frecuencia in apariciones:
+            normalizacion = BM25_K1 * (1 - BM25_B + BM25_B * fragmentos[idFragmento][4] / indice['longitud_media'])
+            puntuaciones[idFragmento] += idf * frecuencia * (BM25_K1 + 1) / (frecuencia + normalizacion)
+    resultado = []
+    porArchivo = Counter()
+    for idFragmento in sorted(puntuaciones, key=lambda i: (-puntuaciones[i], fragmentos[i][0], fragmentos[i][1])):
+        rel, inicio, fin, nombre, _ = fragmentos[idFragmento]
+        if maxPorArchivo and porArchivo[rel] >= maxPorArchivo:
+            continue
+        porArchivo[rel] += 1
+        resultado.append({'archivo': rel, 'nombre': nombre, 'linea_inicio': inicio, 'linea_fin': fin,
+                          'puntuacion': round(puntuaciones[idFragmento], 4)})
+        if len(resultado) >= k:
+            break
+    return resultado
+
+
+def dividirConsultas(texto):
+    """Un texto guía (TODO.md) partido en sus puntos: líneas no vacías sin viñetas ni casillas."""
+    consultas = []
+    for linea in texto.splitlines():
+        linea = re.sub(r"^\s*(?:[-*+]|\d+[.)]|#+)\s*(?:\[[ xX]\]\s*)?", "", linea).strip()
+        if linea:
+            consultas.append(linea)
+    return consultas
+
+
+def construirContexto(rutaBase, consultas, presupuestoTokens, contarTokens, k=10, rutaMeta=None, directoriosIgnorados=None):
+    """
+    Texto con los fragmentos más relevantes para `consultas` (un resultado de cada consulta por
+    turnos, para cubrir todos los puntos), hasta `presupuestoTokens` según `contarTokens(texto)`.
+    Devuelve (texto, fragmentos incluidos); ("", []) si no hay índice o nada relevante.
+    """
+    logPrefix = "construirContexto:"
+    rutaMeta = rutaMeta or os.path.join(rutaBase, '.orion_meta')
+    indice = actualizarIndice(rutaBase, rutaMeta, directoriosIgnorados)
+    if not indice:
+        return "", []
+    if isinstance(consultas, str):
+        consultas = [consultas]
+    resultadosPorConsulta = [buscar(indice, consulta, k) for consulta in consultas]
+    vistos, ordenados = set(), []
+    for ronda in range(k):
+        for resultados in resultadosPorConsulta:
+            if ronda < len(resultados):
+                fragmento = resultados[ronda]
+                clave = (fragmento['archivo'], fragmento['linea_inicio'])
+                if clave not in vistos:
+                    vistos.add(clave)
+                    ordenados.append(fragmento)
+
+    partes, incluidos, tokensUsados = [], [], 0
+    for fragmento in ordenados:
+        codigo = lectorLineas.leerRangoLineas(os.path.join(rutaBase, fragmento['archivo']),
+                                              fragmento['linea_inicio'], fragmento['linea_fin'])
+        if not codigo:
+            continue
+        descripcion = f" ({fragmento['nombre']})" if fragmento['nombre'] else ""
+        parte = (f"--- FRAGMENTO: {fragmento['archivo']} líneas {fragmento['linea_inicio']}-{fragmento['linea_fin']}{descripcion} ---\n"
+                 f"{codigo.rstrip()}\n")
+        tokens = contarTokens(parte)
+        if tokensUsados + tokens > presupuestoTokens:
+            continue
+        partes.append(parte)
+        incluidos.append(fragmento)
+        tokensUsados += tokens
+    log.info(f"{logPrefix} {len(incluidos)} fragmento(s) de {len({f['archivo'] for f in incluidos})} archivo(s), "
+             f"~{tokensUsados} tokens para {len(consultas)} consulta(s).")
+    return "\n".join(partes), incluidos
+
+
+def obtenerEstadisticas():
+    """Archivos analizados, reutilizados del índice y búsquedas realizadas."""
+    with _lock:
+        return dict(_estadisticas)
@@ -0,0 +1,415 @@
+# nucleo/indiceSimbolos.py
+import os
+import re
+import ast
+import json
+import time
+import logging
+import threading
+from config import settings
+from nucleo import indiceArchivos
+
+log = logging.getLogger(__name__)
+
+# Índice persistente de símbolos (clases, funciones y métodos) del proyecto clonado, guardado en
+# <ruta_proyecto>/.orion_meta/. Para cada archivo .py/.php/.js guarda sus símbolos con las líneas
+# exactas de inicio y fin (1-based, inclusivas), y solo se vuelven a analizar los archivos cuyo
+# tamaño o mtime cambió desde la última vez.
+#   - .py: módulo `ast` (incluye decoradores en el rango).
+#   - .php/.js: tokenizador ligero que salta cadenas, comentarios (y HTML fuera de <?php ?>)
+#     y empareja llaves. El inicio incluye modificadores (public static, export, async...).
+#     Las funciones flecha solo se indexan si tienen cuerpo entre llaves.
+
+VERSION_INDICE = 1
+NOMBRE_ARCHIVO_INDICE = "indice_simbolos.json"
+EXTENSIONES_SOPORTADAS = ('.py', '.php', '.js')
+
+_lock = threading.Lock()
+_estadisticas = {'archivos_analizados': 0, 'archivos_reutilizados': 0, 'errores_analisis': 0}
+
+_PATRON_PHP = re.compile(r"""
+    (?P<nl>\n)
+  | (?P<ws>[^\S\n]+)
+  | (?P<com>//[^\n]*?(?=\?>|\n|\Z)|\#(?!\[)[^\n]*?(?=\?>|\n|\Z)|/\*.*?(?:\*/|\Z))
+  | (?P<cad>'(?:\\.|[^'\\])*'|"(?:\\.|[^"\\])*")
+  | (?P<heredoc><<<[ \t]*(?P<q>['"]?)(?P<et>[A-Za-z_]\w*)(?P=q)\n.*?\n[ \t]*(?P=et)\b)
+  | (?P<html>\?>.*?(?:<\?php\b|<\?=|\Z))
+  | (?P<id>[^\W\d]\w*)
+  | (?P<sim>::|->|=>|[{}()\[\];,=&:?*.])
+  | (?P<otro>.)
+""", re.S | re.X)
+
+_PATRON_JS = re.compile(r"""
+    (?P<nl>\n)
+  | (?P<ws>[^\S\n]+)
+  | (?P<com>//[^\n]*|/\*.*?(?:\*/|\Z))
+  | (?P<cad>'(?:\\.|[^'\\\n])*'|"(?:\\.|[^"\\\n])*"|`(?:\\.|[^`\\])*`)
+  | (?P<id>[^\W\d][\w$]*|\$[\w$]*)
+  | (?P<sim>=>|[{}()\[\];,=:?*.])
+  | (?P<otro>.)
+""", re.S | re.X)
+
+_REGEX_JS = re.compile(r"/(?![*/])(?:\\.|\[(?:\\.|[^\]\\\n])*\]|[^/\\\n\[])+/[A-Za-z]*")
+# Tras estos tokens una '/' abre un literal regex y no es una división
+_PREVIOS_REGEX_JS = {None, '(', ',', '=', ':', '[', '!', '&', '|', '?', '{', '}', ';', '=>',
+                     'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete', 'void', 'throw'}
+
+_TIPOS_CLASE_PHP = {'class': 'clase', 'interface': 'interfaz', 'trait': 'trait', 'enum': 'enum'}
+_TIPOS_CONTENEDOR = ('clase', 'interfaz', 'trait', 'enum')
+_MODIFICADORES_PHP = {'public', 'private', 'protected', 'static', 'abstract', 'final', 'readonly'}
+_MODIFICADORES_JS = {'export', 'default', 'async', 'static', 'get', 'set'}
+_NO_METODOS_JS = {'if', 'for', 'while', 'switch', 'catch', 'function', 'return', 'with', 'super'}
+
+
+def _tokenizar(texto, lenguaje):
+    """Lista de (tipo, valor, linea) con solo identificadores, símbolos, cadenas ('cad') y otros."""
+    tokens = []
+    linea = 1
+    pos = 0
+    patron = _PATRON_PHP if lenguaje == 'php' else _PATRON_JS
+    if lenguaje == 'php':
+        # Lo anterior al primer <?php es HTML
+        inicio = re.search(r"<\?php\b|<\?=", texto)
+        if not inicio:
+            return tokens
+        linea += texto.count('\n', 0, inicio.end())
+        pos = inicio.end()
+    previo = None
+    longitud = len(texto)
+    while pos < longitud:
+        if lenguaje == 'js' and texto[pos] == '/' and previo in _PREVIOS_REGEX_JS:
+            m = _REGEX_JS.match(texto, pos)
+            if m:
+                tokens.append(('cad', '', linea))
+                previo = 'regex'
+                pos = m.end()
+                continue
+        m = patron.match(texto, pos)
+        tipo = m.lastgroup
+        valor = m.group()
+        if tipo == 'nl':
+            linea += 1
+        elif tipo in ('ws', 'com', 'html', 'cad', 'heredoc'):
+            if tipo in ('cad', 'heredoc'):
+                tokens.append(('cad', '', linea))
+                previo = 'cad'
+            linea += valor.count('\n')
+        else:
+            tokens.append((tipo, valor, linea))
+            previo = valor
+        pos = m.end()
+    return tokens
+
+
+def _lineaConModificadores(tokens, i, modificadores):
+    """Línea del primer modificador (public, static, export...) que precede al token i."""
+    linea = tokens[i][2]
+    j = i - 1
+    while j >= 0 and tokens[j][0] == 'id' and tokens[j][1].lower() in modificadores:
+        linea = tokens[j][2]
+        j -= 1
+    return linea
+
+
+def _cierreParentesis(tokens, i):
+    """Índice del ')' que cierra el '(' en tokens[i], o None."""
+    profundidad = 0
+    for j in range(i, len(tokens)):
+        if tokens[j][0] == 'sim':
+            if tokens[j][1] == '(':
+                profundidad += 1
+            elif tokens[j][1] == ')':
+                profundidad -= 1
+                if profundidad == 0:
+                    return j
+    return None
+
+
+def _valor(tokens, i):
+    return tokens[i][1] if 0 <= i < len(tokens) else None
+
+
+def _detectarPhp(tokens, i, pila):
+    """(tipo, nombre, indiceInicio) si en tokens[i] empieza una declaración PHP, o None."""
+    valor = tokens[i][1].lower()
+    previo = _valor(tokens, i - 1)
+    if previo in ('->', '::'):
+        return None
+    if valor == 'function':
+        j = i + 1 + (_valor(tokens, i + 1) == '&')
+        if j + 1 < len(tokens) and tokens[j][0] == 'id' and _valor(tokens, j + 1) == '(':
+            enClase = bool(pila) and pila[-1] is not None and pila[-1][0] in _TIPOS_CONTENEDOR
+            return ('metodo' if enClase else 'funcion'), tokens[j][1], i
+    elif valor in _TIPOS_CLASE_PHP and previo != 'new':
+        if i + 1 < len(tokens) and tokens[i + 1][0] == 'id':
+            return _TIPOS_CLASE_PHP[valor], tokens[i + 1][1], i
+    return None
+
+
+def _detectarJs(tokens, i, pila):
+    """(tipo, nombre, indiceInicio) si en tokens[i] empieza una declaración JS, o None."""
+    valor = tokens[i][1]
+    previo = _valor(tokens, i - 1)
+    if previo == '.':
+        return None
+    if valor == 'function':
+        j = i + 1 + (_valor(tokens, i + 1) == '*')
+        if j + 1 < len(tokens) and tokens[j][0] == 'id' and _valor(tokens, j + 1) == '(':
+            return 'funcion', tokens[j][1], i
+        return None
+    if valor == 'class':
+        if i + 1 < len(tokens) and tokens[i + 1][0] == 'id' and tokens[i + 1][1] != 'extends':
+            return 'clase', tokens[i + 1][1], i
+        return None
+    if valor in ('const', 'let', 'var'):
+        if not (i + 2 < len(tokens) and tokens[i + 1][0] == 'id' and _valor(tokens, i + 2) == '='):
+            return None
+        k = i + 3 + (_valor(tokens, i + 3) == 'async')
+        if _valor(tokens, k) == 'function':
+            return 'funcion', tokens[i + 1][1], i
+        if _valor(tokens, k) == '(':
+            cierre = _cierreParentesis(tokens, k)
+            if cierre is not None and _valor(tokens, cierre + 1) == '=>' and _valor(tokens, cierre + 2) == '{':
+                return 'funcion', tokens[i + 1][1], i
+        elif k < len(tokens) and tokens[k][0] == 'id' and _valor(tokens, k + 1) == '=>' and _valor(tokens, k + 2) == '{':
+            return 'funcion', tokens[i + 1][1], i
+        return None
+    # Método: identificador seguido de '(' directamente en el cuerpo de una clase
+    if (pila and pila[-1] is not None and pila[-1][0] == 'clase' and _valor(tokens, i + 1) == '('
+            and valor not in _NO_METODOS_JS
+            and (previo in (None, '{', '}', ';', '*') or previo in _MODIFICADORES_JS)):
+        return 'metodo', valor, i
+    return None
+
+
+def _simbolosLlaves(texto, lenguaje):
+    """Símbolos de un archivo PHP o JS emparejando las llaves de cada declaración."""
+    tokens = _tokenizar(texto, lenguaje)
+    detectar = _detectarPhp if lenguaje == 'php' else _detectarJs
+    modificadores = _MODIFICADORES_PHP if lenguaje == 'php' else _MODIFICADORES_JS
+    simbolos = []
+    pila = []  # Un marco por cada '{' abierto: (tipo, nombre, contenedor, inicio) o None
+    pendiente = None  # Declaración vista cuyo '{' aún no ha llegado: (..., parentesis)
+    parentesis = 0
+    for i, (tipo, valor, linea) in enumerate(tokens):
+        if tipo == 'sim':
+            if valor == '(':
+                parentesis += 1
+            elif valor == ')':
+                parentesis = max(0, parentesis - 1)
+            elif valor == '{':
+                if pendiente is not None and pendiente[4] == parentesis:
+                    pila.append(pendiente[:4])
+                    pendiente = None
+                else:
+                    pila.append(None)
+            elif valor == '}':
+                if pila:
+                    marco = pila.pop()
+                    if marco is not None:
+                        simbolos.append([marco[0], marco[1], marco[2], marco[3], linea])
+            elif valor == ';' and pendiente is not None and pendiente[4] == parentesis:
+                if lenguaje == 'php':  # Método abstracto o de interfaz: sin cuerpo
+                    simbolos.append([pendiente[0], pendiente[1], pendiente[2], pendiente[3], linea])
+                pendiente = None
+            continue
+        if tipo != 'id' or pendiente is not None:
+            continue
+        detectado = detectar(tokens, i, pila)
+        if detectado is None:
+            continue
+        tipoSimbolo, nombre, indiceInicio = detectado
+        contenedor = next((m[1] for m in reversed(pila) if m is not None), None)
+        pendiente = (tipoSimbolo, nombre, contenedor,
+                     _lineaConModificadores(tokens, indiceInicio, modificadores), parentesis)
+    simbolos.sort(key=lambda s: (s[3], -s[4]))
+    return simbolos
+
+
+def _simbolosPython(texto):
+    """Símbolos de un archivo Python con `ast`; [] si no compila."""
+    arbol = ast.parse(texto)
+    simbolos = []
+
+    def _visitar(nodo, contenedor, esClase):
+        for hijo in ast.iter_child_nodes(nodo):
+            if isinstance(hijo, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                inicio = min([hijo.lineno] + [d.lineno for d in hijo.decorator_list])
+                if isinstance(hijo, ast.ClassDef):
+                    tipo = 'clase'
+                else:
+                    tipo = 'metodo' if esClase else 'funcion'
+                simbolos.append([tipo, hijo.name, contenedor, inicio, hijo.end_lineno])
+                _visitar(hijo, hijo.name, isinstance(hijo, ast.ClassDef))
+            else:
+                _visitar(hijo, contenedor, False)
+
+    _visitar(arbol, None, False)
+    simbolos.sort(key=lambda s: (s[3], -s[4]))
+    return simbolos
+
+
+def extraerSimbolos(texto, extension):
+    """
+    Símbolos de `texto` como listas [tipo, nombre, contenedor, linea_inicio, linea_fin], con tipo
+    en clase/interfaz/trait/enum/funcion/metodo. Lanza SyntaxError/ValueError si no se puede analizar.
+    """
+    extension = extension.lower()
+    if extension == '.py':
+        return _simbolosPython(texto)
+    if extension == '.php':
+        return _simbolosLlaves(texto, 'php')
+    if extension == '.js':
+        return _simbolosLlaves(texto, 'js')
+    return []
+
+
+def _rutaArchivoIndice(rutaMeta):
+    return os.path.join(rutaMeta, NOMBRE_ARCHIVO_INDICE)
+
+
+def _cargarIndices(rutaMeta):
+    rutaIndice = _rutaArchivoIndice(rutaMeta)
+    if not os.path.exists(rutaIndice):
+        return {}
+    try:
+        with open(rutaIndice, 'r', encoding='utf-8') as f:
+            datos = json.load(f)
+        if isinstance(datos, dict) and datos.get('version') == VERSION_INDICE:
+            return datos.get('indices', {})
+    except (OSError, ValueError) as e:
+        log.warning(f"_cargarIndices: Índice de símbolos ilegible en '{rutaIndice}', se reconstruirá: {e}")
+    return {}
+
+
+def _guardarIndices(rutaMeta, indices):
+    rutaIndice = _rutaArchivoIndice(rutaMeta)
+    try:
+        os.makedirs(rutaMeta, exist_ok=True)
+        temporal = rutaIndice + ".tmp"
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump({'version': VERSION_INDICE, 'indices': indices}, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temporal, rutaIndice)
+    except OSError as e:
+        log.warning(f"_guardarIndices: No se pudo guardar el índice de símbolos en '{rutaIndice}': {e}")
+
+
+def _analizarArchivo(rutaBase, rel, entradaAnterior):
+    """Entrada del índice para `rel`, reutilizando `entradaAnterior` si no cambió. None si no existe."""
+    rutaAbs = os.path.join(rutaBase, rel)
+    try:
+        stat = os.stat(rutaAbs)
+    except OSError:
+        return None
+    if entradaAnterior and entradaAnterior.get('tam') == stat.st_size and entradaAnterior.get('mtime_ns') == stat.st_mtime_ns:
+        with _lock:
+            _estadisticas['archivos_reutilizados'] += 1
+        return entradaAnterior
+    simbolos = []
+    try:
+        with open(rutaAbs, 'r', encoding='utf-8', errors='replace') as f:
+            texto = f.read()
+        simbolos = extraerSimbolos(texto, os.path.splitext(rel)[1])
+    except (OSError, SyntaxError, ValueError, RecursionError) as e:
+        log.debug(f"_analizarArchivo: No se pudieron extraer símbolos de '{rel}': {e}")
+        with _lock:
+            _estadisticas['errores_analisis'] += 1
+    with _lock:
+        _estadisticas['archivos_analizados'] += 1
+    return {'tam': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'simbolos': simbolos}
+
+
+def actualizarIndiceSimbolos(rutaBase, rutaMeta, directoriosIgnorados=None, extensiones=None):
+    """
+    Devuelve {rel: {'tam', 'mtime_ns', 'simbolos': [...]}} de los archivos del proyecto con
+    extensión soportada, volviendo a analizar solo los que cambiaron, y lo persiste en `rutaMeta`.
+    None si no se pudo listar el proyecto.
+    """
+    logPrefix = "actualizarIndiceSimbolos:"
+    inicio = time.monotonic()
+    if directoriosIgnorados is None:
+        directoriosIgnorados = settings.DIRECTORIOS_IGNORADOS
+    if extensiones is None:
+        extensiones = [e for e in settings.EXTENSIONESPERMITIDAS if e]
+    extensiones = {e.lower() for e in extensiones} & set(EXTENSIONES_SOPORTADAS)
+    ignorados = {d for d in directoriosIgnorados if not d.startswith('.')}
+    rutas = indiceArchivos.listarRutasProyecto(rutaBase, ignorados, rutaMeta)
+    if rutas is None:
+        log.error(f"{logPrefix} No se pudieron listar los archivos de '{rutaBase}'.")
+        return None
+
+    claveIndice = os.path.normpath(os.path.abspath(rutaBase))
+    indices = _cargarIndices(rutaMeta)
+    anterior = indices.get(claveIndice, {})
+    archivos = {}
+    for rel in rutas:
+        if os.path.splitext(rel)[1].lower() not in extensiones:
+            continue
+        entrada = _analizarArchivo(rutaBase, rel, anterior.get(rel))
+        if entrada is not None:
+            archivos[rel] = entrada
+    indices[claveIndice] = archivos
+    _guardarIndices(rutaMeta, indices)
+    log.info(f"{logPrefix} Índice de símbolos de '{rutaBase}': {len(archivos)} archivos, "
+             f"{sum(len(e['simbolos']) for e in archivos.values())} símbolos en {time.monotonic() - inicio:.2f}s.")
+    return archivos
+
+
+def obtenerSimbolosArchivo(rutaBase, rel, rutaMeta=None):
+    """
+    Símbolos actuales de un solo archivo (relativo a `rutaBase`), reanalizándolo si cambió.
+    Con `rutaMeta` se reutiliza y actualiza la entrada del índice persistido.
+    """
+    rel = rel.replace(os.sep, '/').lstrip('/')
+    claveIndice = os.path.normpath(os.path.abspath(rutaBase))
+    indices = _cargarIndices(rutaMeta) if rutaMeta else {}
+    archivos = indices.get(claveIndice, {})
+    anterior = archivos.get(rel)
+    entrada = _analizarArchivo(rutaBase, rel, anterior)
+    if entrada is None:
+        return []
+    if rutaMeta and entrada is not anterior:
+        archivos[rel] = entrada
+        indices[claveIndice] = archivos
+        _guardarIndices(rutaMeta, indices)
+    return entrada['simbolos']
+
+
+def _comoDiccionario(rel, simbolo):
+    tipo, nombre, contenedor, inicio, fin = simbolo
+    return {'archivo': rel, 'tipo': tipo, 'nombre': nombre, 'contenedor': contenedor,
+            'linea_inicio': inicio, 'linea_fin': fin}
+
+
+def _coincideNombre(simbolo, nombre):
+    if simbolo[1] == nombre:
+        return True
+    # Nombres cualificados: Clase.metodo, Clase::metodo, Clase->metodo
+    for separador in ('::', '->', '.'):
+        if separador in nombre:
+            contenedor, _, corto = nombre.rpartition(separador)
+            return simbolo[1] == corto and simbolo[2] == contenedor.rsplit('\\', 1)[-1]
+    return False
+
+
+def buscarSimbolos(indice, nombre, archivo=None):
+    """Símbolos del índice llamados `nombre` (admite `Clase::metodo`), opcionalmente solo de `archivo`."""
+    resultado = []
+    archivo = archivo.replace(os.sep, '/').lstrip('/') if archivo else None
+    for rel, entrada in indice.items():
+        if archivo and rel != archivo:
+            continue
+        resultado.extend(_comoDiccionario(rel, s) for s in entrada['simbolos'] if _coincideNombre(s, nombre))
+    return resultado
+
+
+def simboloEnLinea(simbolos, linea):
+    """El símbolo más interno de la lista que contiene `linea`, o None."""
+    candidatos = [s for s in simbolos if s[3] <= linea <= s[4]]
+    return min(candidatos, key=lambda s: s[4] - s[3]) if candidatos else None
+
+
+def obtenerEstadisticas():
+    """Archivos analizados, reutilizados del índice y con errores de análisis."""
+    with _lock:
+        return dict(_estadisticas)
@@ -0,0 +1,184 @@
+# nucleo/lectorLineas.py
+import os
+import mmap
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+# Lector de archivos indexado por líneas.
+# En lugar de leer el archivo entero y partirlo con splitlines() para quedarse con unas pocas
+# líneas, se mapea con mmap, se calcula una vez el array de offsets de inicio de cada línea
+# (cacheado por ruta y validado con mtime_ns + tamaño) y se devuelve solo el rango pedido.
+# Lo usan la extracción de bloques de paso2 y aplicarCambiosGranulares (que empalma el
+# contenido nuevo entre los bytes anteriores y posteriores al rango, sin partir en líneas).
+# Las líneas se delimitan por '\n' (igual que git); un '\r\n' queda dentro de la línea.
+
+MAX_ARCHIVOS_CACHE = 256
+
+_lock = threading.Lock()
+_cache = OrderedDict()  # ruta -> IndiceLineas
+_estadisticas = {'indices_construidos': 0, 'aciertos_cache': 0, 'rangos_leidos': 0,
+                 'bytes_leidos': 0, 'empalmes': 0}
+
+
+class IndiceLineas:
+    """Offsets de inicio de cada línea de un archivo: la línea i (0-based) es [offsets[i], offsets[i+1])."""
+
+    __slots__ = ('mtime_ns', 'tam', 'offsets')
+
+    def __init__(self, mtime_ns, tam, offsets):
+        self.mtime_ns = mtime_ns
+        self.tam = tam
+        self.offsets = offsets
+
+    @property
+    def numLineas(self):
+        return len(self.offsets) - 1
+
+
+def _clave(ruta):
+    return os.path.normpath(os.path.abspath(ruta))
+
+
+def _construirOffsets(mm, tam):
+    offsets = array('q', [0])
+    pos = mm.find(b'\n')
+    while pos != -1:
+        offsets.append(pos + 1)
+        pos = mm.find(b'\n', pos + 1)
+    if offsets[-1] != tam:
+        offsets.append(tam)  # Última línea sin '\n' final
+    return offsets
+
+
+def obtenerIndice(ruta):
+    """Índice de líneas de `ruta` (cacheado mientras no cambien mtime ni tamaño). None si no se puede leer."""
+    clave = _clave(ruta)
+    try:
+        stat = os.stat(clave)
+    except OSError as e:
+        log.debug(f"obtenerIndice: No se pudo acceder a '{ruta}': {e}")
+        return None
+    with _lock:
+        indice = _cache.get(clave)
+        if indice is not None and indice.mtime_ns == stat.st_mtime_ns and indice.tam == stat.st_size:
+            _cache.move_to_end(clave)
+            _estadisticas['aciertos_cache'] += 1
+            return indice
+    try:
+        if stat.st_size == 0:
+            offsets = array('q', [0])
+        else:
+            with open(clave, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                offsets = _construirOffsets(mm, stat.st_size)
+    except (OSError, ValueError) as e:
+        log.error(f"obtenerIndice: Error indexando líneas de '{ruta}': {e}")
+        return None
+    indice = IndiceLineas(stat.st_mtime_ns, stat.st_size, offsets)
+    with _lock:
+        _cache[clave] = indice
+        _cache.move_to_end(clave)
+        while len(_cache) > MAX_ARCHIVOS_CACHE:
+            _cache.popitem(last=False)
+        _estadisticas['indices_construidos'] += 1
+    return indice
+
+
+def contarLineas(ruta):
+    """Número de líneas de `ruta` (como len(readlines())), o None si no se puede leer."""
+    indice = obtenerIndice(ruta)
+    return indice.numLineas if indice is not None else None
+
+
+def _leerBytes(ruta, inicio, fin):
+    if fin <= inicio:
+        return b""
+    with open(ruta, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return mm[inicio:fin]
+
+
+def leerRangoLineas(ruta, lineaInicio, lineaFin, encoding='utf-8'):
+    """
+    Texto de las líneas `lineaInicio`..`lineaFin` (1-based, inclusivas) de `ruta`, con sus saltos
+    de línea normalizados a '\\n' como en modo texto. None si el rango está fuera del archivo o
+    si no se puede leer/decodificar.
+    """
+    logPrefix = "leerRangoLineas:"
+    indice = obtenerIndice(ruta)
+    if indice is None:
+        return None
+    if not (1 <= lineaInicio <= lineaFin <= indice.numLineas):
+        log.debug(f"{logPrefix} Rango [{lineaInicio}-{lineaFin}] fuera de '{ruta}' ({indice.numLineas} líneas).")
+        return None
+    try:
+        datos = _leerBytes(_clave(ruta), indice.offsets[lineaInicio - 1], indice.offsets[lineaFin])
+        texto = datos.decode(encoding)
+    except (OSError, ValueError) as e:
+        log.error(f"{logPrefix} Error leyendo líneas [{lineaInicio}-{lineaFin}] de '{ruta}': {e}")
+        return None
+    with _lock:
+        _estadisticas['rangos_leidos'] += 1
+        _estadisticas['bytes_leidos'] += len(datos)
+    return texto.replace('\r\n', '\n')
+
+
+def _finDeLinea(prefijo, sufijo):
+    """Fin de línea (CRLF o LF) de la línea anterior al empalme o, si no hay, de la siguiente."""
+    if prefijo:
+        return b"\r\n" if prefijo.endswith(b"\r\n") else b"\n"
+    salto = sufijo.find(b"\n")
+    return b"\r\n" if salto > 0 and sufijo[salto - 1:salto] == b"\r" else b"\n"
+
+
+def empalmarLineas(ruta, idxInicio, idxFin, nuevoContenido, encoding='utf-8'):
+    """
+    Sustituye las líneas del slice [idxInicio:idxFin] (0-based, como en una lista de readlines())
+    por `nuevoContenido` y guarda el archivo. El resto de bytes se copia tal cual, sin decodificar
+    ni partir en líneas; los saltos de `nuevoContenido` se convierten al fin de línea del archivo
+    (CRLF o LF). Devuelve True si se escribió; False si el rango no es válido o hubo error.
+    """
+    logPrefix = "empalmarLineas:"
+    indice = obtenerIndice(ruta)
+    if indice is None:
+        return False
+    if not (0 <= idxInicio <= idxFin <= indice.numLineas):
+        log.error(f"{logPrefix} Slice [{idxInicio}:{idxFin}] fuera de '{ruta}' ({indice.numLineas} líneas).")
+        return False
+    clave = _clave(ruta)
+    try:
+        if indice.tam:
+            with open(clave, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                prefijo = mm[:indice.offsets[idxInicio]]
+                sufijo = mm[indice.offsets[idxFin]:]
+        else:
+            prefijo = sufijo = b""
+        nuevoContenido = nuevoContenido.replace('\r\n', '\n')
+        if _finDeLinea(prefijo, sufijo) == b"\r\n":
+            nuevoContenido = nuevoContenido.replace('\n', '\r\n')
+        with open(clave, 'wb') as f:
+            f.write(prefijo)
+            f.write(nuevoContenido.encode(encoding))
+            f.write(sufijo)
+    except (OSError, ValueError) as e:
+        log.error(f"{logPrefix} Error reescribiendo '{ruta}': {e}")
+        return False
+    finally:
+        invalidar(clave)
+    with _lock:
+        _estadisticas['empalmes'] += 1
+    return True
+
+
+def invalidar(ruta):
+    """Olvida el índice cacheado de `ruta` (tras escribir el archivo por otra vía)."""
+    with _lock:
+        _cache.pop(_clave(ruta), None)
+
+
+def obtenerEstadisticas():
+    """Índices construidos, aciertos de caché, rangos leídos, bytes leídos y empalmes."""
+    with _lock:
+        return dict(_estadisticas, archivos_en_cache=len(_cache))
@@ -0,0 +1,295 @@
+# nucleo/limitadorTokens.py
+import os
+import time
+import sqlite3
+import logging
+import threading
+from collections import deque
+from config import settings
+
+log = logging.getLogger(__name__)
+
+# Limitadores de tokens por minuto (ventana deslizante).
+# - LimitadorTokensPersistente: compartido por todos los procesos del agente en la máquina.
+#   Cada fase de principal.py es un proceso nuevo, así que la ventana no puede vivir en memoria:
+#   se guarda en SQLite (modo WAL) y cada operación va en una transacción IMMEDIATE, que actúa
+#   como cerrojo entre procesos. La suma de la ventana se mantiene en una tabla aparte y se
+#   actualiza al insertar y al purgar, de modo que cada registro se suma y se resta una sola vez.
+# - VentanaTokens: misma interfaz en memoria (deque + suma acumulada), para un solo proceso o
+#   como respaldo si el fichero SQLite no está disponible.
+# Ambos calculan el instante exacto en que cabe una petición, esperan en bucle (sin recursión)
+# y dejan pasar una petición mayor que todo el presupuesto en cuanto la ventana está vacía.
+
+VENTANA_SEGUNDOS = 60
+
+_ESQUEMA = (
+    "CREATE TABLE IF NOT EXISTS uso ("
+    " id INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL NOT NULL, tokens INTEGER NOT NULL, proveedor TEXT)",
+    "CREATE INDEX IF NOT EXISTS idx_uso_ts ON uso(ts)",
+    "CREATE TABLE IF NOT EXISTS total (id INTEGER PRIMARY KEY CHECK (id = 1), suma INTEGER NOT NULL)",
+    "INSERT OR IGNORE INTO total (id, suma) VALUES (1, 0)",
+)
+
+
+class _LimitadorBase:
+    """Espera hasta que una petición quepa y lleva las métricas de tiempo de throttling."""
+
+    def __init__(self, limitePorMinuto, ventanaSegundos):
+        self.limitePorMinuto = limitePorMinuto
+        self.ventanaSegundos = ventanaSegundos
+        self._lockMetricas = threading.Lock()
+        self._metricas = {'reservas': 0, 'reservas_con_espera': 0, 'segundos_esperando': 0.0,
+                          'espera_maxima': 0.0, 'peticiones_sobredimensionadas': 0}
+
+    def esperarYReservar(self, tokens, proveedor=None, logPrefix="esperarYReservar:"):
+        """Bloquea hasta poder reservar `tokens` y devuelve el id de la reserva."""
+        if tokens > self.limitePorMinuto:
+            with self._lockMetricas:
+                self._metricas['peticiones_sobredimensionadas'] += 1
+            log.warning(f"{logPrefix} La petición ({tokens} tokens) supera el límite por minuto "
+                        f"({self.limitePorMinuto}); se esperará a tener la ventana vacía.")
+        inicio = time.monotonic()
+        esperas = 0
+        while True:
+            idReserva, espera = self.intentarReservar(tokens, proveedor)
+            if idReserva is not None:
+                break
+            esperas += 1
+            log.info(f"{logPrefix} Límite de tokens ({self.limitePorMinuto}/min) excedería con {tokens} tokens. "
+                     f"Pausando {espera:.1f}s...")
+            time.sleep(espera)
+        if esperas:
+            esperado = time.monotonic() - inicio
+            with self._lockMetricas:
+                self._metricas['reservas_con_espera'] += 1
+                self._metricas['segundos_esperando'] += esperado
+                self._metricas['espera_maxima'] = max(self._metricas['espera_maxima'], esperado)
+        with self._lockMetricas:
+            self._metricas['reservas'] += 1
+        return idReserva
+
+    def obtenerMetricas(self):
+        """Reservas hechas, cuántas tuvieron que esperar, tiempo total/máximo esperando y peticiones sobredimensionadas."""
+        with self._lockMetricas:
+            metricas = dict(self._metricas)
+        metricas['segundos_esperando'] = round(metricas['segundos_esperando'], 2)
+        metricas['espera_maxima'] = round(metricas['espera_maxima'], 2)
+        metricas['tokens_en_ventana'] = self.tokensEnVentana()
+        return metricas
+
+
+class VentanaTokens(_LimitadorBase):
+    """Ventana deslizante de tokens por minuto en memoria: deque de consumos y suma acumulada."""
+
+    def __init__(self, limitePorMinuto, ventanaSegundos=VENTANA_SEGUNDOS):
+        super().__init__(limitePorMinuto, ventanaSegundos)
+        self._lock = threading.Lock()
+        self._eventos = deque()  # [instante, tokens, id], en orden de llegada
+        self._porId = {}
+        self._suma = 0
+        self._siguienteId = 1
+
+    def _purgar(self, ahora):
+        limite = ahora - self.ventanaSegundos
+        while self._eventos and self._eventos[0][0] <= limite:
+            _, tokens, idEvento = self._eventos.popleft()
+            self._suma -= tokens
+            self._porId.pop(idEvento, None)
+
+    def _esperaNecesaria(self, ahora, tokens):
+        if self._suma + tokens <= self.limitePorMinuto:
+            return 0.0
+        if tokens >= self.limitePorMinuto:
+            return max(0.0, self._eventos[-1][0] + self.ventanaSegundos - ahora) if self._eventos else 0.0
+        exceso = self._suma + tokens - self.limitePorMinuto
+        liberados = 0
+        for instante, cantidad, _ in self._eventos:
+            liberados += cantidad
+            if liberados >= exceso:
+                return max(0.0, instante + self.ventanaSegundos - ahora)
+        return 0.0
+
+    def _insertar(self, ahora, tokens):
+        idEvento = self._siguienteId
+        self._siguienteId += 1
+        evento = [ahora, tokens, idEvento]
+        self._eventos.append(evento)
+        self._porId[idEvento] = evento
+        self._suma += tokens
+        return idEvento
+
+    def predecirEspera(self, tokens):
+        """Segundos que habría que esperar ahora mismo para poder gastar `tokens`."""
+        with self._lock:
+            ahora = time.monotonic()
+            self._purgar(ahora)
+            return self._esperaNecesaria(ahora, tokens)
+
+    def tokensEnVentana(self):
+        """Tokens registrados en el último minuto."""
+        with self._lock:
+            self._purgar(time.monotonic())
+            return self._suma
+
+    def intentarReservar(self, tokens, proveedor=None):
+        """Reserva `tokens` si caben: (id_reserva, 0.0); si no, (None, segundos_de_espera)."""
+        with self._lock:
+            ahora = time.monotonic()
+            self._purgar(ahora)
+            espera = self._esperaNecesaria(ahora, tokens)
+            if espera > 0:
+                return None, espera
+            return self._insertar(ahora, tokens), 0.0
+
+    def registrar(self, tokens, proveedor=None):
+        """Añade un consumo a la ventana sin comprobar el límite."""
+        if tokens <= 0:
+            return
+        with self._lock:
+            self._insertar(time.monotonic(), tokens)
+
+    def ajustar(self, idReserva, tokensReales):
+        """Sustituye los tokens de una reserva por los consumidos realmente."""
+        with self._lock:
+            self._purgar(time.monotonic())
+            evento = self._porId.get(idReserva)
+            if evento is not None:
+                self._suma += tokensReales - evento[1]
+                evento[1] = tokensReales
+                return
+        self.registrar(tokensReales)
+
+
+class LimitadorTokensPersistente(_LimitadorBase):
+    """Ventana deslizante de tokens por minuto respaldada en un fichero SQLite."""
+
+    def __init__(self, ruta, limitePorMinuto, ventanaSegundos=VENTANA_SEGUNDOS):
+        super().__init__(limitePorMinuto, ventanaSegundos)
+        self.ruta = ruta
+        self._local = threading.local()  # Una conexión por hilo (sqlite3 no las comparte)
+
+    def _conexion(self):
+        conexion = getattr(self._local, 'conexion', None)
+        if conexion is None:
+            directorio = os.path.dirname(self.ruta)
+            if directorio:
+                os.makedirs(directorio, exist_ok=True)
+            conexion = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.execute("PRAGMA synchronous=NORMAL")
+            for sentencia in _ESQUEMA:
+                conexion.execute(sentencia)
+            self._local.conexion = conexion
+        return conexion
+
+    def _transaccion(self, operacion):
+        """Ejecuta `operacion(conexion, ahora)` en una transacción con cerrojo de escritura."""
+        conexion = self._conexion()
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            ahora = time.time()
+            self._purgar(conexion, ahora)
+            resultado = operacion(conexion, ahora)
+            conexion.execute("COMMIT")
+            return resultado
+        except BaseException:
+            conexion.execute("ROLLBACK")
+            raise
+
+    def _purgar(self, conexion, ahora):
+        limite = ahora - self.ventanaSegundos
+        caducados = conexion.execute(
+            "SELECT COALESCE(SUM(tokens), 0), COUNT(*) FROM uso WHERE ts <= ?", (limite,)).fetchone()
+        if caducados[1]:
+            conexion.execute("DELETE FROM uso WHERE ts <= ?", (limite,))
+            conexion.execute("UPDATE total SET suma = suma - ? WHERE id = 1", (caducados[0],))
+
+    def _suma(self, conexion):
+        return conexion.execute("SELECT suma FROM total WHERE id = 1").fetchone()[0]
+
+    def _esperaNecesaria(self, conexion, ahora, tokens):
+        """Segundos hasta que `tokens` quepan en la ventana (0 si caben ya)."""
+        usados = self._suma(conexion)
+        if usados + tokens <= self.limitePorMinuto:
+            return 0.0
+        if tokens >= self.limitePorMinuto:
+            # Petición mayor que todo el presupuesto: se deja pasar con la ventana vacía.
+            ultimo = conexion.execute("SELECT MAX(ts) FROM uso").fetchone()[0]
+            return max(0.0, ultimo + self.ventanaSegundos - ahora) if ultimo is not None else 0.0
+        exceso = usados + tokens - self.limitePorMinuto
+        liberados = 0
+        for ts, cantidad in conexion.execute("SELECT ts, tokens FROM uso ORDER BY ts"):
+            liberados += cantidad
+            if liberados >= exceso:
+                return max(0.0, ts + self.ventanaSegundos - ahora)
+        return 0.0
+
+    def predecirEspera(self, tokens):
+        """Segundos que habría que esperar ahora mismo para poder gastar `tokens`."""
+        return self._transaccion(lambda conexion, ahora: self._esperaNecesaria(conexion, ahora, tokens))
+
+    def tokensEnVentana(self):
+        """Tokens registrados por todos los procesos en el último minuto."""
+        return self._transaccion(lambda conexion, ahora: self._suma(conexion))
+
+    def intentarReservar(self, tokens, proveedor=None):
+        """
+        Reserva `tokens` si caben en la ventana. Devuelve (id_reserva, 0.0) si se reservó,
+        o (None, segundos_de_espera) si todavía no caben.
+        """
+        def _operacion(conexion, ahora):
+            espera = self._esperaNecesaria(conexion, ahora, tokens)
+            if espera > 0:
+                return None, espera
+            return self._insertar(conexion, ahora, tokens, proveedor), 0.0
+        return self._transaccion(_operacion)
+
+    def registrar(self, tokens, proveedor=None):
+        """Añade un consumo a la ventana sin comprobar el límite."""
+        if tokens <= 0:
+            return
+        self._transaccion(lambda conexion, ahora: self._insertar(conexion, ahora, tokens, proveedor))
+
+    def ajustar(self, idReserva, tokensReales):
+        """Sustituye los tokens de una reserva por los consumidos realmente."""
+        def _operacion(conexion, ahora):
+            fila = conexion.execute("SELECT tokens FROM uso WHERE id = ?", (idReserva,)).fetchone()
+            if fila is None:
+                return False  # Ya caducó: el consumo real cuenta desde ahora
+            conexion.execute("UPDATE uso SET tokens = ? WHERE id = ?", (tokensReales, idReserva))
+            conexion.execute("UPDATE total SET suma = suma + ? WHERE id = 1", (tokensReales - fila[0],))
+            return True
+        if not self._transaccion(_operacion):
+            self.registrar(tokensReales)
+
+    def _insertar(self, conexion, ahora, tokens, proveedor):
+        cursor = conexion.execute(
+            "INSERT INTO uso (ts, tokens, proveedor) VALUES (?, ?, ?)", (ahora, tokens, proveedor))
+        conexion.execute("UPDATE total SET suma = suma + ? WHERE id = 1", (tokens,))
+        return cursor.lastrowid
+
+
+_lockLimitador = threading.Lock()
+_limitador = None
+
+
+def obtenerLimitador():
+    """
+    Devuelve el limitador configurado en settings: el persistente en RUTA_LIMITADOR_TOKENS, o
+    VentanaTokens en memoria si LIMITADOR_TOKENS_PERSISTENTE está desactivado o SQLite falla.
+    """
+    global _limitador
+    with _lockLimitador:
+        if _limitador is None:
+            if settings.LIMITADOR_TOKENS_PERSISTENTE:
+                try:
+                    _limitador = LimitadorTokensPersistente(
+                        settings.RUTA_LIMITADOR_TOKENS, settings.TOKEN_LIMIT_PER_MINUTE)
+                    _limitador.tokensEnVentana()
+                except (sqlite3.Error, OSError) as e:
+                    log.warning(f"obtenerLimitador: No se pudo abrir la ventana compartida "
+                                f"'{settings.RUTA_LIMITADOR_TOKENS}' ({e}); se usa una ventana en memoria.")
+                    _limitador = None
+            if _limitador is None:
+                _limitador = VentanaTokens(settings.TOKEN_LIMIT_PER_MINUTE)
+        return _limitador
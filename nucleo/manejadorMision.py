@@ -1,298 +1,695 @@
 # nucleo/manejadorMisiones.py
-import logging
+import os
 import re
+import json
+import bisect
+import hashlib
+import logging
+import heapq
+import threading
+from collections import OrderedDict, defaultdict
+from config import settings
 
 log = logging.getLogger(__name__)
 
-
-def _parse_tarea_individual(tarea_buffer: dict):
-    logPrefix = "_parse_tarea_individual:"
-    if not tarea_buffer or not tarea_buffer.get("raw_lines"):
-        return None
-    
-    lineas_tarea = tarea_buffer["raw_lines"]
-    tarea_dict = {
-        "id": None, "titulo": None, "estado": "PENDIENTE", 
-        "descripcion": "", "archivos_implicados_especificos": [], "intentos": 0,
-        "bloques_codigo_objetivo": [], # Nueva lista para bloques de código
-        "raw_lines": lineas_tarea,
-        "line_start_index": tarea_buffer.get("line_start_index", -1),
-        "line_end_index": tarea_buffer.get("line_start_index", -1) + len(lineas_tarea) -1 if tarea_buffer.get("line_start_index", -1) != -1 else -1
-    }
-    descripcion_parts = []
-    in_descripcion = False
-    parsing_bloques_codigo = False
-    current_block_info = None
-
-    match_titulo_linea = lineas_tarea[0] if lineas_tarea else ""
-    match_titulo_encabezado = re.match(r"###\s*Tarea\s*([\w.-]+):\s*(.+)", match_titulo_linea, re.IGNORECASE)
-    if match_titulo_encabezado:
-        tarea_dict["id_titulo"] = match_titulo_encabezado.group(1).strip()
-        tarea_dict["titulo"] = match_titulo_encabezado.group(2).strip()
-    else:
-        logging.warning(f"{logPrefix} No se pudo parsear ID/Título del encabezado de la tarea: '{match_titulo_linea}'")
-
-    id_del_campo_encontrado = None
-
-    for linea_original_tarea in lineas_tarea[1:]:
-        linea_strip_para_campos_std = linea_original_tarea.strip()
-
-        # Primero, verificar si estamos saliendo de la sección de bloques de código
-        # o si es un campo de tarea estándar, lo cual también finaliza la sección de bloques.
-        es_campo_tarea_estandar = (
-            re.match(r"-\s*\*\*ID:\*\*", linea_original_tarea, re.I) or
-            re.match(r"-\s*\*\*Estado:\*\*", linea_original_tarea, re.I) or
-            re.match(r"-\s*\*\*Intentos:\*\*", linea_original_tarea, re.I) or
-            re.match(r"-\s*\*\*Archivos Implicados .*:\*\*", linea_original_tarea, re.I) or
-            re.match(r"-\s*\*\*Descripción:\*\*", linea_original_tarea, re.I)
-        )
-
-        if es_campo_tarea_estandar and parsing_bloques_codigo:
-            if current_block_info:
-                tarea_dict["bloques_codigo_objetivo"].append(current_block_info)
-                current_block_info = None
-            parsing_bloques_codigo = False
-        
-        # --- Procesamiento de campos de Bloques de Código Objetivo ---
-        if parsing_bloques_codigo:
-            match_archivo_bloque = re.match(r"\s*-\s*\*\*Archivo:\*\*\s*(.+)", linea_original_tarea, re.I)
-            match_nombre_bloque = re.match(r"\s*-\s*\*\*Nombre Bloque:\*\*\s*(.+)", linea_original_tarea, re.I)
-            match_linea_inicio = re.match(r"\s*-\s*\*\*Línea Inicio:\*\*\s*(\d+)", linea_original_tarea, re.I)
-            match_linea_fin = re.match(r"\s*-\s*\*\*Línea Fin:\*\*\s*(\d+)", linea_original_tarea, re.I)
-
-            if match_archivo_bloque:
-                if current_block_info: # Guardar bloque anterior si existe
-                    # Validar que el bloque anterior tenga los campos esperados antes de guardarlo
-                    if all(k in current_block_info for k in ["archivo", "nombre_bloque", "linea_inicio", "linea_fin"]):
-                        tarea_dict["bloques_codigo_objetivo"].append(current_block_info)
-                    else:
-                        logging.warning(f"{logPrefix} Bloque de código anterior incompleto, no se guardó: {current_block_info} en tarea ID '{tarea_dict.get('id_titulo','??')}'")
-                current_block_info = {"archivo": match_archivo_bloque.group(1).strip().replace('`', '')}
-                in_descripcion = False # Salir de descripción si estábamos
-                continue 
-            elif match_nombre_bloque and current_block_info:
-                current_block_info["nombre_bloque"] = match_nombre_bloque.group(1).strip().replace('`', '')
-                in_descripcion = False
-                continue
-            elif match_linea_inicio and current_block_info:
-                try:
-                    current_block_info["linea_inicio"] = int(match_linea_inicio.group(1).strip())
-                except ValueError:
-                    logging.warning(f"{logPrefix} Valor no entero para Línea Inicio: '{match_linea_inicio.group(1).strip()}' en tarea ID '{tarea_dict.get('id_titulo','??')}'")
-                in_descripcion = False
-                continue
-            elif match_linea_fin and current_block_info:
-                try:
-                    current_block_info["linea_fin"] = int(match_linea_fin.group(1).strip())
-                except ValueError:
-                    logging.warning(f"{logPrefix} Valor no entero para Línea Fin: '{match_linea_fin.group(1).strip()}' en tarea ID '{tarea_dict.get('id_titulo','??')}'")
-                in_descripcion = False
-                continue
-            elif linea_original_tarea.strip() == "": # Ignorar líneas vacías dentro de la sección de bloques
-                continue
-            # Si no es un campo de bloque conocido y no es una línea vacía, podría ser un error de formato o el final.
-            # Si es un campo de tarea estándar, ya se manejó arriba.
-            # Si es cualquier otra cosa, y estamos en parsing_bloques_codigo, es mejor terminar.
-            elif not es_campo_tarea_estandar: 
-                # Podría ser una línea de comentario o texto mal formateado dentro de la sección de bloques.
-                # Por ahora, si no es un campo de bloque reconocido, terminamos la sección de bloques.
-                if current_block_info:
-                    if all(k in current_block_info for k in ["archivo", "nombre_bloque", "linea_inicio", "linea_fin"]):
-                        tarea_dict["bloques_codigo_objetivo"].append(current_block_info)
-                    else:
-                        logging.warning(f"{logPrefix} Bloque de código al finalizar sección por línea no reconocida, incompleto: {current_block_info} en tarea ID '{tarea_dict.get('id_titulo','??')}'")
-                    current_block_info = None
-                parsing_bloques_codigo = False
-                # No hacer 'continue' aquí, la línea podría ser un campo de tarea estándar o el inicio de descripción.
-        
-        # --- Procesamiento de campos de tarea estándar ---
-        match_id_campo_explicito = re.match(r"-\s*\*\*ID:\*\*\s*([\w.-]+)", linea_original_tarea, re.I)
-        if match_id_campo_explicito: 
-            id_del_campo_encontrado = match_id_campo_explicito.group(1).strip()
-            in_descripcion = False
-            continue
-
-        match_estado = re.match(r"-\s*\*\*Estado:\*\*\s*(PENDIENTE|COMPLETADA|SALTADA|FALLIDA_TEMPORALMENTE|FALLIDA_PERMANENTEMENTE)", linea_original_tarea, re.I)
-        if match_estado: 
-            tarea_dict["estado"] = match_estado.group(1).upper().strip()
-            in_descripcion = False
+# El markdown de la misión se parsea en una sola pasada (patrones precompilados) a un modelo
+# tipado (MisionOrion / TareaMision) que guarda además la posición exacta (offsets de carácter
+# en el markdown) del valor de Estado e Intentos de cada tarea. El modelo se memoriza por huella
+# (sha1) del contenido y, si se indica `ruta_sidecar`, se persiste como JSON en
+# .orion_meta/misiones/<nombre_clave>.json: mientras la huella coincida con la del .md, las
+# fases siguientes lo cargan sin volver a parsear.
+# actualizar_estados_tareas parchea esos valores directamente (sin partir en líneas ni buscar
+# con regex), desplaza los offsets del modelo y lo registra bajo la huella del contenido nuevo,
+# así que el parseo posterior para saber si quedan pendientes es un acierto de memoria.
+# PlanificadorTareas decide qué tarea toca: cola de prioridad (reintentos antes que pendientes,
+# luego orden declarado) que respeta el campo opcional '- **Depende De:** T1, T2' de cada tarea y
+# el límite de reintentos (settings.MAX_REINTENTOS_TAREA o '- **Máximo Reintentos:** N' en los
+# metadatos de la misión).
+
+VERSION_SIDECAR = 3
+MAX_MISIONES_MEMORIA = 32
+ESTADOS_TAREA = ("PENDIENTE", "COMPLETADA", "SALTADA", "FALLIDA_TEMPORALMENTE", "FALLIDA_PERMANENTEMENTE")
+ESTADOS_RESUELTOS = ("COMPLETADA", "SALTADA")  # Desbloquean a las tareas que dependen de ellas
+
+_lock = threading.Lock()
+_memoria = OrderedDict()  # huella -> MisionOrion
+_sidecarsEscritos = {}  # ruta_sidecar -> huella guardada
+_estadisticas = {'parseos': 0, 'aciertos_memoria': 0, 'aciertos_sidecar': 0, 'sidecars_guardados': 0}
+
+_RE_CAMPO = re.compile(r"(?P<sangria>\s*)-\s*\*\*(?P<campo>[^*]+?):\*\*\s*(?P<valor>.*)")
+_RE_TITULO_TAREA = re.compile(r"###\s*Tarea\s*([\w.-]+):\s*(.+)", re.I)
+_RE_TITULO_MISION = re.compile(r"#\s*Misi[oó]n:\s*(.+)", re.I)
+_RE_ID = re.compile(r"[\w.-]+")
+_RE_ENTERO = re.compile(r"\d+")
+_RE_PALABRA = re.compile(r"\w+")
+_RE_ESTADO_TAREA = re.compile("|".join(ESTADOS_TAREA), re.I)
+_RE_ESTADO_MISION = re.compile(r"PENDIENTE|EN_PROGRESO|COMPLETADA|FALLIDA", re.I)
+_RE_VALOR_ESTADO = re.compile(r"[A-Za-z_]*")
+_FINES_LINEA = '\r\n\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029'  # Los de str.splitlines()
+
+_CAMPOS_ESTANDAR = ('id', 'estado', 'intentos', 'descripción')  # + 'archivos implicados ...', 'depende de ...'
+_CAMPOS_BLOQUE = {'nombre bloque': 'nombre_bloque', 'línea inicio': 'linea_inicio', 'línea fin': 'linea_fin'}
+_CLAVES_BLOQUE = ("archivo", "nombre_bloque", "linea_inicio", "linea_fin")
+_CAMPOS_METADATOS = {'nombre clave': 'nombre_clave', 'archivo principal': 'archivo_principal',
+                     'razón (paso 1.1)': 'razon_paso1_1'}
+_LISTAS_METADATOS = {'archivos de contexto (generación)': 'archivos_contexto_generacion',
+                     'archivos de contexto (ejecución)': 'archivos_contexto_ejecucion'}
+_NINGUNO = ("ninguno", "ninguno.")
+
+
+class TareaMision:
+    """
+    Una tarea de la misión. `linea_inicio`/`linea_fin` son índices 0-based de línea en el markdown
+    (-1 si no hay); `pos_estado`/`pos_intentos`, el rango [inicio, fin) en caracteres del valor de
+    esos campos (None si la tarea no tiene la línea).
+    """
+
+    __slots__ = ('id', 'titulo', 'estado', 'descripcion', 'archivos_implicados_especificos', 'intentos',
+                 'bloques_codigo_objetivo', 'dependencias', 'linea_inicio', 'linea_fin', 'pos_estado', 'pos_intentos')
+
+    def __init__(self, id=None, titulo=None, estado="PENDIENTE", descripcion="", archivos_implicados_especificos=None,
+                 intentos=0, bloques_codigo_objetivo=None, dependencias=None, linea_inicio=-1, linea_fin=-1,
+                 pos_estado=None, pos_intentos=None):
+        self.id = id
+        self.titulo = titulo
+        self.estado = estado
+        self.descripcion = descripcion
+        self.archivos_implicados_especificos = archivos_implicados_especificos or []
+        self.intentos = intentos
+        self.bloques_codigo_objetivo = bloques_codigo_objetivo or []
+        self.dependencias = dependencias or []
+        self.linea_inicio = linea_inicio
+        self.linea_fin = linea_fin
+        self.pos_estado = pos_estado
+        self.pos_intentos = pos_intentos
+
+    def aDiccionario(self):
+        return {campo: getattr(self, campo) for campo in self.__slots__}
+
+    def comoDiccionario(self):
+        """Formato de tarea que usa el resto del agente (copia independiente del modelo)."""
+        return {"id": self.id, "titulo": self.titulo, "estado": self.estado, "descripcion": self.descripcion,
+                "archivos_implicados_especificos": list(self.archivos_implicados_especificos),
+                "intentos": self.intentos,
+                "bloques_codigo_objetivo": [dict(b) for b in self.bloques_codigo_objetivo],
+                "dependencias": list(self.dependencias),
+                "line_start_index": self.linea_inicio, "line_end_index": self.linea_fin}
+
+
+class MisionOrion:
+    """Metadatos y tareas de una misión, con la huella del markdown del que salieron."""
+
+    __slots__ = ('metadatos', 'tareas', 'huella')
+
+    def __init__(self, metadatos, tareas, huella):
+        self.metadatos = metadatos
+        self.tareas = tareas
+        self.huella = huella
+
+    @property
+    def hayPendientes(self):
+        return any(t.estado == "PENDIENTE" for t in self.tareas)
+
+    def buscarTarea(self, idTarea):
+        return next((t for t in self.tareas if t.id == idTarea), None)
+
+    def aDiccionario(self):
+        return {'metadatos': self.metadatos, 'tareas': [t.aDiccionario() for t in self.tareas], 'huella': self.huella}
+
+    @classmethod
+    def desdeDiccionario(cls, datos):
+        return cls(dict(datos['metadatos']), [TareaMision(**t) for t in datos['tareas']], datos['huella'])
+
+    def comoTupla(self):
+        """(metadatos, tareas, hay_pendientes) como los devolvía parsear_mision_orion, en copias nuevas."""
+        metadatos = {k: list(v) if isinstance(v, list) else v for k, v in self.metadatos.items()}
+        return metadatos, [t.comoDiccionario() for t in self.tareas], self.hayPendientes
+
+
+class _ConstructorTarea:
+    """Estado del parseo de una tarea mientras se recorren sus líneas."""
+
+    def __init__(self, lineaInicio):
+        self.tarea = TareaMision(linea_inicio=lineaInicio)
+        self.numLineas = 0
+        self.idTitulo = None
+        self.idCampo = None
+        self.descripcion = []
+        self.enDescripcion = False
+        self.enBloques = False
+        self.bloque = None
+
+    def _cerrarBloque(self, motivo):
+        if self.bloque is None:
+            return
+        if all(k in self.bloque for k in _CLAVES_BLOQUE):
+            self.tarea.bloques_codigo_objetivo.append(self.bloque)
+        else:
+            log.warning(f"_ConstructorTarea: Bloque de código incompleto ({motivo}), no se guardó: {self.bloque} "
+                        f"en tarea ID '{self.idTitulo or '??'}'")
+        self.bloque = None
+
+    def procesar(self, indice, linea, offset):
+        self.numLineas += 1
+        if self.numLineas == 1:
+            m = _RE_TITULO_TAREA.match(linea)
+            if m:
+                self.idTitulo, self.tarea.titulo = m.group(1).strip(), m.group(2).strip()
+            else:
+                log.warning(f"_ConstructorTarea: No se pudo parsear ID/Título del encabezado de la tarea: '{linea}'")
+            return
+
+        m = _RE_CAMPO.match(linea)
+        campo = m.group('campo').strip().lower() if m else None
+        valor = m.group('valor').strip() if m else ""
+        # Los campos de la tarea van sin sangría; los de cada bloque pueden ir sangrados
+        deTarea = m is not None and not m.group('sangria')
+        estandar = deTarea and (campo in _CAMPOS_ESTANDAR or campo.startswith(('archivos implicados ', 'depende de')))
+        if deTarea and campo == 'estado' and self.tarea.pos_estado is None:
+            inicio = m.start('valor')
+            self.tarea.pos_estado = [offset + inicio, offset + _RE_VALOR_ESTADO.match(linea, inicio).end()]
+        if deTarea and campo == 'intentos' and self.tarea.pos_intentos is None:
+            numero = _RE_ENTERO.match(linea, m.start('valor'))
+            if numero:
+                self.tarea.pos_intentos = [offset + numero.start(), offset + numero.end()]
+
+        if self.enBloques:
+            if estandar:
+                self._cerrarBloque("fin de la sección")
+                self.enBloques = False
+            elif campo == 'archivo' and valor:
+                self._cerrarBloque("nuevo bloque")
+                self.bloque = {"archivo": valor.replace('`', '')}
+                return
+            elif campo in _CAMPOS_BLOQUE and self.bloque is not None and valor:
+                clave = _CAMPOS_BLOQUE[campo]
+                if clave == 'nombre_bloque':
+                    self.bloque[clave] = valor.replace('`', '')
+                    return
+                numero = _RE_ENTERO.match(valor)
+                if numero:
+                    self.bloque[clave] = int(numero.group())
+                    return
+            elif not linea.strip():
+                return
+            # Línea no reconocida: termina la sección de bloques y se procesa como campo normal
+            self._cerrarBloque("línea no reconocida")
+            self.enBloques = False
+
+        if deTarea:
+            if campo == 'id':
+                mId = _RE_ID.match(valor)
+                if mId:
+                    self.idCampo = mId.group()
+                    self.enDescripcion = False
+                    return
+            elif campo == 'estado':
+                mEstado = _RE_ESTADO_TAREA.match(valor)
+                if mEstado:
+                    self.tarea.estado = mEstado.group().upper()
+                    self.enDescripcion = False
+                    return
+            elif campo == 'intentos':
+                mIntentos = _RE_ENTERO.match(valor)
+                if mIntentos:
+                    self.tarea.intentos = int(mIntentos.group())
+                    self.enDescripcion = False
+                    return
+            elif campo.startswith('archivos implicados ') and valor:
+                if valor.lower() not in ("ninguno", "opcional:", "ninguno."):
+                    self.tarea.archivos_implicados_especificos = [a.strip() for a in valor.split(',') if a.strip()]
+                self.enDescripcion = False
+                return
+            elif campo.startswith('depende de'):
+                if valor.lower() not in _NINGUNO:
+                    ids = (_RE_ID.search(parte) for parte in valor.split(','))
+                    self.tarea.dependencias = list(dict.fromkeys(m.group() for m in ids if m))
+                self.enDescripcion = False
+                return
+            elif campo == 'bloques de código objetivo':
+                if self.bloque is not None:
+                    log.warning(f"_ConstructorTarea: Encabezado de Bloques de Código con un bloque abierto; se descarta: {self.bloque}")
+                    self.bloque = None
+                self.enBloques = True
+                self.enDescripcion = False
+                return
+            elif campo == 'descripción':
+                self.enDescripcion = True
+                if valor:
+                    self.descripcion.append(valor)
+                return
+
+        if self.enDescripcion and not (deTarea and _RE_PALABRA.fullmatch(m.group('campo'))):
+            self.descripcion.append(linea.strip())
+
+    def cerrar(self):
+        """La TareaMision construida, o None si no tiene líneas o su ID falta o es incoherente."""
+        logPrefix = "_ConstructorTarea.cerrar:"
+        if not self.numLineas:
+            return None
+        self._cerrarBloque("final de la tarea")
+        tarea = self.tarea
+        tarea.linea_fin = tarea.linea_inicio + self.numLineas - 1
+        if self.idTitulo and self.idCampo and self.idTitulo != self.idCampo:
+            log.error(f"{logPrefix} ¡DISCREPANCIA FATAL DE ID! ID en encabezado de tarea ('{self.idTitulo}') "
+                      f"difiere de ID en campo '- **ID:**' ('{self.idCampo}'). "
+                      f"Formato de misión inválido para la tarea en líneas {tarea.linea_inicio}-{tarea.linea_fin}. Tarea ignorada.")
+            return None
+        tarea.id = self.idTitulo or self.idCampo
+        if not tarea.id:
+            log.error(f"{logPrefix} Tarea parseada SIN ID. No se encontró ID en el encabezado (### Tarea ID: Título) "
+                      f"ni en un campo '- **ID:** ID'. Líneas {tarea.linea_inicio}-{tarea.linea_fin}.")
+            return None
+        tarea.descripcion = "\n".join(self.descripcion).strip()
+        return tarea
+
+
+def _limpiarListaRutas(valor):
+    """Rutas de una lista de metadatos ('a.py, [b.php]', 'Ninguno'...), sin corchetes ni '/' inicial."""
+    if valor.startswith('[') and valor.endswith(']'):
+        valor = valor[1:-1].strip()
+    if not valor or valor.lower() in _NINGUNO:
+        return []
+    rutas = []
+    for ruta in valor.split(','):
+        # Los corchetes dentro de una ruta y la barra inicial harían que os.path.join la trate como absoluta
+        ruta = ruta.strip().replace('[', '').replace(']', '').lstrip('/\\').strip()
+        if ruta and ruta.lower() not in _NINGUNO:
+            rutas.append(ruta)
+    return rutas
+
+
+def _parsearMision(contenido_mision, huella):
+    """Una sola pasada por las líneas del markdown. None si falta el nombre clave o hay un error."""
+    logPrefix = "_parsearMision:"
+    metadatos = {"nombre_clave": None, "archivo_principal": None, "archivos_contexto_generacion": [],
+                 "archivos_contexto_ejecucion": [], "razon_paso1_1": None, "estado_general": "PENDIENTE",
+                 "max_reintentos": None}
+    tareas = []
+    lineas = contenido_mision.splitlines(keepends=True)
+    seccion, constructor = None, None
+    offset = 0
+
+    def cerrarTarea():
+        tarea = constructor.cerrar() if constructor else None
+        if tarea:
+            tareas.append(tarea)
+
+    for i, lineaCruda in enumerate(lineas):
+        inicioLinea = offset
+        offset += len(lineaCruda)
+        lineaOrig = lineaCruda.rstrip(_FINES_LINEA)
+        linea = lineaOrig.strip()
+        if linea.startswith("# Misión:"):
             continue
-        
-        match_intentos = re.match(r"-\s*\*\*Intentos:\*\*\s*(\d+)", linea_original_tarea, re.I)
-        if match_intentos: 
-            tarea_dict["intentos"] = int(match_intentos.group(1).strip())
-            in_descripcion = False
+        minusculas = linea.lower()
+        if minusculas == "**metadatos de la misión:**":
+            seccion = "metadatos"
             continue
-
-        match_aie = re.match(r"-\s*\*\*Archivos Implicados .*:\*\*\s*(.+)", linea_original_tarea, re.I)
-        if match_aie:
-            archivos_str = match_aie.group(1).strip()
-            if archivos_str and archivos_str.lower() not in ["ninguno", "opcional:", "ninguno."]:
-                tarea_dict["archivos_implicados_especificos"] = [a.strip() for a in archivos_str.split(',') if a.strip()]
-            in_descripcion = False
+        if minusculas == "## tareas de refactorización:":
+            seccion = "tareas"
+            cerrarTarea()
+            constructor = None
             continue
-        
-        match_bloques_header = re.match(r"-\s*\*\*Bloques de Código Objetivo:\*\*\s*(.*)", linea_original_tarea, re.I)
-        if match_bloques_header:
-            parsing_bloques_codigo = True
-            in_descripcion = False 
-            if current_block_info: # Si por alguna razón ya había un bloque (no debería)
-                 logging.warning(f"{logPrefix} Se encontró encabezado de Bloques de Código con un current_block_info ya existente. Descartando el previo: {current_block_info}")
-                 current_block_info = None
+        if seccion == "tareas" and linea.startswith("---"):
+            cerrarTarea()
+            constructor = _ConstructorTarea(i + 1)
             continue
 
-        match_desc_start = re.match(r"-\s*\*\*Descripción:\*\*\s*(.*)", linea_original_tarea, re.I)
-        if match_desc_start:
-            in_descripcion = True
-            # Si estábamos parseando bloques, y encontramos Descripción, finalizamos el bloque actual.
-            if parsing_bloques_codigo:
-                if current_block_info:
-                    if all(k in current_block_info for k in ["archivo", "nombre_bloque", "linea_inicio", "linea_fin"]):
-                        tarea_dict["bloques_codigo_objetivo"].append(current_block_info)
-                    else:
-                        logging.warning(f"{logPrefix} Bloque de código al iniciar descripción, incompleto: {current_block_info} en tarea ID '{tarea_dict.get('id_titulo','??')}'")
-                    current_block_info = None
-                parsing_bloques_codigo = False
-
-            desc_first_line = match_desc_start.group(1).strip()
-            if desc_first_line: 
-                descripcion_parts.append(desc_first_line)
-            continue
+        if seccion == "metadatos":
+            m = _RE_CAMPO.match(lineaOrig)
+            if not m or m.group('sangria'):
+                continue
+            campo, valor = m.group('campo').strip().lower(), m.group('valor').strip()
+            if campo in _CAMPOS_METADATOS and valor:
+                metadatos[_CAMPOS_METADATOS[campo]] = valor
+            elif campo == 'estado':
+                mEstado = _RE_ESTADO_MISION.match(valor)
+                if mEstado:
+                    metadatos["estado_general"] = mEstado.group().upper()
+            elif campo == 'máximo reintentos':
+                numero = _RE_ENTERO.match(valor)
+                if numero:
+                    metadatos["max_reintentos"] = int(numero.group())
+            elif campo in _LISTAS_METADATOS and valor:
+                metadatos[_LISTAS_METADATOS[campo]] = _limpiarListaRutas(valor)
+        elif seccion == "tareas" and constructor is not None:
+            constructor.procesar(i, lineaOrig, inicioLinea)
+    cerrarTarea()
+
+    if not metadatos["nombre_clave"]:
+        mTitulo = _RE_TITULO_MISION.match(lineas[0] if lineas else "")
+        if not mTitulo:
+            log.error(f"{logPrefix} Error crítico: Nombre Clave no encontrado.")
+            return None
+        metadatos["nombre_clave"] = mTitulo.group(1).strip()
+        log.info(f"{logPrefix} Nombre Clave de fallback: {metadatos['nombre_clave']}")
+    mision = MisionOrion(metadatos, tareas, huella)
+    with _lock:
+        _estadisticas['parseos'] += 1
+    log.info(f"{logPrefix} Misión parseada. Clave: {metadatos['nombre_clave']}. Tareas: {len(tareas)}. "
+             f"Pendientes: {mision.hayPendientes}.")
+    return mision
 
-        if in_descripcion and not re.match(r"-\s*\*\*\w+:\*\*", linea_original_tarea):
-             descripcion_parts.append(linea_original_tarea.strip())
 
-    # Finalizar el último bloque de código si existe
-    if current_block_info:
-        if all(k in current_block_info for k in ["archivo", "nombre_bloque", "linea_inicio", "linea_fin"]):
-            tarea_dict["bloques_codigo_objetivo"].append(current_block_info)
-        else:
-            logging.warning(f"{logPrefix} Último bloque de código al final de la tarea, incompleto: {current_block_info} en tarea ID '{tarea_dict.get('id_titulo','??')}'")
-    
-    id_del_titulo = tarea_dict.pop("id_titulo", None)
-    if id_del_titulo and id_del_campo_encontrado:
-        if id_del_titulo == id_del_campo_encontrado:
-            tarea_dict["id"] = id_del_titulo
-            logging.debug(f"{logPrefix} ID del título y del campo coinciden: '{tarea_dict['id']}'.")
-        else:
-            logging.error(f"{logPrefix} ¡DISCREPANCIA FATAL DE ID! ID en encabezado de tarea ('{id_del_titulo}') "
-                          f"difiere de ID en campo '- **ID:**' ('{id_del_campo_encontrado}'). "
-                          f"Formato de misión inválido para la tarea en líneas {tarea_dict['line_start_index']}-{tarea_dict['line_end_index']}. Tarea ignorada.")
+def _huella(contenido_mision):
+    return hashlib.sha1(contenido_mision.encode('utf-8')).hexdigest()
+
+
+def _memorizar(mision):
+    with _lock:
+        _memoria[mision.huella] = mision
+        _memoria.move_to_end(mision.huella)
+        while len(_memoria) > MAX_MISIONES_MEMORIA:
+            _memoria.popitem(last=False)
+
+
+def rutaSidecar(ruta_repo, nombre_clave):
+    """Ruta del JSON con el modelo parseado de la misión `nombre_clave` del repositorio."""
+    return os.path.join(ruta_repo, ".orion_meta", "misiones", f"{nombre_clave}.json")
+
+
+def _leerSidecar(ruta_sidecar, huella):
+    try:
+        with open(ruta_sidecar, 'r', encoding='utf-8') as f:
+            datos = json.load(f)
+        if datos.get('version') != VERSION_SIDECAR or datos.get('huella') != huella:
             return None
-    elif id_del_titulo:
-        tarea_dict["id"] = id_del_titulo
-        logging.debug(f"{logPrefix} Usando ID del encabezado de tarea: '{id_del_titulo}'.")
-    elif id_del_campo_encontrado:
-        tarea_dict["id"] = id_del_campo_encontrado
-        logging.debug(f"{logPrefix} Usando ID del campo '- **ID:**': '{id_del_campo_encontrado}'.")
-    else:
-        logging.error(f"{logPrefix} Tarea parseada SIN ID. No se encontró ID en el encabezado (### Tarea ID: Título) ni en un campo '- **ID:** ID'. Líneas: {tarea_dict['raw_lines']}")
+        mision = MisionOrion.desdeDiccionario(datos['mision'])
+    except FileNotFoundError:
         return None
-
-    tarea_dict["descripcion"] = "\n".join(descripcion_parts).strip()
-    
-    if not tarea_dict["id"]:
-        logging.error(f"{logPrefix} Error Lógico: Tarea finalizada sin ID a pesar de las validaciones. Líneas: {tarea_dict['raw_lines']}")
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        log.warning(f"_leerSidecar: Sidecar de misión ilegible en '{ruta_sidecar}', se volverá a parsear: {e}")
         return None
-        
-    logging.debug(f"{logPrefix} Tarea parseada. ID: '{tarea_dict['id']}', Título: '{tarea_dict['titulo']}', Estado: '{tarea_dict['estado']}', Bloques: {len(tarea_dict['bloques_codigo_objetivo'])}")
-    return tarea_dict
+    with _lock:
+        _estadisticas['aciertos_sidecar'] += 1
+        _sidecarsEscritos[ruta_sidecar] = huella
+    return mision
 
-def parsear_mision_orion(contenido_mision: str):
-    logPrefix = "parsear_mision_orion:"
-    if not contenido_mision: return None, [], False
-    metadatos = {"nombre_clave": None, "archivo_principal": None, "archivos_contexto_generacion": [],
-                 "archivos_contexto_ejecucion": [], "razon_paso1_1": None, "estado_general": "PENDIENTE"}
-    tareas, hay_tareas_pendientes = [], False
-    lineas = contenido_mision.splitlines()
-    seccion_actual, tarea_actual_buffer = None, None
 
+def _guardarSidecar(ruta_sidecar, mision):
     try:
-        for i, linea_orig in enumerate(lineas):
-            linea = linea_orig.strip()
-            if linea.startswith("# Misión:"): continue
-            if linea.lower() == "**metadatos de la misión:**": seccion_actual = "metadatos"; continue
-            elif linea.lower() == "## tareas de refactorización:":
-                seccion_actual = "tareas"
-                if tarea_actual_buffer: parsed = _parse_tarea_individual(tarea_actual_buffer); tarea_actual_buffer = None; (tareas.append(parsed) if parsed else None)
-                continue
-            if linea.startswith("---") and seccion_actual == "tareas":
-                if tarea_actual_buffer: parsed = _parse_tarea_individual(tarea_actual_buffer); (tareas.append(parsed) if parsed else None)
-                tarea_actual_buffer = {"raw_lines": [], "line_start_index": i + 1}; continue
-
-            if seccion_actual == "metadatos":
-                m_nk = re.match(r"-\s*\*\*Nombre Clave:\*\*\s*(.+)", linea_orig, re.I); m_ap = re.match(r"-\s*\*\*Archivo Principal:\*\*\s*(.+)", linea_orig, re.I)
-                m_acg = re.match(r"-\s*\*\*Archivos de Contexto \(Generación\):\*\*\s*(.+)", linea_orig, re.I); m_ace = re.match(r"-\s*\*\*Archivos de Contexto \(Ejecución\):\*\*\s*(.+)", linea_orig, re.I)
-                m_r11 = re.match(r"-\s*\*\*Razón \(Paso 1.1\):\*\*\s*(.+)", linea_orig, re.I); m_eg = re.match(r"-\s*\*\*Estado:\*\*\s*(PENDIENTE|EN_PROGRESO|COMPLETADA|FALLIDA)", linea_orig, re.I)
-                if m_nk: metadatos["nombre_clave"] = m_nk.group(1).strip(); continue
-                if m_ap: metadatos["archivo_principal"] = m_ap.group(1).strip(); continue
-                if m_r11: metadatos["razon_paso1_1"] = m_r11.group(1).strip(); continue
-                if m_eg: metadatos["estado_general"] = m_eg.group(1).upper().strip(); continue
-                
-                for m, key in [(m_acg, "archivos_contexto_generacion"), (m_ace, "archivos_contexto_ejecucion")]:
-                    if m:
-                        s = m.group(1).strip()
-                        # Eliminar corchetes si están al principio y al final de la LISTA COMPLETA de archivos
-                        if s.startswith('[') and s.endswith(']'):
-                            s = s[1:-1].strip()
-                        
-                        rutas_finales = []
-                        # Solo procesar si hay algo después de quitar corchetes de la lista y no es "ninguno"
-                        if s and s.lower() not in ["ninguno", "ninguno."]:
-                            rutas_individuales_str = s.split(',')
-                            for ruta_str_orig in rutas_individuales_str:
-                                ruta_procesada = ruta_str_orig.strip()
-
-                                # 1. Eliminar completamente los caracteres '[' y ']' de la ruta.
-                                #    Esto es más agresivo que solo al principio/final.
-                                ruta_procesada = ruta_procesada.replace('[', '').replace(']', '')
-                                
-                                # 2. Eliminar barra inclinada inicial (federal o invertida) si existe 
-                                #    DESPUÉS de quitar corchetes.
-                                #    Esto previene rutas como '/app/file.py' o '\app\file.py' 
-                                #    volviéndose absolutas erróneamente si se unen con os.path.join más tarde.
-                                if ruta_procesada.startswith('/') or ruta_procesada.startswith('\\'):
-                                    ruta_procesada = ruta_procesada[1:]
-                                
-                                # Strip final para quitar espacios que pudieron quedar después de reemplazos
-                                ruta_procesada = ruta_procesada.strip() 
-
-                                # Solo añadir si después de toda la limpieza, la ruta es válida (no vacía)
-                                # y no es explícitamente "ninguno".
-                                if ruta_procesada and ruta_procesada.lower() not in ["ninguno", "ninguno."]:
-                                    rutas_finales.append(ruta_procesada)
-                                elif ruta_procesada: # Log si se descarta algo que no era "ninguno" pero quedó vacío
-                                    logging.debug(f"{logPrefix} Ruta individual '{ruta_str_orig}' descartada después de limpieza (quedó vacía pero no era 'ninguno').")
-
-                        metadatos[key] = rutas_finales
-                        continue
-            elif seccion_actual == "tareas" and tarea_actual_buffer is not None: tarea_actual_buffer["raw_lines"].append(linea_orig)
-        
-        if tarea_actual_buffer: parsed = _parse_tarea_individual(tarea_actual_buffer); (tareas.append(parsed) if parsed else None)
-        for t in tareas: 
-            if t and t.get("estado", "").upper() == "PENDIENTE": hay_tareas_pendientes = True; break
-        
-        if not metadatos["nombre_clave"]:
-            m_title = re.match(r"#\s*Misi[oó]n:\s*(.+)", lineas[0] if lineas else "", re.I)
-            if m_title: metadatos["nombre_clave"] = m_title.group(1).strip(); logging.info(f"{logPrefix} Nombre Clave de fallback: {metadatos['nombre_clave']}")
-            else: logging.error(f"{logPrefix} Error crítico: Nombre Clave no encontrado."); return None, [], False
-        logging.info(f"{logPrefix} Misión parseada. Clave: {metadatos['nombre_clave']}. Tareas: {len(tareas)}. Pendientes: {hay_tareas_pendientes}.")
-        return metadatos, tareas, hay_tareas_pendientes
-    except Exception as e: logging.error(f"{logPrefix} Excepción: {e}", exc_info=True); return None, [], False
-    
+        os.makedirs(os.path.dirname(ruta_sidecar), exist_ok=True)
+        temporal = ruta_sidecar + ".tmp"
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump({'version': VERSION_SIDECAR, 'huella': mision.huella, 'mision': mision.aDiccionario()},
+                      f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temporal, ruta_sidecar)
+    except OSError as e:
+        log.warning(f"_guardarSidecar: No se pudo guardar el sidecar de la misión en '{ruta_sidecar}': {e}")
+        return
+    with _lock:
+        _estadisticas['sidecars_guardados'] += 1
+        _sidecarsEscritos[ruta_sidecar] = mision.huella
+
+
+def obtenerModeloMision(contenido_mision, ruta_sidecar=None):
+    """
+    MisionOrion del markdown: de memoria o del sidecar si la huella coincide y, si no, parseándolo.
+    Con `ruta_sidecar` el sidecar queda actualizado. None si el markdown no es una misión válida.
+    El modelo devuelto es compartido: no modificarlo (usar comoTupla() para obtener copias).
+    """
+    if not contenido_mision:
+        return None
+    huella = _huella(contenido_mision)
+    with _lock:
+        mision = _memoria.get(huella)
+        if mision is not None:
+            _memoria.move_to_end(huella)
+            _estadisticas['aciertos_memoria'] += 1
+    if mision is None and ruta_sidecar:
+        mision = _leerSidecar(ruta_sidecar, huella)
+    if mision is None:
+        try:
+            mision = _parsearMision(contenido_mision, huella)
+        except Exception as e:
+            log.error(f"obtenerModeloMision: Excepción parseando la misión: {e}", exc_info=True)
+            return None
+        if mision is None:
+            return None
+    _memorizar(mision)
+    if ruta_sidecar and _sidecarsEscritos.get(ruta_sidecar) != huella:
+        _guardarSidecar(ruta_sidecar, mision)
+    return mision
+
+
+def parsear_mision_orion(contenido_mision: str, ruta_sidecar: str = None):
+    """(metadatos, tareas, hay_tareas_pendientes) de la misión; (None, [], False) si no es válida."""
+    mision = obtenerModeloMision(contenido_mision, ruta_sidecar)
+    if mision is None:
+        return None, [], False
+    return mision.comoTupla()
+
+
 def parsear_nombre_clave_de_mision(contenido_mision: str):
     logPrefix = "parsear_nombre_clave_de_mision:"
-    metadatos, _, _ = parsear_mision_orion(contenido_mision)
-    if metadatos and metadatos.get("nombre_clave"): return metadatos["nombre_clave"]
+    mision = obtenerModeloMision(contenido_mision)
+    if mision and mision.metadatos.get("nombre_clave"): return mision.metadatos["nombre_clave"]
     logging.warning(f"{logPrefix} No se pudo parsear nombre clave."); return None
 
-def obtener_proxima_tarea_pendiente(contenido_mision_o_lista_tareas):
-    logPrefix = "obtener_proxima_tarea_pendiente:"
-    MAX_REINTENTOS_FALLA_TEMPORAL = 3  # Número máximo de reintentos para tareas fallidas temporalmente
+def _campoTarea(tarea, campo, defecto=None):
+    if isinstance(tarea, dict):
+        return tarea.get(campo, defecto)
+    return getattr(tarea, campo, defecto)
+
+
+def _normalizarRuta(ruta):
+    ruta = (ruta or "").strip().replace('`', '').replace('\\', '/')
+    return os.path.normpath(ruta).replace('\\', '/').lstrip('/') if ruta else None
+
+
+def _rangosPorArchivo(tarea):
+    """Ruta -> lista de rangos (inicio, fin) de sus bloques objetivo, o None si toca el archivo sin rango."""
+    rangos = {}
+    for bloque in _campoTarea(tarea, "bloques_codigo_objetivo") or []:
+        ruta = _normalizarRuta(bloque.get("archivo"))
+        if not ruta:
+            continue
+        inicio, fin = bloque.get("linea_inicio"), bloque.get("linea_fin")
+        if isinstance(inicio, int) and isinstance(fin, int) and rangos.get(ruta, []) is not None:
+            rangos.setdefault(ruta, []).append((inicio, max(inicio, fin)))
+        else:
+            rangos[ruta] = None
+    for ruta in _campoTarea(tarea, "archivos_implicados_especificos") or []:
+        ruta = _normalizarRuta(ruta)
+        if ruta and ruta not in rangos:
+            rangos[ruta] = None
+    return rangos
+
+
+def _solapan(rangosA, rangosB):
+    if rangosA is None or rangosB is None:
+        return True
+    return any(inicioA <= finB and inicioB <= finA for inicioA, finA in rangosA for inicioB, finB in rangosB)
+
+
+def archivosDeTarea(tarea):
+    """Rutas relativas que la tarea puede modificar (bloques objetivo y archivos implicados)."""
+    return set(_rangosPorArchivo(tarea))
+
+
+def rutasFueraDeTarea(tarea, modificaciones):
+    """Rutas de `modificaciones` (operaciones granulares) que no están en archivosDeTarea(tarea)."""
+    declarados = archivosDeTarea(tarea)
+    fuera = []
+    for operacion in modificaciones or []:
+        ruta = _normalizarRuta(operacion.get("ruta_archivo") if isinstance(operacion, dict) else None)
+        if ruta not in declarados and ruta not in fuera:
+            fuera.append(ruta)
+    return fuera
+
+
+def inferirDependencias(tareas):
+    """
+    Dependencias implícitas por solape: índice -> índices de las tareas declaradas antes que tocan
+    algún archivo en común con rangos de líneas que se cruzan (o sin rango, que cuenta como todo el
+    archivo).
+    """
+    porArchivo = defaultdict(list)  # ruta -> [(índice, rangos)]
+    dependencias = {}
+    for i, tarea in enumerate(tareas):
+        previas = set()
+        for ruta, rangos in _rangosPorArchivo(tarea).items():
+            previas.update(j for j, rangosPrevios in porArchivo[ruta] if _solapan(rangos, rangosPrevios))
+            porArchivo[ruta].append((i, rangos))
+        dependencias[i] = sorted(previas)
+    return dependencias
+
+
+class PlanificadorTareas:
+    """
+    Cola de tareas listas para ejecutar. Acepta tanto TareaMision como los diccionarios de
+    parsear_mision_orion. Mantiene id -> índice y un heap ordenado por (prioridad, orden declarado):
+    primero los reintentos de FALLIDA_TEMPORALMENTE que no agotaron `maxReintentos`, después las
+    PENDIENTE. Una tarea solo entra en la cola cuando todas sus dependencias ('Depende De') están
+    en ESTADOS_RESUELTOS. Con `inferirSolapes` se añaden además las de inferirDependencias(), que solo
+    ordenan: se dan por cumplidas en cuanto la tarea previa ya no vaya a ejecutarse (resuelta,
+    fallida permanentemente o sin reintentos). Cada cambio de estado cuesta O(log n): las entradas
+    que quedan obsoletas en el heap se descartan al llegar a la cima. Las tareas recibidas no se
+    modifican; el estado vigente lo lleva el planificador.
+    """
+
+    def __init__(self, tareas, maxReintentos=None, inferirSolapes=False):
+        logPrefix = "PlanificadorTareas:"
+        self.tareas = tareas
+        self.maxReintentos = settings.MAX_REINTENTOS_TAREA if maxReintentos is None else maxReintentos
+        self._porId = {}
+        self._estados = []  # (estado, intentos) por índice
+        for i, tarea in enumerate(tareas):
+            self._porId.setdefault(_campoTarea(tarea, "id"), i)
+            self._estados.append(((_campoTarea(tarea, "estado") or "").upper(), _campoTarea(tarea, "intentos", 0) or 0))
+        explicitas = []
+        for i, tarea in enumerate(tareas):
+            previas = []
+            for idDependencia in _campoTarea(tarea, "dependencias") or []:
+                j = self._porId.get(idDependencia)
+                if j is None or j == i:
+                    log.warning(f"{logPrefix} Tarea '{_campoTarea(tarea, 'id')}' depende de '{idDependencia}', "
+                                f"que no existe en la misión. Dependencia ignorada.")
+                    continue
+                previas.append(j)
+            explicitas.append(previas)
+        inferidas = inferirDependencias(tareas) if inferirSolapes else {}
+
+        # Grafo combinado: las explícitas y las inferidas aceptadas hasta el momento. Una arista
+        # inferida que cerrase un ciclo en él bloquearía para siempre a todas las tareas del ciclo.
+        grafo = [list(previas) for previas in explicitas]
+        aceptadas = defaultdict(list)
+        for i in range(len(tareas)):
+            for j in inferidas.get(i, ()):
+                if j not in grafo[i] and not self._alcanza(grafo, j, i):
+                    grafo[i].append(j)
+                    aceptadas[i].append(j)
+
+        self._dependientes = defaultdict(list)  # índice -> [(índice dependiente, inferida)]
+        self._faltan = [0] * len(tareas)  # Dependencias sin cumplir por índice
+        for i in range(len(tareas)):
+            aristas = [(j, False) for j in explicitas[i]] + [(j, True) for j in aceptadas[i]]
+            for j, inferida in aristas:
+                self._dependientes[j].append((i, inferida))
+                if not self._cumple(j, inferida):
+                    self._faltan[i] += 1
+        self._versiones = [0] * len(tareas)
+        self._heap = []
+        for i in range(len(tareas)):
+            prioridad = self._prioridad(i)
+            if prioridad is not None:
+                self._heap.append((prioridad, i, 0))
+        heapq.heapify(self._heap)
+
+    @classmethod
+    def desdeMision(cls, mision, maxReintentos=None):
+        """Planificador sobre las tareas del modelo, con el límite de reintentos de la misión si lo fija."""
+        if maxReintentos is None:
+            maxReintentos = mision.metadatos.get("max_reintentos")
+        return cls(mision.tareas, maxReintentos)
+
+    @staticmethod
+    def _alcanza(grafo, origen, destino):
+        """True si `origen` depende (directa o transitivamente en `grafo`) de `destino`."""
+        pendientes, vistos = [origen], {origen}
+        while pendientes:
+            for j in grafo[pendientes.pop()]:
+                if j == destino:
+                    return True
+                if j not in vistos:
+                    vistos.add(j)
+                    pendientes.append(j)
+        return False
+
+    def _ejecutable(self, i):
+        estado, intentos = self._estados[i]
+        return estado == "PENDIENTE" or (estado == "FALLIDA_TEMPORALMENTE" and intentos < self.maxReintentos)
+
+    def _cumple(self, j, inferida):
+        if inferida:
+            return not self._ejecutable(j)
+        return self._estados[j][0] in ESTADOS_RESUELTOS
+
+    def _prioridad(self, i):
+        if self._faltan[i]:
+            return None
+        estado, intentos = self._estados[i]
+        if estado == "FALLIDA_TEMPORALMENTE" and intentos < self.maxReintentos:
+            return 0
+        if estado == "PENDIENTE":
+            return 1
+        return None
 
+    def _reencolar(self, i):
+        self._versiones[i] += 1  # Invalida la entrada anterior de la tarea, si la hay
+        prioridad = self._prioridad(i)
+        if prioridad is not None:
+            heapq.heappush(self._heap, (prioridad, i, self._versiones[i]))
+
+    def siguiente(self):
+        """(tarea, índice) de la próxima tarea lista, sin sacarla de la cola; (None, -1) si no hay."""
+        while self._heap:
+            _, i, version = self._heap[0]
+            if version == self._versiones[i]:
+                return self.tareas[i], i
+            heapq.heappop(self._heap)
+        return None, -1
+
+    def listas(self):
+        """Todas las tareas listas ahora mismo, en el orden en que siguiente() las devolvería."""
+        return [(self.tareas[i], i) for _, i, version in sorted(self._heap) if version == self._versiones[i]]
+
+    def lote(self, maxTareas):
+        """
+        Hasta `maxTareas` tareas listas que pueden ejecutarse a la vez, en orden de cola y sin archivos
+        en común: las operaciones granulares van por número de línea, así que dos tareas sobre el mismo
+        archivo no pueden prepararse desde el mismo contenido. Una tarea sin archivos conocidos va sola.
+        """
+        elegidas, ocupados = [], set()
+        for tarea, i in self.listas():
+            if len(elegidas) >= maxTareas:
+                break
+            archivos = archivosDeTarea(tarea)
+            if not archivos:
+                if not elegidas:
+                    elegidas.append((tarea, i))
+                break
+            if not archivos & ocupados:
+                elegidas.append((tarea, i))
+            # Aunque se salte, sus archivos quedan ocupados para no adelantarla con una tarea posterior
+            ocupados |= archivos
+        return elegidas
+
+    def bloqueadas(self):
+        """IDs de las tareas pendientes o reintentables que esperan a alguna dependencia."""
+        return [_campoTarea(t, "id") for i, t in enumerate(self.tareas)
+                if self._faltan[i] and self._estados[i][0] in ("PENDIENTE", "FALLIDA_TEMPORALMENTE")]
+
+    def estadoDe(self, idTarea):
+        i = self._porId.get(idTarea)
+        return self._estados[i] if i is not None else None
+
+    def actualizarEstado(self, idTarea, estado, intentos=None):
+        """Registra el nuevo estado (y opcionalmente intentos) de una tarea. False si el ID no existe."""
+        i = self._porId.get(idTarea)
+        if i is None:
+            log.warning(f"PlanificadorTareas.actualizarEstado: Tarea ID '{idTarea}' no encontrada.")
+            return False
+        antes = (self._cumple(i, False), self._cumple(i, True))
+        self._estados[i] = (estado.upper(), self._estados[i][1] if intentos is None else intentos)
+        despues = (self._cumple(i, False), self._cumple(i, True))
+        self._reencolar(i)
+        if antes != despues:
+            for j, inferida in self._dependientes[i]:
+                if antes[inferida] != despues[inferida]:
+                    self._faltan[j] += -1 if despues[inferida] else 1
+                    self._reencolar(j)
+        return True
+
+
+def obtener_proxima_tarea_pendiente(contenido_mision_o_lista_tareas, max_reintentos=None):
+    logPrefix = "obtener_proxima_tarea_pendiente:"
     lista_tareas = []
     if isinstance(contenido_mision_o_lista_tareas, str):
-        _, lista_tareas, _ = parsear_mision_orion(contenido_mision_o_lista_tareas)
+        metadatos, lista_tareas, _ = parsear_mision_orion(contenido_mision_o_lista_tareas)
+        if max_reintentos is None and metadatos:
+            max_reintentos = metadatos.get("max_reintentos")
     elif isinstance(contenido_mision_o_lista_tareas, list):
         lista_tareas = contenido_mision_o_lista_tareas
     else:
@@ -303,110 +700,111 @@ def obtener_proxima_tarea_pendiente(contenido_mision_o_lista_tareas):
         logging.error(f"{logPrefix} Lista de tareas es None (posiblemente por error de parseo previo).")
         return None, -1
 
-    # Primera pasada: Buscar tareas FALLIDA_TEMPORALMENTE con reintentos pendientes
-    for i, tarea in enumerate(lista_tareas):
-        if isinstance(tarea, dict) and tarea.get("estado", "").upper() == "FALLIDA_TEMPORALMENTE":
-            intentos_realizados = tarea.get("intentos", 0)
-            if intentos_realizados < MAX_REINTENTOS_FALLA_TEMPORAL:
-                logging.info(f"{logPrefix} Próxima tarea (REINTENTO): ID '{tarea.get('id', 'N/A')}' - Título: '{tarea.get('titulo', 'N/A')}' (Intentos: {intentos_realizados}/{MAX_REINTENTOS_FALLA_TEMPORAL})")
-                return tarea, i
+    planificador = PlanificadorTareas(lista_tareas, max_reintentos)
+    tarea, i = planificador.siguiente()
+    if tarea is None:
+        bloqueadas = planificador.bloqueadas()
+        if bloqueadas:
+            logging.warning(f"{logPrefix} Tareas bloqueadas por dependencias sin completar: {bloqueadas}")
+        logging.info(f"{logPrefix} No hay más tareas elegibles (FALLIDA_TEMPORALMENTE con reintentos o PENDIENTE).")
+        return None, -1
+    intentos = _campoTarea(tarea, "intentos", 0)
+    if (_campoTarea(tarea, "estado") or "").upper() == "FALLIDA_TEMPORALMENTE":
+        logging.info(f"{logPrefix} Próxima tarea (REINTENTO): ID '{_campoTarea(tarea, 'id', 'N/A')}' - Título: '{_campoTarea(tarea, 'titulo', 'N/A')}' (Intentos: {intentos}/{planificador.maxReintentos})")
+    else:
+        logging.info(f"{logPrefix} Próxima tarea (PENDIENTE): ID '{_campoTarea(tarea, 'id', 'N/A')}' - Título: '{_campoTarea(tarea, 'titulo', 'N/A')}'")
+    return tarea, i
+
+def actualizar_estados_tareas(contenido_mision_md: str, estados_por_tarea: dict, incrementar_intentos_si_fallida_temp: bool = False):
+    """
+    Cambia el Estado de varias tareas ({id_tarea: nuevo_estado}) en una sola llamada y, si se pide,
+    suma un intento a las que pasan a FALLIDA_TEMPORALMENTE, parcheando directamente las posiciones
+    registradas en el modelo. Devuelve (markdown_nuevo, MisionOrion actualizada); (None, None) si los
+    argumentos no son válidos, y el contenido original con su modelo si no se pudo cambiar ninguna.
+    """
+    logPrefix = "actualizar_estados_tareas:"
+    if not contenido_mision_md or not estados_por_tarea:
+        log.error(f"{logPrefix} Faltan argumentos: contenido de la misión o estados a aplicar.")
+        return None, None
+    estados = {}
+    for id_tarea, nuevo_estado in estados_por_tarea.items():
+        if not id_tarea or (nuevo_estado or "").upper() not in ESTADOS_TAREA:
+            log.error(f"{logPrefix} Tarea '{id_tarea}' con estado '{nuevo_estado}' no válido. Permitidos: {list(ESTADOS_TAREA)}")
+            return None, None
+        estados[id_tarea] = nuevo_estado.upper()
+
+    mision = obtenerModeloMision(contenido_mision_md)
+    if not mision or not mision.tareas:
+        log.warning(f"{logPrefix} No se parsearon tareas del contenido original. Devolviendo original.")
+        return contenido_mision_md, mision
+
+    parches = []  # (inicio, fin, texto nuevo) en el markdown original
+    cambiosPorIndice = {}  # índice de tarea -> (estado, intentos)
+    for id_tarea, nuevo_estado in estados.items():
+        indice = next((i for i, t in enumerate(mision.tareas) if t.id == id_tarea), None)
+        tarea = mision.tareas[indice] if indice is not None else None
+        if tarea is None or tarea.pos_estado is None:
+            log.warning(f"{logPrefix} Tarea ID '{id_tarea}' no encontrada o sin línea de 'Estado:'. No se modifica.")
+            continue
+        parches.append((tarea.pos_estado[0], tarea.pos_estado[1], nuevo_estado))
+        intentos = tarea.intentos
+        if incrementar_intentos_si_fallida_temp and nuevo_estado == "FALLIDA_TEMPORALMENTE":
+            if tarea.pos_intentos is not None:
+                intentos += 1
+                parches.append((tarea.pos_intentos[0], tarea.pos_intentos[1], str(intentos)))
             else:
-                logging.info(f"{logPrefix} Tarea FALLIDA_TEMPORALMENTE ID '{tarea.get('id', 'N/A')}' ha alcanzado el límite de reintentos ({intentos_realizados}/{MAX_REINTENTOS_FALLA_TEMPORAL}). Se omite.")
-
-    # Segunda pasada: Buscar tareas PENDIENTE
-    for i, tarea in enumerate(lista_tareas):
-        if isinstance(tarea, dict) and tarea.get("estado", "").upper() == "PENDIENTE":
-            logging.info(f"{logPrefix} Próxima tarea (PENDIENTE): ID '{tarea.get('id', 'N/A')}' - Título: '{tarea.get('titulo', 'N/A')}'")
-            return tarea, i
+                log.warning(f"{logPrefix} No se encontró línea de '- **Intentos:**' para Tarea ID '{id_tarea}'. "
+                            f"Intentos no actualizados en el Markdown, aunque el valor parseado era {tarea.intentos}.")
+        cambiosPorIndice[indice] = (nuevo_estado, intentos)
+        log.info(f"{logPrefix} Tarea ID '{id_tarea}': Estado '{tarea.estado}' -> '{nuevo_estado}', Intentos {intentos}.")
+    if not parches:
+        return contenido_mision_md, mision
+
+    parches.sort()
+    piezas, anterior = [], 0
+    desplazamientos = [0]  # desplazamientos[k]: suma de lo que crecen los k primeros parches
+    for inicio, fin, texto in parches:
+        piezas.append(contenido_mision_md[anterior:inicio])
+        piezas.append(texto)
+        anterior = fin
+        desplazamientos.append(desplazamientos[-1] + len(texto) - (fin - inicio))
+    piezas.append(contenido_mision_md[anterior:])
+    contenido_nuevo = "".join(piezas)
+
+    # Mismas líneas en el mismo orden: se copia el modelo y solo se mueven los offsets
+    inicios = [p[0] for p in parches]
+
+    def desplazar(pos):
+        if pos is None:
+            return None
+        k = bisect.bisect_left(inicios, pos[0])
+        if k < len(parches) and inicios[k] == pos[0]:  # Es el propio valor parcheado
+            nuevoInicio = pos[0] + desplazamientos[k]
+            return [nuevoInicio, nuevoInicio + len(parches[k][2])]
+        return [pos[0] + desplazamientos[k], pos[1] + desplazamientos[k]]
+
+    actualizada = MisionOrion.desdeDiccionario(mision.aDiccionario())
+    for indice, tarea in enumerate(actualizada.tareas):
+        tarea.pos_estado = desplazar(tarea.pos_estado)
+        tarea.pos_intentos = desplazar(tarea.pos_intentos)
+        if indice in cambiosPorIndice:
+            tarea.estado, tarea.intentos = cambiosPorIndice[indice]
+    actualizada.huella = _huella(contenido_nuevo)
+    _memorizar(actualizada)
+    return contenido_nuevo, actualizada
 
-    logging.info(f"{logPrefix} No hay más tareas elegibles (FALLIDA_TEMPORALMENTE con reintentos o PENDIENTE).")
-    return None, -1
 
 def marcar_tarea_como_completada(contenido_mision_md_original: str, id_tarea_a_marcar: str, nuevo_estado: str = "COMPLETADA", incrementar_intentos_si_fallida_temp: bool = False):
     logPrefix = "marcar_tarea_como_completada:"
     if not contenido_mision_md_original or not id_tarea_a_marcar:
         logging.error(f"{logPrefix} Faltan argumentos: contenido_mision_md_original o id_tarea_a_marcar.")
         return None
-    
-    nuevo_estado_valido = nuevo_estado.upper()
-    estados_permitidos = ["COMPLETADA", "SALTADA", "PENDIENTE", "FALLIDA_TEMPORALMENTE", "FALLIDA_PERMANENTEMENTE"] # Añadido FALLIDA_PERMANENTEMENTE
-    if nuevo_estado_valido not in estados_permitidos:
-        logging.error(f"{logPrefix} Estado '{nuevo_estado}' no válido. Permitidos: {estados_permitidos}")
-        return None
-    
-    _, tareas_originales, _ = parsear_mision_orion(contenido_mision_md_original)
-    if not tareas_originales:
-        logging.warning(f"{logPrefix} No se parsearon tareas del contenido original. Devolviendo original.")
-        return contenido_mision_md_original # O None si es mejor un error duro
-    
-    lineas_originales = list(contenido_mision_md_original.splitlines())
-    tarea_encontrada_y_modificada = False
-
-    for tarea_dict in tareas_originales:
-        if tarea_dict and tarea_dict.get("id") == id_tarea_a_marcar:
-            line_start_abs = tarea_dict.get("line_start_index", -1) # Índice absoluto en lineas_originales
-            # raw_lines son las líneas originales de la tarea, tal cual están en el MD
-            raw_lines_tarea = tarea_dict.get("raw_lines", []) 
-            if not (0 <= line_start_abs < len(lineas_originales)) or not raw_lines_tarea:
-                logging.error(f"{logPrefix} Índices inválidos o raw_lines vacías para tarea ID '{id_tarea_a_marcar}'. Start: {line_start_abs}, Len Raw: {len(raw_lines_tarea)}")
-                continue
+    contenido_nuevo, _ = actualizar_estados_tareas(
+        contenido_mision_md_original, {id_tarea_a_marcar: nuevo_estado}, incrementar_intentos_si_fallida_temp)
+    return contenido_nuevo
 
-            # --- Modificar Estado ---
-            estado_line_idx_rel = -1 # Relativo al inicio de raw_lines_tarea
-            for idx_rel, linea_tarea_raw in enumerate(raw_lines_tarea):
-                if re.match(r"-\s*\*\*Estado:\*\*", linea_tarea_raw, re.I):
-                    estado_line_idx_rel = idx_rel
-                    break
-            
-            if estado_line_idx_rel != -1:
-                estado_line_idx_abs = line_start_abs + estado_line_idx_rel
-                linea_estado_antigua = lineas_originales[estado_line_idx_abs]
-                match_prefijo = re.match(r"(.*-\s*\*\*Estado:\*\*\s*)(?:[A-Z_]+)(.*)", linea_estado_antigua, re.IGNORECASE)
-                if match_prefijo:
-                    prefijo_estado = match_prefijo.group(1)
-                    sufijo_estado = match_prefijo.group(2)
-                    lineas_originales[estado_line_idx_abs] = f"{prefijo_estado}{nuevo_estado_valido}{sufijo_estado}"
-                    logging.info(f"{logPrefix} Estado de Tarea ID '{id_tarea_a_marcar}' actualizado a '{nuevo_estado_valido}' en línea {estado_line_idx_abs + 1}.")
-                    tarea_encontrada_y_modificada = True # Marcar que al menos el estado se intentó/modificó
-                else:
-                    logging.warning(f"{logPrefix} No se pudo parsear prefijo/sufijo de estado para Tarea ID '{id_tarea_a_marcar}'. Reemplazo simple.")
-                    lineas_originales[estado_line_idx_abs] = re.sub(r"(PENDIENTE|COMPLETADA|SALTADA|FALLIDA_TEMPORALMENTE|FALLIDA_PERMANENTEMENTE)", nuevo_estado_valido, linea_estado_antigua, flags=re.IGNORECASE)
-                    tarea_encontrada_y_modificada = True
-            else:
-                logging.warning(f"{logPrefix} No se encontró línea de 'Estado:' para tarea ID '{id_tarea_a_marcar}'. Estado no modificado.")
-
-            # --- Modificar Intentos si aplica ---
-            if incrementar_intentos_si_fallida_temp and nuevo_estado_valido == "FALLIDA_TEMPORALMENTE":
-                intentos_line_idx_rel = -1
-                intentos_actuales = tarea_dict.get("intentos", 0) # Tomar de la tarea parseada
-
-                for idx_rel, linea_tarea_raw in enumerate(raw_lines_tarea):
-                    if re.match(r"-\s*\*\*Intentos:\*\*", linea_tarea_raw, re.I):
-                        intentos_line_idx_rel = idx_rel
-                        break
-                
-                nuevos_intentos = intentos_actuales + 1
-                if intentos_line_idx_rel != -1:
-                    intentos_line_idx_abs = line_start_abs + intentos_line_idx_rel
-                    linea_intentos_antigua = lineas_originales[intentos_line_idx_abs]
-                    match_prefijo_intentos = re.match(r"(.*-\s*\*\*Intentos:\*\*\s*)(\d+)(.*)", linea_intentos_antigua, re.IGNORECASE)
-                    if match_prefijo_intentos:
-                        prefijo_intentos = match_prefijo_intentos.group(1)
-                        sufijo_intentos = match_prefijo_intentos.group(3)
-                        lineas_originales[intentos_line_idx_abs] = f"{prefijo_intentos}{nuevos_intentos}{sufijo_intentos}"
-                        logging.info(f"{logPrefix} Intentos para Tarea ID '{id_tarea_a_marcar}' incrementados a {nuevos_intentos} en línea {intentos_line_idx_abs + 1}.")
-                    else:
-                        logging.warning(f"{logPrefix} No se pudo parsear prefijo/sufijo de intentos para Tarea ID '{id_tarea_a_marcar}'. Intentos no modificados en MD directamente.")
-                else: # Si no existe la línea de Intentos, pero tenemos la tarea parseada, es raro.
-                      # Podríamos considerar añadirla, pero es más seguro asumir que el formato está.
-                    logging.warning(f"{logPrefix} No se encontró línea de '- **Intentos:**' para Tarea ID '{id_tarea_a_marcar}'. Intentos no actualizados en el Markdown, aunque el valor parseado era {intentos_actuales}.")
-            
-            if tarea_encontrada_y_modificada: # Si se modificó algo (al menos el estado)
-                break # Salir del bucle de tareas_originales, ya encontramos y procesamos la tarea.
-    
-    if not tarea_encontrada_y_modificada:
-        logging.warning(f"{logPrefix} Tarea ID '{id_tarea_a_marcar}' no encontrada o no modificada. Devolviendo contenido original.")
-        return contenido_mision_md_original # o None, si es un error que deba detener el flujo
-        
-    return "\n".join(lineas_originales)
 
+def obtenerEstadisticas():
+    """Parseos completos frente a modelos servidos desde memoria o desde el sidecar."""
+    with _lock:
+        return dict(_estadisticas)
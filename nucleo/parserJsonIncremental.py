@@ -0,0 +1,118 @@
+# nucleo/parserJsonIncremental.py
+import json
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class RespuestaMalformadaError(ValueError):
+    """La respuesta en streaming ya no puede ser un JSON válido; conviene abortar la generación."""
+
+
+class ParserListaIncremental:
+    """
+    Parser incremental para respuestas JSON del tipo {"<clave_lista>": [ {...}, {...} ], ...}.
+
+    Se alimenta con fragmentos de texto tal como llegan del streaming y devuelve cada objeto
+    de la lista en cuanto su '}' de cierre ha llegado, sin esperar al resto de la respuesta.
+    Ignora cualquier texto previo a la primera '{' (p.ej. vallas ```json).
+    """
+
+    def __init__(self, clave_lista="modificaciones"):
+        self.clave_lista = clave_lista
+        self._buffer = ""
+        self._pos = 0
+        self._profundidad = 0
+        self._enCadena = False
+        self._escape = False
+        self._inicioCadena = -1
+        self._ultimaCadenaNivel1 = None
+        self._ultimoSignificativo = None
+        self._enLista = False
+        self._inicioElemento = -1
+        self.lista_cerrada = False
+        self.elementos_emitidos = 0
+
+    def alimentar(self, fragmento: str) -> list:
+        """Añade un fragmento y devuelve la lista de objetos completados con él (puede ser vacía)."""
+        if not fragmento:
+            return []
+        self._buffer += fragmento
+        completados = []
+        buf = self._buffer
+        i = self._pos
+        n = len(buf)
+        while i < n:
+            c = buf[i]
+            if self._enCadena:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._enCadena = False
+                    if self._profundidad == 1:
+                        self._ultimaCadenaNivel1 = buf[self._inicioCadena + 1:i]
+                    self._ultimoSignificativo = '"'
+                i += 1
+                continue
+
+            if self._profundidad == 0:
+                # Antes del objeto raíz (o después): solo interesa la primera '{'.
+                if c == '{' and not self.lista_cerrada:
+                    self._profundidad = 1
+                    self._ultimoSignificativo = c
+                i += 1
+                continue
+
+            if c == '"':
+                if self._enLista and self._profundidad == 2:
+                    raise RespuestaMalformadaError(
+                        f"Elemento no-objeto en '{self.clave_lista}' (posición {i}).")
+                self._enCadena = True
+                self._inicioCadena = i
+            elif c in '{[':
+                if self._enLista and self._profundidad == 2:
+                    if c != '{':
+                        raise RespuestaMalformadaError(
+                            f"Elemento no-objeto en '{self.clave_lista}' (posición {i}).")
+                    self._inicioElemento = i
+                elif (c == '[' and self._profundidad == 1 and not self._enLista
+                      and self._ultimoSignificativo == ':'
+                      and self._ultimaCadenaNivel1 == self.clave_lista):
+                    self._enLista = True
+                self._profundidad += 1
+            elif c in '}]':
+                self._profundidad -= 1
+                if self._profundidad < 0:
+                    raise RespuestaMalformadaError(f"Cierre sin apertura en la posición {i}.")
+                if self._enLista and self._profundidad == 2 and c == '}':
+                    completados.append(self._parsearElemento(buf[self._inicioElemento:i + 1]))
+                    self._inicioElemento = -1
+                elif self._enLista and self._profundidad == 1:
+                    if c != ']':
+                        raise RespuestaMalformadaError(
+                            f"'{self.clave_lista}' cerrada con '{c}' en la posición {i}.")
+                    self._enLista = False
+                    self.lista_cerrada = True
+            elif self._enLista and self._profundidad == 2 and not c.isspace() and c != ',':
+                raise RespuestaMalformadaError(
+                    f"Carácter inesperado '{c}' entre elementos de '{self.clave_lista}' (posición {i}).")
+            if not c.isspace():
+                self._ultimoSignificativo = c
+            i += 1
+        self._pos = i
+        return completados
+
+    def _parsearElemento(self, texto):
+        try:
+            elemento = json.loads(texto)
+        except json.JSONDecodeError as e:
+            raise RespuestaMalformadaError(
+                f"Elemento #{self.elementos_emitidos + 1} de '{self.clave_lista}' no es JSON válido: {e}") from e
+        self.elementos_emitidos += 1
+        return elemento
+
+    def texto_completo(self) -> str:
+        """Texto acumulado hasta el momento."""
+        return self._buffer
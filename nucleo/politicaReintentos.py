@@ -0,0 +1,178 @@
+# nucleo/politicaReintentos.py
+import time
+import random
+import asyncio
+import logging
+import threading
+import email.utils
+import google.api_core.exceptions
+import openai
+from config import settings
+
+log = logging.getLogger(__name__)
+
+# Política de reintentos para las llamadas a la IA.
+# Ante errores transitorios (503, 429, timeouts, cortes de conexión) se reintenta con backoff
+# exponencial con jitter, respetando el Retry-After que indique la API y sin pasarse del plazo
+# de la fase (ligado a SCRIPT_EXECUTION_TIMEOUT_SECONDS). Si se agotan los reintentos y el
+# failover está activado, se prueba con el otro proveedor (google <-> openrouter).
+
+MARGEN_FIN_FASE_SEGUNDOS = 30  # Tiempo que se deja libre al final de la fase para guardar estado
+
+_ERRORES_TRANSITORIOS = (
+    google.api_core.exceptions.ServiceUnavailable,
+    google.api_core.exceptions.ResourceExhausted,
+    google.api_core.exceptions.TooManyRequests,
+    google.api_core.exceptions.DeadlineExceeded,
+    google.api_core.exceptions.InternalServerError,
+    google.api_core.exceptions.BadGateway,
+    google.api_core.exceptions.GatewayTimeout,
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    asyncio.TimeoutError,
+    ConnectionError,
+)
+
+_lock = threading.Lock()
+_limiteFase = None  # time.monotonic() en que vence la fase actual
+_estadisticas = {'reintentos': 0, 'failovers': 0, 'exitos_tras_reintento': 0,
+                 'abandonos_por_plazo': 0, 'errores_no_transitorios': 0}
+
+
+def iniciarFase(segundos=None):
+    """Fija el plazo de la fase actual (por defecto SCRIPT_EXECUTION_TIMEOUT_SECONDS desde ahora)."""
+    global _limiteFase
+    segundos = settings.SCRIPT_EXECUTION_TIMEOUT_SECONDS if segundos is None else segundos
+    with _lock:
+        _limiteFase = time.monotonic() + segundos
+    log.debug(f"iniciarFase: Plazo de la fase para reintentos IA: {segundos}s.")
+
+
+def segundosRestantesFase():
+    """Segundos que le quedan a la fase (descontado el margen final), o None si no hay plazo fijado."""
+    with _lock:
+        if _limiteFase is None:
+            return None
+        return _limiteFase - MARGEN_FIN_FASE_SEGUNDOS - time.monotonic()
+
+
+def esErrorTransitorio(e):
+    """True si merece la pena reintentar la llamada que lanzó `e`."""
+    if isinstance(e, _ERRORES_TRANSITORIOS):
+        return True
+    # 408/409/5xx que la librería de OpenAI no tipa por separado
+    codigo = getattr(e, 'status_code', None)
+    return isinstance(e, openai.APIStatusError) and (codigo in (408, 409) or (codigo or 0) >= 500)
+
+
+def extraerRetryAfter(e):
+    """Segundos de espera que pide la API (cabecera Retry-After o RetryInfo de Gemini), o None."""
+    respuesta = getattr(e, 'response', None)
+    cabeceras = getattr(respuesta, 'headers', None)
+    if cabeceras:
+        try:
+            valorMs = cabeceras.get('retry-after-ms')
+            if valorMs:
+                return float(valorMs) / 1000
+            valor = cabeceras.get('retry-after')
+            if valor:
+                try:
+                    return float(valor)
+                except ValueError:
+                    fecha = email.utils.parsedate_to_datetime(valor)
+                    return max(0.0, fecha.timestamp() - time.time())
+        except (TypeError, ValueError, AttributeError):
+            pass
+    for detalle in getattr(e, 'details', None) or []:
+        retraso = getattr(detalle, 'retry_delay', None)
+        if retraso is not None:
+            return retraso.seconds + retraso.nanos / 1e9
+    return None
+
+
+def calcularEspera(intento, retryAfter=None):
+    """Backoff exponencial con jitter completo; nunca por debajo del Retry-After indicado."""
+    techo = min(settings.IA_BACKOFF_MAX_SEGUNDOS, settings.IA_BACKOFF_BASE_SEGUNDOS * (2 ** intento))
+    espera = random.uniform(0, techo)
+    if retryAfter is not None:
+        espera = max(espera, min(retryAfter, settings.IA_BACKOFF_MAX_SEGUNDOS))
+    return espera
+
+
+def proveedoresAlternativos(api_provider):
+    """Proveedores a los que se puede hacer failover desde `api_provider` (vacío si está desactivado)."""
+    if not settings.IA_FAILOVER_HABILITADO:
+        return []
+    if api_provider == 'google' and settings.OPENROUTER_API_KEYS:
+        return ['openrouter']
+    if api_provider == 'openrouter' and settings.GEMINI_API_KEYS:
+        return ['google']
+    return []
+
+
+async def ejecutarConReintentos(llamada, proveedores, logPrefix, timeoutLlamada, puedeReintentar=None):
+    """
+    Ejecuta `await llamada(api_provider, timeout)` probando los `proveedores` en orden, con hasta
+    IA_MAX_REINTENTOS reintentos cada uno ante errores transitorios. `puedeReintentar()` permite
+    vetar el reintento (p.ej. si ya se entregaron fragmentos de un streaming). Si no hay éxito
+    se relanza la última excepción.
+    """
+    ultimoError = None
+    for posicion, api_provider in enumerate(proveedores):
+        if posicion > 0:
+            with _lock:
+                _estadisticas['failovers'] += 1
+            log.warning(f"{logPrefix} Failover al proveedor '{api_provider}' tras agotar reintentos.")
+        for intento in range(settings.IA_MAX_REINTENTOS + 1):
+            restantes = segundosRestantesFase()
+            if restantes is not None and restantes <= 0:
+                with _lock:
+                    _estadisticas['abandonos_por_plazo'] += 1
+                log.error(f"{logPrefix} Plazo de la fase agotado; no se lanzan más llamadas a la IA.")
+                if ultimoError:
+                    raise ultimoError
+                raise TimeoutError("Plazo de la fase agotado antes de llamar a la IA.")
+            timeout = timeoutLlamada if restantes is None else max(1, min(timeoutLlamada, restantes))
+            try:
+                resultado = await llamada(api_provider, timeout)
+                if intento > 0 or posicion > 0:
+                    with _lock:
+                        _estadisticas['exitos_tras_reintento'] += 1
+                return resultado
+            except Exception as e:
+                ultimoError = e
+                if not esErrorTransitorio(e):
+                    with _lock:
+                        _estadisticas['errores_no_transitorios'] += 1
+                    raise
+                if puedeReintentar is not None and not puedeReintentar():
+                    log.warning(f"{logPrefix} Error transitorio sin reintento posible: {type(e).__name__} - {e}")
+                    raise
+                if intento >= settings.IA_MAX_REINTENTOS:
+                    log.warning(
+                        f"{logPrefix} Reintentos agotados con '{api_provider}': {type(e).__name__} - {e}")
+                    break
+                espera = calcularEspera(intento, extraerRetryAfter(e))
+                restantes = segundosRestantesFase()
+                if restantes is not None and espera >= restantes:
+                    with _lock:
+                        _estadisticas['abandonos_por_plazo'] += 1
+                    log.error(
+                        f"{logPrefix} La espera de reintento ({espera:.1f}s) supera el plazo de la fase "
+                        f"({max(0, restantes):.0f}s); se abandona.")
+                    raise
+                with _lock:
+                    _estadisticas['reintentos'] += 1
+                log.warning(
+                    f"{logPrefix} Error transitorio con '{api_provider}' ({type(e).__name__}: {e}). "
+                    f"Reintento {intento + 1}/{settings.IA_MAX_REINTENTOS} en {espera:.1f}s.")
+                await asyncio.sleep(espera)
+    raise ultimoError
+
+
+def obtenerEstadisticas():
+    """Contadores de reintentos, failovers y abandonos por plazo."""
+    with _lock:
+        return dict(_estadisticas)
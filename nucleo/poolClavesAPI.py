@@ -0,0 +1,156 @@
+# nucleo/poolClavesAPI.py
+import time
+import logging
+import threading
+from collections import deque
+from config import settings
+
+log = logging.getLogger(__name__)
+
+# Pool de claves API por proveedor.
+# settings.py elige una clave al importar (rotación por fichero de estado); este pool guarda
+# todas las claves configuradas y, en cada petición, elige la sana con menos tokens usados en
+# el último minuto. Tras un error de cuota la clave entra en enfriamiento y se deja de elegir.
+
+VENTANA_SEGUNDOS = 60
+
+
+class PoolClavesAPI:
+    """Conjunto de claves de un proveedor con uso por minuto (TPM) y enfriamientos."""
+
+    def __init__(self, proveedor, claves):
+        self.proveedor = proveedor
+        self._lock = threading.Lock()
+        self._claves = [{
+            'indice': i,
+            'clave': clave,
+            'uso': deque(),  # (instante, tokens)
+            'tokens_ventana': 0,
+            'enfriamiento_hasta': 0.0,
+            'ultimo_uso': 0.0,
+            'llamadas': 0,
+            'errores_cuota': 0,
+            'errores_permiso': 0,
+        } for i, clave in enumerate(claves)]
+
+    def __len__(self):
+        return len(self._claves)
+
+    def _buscar(self, clave):
+        for entrada in self._claves:
+            if entrada['clave'] == clave:
+                return entrada
+        return None
+
+    def _purgarVentana(self, entrada, ahora):
+        uso = entrada['uso']
+        while uso and uso[0][0] <= ahora - VENTANA_SEGUNDOS:
+            entrada['tokens_ventana'] -= uso.popleft()[1]
+
+    def seleccionar(self, tokensEstimados=0):
+        """
+        Devuelve la clave sana con menos tokens en el último minuto (desempate: la usada hace más tiempo)
+        y le reserva `tokensEstimados`. Si todas están en enfriamiento devuelve la que sale antes de él.
+        Devuelve None si el pool está vacío.
+        """
+        logPrefix = f"PoolClavesAPI.seleccionar({self.proveedor}):"
+        if not self._claves:
+            return None
+        ahora = time.monotonic()
+        with self._lock:
+            for entrada in self._claves:
+                self._purgarVentana(entrada, ahora)
+            sanas = [e for e in self._claves if e['enfriamiento_hasta'] <= ahora]
+            if sanas:
+                elegida = min(sanas, key=lambda e: (e['tokens_ventana'], e['ultimo_uso']))
+            else:
+                elegida = min(self._claves, key=lambda e: e['enfriamiento_hasta'])
+                log.warning(
+                    f"{logPrefix} Todas las claves están en enfriamiento; se usa la índice {elegida['indice']} "
+                    f"(libre en {elegida['enfriamiento_hasta'] - ahora:.0f}s).")
+            if tokensEstimados > 0:
+                elegida['uso'].append((ahora, tokensEstimados))
+                elegida['tokens_ventana'] += tokensEstimados
+            elegida['ultimo_uso'] = ahora
+            elegida['llamadas'] += 1
+            return elegida['clave']
+
+    def registrarUso(self, clave, tokensReales, tokensReservados=0):
+        """Corrige la reserva hecha en seleccionar() con los tokens que reportó la API."""
+        if not isinstance(tokensReales, int) or tokensReales <= 0:
+            return
+        diferencia = tokensReales - (tokensReservados or 0)
+        if diferencia == 0:
+            return
+        with self._lock:
+            entrada = self._buscar(clave)
+            if entrada is None:
+                return
+            entrada['uso'].append((time.monotonic(), diferencia))
+            entrada['tokens_ventana'] += diferencia
+
+    def marcarCuotaAgotada(self, clave, segundos=None):
+        """Pone la clave en enfriamiento tras un error de cuota (ResourceExhausted / 429)."""
+        self._enfriar(clave, segundos or settings.API_KEY_ENFRIAMIENTO_SEGUNDOS, 'errores_cuota')
+
+    def marcarRechazada(self, clave):
+        """Pone la clave en un enfriamiento largo tras un error de permiso/autenticación."""
+        self._enfriar(clave, settings.API_KEY_ENFRIAMIENTO_INVALIDA_SEGUNDOS, 'errores_permiso')
+
+    def _enfriar(self, clave, segundos, contador):
+        with self._lock:
+            entrada = self._buscar(clave)
+            if entrada is None:
+                return
+            entrada['enfriamiento_hasta'] = max(entrada['enfriamiento_hasta'], time.monotonic() + segundos)
+            entrada[contador] += 1
+            indice = entrada['indice']
+        log.warning(
+            f"PoolClavesAPI._enfriar({self.proveedor}): Clave índice {indice} (...{clave[-4:]}) "
+            f"en enfriamiento {segundos}s ({contador}).")
+
+    def obtenerEstadisticas(self):
+        """Uso por clave: tokens en el último minuto, llamadas, errores y segundos de enfriamiento restantes."""
+        ahora = time.monotonic()
+        with self._lock:
+            resultado = []
+            for entrada in self._claves:
+                self._purgarVentana(entrada, ahora)
+                resultado.append({
+                    'indice': entrada['indice'],
+                    'clave': f"...{entrada['clave'][-4:]}",
+                    'tokens_ultimo_minuto': entrada['tokens_ventana'],
+                    'llamadas': entrada['llamadas'],
+                    'errores_cuota': entrada['errores_cuota'],
+                    'errores_permiso': entrada['errores_permiso'],
+                    'enfriamiento_restante': max(0, round(entrada['enfriamiento_hasta'] - ahora, 1)),
+                })
+            return resultado
+
+
+_lockPools = threading.Lock()
+_pools = {}
+
+
+def obtenerPool(api_provider):
+    """Devuelve el pool de claves del proveedor ('google' u 'openrouter'), creándolo la primera vez."""
+    with _lockPools:
+        pool = _pools.get(api_provider)
+        if pool is None:
+            if api_provider == 'google':
+                claves = settings.GEMINI_API_KEYS
+            elif api_provider == 'openrouter':
+                claves = settings.OPENROUTER_API_KEYS
+            else:
+                claves = []
+            pool = PoolClavesAPI(api_provider, claves)
+            _pools[api_provider] = pool
+            log.info(f"obtenerPool: Pool de claves '{api_provider}' creado con {len(pool)} clave(s).")
+        return pool
+
+
+def obtenerEstadisticas():
+    """Estadísticas de todos los pools creados, por proveedor."""
+    with _lockPools:
+        pools = dict(_pools)
+    return {proveedor: pool.obtenerEstadisticas() for proveedor, pool in pools.items()}
@@ -0,0 +1,337 @@
+# nucleo/proveedoresIA.py
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager
+import google.api_core.exceptions
+import google.generativeai.types as types
+import openai
+from config import settings
+from nucleo import clientesIA
+from nucleo import estimadorTokens
+from nucleo import poolClavesAPI
+
+log = logging.getLogger(__name__)
+
+# Capa asíncrona de proveedores de IA (Gemini y OpenRouter).
+# Todas las llamadas corren en un único bucle de eventos en un hilo de fondo, de modo que
+# el código síncrono (principal.py, analizadorCodigo) puede usarlas con ejecutarSincrono()
+# y varios hilos u orquestadores asíncronos pueden tener llamadas en vuelo a la vez.
+# La concurrencia se limita con un semáforo global y otro por proveedor.
+
+_lockBucle = threading.Lock()
+_bucle = None
+_hiloBucle = None
+_semaforoGlobal = None
+_semaforosProveedor = {}
+_lockEstadisticas = threading.Lock()
+_estadisticas = {'llamadas': 0, 'en_curso': 0, 'maximo_simultaneo': 0, 'esperas_por_limite': 0}
+
+
+def _obtenerBucle():
+    """Devuelve el bucle de eventos de fondo, arrancándolo la primera vez."""
+    global _bucle, _hiloBucle
+    with _lockBucle:
+        if _bucle is None or not _hiloBucle.is_alive():
+            _bucle = asyncio.new_event_loop()
+            _hiloBucle = threading.Thread(
+                target=_bucle.run_forever, name="bucle-proveedoresIA", daemon=True)
+            _hiloBucle.start()
+            log.debug("_obtenerBucle: Bucle de eventos de proveedores IA iniciado.")
+        return _bucle
+
+
+def ejecutarSincrono(corrutina):
+    """Ejecuta una corrutina en el bucle de fondo y bloquea el hilo actual hasta su resultado."""
+    bucle = _obtenerBucle()
+    if threading.current_thread() is _hiloBucle:
+        corrutina.close()
+        raise RuntimeError(
+            "ejecutarSincrono no puede llamarse desde el propio bucle de proveedores IA; usar await.")
+    futuro = asyncio.run_coroutine_threadsafe(corrutina, bucle)
+    try:
+        return futuro.result()
+    except BaseException:
+        # Incluye TimeoutException de SIGALRM en principal.py: no dejar la llamada huérfana.
+        futuro.cancel()
+        raise
+
+
+def _limiteProveedor(api_provider):
+    if api_provider == 'google':
+        return settings.IA_MAX_CONCURRENCIA_GOOGLE
+    if api_provider == 'openrouter':
+        return settings.IA_MAX_CONCURRENCIA_OPENROUTER
+    return settings.IA_MAX_CONCURRENCIA_GLOBAL
+
+
+@asynccontextmanager
+async def _limitarConcurrencia(api_provider):
+    global _semaforoGlobal
+    if _semaforoGlobal is None:
+        _semaforoGlobal = asyncio.Semaphore(settings.IA_MAX_CONCURRENCIA_GLOBAL)
+    semaforoProveedor = _semaforosProveedor.get(api_provider)
+    if semaforoProveedor is None:
+        semaforoProveedor = asyncio.Semaphore(_limiteProveedor(api_provider))
+        _semaforosProveedor[api_provider] = semaforoProveedor
+
+    if _semaforoGlobal.locked() or semaforoProveedor.locked():
+        with _lockEstadisticas:
+            _estadisticas['esperas_por_limite'] += 1
+        log.debug(f"_limitarConcurrencia: Esperando hueco de concurrencia para '{api_provider}'.")
+    async with _semaforoGlobal:
+        async with semaforoProveedor:
+            with _lockEstadisticas:
+                _estadisticas['llamadas'] += 1
+                _estadisticas['en_curso'] += 1
+                _estadisticas['maximo_simultaneo'] = max(
+                    _estadisticas['maximo_simultaneo'], _estadisticas['en_curso'])
+            try:
+                yield
+            finally:
+                with _lockEstadisticas:
+                    _estadisticas['en_curso'] -= 1
+
+
+async def generarAsync(api_provider, modeloNombre, promptCompleto, configuracion, logPrefix,
+                       al_recibir_fragmento=None, timeout=300):
+    """
+    Llama al proveedor y devuelve un dict con 'texto', 'tokens_prompt', 'tokens_respuesta' y
+    'tokens_totales' (los tokens son None si la API no los reporta).
+
+    `configuracion` es la misma que usa la cache de analizadorCodigo: 'temperatura', 'max_tokens'
+    y, según el proveedor, 'seguridad'/'response_schema' (google) o 'json' (openrouter).
+    Si se pasa `al_recibir_fragmento` la respuesta se pide en streaming.
+    """
+    if api_provider == 'google':
+        generar = _generarGeminiAsync
+    elif api_provider == 'openrouter':
+        generar = _generarOpenRouterAsync
+    else:
+        raise ValueError(f"Proveedor API '{api_provider}' no soportado.")
+
+    async with _limitarConcurrencia(api_provider):
+        # La clave se elige ya dentro del hueco de concurrencia para repartir con el uso más reciente.
+        pool = poolClavesAPI.obtenerPool(api_provider)
+        tokensReservados = estimadorTokens.estimarTokens(promptCompleto, api_provider, modeloNombre)
+        apiKey = pool.seleccionar(tokensReservados)
+        try:
+            resultado = await generar(modeloNombre, promptCompleto, configuracion, logPrefix,
+                                      al_recibir_fragmento, timeout, apiKey)
+        except Exception as e:
+            if apiKey:
+                _notificarErrorClave(pool, apiKey, e)
+            raise
+        if apiKey:
+            pool.registrarUso(apiKey, resultado.get('tokens_totales'), tokensReservados)
+        return resultado
+
+
+def _clasificarErrorClave(e):
+    """'cuota', 'permiso' o None según la excepción (mismos casos que _manejarExcepcionGemini/API)."""
+    if isinstance(e, (google.api_core.exceptions.ResourceExhausted, openai.RateLimitError)):
+        return 'cuota'
+    if isinstance(e, openai.APIStatusError) and e.status_code == 402:  # Sin créditos en OpenRouter
+        return 'cuota'
+    if isinstance(e, (google.api_core.exceptions.PermissionDenied,
+                      openai.AuthenticationError, openai.PermissionDeniedError)):
+        return 'permiso'
+    return None
+
+
+def _notificarErrorClave(pool, apiKey, e):
+    tipo = _clasificarErrorClave(e)
+    if tipo == 'cuota':
+        pool.marcarCuotaAgotada(apiKey)
+    elif tipo == 'permiso':
+        pool.marcarRechazada(apiKey)
+
+
+async def streamAsync(api_provider, modeloNombre, promptCompleto, configuracion, logPrefix, timeout=300):
+    """Generador asíncrono que va entregando los fragmentos de texto de la respuesta."""
+    cola = asyncio.Queue()
+    fin = object()
+
+    async def _producir():
+        try:
+            await generarAsync(api_provider, modeloNombre, promptCompleto, configuracion, logPrefix,
+                               al_recibir_fragmento=cola.put_nowait, timeout=timeout)
+        finally:
+            cola.put_nowait(fin)
+
+    tarea = asyncio.ensure_future(_producir())
+    try:
+        while True:
+            fragmento = await cola.get()
+            if fragmento is fin:
+                break
+            yield fragmento
+        await tarea  # Propaga errores de la API
+    finally:
+        if not tarea.done():
+            tarea.cancel()
+
+
+async def contarTokensAsync(texto, api_provider='google', modeloNombre=None):
+    """Conteo de tokens para orquestadores asíncronos (estimador local, sin red)."""
+    return estimadorTokens.estimarTokens(texto, api_provider, modeloNombre)
+
+
+async def _generarGeminiAsync(modeloNombre, promptCompleto, configuracion, logPrefix, al_recibir_fragmento, timeout,
+                              apiKey=None):
+    modelo = clientesIA.obtenerModeloGemini(modeloNombre, apiKey)
+    generation_config_dict = {
+        "temperature": configuracion['temperatura'],
+        "response_mime_type": "application/json",
+        "max_output_tokens": configuracion['max_tokens'],
+    }
+    if configuracion.get('response_schema'):
+        generation_config_dict["response_schema"] = configuracion['response_schema']
+        log.debug(
+            f"{logPrefix} Incluyendo response_schema en GenerationConfig para Gemini.")
+    nivel = configuracion.get('seguridad', 'BLOCK_MEDIUM_AND_ABOVE')
+    respuesta = await modelo.generate_content_async(
+        promptCompleto,
+        generation_config=types.GenerationConfig(**generation_config_dict),
+        safety_settings={'HATE': nivel, 'HARASSMENT': nivel,
+                         'SEXUAL': nivel, 'DANGEROUS': nivel},
+        stream=bool(al_recibir_fragmento),
+        request_options={'timeout': timeout}
+    )
+    if al_recibir_fragmento:
+        fragmentos = []
+        async for chunk in respuesta:
+            fragmento = _extraerTextoFragmento(chunk)
+            if fragmento:
+                fragmentos.append(fragmento)
+                al_recibir_fragmento(fragmento)
+        texto = "".join(fragmentos).strip() or _extraerTextoRespuesta(respuesta, logPrefix)
+    else:
+        texto = _extraerTextoRespuesta(respuesta, logPrefix)
+
+    usoMetadata = getattr(respuesta, 'usage_metadata', None)
+    return {
+        'texto': texto,
+        'tokens_prompt': getattr(usoMetadata, 'prompt_token_count', None),
+        'tokens_respuesta': getattr(usoMetadata, 'candidates_token_count', None),
+        'tokens_totales': getattr(usoMetadata, 'total_token_count', None),
+    }
+
+
+async def _generarOpenRouterAsync(modeloNombre, promptCompleto, configuracion, logPrefix, al_recibir_fragmento, timeout,
+                                  apiKey=None):
+    client = clientesIA.obtenerClienteOpenRouterAsync(apiKey)
+    if not client:
+        return {'texto': None, 'tokens_prompt': None, 'tokens_respuesta': None, 'tokens_totales': None}
+    argumentosExtra = {}
+    if configuracion.get('json'):
+        argumentosExtra['response_format'] = {"type": "json_object"}
+    if al_recibir_fragmento:
+        argumentosExtra['stream'] = True
+        argumentosExtra['stream_options'] = {"include_usage": True}
+    completion = await client.chat.completions.create(
+        extra_headers={"HTTP-Referer": settings.OPENROUTER_REFERER,
+                       "X-Title": settings.OPENROUTER_TITLE},
+        model=modeloNombre, messages=[{"role": "user", "content": promptCompleto}],
+        temperature=configuracion['temperatura'], max_tokens=configuracion['max_tokens'],
+        timeout=timeout, **argumentosExtra
+    )
+    texto = None
+    uso = None
+    if al_recibir_fragmento:
+        fragmentos = []
+        try:
+            async for chunk in completion:
+                if getattr(chunk, 'usage', None):
+                    uso = chunk.usage
+                if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                    fragmentos.append(chunk.choices[0].delta.content)
+                    al_recibir_fragmento(chunk.choices[0].delta.content)
+        finally:
+            await completion.close()
+        texto = "".join(fragmentos)
+    else:
+        if completion.choices:
+            texto = completion.choices[0].message.content
+        uso = getattr(completion, 'usage', None)
+    return {
+        'texto': texto,
+        'tokens_prompt': getattr(uso, 'prompt_tokens', None),
+        'tokens_respuesta': getattr(uso, 'completion_tokens', None),
+        'tokens_totales': getattr(uso, 'total_tokens', None),
+    }
+
+
+def obtenerEstadisticas():
+    """Llamadas realizadas, en curso, máximo simultáneo observado y esperas por límite de concurrencia."""
+    with _lockEstadisticas:
+        return dict(_estadisticas)
+
+
+def _extraerTextoFragmento(chunk):
+    """Texto de un fragmento de streaming de Gemini ('' si el fragmento no trae texto)."""
+    try:
+        if chunk.candidates and chunk.candidates[0].content and chunk.candidates[0].content.parts:
+            return "".join(part.text for part in chunk.candidates[0].content.parts if hasattr(part, 'text'))
+    except (AttributeError, IndexError, ValueError, TypeError):
+        pass
+    return ""
+
+
+def _extraerTextoRespuesta(respuesta, logPrefix):
+    textoRespuesta = ""
+    try:
+        # Priorizar el atributo 'text' si existe directamente en la respuesta (Gemini V1 Pro)
+        if hasattr(respuesta, 'text') and respuesta.text:
+            textoRespuesta = respuesta.text
+        # Estructura de Gemini V1.5 (candidates -> content -> parts)
+        elif hasattr(respuesta, 'candidates') and respuesta.candidates:
+            candidate = respuesta.candidates[0]
+            if hasattr(candidate, 'content') and hasattr(candidate.content, 'parts') and candidate.content.parts:
+                textoRespuesta = "".join(
+                    part.text for part in candidate.content.parts if hasattr(part, 'text'))
+            # Fallback por si 'content' no tiene 'parts' pero sí 'text' (menos común)
+            elif hasattr(candidate, 'content') and hasattr(candidate.content, 'text') and candidate.content.text:
+                textoRespuesta = candidate.content.text
+        # Estructura más antigua de Gemini (parts directamente en la respuesta)
+        elif hasattr(respuesta, 'parts') and respuesta.parts:
+            textoRespuesta = "".join(
+                part.text for part in respuesta.parts if hasattr(part, 'text'))
+
+        if not textoRespuesta:
+            finish_reason_str = "N/A"
+            safety_ratings_str = "N/A"
+            block_reason_str = "N/A"
+
+            if hasattr(respuesta, 'prompt_feedback'):
+                feedback = respuesta.prompt_feedback
+                if hasattr(feedback, 'block_reason'):
+                    block_reason_str = str(feedback.block_reason)
+                if hasattr(feedback, 'safety_ratings'):  # Lista de SafetyRating
+                    safety_ratings_str = ", ".join(
+                        [f"{r.category}: {r.probability}" for r in feedback.safety_ratings])
+
+            if hasattr(respuesta, 'candidates') and isinstance(respuesta.candidates, (list, tuple)) and respuesta.candidates:
+                candidate = respuesta.candidates[0]
+                if hasattr(candidate, 'finish_reason'):
+                    finish_reason_str = str(candidate.finish_reason)
+                # Lista de SafetyRating
+                if hasattr(candidate, 'safety_ratings') and safety_ratings_str == "N/A":
+                    safety_ratings_str = ", ".join(
+                        [f"{r.category}: {r.probability}" for r in candidate.safety_ratings])
+
+            log.error(f"{logPrefix} Respuesta de IA vacía o no se pudo extraer texto. "
+                      f"FinishReason: {finish_reason_str}, BlockReason: {block_reason_str}, SafetyRatings: {safety_ratings_str}")
+            log.debug(f"{logPrefix} Respuesta completa (objeto): {respuesta}")
+            return None
+
+        return textoRespuesta.strip()
+
+    except (AttributeError, IndexError, ValueError, TypeError) as e:
+        log.error(
+            f"{logPrefix} Error extrayendo texto de la respuesta: {e}. Respuesta obj: {respuesta}", exc_info=True)
+        return None
+    except Exception as e:  # Captura general para errores inesperados
+        log.error(
+            f"{logPrefix} Error inesperado extrayendo texto: {e}. Respuesta obj: {respuesta}", exc_info=True)
+        return None
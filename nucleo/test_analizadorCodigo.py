@@ -0,0 +1,76 @@
+import unittest
+import os
+import shutil
+import tempfile
+import logging
+from nucleo import analizadorCodigo
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(name)s - %(funcName)s: %(message)s')
+log_test = logging.getLogger(__name__)
+
+
+class TestLeerArchivos(unittest.TestCase):
+
+    def setUp(self):
+        """Cinco archivos de ~1.8 KB en un directorio temporal."""
+        self.test_dir = tempfile.mkdtemp()
+        self.rutas = []
+        for i in range(5):
+            ruta = os.path.join(self.test_dir, f"f{i}.php")
+            with open(ruta, 'w', encoding='utf-8', newline='') as f:
+                f.write(f"<?php // archivo {i}\n" + "echo 'linea de relleno';\n" * 75)
+            self.rutas.append(ruta)
+        self.tamano = os.path.getsize(self.rutas[0])
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_sin_presupuesto_lee_todo_en_orden(self):
+        resultado = analizadorCodigo.leerArchivos(self.rutas, self.test_dir)
+        self.assertEqual(resultado['archivos'], [f"f{i}.php" for i in range(5)])
+        self.assertEqual(resultado['bytes'], 5 * self.tamano)
+        self.assertEqual(resultado['omitidos_por_presupuesto'], 0)
+        self.assertLess(resultado['contenido'].index("f0.php"), resultado['contenido'].index("f4.php"))
+
+    def test_presupuesto_de_bytes(self):
+        resultado = analizadorCodigo.leerArchivos(self.rutas, self.test_dir, max_bytes=2 * self.tamano + 10)
+        self.assertEqual(resultado['archivos'], ['f0.php', 'f1.php'])
+        self.assertEqual(resultado['omitidos_por_presupuesto'], 3)
+
+        # El primero no cabe: solo entra si es obligatorio, y el resto queda fuera
+        resultado = analizadorCodigo.leerArchivos(self.rutas, self.test_dir, max_bytes=100)
+        self.assertEqual((resultado['archivos_leidos'], resultado['omitidos_por_presupuesto']), (0, 5))
+        resultado = analizadorCodigo.leerArchivos(self.rutas, self.test_dir, max_bytes=100, obligatorios=1)
+        self.assertEqual(resultado['archivos'], ['f0.php'])
+        self.assertEqual(resultado['omitidos_por_presupuesto'], 4)
+
+    def test_presupuesto_de_tokens(self):
+        tokensUno = analizadorCodigo.leerArchivos(self.rutas[:1], self.test_dir)['tokens']
+        resultado = analizadorCodigo.leerArchivos(self.rutas, self.test_dir, max_tokens=3 * tokensUno)
+        self.assertEqual(resultado['archivos'], ['f0.php', 'f1.php', 'f2.php'])
+        self.assertLessEqual(resultado['tokens'], 3 * tokensUno)
+        self.assertEqual(resultado['omitidos_por_presupuesto'], 2)
+
+    def test_primer_archivo_obligatorio_aunque_supere_el_presupuesto(self):
+        resultado = analizadorCodigo.leerArchivos(self.rutas, self.test_dir, max_tokens=10)
+        self.assertEqual((resultado['contenido'], resultado['omitidos_por_presupuesto']), ("", 5))
+
+        resultado = analizadorCodigo.leerArchivos(self.rutas, self.test_dir, max_tokens=10, obligatorios=1)
+        self.assertEqual(resultado['archivos'], ['f0.php'])
+        self.assertIn("<?php // archivo 0", resultado['contenido'])
+        self.assertGreater(resultado['tokens'], 10)
+        self.assertEqual(resultado['omitidos_por_presupuesto'], 4)
+
+    def test_crlf_se_normaliza_a_lf(self):
+        datos = b"<?php\r\necho 1;\r\necho 2;\recho 3;\n"
+        with open(self.rutas[0], 'wb') as f:
+            f.write(datos)
+        resultado = analizadorCodigo.leerArchivos(self.rutas[:1], self.test_dir)
+        self.assertNotIn("\r", resultado['contenido'])
+        self.assertIn("<?php\necho 1;\necho 2;\necho 3;\n", resultado['contenido'])
+        self.assertEqual(resultado['bytes'], len(datos))  # Bytes reales del archivo, con los \r
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+import os
+import shutil
+import tempfile
+import logging
+import subprocess
+from unittest import mock
+from config import settings
+from nucleo import anclajeBloques
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(name)s - %(funcName)s: %(message)s')
+log_test = logging.getLogger(__name__)
+
+CODIGO = """<?php
+class Pedido {
+    public function crear($datos) {
+        return new Pedido($datos);
+    }
+
+    public function total() {
+        return 0;
+    }
+}
+"""
+
+
+@unittest.skipUnless(shutil.which('git'), "git no disponible")
+class TestAnclajeBloques(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self._git('init', '-q')
+        self._git('config', 'user.email', 'test@example.com')
+        self._git('config', 'user.name', 'test')
+        self._escribir('app/Pedido.php', CODIGO)
+        self._escribir('Mision.md', "# Misión: Mision\n")
+        self._git('add', '-A')
+        self._git('commit', '-q', '-m', 'base')
+        self.bloques = [
+            {"archivo": "app/Pedido.php", "nombre_bloque": "Pedido::crear", "linea_inicio": 3, "linea_fin": 5},
+            {"archivo": "app/Pedido.php", "nombre_bloque": "metodo total", "linea_inicio": 7, "linea_fin": 9},
+        ]
+        parche = mock.patch.object(settings, 'LISTADO_ARCHIVOS_GIT', False)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def _git(self, *args):
+        subprocess.run(['git', *args], cwd=self.test_dir, check=True)
+
+    def _escribir(self, rel, contenido):
+        ruta = os.path.join(self.test_dir, rel)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(ruta, 'w', encoding='utf-8') as f:
+            f.write(contenido)
+
+    def _rangos(self, bloques):
+        return [(b['linea_inicio'], b['linea_fin']) for b in bloques]
+
+    def test_remapear_linea(self):
+        hunks = [(2, 0, 3, 2), (5, 2, 7, 1), (9, 1, 9, 0)]
+        self.assertEqual(anclajeBloques.remapearLinea(hunks, 1), 1)
+        self.assertEqual(anclajeBloques.remapearLinea(hunks, 3), 5)
+        self.assertEqual(anclajeBloques.remapearLinea(hunks, 5), 7)
+        self.assertEqual(anclajeBloques.remapearLinea(hunks, 6, esFin=True), 7)
+        self.assertEqual(anclajeBloques.remapearLinea(hunks, 8), 9)
+        self.assertEqual(anclajeBloques.remapearLinea(hunks, 12), 12)
+
+    def test_sin_cambios(self):
+        tareas = [{"id": "1.1", "bloques_codigo_objetivo": self.bloques}]
+        self.assertTrue(anclajeBloques.registrarAnclas(self.test_dir, "Mision", tareas))
+        self.assertEqual(self._rangos(anclajeBloques.reanclarBloques(self.test_dir, "Mision", "1.1", self.bloques)),
+                         [(3, 5), (7, 9)])
+
+    def test_desplazado_por_tarea_previa(self):
+        anclajeBloques.registrarAnclas(self.test_dir, "Mision", [{"id": "1.2", "bloques_codigo_objetivo": self.bloques}])
+        # Una tarea previa añade un método arriba y cambia el cuerpo de total()
+        nuevo = CODIGO.replace("class Pedido {\n", "class Pedido {\n    private $a;\n\n    public function validar() {\n    }\n\n")
+        nuevo = nuevo.replace("return 0;", "$suma = 1;\n        return $suma;")
+        self._escribir('app/Pedido.php', nuevo)
+        self._git('commit', '-q', '-am', 'tarea 1.1')
+        reanclados = anclajeBloques.reanclarBloques(self.test_dir, "Mision", "1.2", self.bloques)
+        self.assertEqual(self._rangos(reanclados), [(8, 10), (12, 15)])
+        self.assertEqual(self._rangos(self.bloques), [(3, 5), (7, 9)])  # No modifica la entrada
+
+    def test_sin_anclas_guardadas_se_reconstruye_desde_git(self):
+        self._escribir('app/Pedido.php', "<?php\n// cabecera\n" + CODIGO[len("<?php\n"):])
+        reanclados = anclajeBloques.reanclarBloques(self.test_dir, "Mision", "1.1", self.bloques)
+        self.assertEqual(self._rangos(reanclados), [(4, 6), (8, 10)])
+
+
+if __name__ == '__main__':
+    unittest.main()
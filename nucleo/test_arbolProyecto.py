@@ -0,0 +1,89 @@
+import unittest
+import os
+import shutil
+import tempfile
+import logging
+from unittest import mock
+from config import settings
+from nucleo import arbolProyecto
+from nucleo import analizadorCodigo
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(name)s - %(funcName)s: %(message)s')
+log_test = logging.getLogger(__name__)
+
+
+class TestArbolProyecto(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.rutaApp = os.path.join(self.test_dir, 'app')
+        for rel in ('a.php', 'lib/b.js', 'lib/sub/c.py', 'vendor/x.php', '.oculto/y.php'):
+            self._escribir(rel)
+        os.makedirs(os.path.join(self.rutaApp, 'vacio'))
+        parche = mock.patch.object(settings, 'LISTADO_ARCHIVOS_GIT', False)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def _escribir(self, rel):
+        ruta = os.path.join(self.rutaApp, rel)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(ruta, 'w', encoding='utf-8') as f:
+            f.write("x")
+
+    def _estructura(self, **kwargs):
+        return analizadorCodigo.generarEstructuraDirectorio(self.rutaApp, directorios_ignorados=['vendor'], **kwargs)
+
+    def test_formato_completo(self):
+        esperado = "\n".join([
+            "app/",
+            "├── a.php",
+            "├── lib/",
+            "│   ├── b.js",
+            "│   └── sub/",
+            "│       └── c.py",
+            "└── vacio/",
+        ])
+        self.assertEqual(self._estructura(), esperado)
+
+    def test_variantes_desde_el_mismo_modelo(self):
+        self.assertEqual(self._estructura(max_depth=0),
+                         "app/\n├── a.php\n├── lib/\n│   └── ... (Profundidad máxima alcanzada)\n"
+                         "└── vacio/\n    └── ... (Profundidad máxima alcanzada)")
+        self.assertEqual(self._estructura(incluir_archivos=False), "app/\n├── lib/\n│   └── sub/\n└── vacio/")
+        self.assertEqual(self._estructura(subruta='lib'), "app/lib/\n├── b.js\n└── sub/\n    └── c.py")
+        self.assertIsNone(self._estructura(subruta='no_existe'))
+
+    def test_cache_hasta_que_cambia_el_arbol(self):
+        primera = self._estructura()
+        aciertos = arbolProyecto.obtenerEstadisticas()['aciertos_cache']
+        self.assertEqual(self._estructura(), primera)
+        self.assertEqual(arbolProyecto.obtenerEstadisticas()['aciertos_cache'], aciertos + 1)
+        self.assertTrue(os.path.exists(
+            os.path.join(self.rutaApp, '.orion_meta', arbolProyecto.NOMBRE_ARCHIVO_CACHE)))
+
+        self._escribir('lib/nuevo.php')
+        self.assertIn("│   ├── nuevo.php", self._estructura())
+
+    def test_estructura_relevante_colapsa_lo_lejano(self):
+        for i in range(30):
+            self._escribir(f'lejos/profundo/archivo_{i}.php')
+        contarTokens = lambda texto: len(texto.split())
+        texto = arbolProyecto.generarEstructuraRelevante(
+            self.rutaApp, ['vendor'], os.path.join(self.rutaApp, '.orion_meta'), ['lib/sub/c.py'], 30, contarTokens)
+        self.assertIn("│       └── c.py", texto)
+        self.assertIn("profundo/ (30 archivos)", texto)
+        self.assertNotIn("archivo_0.php", texto)
+        self.assertLessEqual(contarTokens(texto), 30)
+
+        completo = arbolProyecto.generarEstructuraRelevante(
+            self.rutaApp, ['vendor'], os.path.join(self.rutaApp, '.orion_meta'), ['lib/sub/c.py'], 10000, contarTokens)
+        self.assertIn("archivo_29.php", completo)
+        self.assertNotIn("archivos)", completo)
+
+
+if __name__ == '__main__':
+    unittest.main()
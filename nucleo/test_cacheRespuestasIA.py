@@ -0,0 +1,103 @@
+import unittest
+import asyncio
+import os
+import time
+import tempfile
+import shutil
+import logging
+from unittest import mock
+from config import settings
+from nucleo import cacheRespuestasIA
+from nucleo import analizadorCodigo
+from nucleo import proveedoresIA
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(name)s - %(funcName)s: %(message)s')
+log_test = logging.getLogger(__name__)
+
+
+class TestCacheRespuestasIA(unittest.TestCase):
+
+    def setUp(self):
+        """Redirige la cache a un directorio temporal y reinicia su estado."""
+        self.test_dir = tempfile.mkdtemp()
+        self.parches = [
+            mock.patch.object(settings, 'RUTA_CACHE_IA', self.test_dir),
+            mock.patch.object(settings, 'CACHE_IA_TTL_SEGUNDOS', 3600),
+            mock.patch.object(settings, 'CACHE_IA_MAX_MB', 1),
+            mock.patch.object(cacheRespuestasIA, '_bypass', False),
+            mock.patch.object(cacheRespuestasIA, '_bytesEnDisco', None),
+            mock.patch.dict(cacheRespuestasIA._estadisticas,
+                            {k: 0 for k in cacheRespuestasIA._estadisticas}),
+        ]
+        for p in self.parches:
+            p.start()
+
+    def tearDown(self):
+        for p in reversed(self.parches):
+            p.stop()
+        shutil.rmtree(self.test_dir)
+
+    def test_clave_depende_de_todos_los_componentes(self):
+        base = cacheRespuestasIA.calcularClave('google', 'm', {'t': 0.3}, 'prompt')
+        self.assertEqual(base, cacheRespuestasIA.calcularClave('google', 'm', {'t': 0.3}, 'prompt'))
+        self.assertNotEqual(base, cacheRespuestasIA.calcularClave('openrouter', 'm', {'t': 0.3}, 'prompt'))
+        self.assertNotEqual(base, cacheRespuestasIA.calcularClave('google', 'm2', {'t': 0.3}, 'prompt'))
+        self.assertNotEqual(base, cacheRespuestasIA.calcularClave('google', 'm', {'t': 0.4}, 'prompt'))
+        self.assertNotEqual(base, cacheRespuestasIA.calcularClave('google', 'm', {'t': 0.3}, 'prompt '))
+
+    def test_guardar_y_obtener(self):
+        clave = cacheRespuestasIA.calcularClave('google', 'm', {}, 'hola')
+        self.assertIsNone(cacheRespuestasIA.obtener(clave))
+        cacheRespuestasIA.guardar(clave, '{"ok": true}')
+        self.assertEqual(cacheRespuestasIA.obtener(clave), '{"ok": true}')
+        stats = cacheRespuestasIA.obtenerEstadisticas()
+        self.assertEqual(stats['aciertos'], 1)
+        self.assertEqual(stats['fallos'], 1)
+
+    def test_ttl_expira_entradas(self):
+        clave = cacheRespuestasIA.calcularClave('google', 'm', {}, 'viejo')
+        cacheRespuestasIA.guardar(clave, '{}')
+        with mock.patch.object(time, 'time', return_value=time.time() + 7200):
+            self.assertIsNone(cacheRespuestasIA.obtener(clave))
+        self.assertFalse(os.path.exists(os.path.join(self.test_dir, f"{clave}.json")))
+        self.assertEqual(cacheRespuestasIA.obtenerEstadisticas()['expiradas'], 1)
+
+    def test_bypass_no_lee_ni_escribe(self):
+        clave = cacheRespuestasIA.calcularClave('google', 'm', {}, 'x')
+        cacheRespuestasIA.establecerBypass(True)
+        cacheRespuestasIA.guardar(clave, '{}')
+        self.assertEqual(os.listdir(self.test_dir), [])
+        self.assertIsNone(cacheRespuestasIA.obtener(clave))
+
+    def test_desalojo_lru_por_tamano(self):
+        texto = '{"x": "' + ('a' * 300 * 1024) + '"}'  # ~300 KB por entrada, límite 1 MB
+        claves = [cacheRespuestasIA.calcularClave('google', 'm', {}, str(i)) for i in range(3)]
+        for i, clave in enumerate(claves):
+            cacheRespuestasIA.guardar(clave, texto)
+            os.utime(os.path.join(self.test_dir, f"{clave}.json"), (1000 + i, 1000 + i))
+        # Acceder a la más antigua la convierte en la más reciente
+        self.assertIsNotNone(cacheRespuestasIA.obtener(claves[0]))
+        cacheRespuestasIA.guardar(
+            cacheRespuestasIA.calcularClave('google', 'm', {}, 'nueva'), texto)
+        self.assertIsNotNone(cacheRespuestasIA.obtener(claves[0]))
+        self.assertIsNone(cacheRespuestasIA.obtener(claves[1]))
+        self.assertGreaterEqual(cacheRespuestasIA.obtenerEstadisticas()['desalojadas'], 1)
+        self.assertLessEqual(cacheRespuestasIA.obtenerEstadisticas()['bytes_en_disco'], 1024 * 1024)
+
+    def test_no_se_cachean_respuestas_json_invalidas(self):
+        async def llamar(texto):
+            resultado = {'texto': texto, 'tokens_prompt': None, 'tokens_respuesta': None, 'tokens_totales': None}
+            with mock.patch.object(proveedoresIA, 'generarAsync', mock.AsyncMock(return_value=resultado)):
+                return await analizadorCodigo._llamarProveedorIA(
+                    texto, 'openrouter', 'm', {}, "test:", True, None, 10, time.monotonic())
+        for texto in ['{"modificaciones": [{"a": 1}', '```json\n{"a": }\n```', '[1, 2]']:
+            asyncio.run(llamar(texto))
+        self.assertEqual(os.listdir(self.test_dir), [])
+        asyncio.run(llamar('```json\n{"ok": true}\n```'))
+        self.assertEqual(len(os.listdir(self.test_dir)), 1)
+
+
+# Para poder ejecutar desde la línea de comandos
+if __name__ == '__main__':
+    unittest.main()
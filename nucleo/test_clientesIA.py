@@ -0,0 +1,96 @@
+import unittest
+import asyncio
+import logging
+from unittest import mock
+import google.ai.generativelanguage as glm
+from nucleo import clientesIA
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(name)s - %(funcName)s: %(message)s')
+log_test = logging.getLogger(__name__)
+
+
+class TestClientesIA(unittest.TestCase):
+
+    def setUp(self):
+        """Registro de clientes vacío y contadores a cero en cada test."""
+        self.parches = [
+            mock.patch.object(clientesIA, '_registroClientes', {}),
+            mock.patch.dict(clientesIA._estadisticasPool,
+                            {p: {'clientes_creados': 0, 'reutilizaciones': 0} for p in clientesIA._estadisticasPool}),
+        ]
+        for p in self.parches:
+            p.start()
+
+    def tearDown(self):
+        for p in reversed(self.parches):
+            p.stop()
+
+    def test_modelo_gemini_con_clave_usa_su_propio_cliente(self):
+        respuestaApi = glm.GenerateContentResponse(candidates=[glm.Candidate(
+            content=glm.Content(parts=[glm.Part(text='{"ok": true}')], role='model'), finish_reason=1)])
+        clientesFalsos = {}
+
+        def _fabricaCliente(client_options):
+            cliente = mock.Mock()
+            cliente.generate_content = mock.AsyncMock(return_value=respuestaApi)
+            clientesFalsos[client_options['api_key']] = cliente
+            return cliente
+
+        with mock.patch.object(clientesIA.glm, 'GenerativeServiceAsyncClient', side_effect=_fabricaCliente), \
+                mock.patch.object(clientesIA.genai, 'configure') as configurar:
+            modeloA = clientesIA.obtenerModeloGemini('gemini-test', 'clave-aaaa')
+            self.assertIs(clientesIA.obtenerModeloGemini('gemini-test', 'clave-aaaa'), modeloA)
+            modeloB = clientesIA.obtenerModeloGemini('gemini-test', 'clave-bbbb')
+            self.assertIsNot(modeloA, modeloB)
+
+            respuesta = asyncio.run(modeloA.generate_content_async(
+                "hola", generation_config={'temperature': 0.3}, safety_settings={'HATE': 'BLOCK_NONE'},
+                request_options={'timeout': 5}))
+
+        # Cada clave tiene su cliente y la configuración global de genai no se toca
+        self.assertEqual(sorted(clientesFalsos), ['clave-aaaa', 'clave-bbbb'])
+        configurar.assert_not_called()
+        clientesFalsos['clave-bbbb'].generate_content.assert_not_called()
+        peticion, = clientesFalsos['clave-aaaa'].generate_content.call_args.args
+        self.assertEqual(clientesFalsos['clave-aaaa'].generate_content.call_args.kwargs, {'timeout': 5})
+        self.assertEqual(peticion.model, 'models/gemini-test')
+        self.assertEqual(peticion.contents[0].parts[0].text, 'hola')
+        self.assertEqual(peticion.contents[0].role, 'user')
+        self.assertAlmostEqual(peticion.generation_config.temperature, 0.3, places=5)
+        self.assertEqual(len(peticion.safety_settings), 1)
+        self.assertEqual(respuesta.text, '{"ok": true}')
+
+        stats = clientesIA.obtenerEstadisticasPool()['google']
+        self.assertEqual((stats['clientes_creados'], stats['reutilizaciones']), (2, 1))
+
+    def test_reutiliza_clientes_openrouter_y_cierra_el_pool(self):
+        with mock.patch.object(clientesIA, 'OpenAI') as claseOpenAI, \
+                mock.patch.object(clientesIA, 'AsyncOpenAI') as claseAsync:
+            claseOpenAI.side_effect = lambda **kw: mock.Mock(name=kw['api_key'])
+            claseAsync.side_effect = lambda **kw: mock.Mock(name=kw['api_key'])
+            cliente = clientesIA.obtenerClienteOpenRouter('clave-aaaa')
+            self.assertIs(clientesIA.obtenerClienteOpenRouter('clave-aaaa'), cliente)
+            self.assertIsNot(clientesIA.obtenerClienteOpenRouter('clave-bbbb'), cliente)
+            clienteAsync = clientesIA.obtenerClienteOpenRouterAsync('clave-aaaa')
+        self.assertEqual(claseOpenAI.call_count, 2)
+
+        # Un cliente con el pool httpx inspeccionable y otro sin él (estructura interna distinta)
+        cliente._client._transport._pool.connections = [object(), object()]
+        del clientesIA.obtenerClienteOpenRouter('clave-bbbb')._client
+        stats = clientesIA.obtenerEstadisticasPool()
+        self.assertEqual(stats['openrouter'], {'clientes_activos': 2, 'clientes_creados': 2,
+                                               'reutilizaciones': 2, 'conexiones_abiertas': 2})
+        self.assertIsNone(stats['openrouter_async']['conexiones_abiertas'])
+
+        clientesIA.cerrarPool()
+        cliente.close.assert_called_once_with()
+        clienteAsync.close.assert_not_called()  # Corrutina ligada al bucle de proveedoresIA
+        self.assertEqual(clientesIA.obtenerEstadisticasPool()['openrouter']['clientes_activos'], 0)
+        with mock.patch.object(clientesIA, 'OpenAI') as claseOpenAI:
+            self.assertIsNot(clientesIA.obtenerClienteOpenRouter('clave-aaaa'), cliente)
+        claseOpenAI.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
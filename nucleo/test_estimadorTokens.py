@@ -0,0 +1,103 @@
+import unittest
+import os
+import json
+import shutil
+import tempfile
+import logging
+from collections import OrderedDict
+from unittest import mock
+from config import settings
+from nucleo import estimadorTokens
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(name)s - %(funcName)s: %(message)s')
+log_test = logging.getLogger(__name__)
+
+
+class TestEstimadorTokens(unittest.TestCase):
+
+    def setUp(self):
+        """Calibración en un directorio temporal y estado del módulo limpio."""
+        self.test_dir = tempfile.mkdtemp()
+        self.rutaCalibracion = os.path.join(self.test_dir, 'calibracion.json')
+        self.parches = [
+            mock.patch.object(settings, 'ESTIMADOR_TOKENS_STATE_FILE', self.rutaCalibracion),
+            mock.patch.object(estimadorTokens, '_factores', None),
+            mock.patch.object(estimadorTokens, '_factoresGuardados', {}),
+            mock.patch.object(estimadorTokens, '_memo', OrderedDict()),
+            mock.patch.object(estimadorTokens, '_estimadoresRegistrados', {}),
+            mock.patch.dict(estimadorTokens._estadisticas, {k: 0 for k in estimadorTokens._estadisticas}),
+        ]
+        for p in self.parches:
+            p.start()
+
+    def tearDown(self):
+        for p in reversed(self.parches):
+            p.stop()
+        shutil.rmtree(self.test_dir)
+
+    def _leerCalibracion(self):
+        with open(self.rutaCalibracion, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def test_estimacion_base(self):
+        # 'hola'(1) + ' '(0) + 'mundo'(2) + ','(1) + '\n    '(1) + '1234567'(3)
+        self.assertEqual(estimadorTokens.estimarTokens("hola mundo,\n    1234567", 'google'), 8)
+        self.assertEqual(estimadorTokens.estimarTokens("", 'google'), 0)
+        self.assertEqual(estimadorTokens.estimarTokens(" ", 'google'), 1)  # Mínimo 1 para texto no vacío
+
+    def test_memo_y_estimador_registrado(self):
+        estimadorTokens.estimarTokens("def f(): pass", 'google')
+        estimadorTokens.estimarTokens("def f(): pass", 'google')
+        estimadorTokens.estimarTokens("def f(): pass", 'openrouter')
+        stats = estimadorTokens.obtenerEstadisticas()
+        self.assertEqual((stats['memo_aciertos'], stats['memo_fallos'], stats['memo_entradas']), (1, 2, 2))
+
+        # Registrar un estimador vacía el memo para no servir valores del anterior
+        estimadorTokens.registrarEstimador('google', lambda texto: 42)
+        self.assertEqual(estimadorTokens.obtenerEstadisticas()['memo_entradas'], 0)
+        self.assertEqual(estimadorTokens.estimarTokens("def f(): pass", 'google'), 42)
+
+    def test_calibracion_media_movil_y_limites(self):
+        estimadorTokens.registrarEstimador('google', lambda texto: 100)
+        estimadorTokens.calibrar('google', 'm', "prompt", 150)
+        self.assertEqual(estimadorTokens.estimarTokens("prompt", 'google', 'm'), 150)  # Primera observación
+        estimadorTokens.calibrar('google', 'm', "prompt", 100)
+        self.assertAlmostEqual(estimadorTokens.obtenerEstadisticas()['factores']['google|m'], 0.8 * 1.5 + 0.2 * 1.0)
+
+        # Observaciones extremas se recortan a [0.5, 2.0] antes de entrar en la media
+        estimadorTokens.calibrar('google', 'otro', "prompt", 10000)
+        estimadorTokens.calibrar('google', 'bajo', "prompt", 1)
+        factores = estimadorTokens.obtenerEstadisticas()['factores']
+        self.assertEqual((factores['google|otro'], factores['google|bajo']), (2.0, 0.5))
+        # El factor es por modelo: otro modelo sigue sin corrección
+        self.assertEqual(estimadorTokens.estimarTokens("prompt", 'google', 'sin_calibrar'), 100)
+
+        estimadorTokens.calibrar('google', 'm', "prompt", 0)  # Conteos no válidos se ignoran
+        self.assertEqual(estimadorTokens.obtenerEstadisticas()['calibraciones'], 4)
+
+    def test_guardado_solo_con_cambios_significativos(self):
+        estimadorTokens.registrarEstimador('google', lambda texto: 100)
+        estimadorTokens.calibrar('google', 'm', "prompt", 100)
+        self.assertEqual(self._leerCalibracion(), {'google|m': 1.0})
+        for _ in range(5):
+            estimadorTokens.calibrar('google', 'm', "prompt", 100)  # Factor estable: no reescribe
+        estimadorTokens.calibrar('google', 'm', "prompt", 101)  # 1.002, por debajo del umbral
+        self.assertEqual(estimadorTokens.obtenerEstadisticas()['guardados'], 1)
+        estimadorTokens.calibrar('google', 'm', "prompt", 200)  # 1.2016: supera el umbral
+        self.assertEqual(estimadorTokens.obtenerEstadisticas()['guardados'], 2)
+        self.assertEqual(self._leerCalibracion(), {'google|m': 1.2016})
+
+        # Lo que quedó por debajo del umbral se escribe al salir
+        estimadorTokens.calibrar('google', 'm', "prompt", 120)
+        self.assertEqual(self._leerCalibracion(), {'google|m': 1.2016})
+        estimadorTokens._guardarPendientesAlSalir()
+        self.assertEqual(self._leerCalibracion(), {'google|m': 1.2013})
+
+        # Una instancia nueva parte de lo guardado
+        with mock.patch.object(estimadorTokens, '_factores', None):
+            self.assertEqual(estimadorTokens.estimarTokens("prompt", 'google', 'm'), 120)
+
+
+if __name__ == '__main__':
+    unittest.main()
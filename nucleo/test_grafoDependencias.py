@@ -0,0 +1,100 @@
+import unittest
+import os
+import shutil
+import tempfile
+import logging
+from unittest import mock
+from config import settings
+from nucleo import grafoDependencias
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(name)s - %(funcName)s: %(message)s')
+log_test = logging.getLogger(__name__)
+
+ARCHIVOS = {
+    'app/Http/PedidoController.php': """<?php
+namespace App\\Http;
+use App\\Models\\Pedido;
+use App\\Servicios\\{Correo, Pagos as P};
+use Illuminate\\Support\\Str;
+require_once __DIR__ . '/../ayudantes.php';
+// include 'comentado.php';
+class PedidoController {
+    public function crear() { $f = function() use ($x) {}; }
+}
+""",
+    'app/Models/Pedido.php': "<?php\nnamespace App\\Models;\nclass Pedido {}\n",
+    'app/Servicios/Correo.php': "<?php\nclass Correo {}\n",
+    'app/Servicios/Pagos.php': "<?php\nclass Pagos {}\n",
+    'app/ayudantes.php': "<?php\nfunction ayuda() {}\n",
+    'web/js/main.js': "import { Carrito } from './carrito';\nimport 'lodash';\nconst u = require('../util/index.js');\n",
+    'web/js/carrito.js': "export class Carrito {}\nexport { x } from './modelo/index';\n",
+    'web/js/modelo/index.js': "export const x = 1;\n",
+    'web/util/index.js': "module.exports = {};\n",
+    'nucleo/__init__.py': "",
+    'nucleo/servicio.py': "import os\nfrom nucleo import modelos\nfrom .util import ayuda\n",
+    'nucleo/modelos.py': "",
+    'nucleo/util.py': "",
+}
+
+
+class TestGrafoDependencias(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.rutaMeta = os.path.join(self.test_dir, '.orion_meta')
+        for rel, contenido in ARCHIVOS.items():
+            self._escribir(rel, contenido)
+        parche = mock.patch.object(settings, 'LISTADO_ARCHIVOS_GIT', False)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def _escribir(self, rel, contenido):
+        ruta = os.path.join(self.test_dir, rel)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(ruta, 'w', encoding='utf-8') as f:
+            f.write(contenido)
+
+    def _grafo(self):
+        return grafoDependencias.actualizarGrafo(self.test_dir, self.rutaMeta, [], ['.php', '.js', '.py'])
+
+    def test_referencias_php(self):
+        self.assertEqual(grafoDependencias.extraerReferencias(ARCHIVOS['app/Http/PedidoController.php'], '.php'), [
+            ['ruta', '../ayudantes.php'],
+            ['clase', 'App\\Models\\Pedido'],
+            ['clase', 'App\\Servicios\\Correo'],
+            ['clase', 'App\\Servicios\\Pagos'],
+            ['clase', 'Illuminate\\Support\\Str'],
+        ])
+
+    def test_resolucion_por_lenguaje(self):
+        salientes = self._grafo()['salientes']
+        self.assertEqual(salientes['app/Http/PedidoController.php'], [
+            'app/Models/Pedido.php', 'app/Servicios/Correo.php', 'app/Servicios/Pagos.php', 'app/ayudantes.php'])
+        self.assertEqual(salientes['web/js/main.js'], ['web/js/carrito.js', 'web/util/index.js'])
+        self.assertEqual(salientes['web/js/carrito.js'], ['web/js/modelo/index.js'])
+        self.assertEqual(salientes['nucleo/servicio.py'], ['nucleo/__init__.py', 'nucleo/modelos.py', 'nucleo/util.py'])
+
+    def test_relacionados_y_presupuesto(self):
+        grafo = self._grafo()
+        self.assertEqual(grafoDependencias.archivosRelacionados(grafo, 'web/js/carrito.js'),
+                         ['web/js/modelo/index.js', 'web/js/main.js', 'web/util/index.js'])
+        self._escribir('web/js/modelo/index.js', "x" * 4000)
+        with mock.patch.object(settings, 'DIRECTORIOS_IGNORADOS', []):
+            self.assertEqual(grafoDependencias.seleccionarContexto(self.test_dir, 'web/js/carrito.js', 2, 500),
+                             ['web/js/main.js', 'web/util/index.js'])
+
+    def test_incremental(self):
+        self._grafo()
+        analizadosAntes = grafoDependencias.obtenerEstadisticas()['archivos_analizados']
+        self._escribir('nucleo/modelos.py', "from nucleo import util\n")
+        grafo = self._grafo()
+        self.assertEqual(grafoDependencias.obtenerEstadisticas()['archivos_analizados'], analizadosAntes + 1)
+        self.assertEqual(grafo['entrantes']['nucleo/util.py'], ['nucleo/modelos.py', 'nucleo/servicio.py'])
+
+
+if __name__ == '__main__':
+    unittest.main()
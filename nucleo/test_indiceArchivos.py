@@ -0,0 +1,83 @@
+import unittest
+import os
+import shutil
+import tempfile
+import logging
+import subprocess
+from unittest import mock
+from config import settings
+from nucleo import indiceArchivos
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(name)s - %(funcName)s: %(message)s')
+log_test = logging.getLogger(__name__)
+
+
+class TestIndiceArchivos(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.rutaMeta = os.path.join(self.test_dir, '.orion_meta')
+        for rel in ('app/a.php', 'app/sub/b.js', 'app/sub/profundo/c.py', 'app/vendor/x.php',
+                    'app/.oculto/y.php', 'app/notas.txt'):
+            self._escribir(rel)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def _escribir(self, rel, contenido="x"):
+        ruta = os.path.join(self.test_dir, rel)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(ruta, 'w', encoding='utf-8') as f:
+            f.write(contenido)
+
+    def _listar(self):
+        with mock.patch.object(settings, 'LISTADO_ARCHIVOS_GIT', False):
+            return self._listarConConfiguracionActual()
+
+    def _listarConConfiguracionActual(self):
+        rutaApp = os.path.join(self.test_dir, 'app')
+        archivos = indiceArchivos.listarArchivos(rutaApp, ['.php', '.js', '.py'], ['vendor'], self.rutaMeta)
+        return [os.path.relpath(r, rutaApp).replace(os.sep, '/') for r in archivos]
+
+    def test_listado_inicial_aplica_filtros(self):
+        self.assertEqual(self._listar(), ['a.php', 'sub/b.js', 'sub/profundo/c.py'])
+        self.assertTrue(os.path.exists(os.path.join(self.rutaMeta, indiceArchivos.NOMBRE_ARCHIVO_INDICE)))
+
+    def test_actualizacion_incremental(self):
+        self._listar()
+        reescaneadosAntes = indiceArchivos.obtenerEstadisticas()['directorios_reescaneados']
+        # Sin cambios no se vuelve a listar ningún directorio
+        self._listar()
+        self.assertEqual(indiceArchivos.obtenerEstadisticas()['directorios_reescaneados'], reescaneadosAntes)
+
+        self._escribir('app/sub/nuevo.php')
+        self._escribir('app/otro/dir/d.js')
+        shutil.rmtree(os.path.join(self.test_dir, 'app/sub/profundo'))
+        self.assertEqual(self._listar(), ['a.php', 'otro/dir/d.js', 'sub/b.js', 'sub/nuevo.php'])
+
+    def test_cambio_de_filtros_reconstruye(self):
+        self._listar()
+        rutaApp = os.path.join(self.test_dir, 'app')
+        archivos = indiceArchivos.listarArchivos(rutaApp, ['.php'], [], self.rutaMeta)
+        self.assertIn(os.path.normpath(os.path.join(rutaApp, 'vendor/x.php')), archivos)
+
+
+    @unittest.skipUnless(shutil.which('git'), "git no disponible")
+    def test_listado_via_git_respeta_gitignore(self):
+        self._escribir('app/.gitignore', 'generado/\n')
+        self._escribir('app/generado/g.php')
+        self._escribir('app/borrado.php')
+        subprocess.run(['git', 'init', '-q'], cwd=self.test_dir, check=True)
+        subprocess.run(['git', 'add', '-A'], cwd=self.test_dir, check=True)
+        os.remove(os.path.join(self.test_dir, 'app/borrado.php'))
+        self._escribir('app/sin_versionar.php')
+        with mock.patch.object(settings, 'LISTADO_ARCHIVOS_GIT', True):
+            self.assertEqual(self._listarConConfiguracionActual(),
+                             ['a.php', 'sin_versionar.php', 'sub/b.js', 'sub/profundo/c.py'])
+        self.assertFalse(os.path.exists(self.rutaMeta))  # No hizo falta el índice en disco
+
+
+# Para poder ejecutar desde la línea de comandos
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+import os
+import shutil
+import tempfile
+import logging
+from unittest import mock
+from config import settings
+from nucleo import indiceBusqueda
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(name)s - %(funcName)s: %(message)s')
+log_test = logging.getLogger(__name__)
+
+PEDIDOS = """<?php
+class PedidoRepositorio {
+    public function guardarPedido($pedido) {
+        $this->db->insert('pedidos', $pedido);
+    }
+
+    public function borrarPedido($id) {
+        $this->db->delete('pedidos', $id);
+    }
+}
+"""
+
+CORREO = """def enviar_correo(destinatario, asunto):
+    smtp = conectar_smtp()
+    smtp.send(destinatario, asunto)
+
+
+def conectar_smtp():
+    return Smtp()
+"""
+
+
+class TestIndiceBusqueda(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.rutaMeta = os.path.join(self.test_dir, '.orion_meta')
+        self._escribir('app/PedidoRepositorio.php', PEDIDOS)
+        self._escribir('servicios/correo.py', CORREO)
+        self._escribir('README.js', "// Documentación del proyecto\n")
+        parche = mock.patch.object(settings, 'LISTADO_ARCHIVOS_GIT', False)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def _escribir(self, rel, contenido):
+        ruta = os.path.join(self.test_dir, rel)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(ruta, 'w', encoding='utf-8') as f:
+            f.write(contenido)
+
+    def _indice(self):
+        return indiceBusqueda.actualizarIndice(self.test_dir, self.rutaMeta, [], ['.php', '.py', '.js'])
+
+    def test_tokenizar(self):
+        self.assertEqual(indiceBusqueda.tokenizar("guardarPedido(self, HTTPServer) los envíos"),
+                         ['guardarpedido', 'guardar', 'pedido', 'httpserver', 'http', 'server', 'envio'])
+
+    def test_fragmentos_por_funcion(self):
+        fragmentos = [f[:4] for f in self._indice()['fragmentos']]
+        self.assertEqual(fragmentos, [
+            ('README.js', 1, 1, None),
+            ('app/PedidoRepositorio.php', 1, 2, None),
+            ('app/PedidoRepositorio.php', 3, 5, 'PedidoRepositorio::guardarPedido'),
+            ('app/PedidoRepositorio.php', 7, 9, 'PedidoRepositorio::borrarPedido'),
+            ('servicios/correo.py', 1, 3, 'enviar_correo'),
+            ('servicios/correo.py', 6, 7, 'conectar_smtp'),
+        ])
+
+    def test_busqueda_y_contexto(self):
+        indice = self._indice()
+        resultado = indiceBusqueda.buscar(indice, "Borrar los pedidos duplicados", k=2)
+        self.assertEqual(resultado[0]['nombre'], 'PedidoRepositorio::borrarPedido')
+        self.assertEqual(indiceBusqueda.buscar(indice, "reintentar el envío de correos", k=1)[0]['nombre'], 'enviar_correo')
+
+        consultas = indiceBusqueda.dividirConsultas("# TODO\n- [ ] Borrar pedidos\n\n2. Reintentar el correo SMTP\n")
+        self.assertEqual(consultas, ["TODO", "Borrar pedidos", "Reintentar el correo SMTP"])
+        with mock.patch.object(settings, 'DIRECTORIOS_IGNORADOS', []):
+            texto, incluidos = indiceBusqueda.construirContexto(
+                self.test_dir, consultas, 60, lambda t: len(t.split()), k=1, rutaMeta=self.rutaMeta)
+        self.assertEqual([f['nombre'] for f in incluidos], ['PedidoRepositorio::borrarPedido', 'conectar_smtp'])
+        self.assertIn("--- FRAGMENTO: app/PedidoRepositorio.php líneas 7-9 (PedidoRepositorio::borrarPedido) ---", texto)
+
+    def test_incremental(self):
+        self._indice()
+        analizadosAntes = indiceBusqueda.obtenerEstadisticas()['archivos_analizados']
+        self._escribir('servicios/correo.py', "\n" + CORREO)
+        indice = self._indice()
+        self.assertEqual(indiceBusqueda.obtenerEstadisticas()['archivos_analizados'], analizadosAntes + 1)
+        self.assertEqual(indiceBusqueda.buscar(indice, "smtp", k=1)[0]['linea_inicio'], 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import unittest
+import os
+import shutil
+import tempfile
+import logging
+from unittest import mock
+from config import settings
+from nucleo import indiceSimbolos
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(name)s - %(funcName)s: %(message)s')
+log_test = logging.getLogger(__name__)
+
+PHP = """<p>Don't</p>
+<?php
+abstract class Pedido extends Base {
+    public static function crear($datos = "}") {
+        $f = function() { return '{'; };
+        return Pedido::class;
+    }
+    abstract protected function validar();
+}
+function ayudante() {
+    // }
+}
+"""
+
+JS = """export default class Carrito {
+  constructor(items) { this.items = items; }
+  static async total({ iva } = {}) {
+    const r = /[{']/g;
+    return `${iva}}`;
+  }
+}
+const sumar = (a, b) => {
+  return a / b;
+};
+"""
+
+PY = """import os
+
+@decorador
+class Servicio:
+    def ejecutar(self):
+        def interna():
+            pass
+
+async def principal():
+    pass
+"""
+
+
+class TestIndiceSimbolos(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.rutaMeta = os.path.join(self.test_dir, '.orion_meta')
+        parche = mock.patch.object(settings, 'LISTADO_ARCHIVOS_GIT', False)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def _escribir(self, rel, contenido):
+        ruta = os.path.join(self.test_dir, rel)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(ruta, 'w', encoding='utf-8') as f:
+            f.write(contenido)
+
+    def test_php(self):
+        self.assertEqual(indiceSimbolos.extraerSimbolos(PHP, '.php'), [
+            ['clase', 'Pedido', None, 3, 9],
+            ['metodo', 'crear', 'Pedido', 4, 7],
+            ['metodo', 'validar', 'Pedido', 8, 8],
+            ['funcion', 'ayudante', None, 10, 12],
+        ])
+
+    def test_js(self):
+        self.assertEqual(indiceSimbolos.extraerSimbolos(JS, '.js'), [
+            ['clase', 'Carrito', None, 1, 7],
+            ['metodo', 'constructor', 'Carrito', 2, 2],
+            ['metodo', 'total', 'Carrito', 3, 6],
+            ['funcion', 'sumar', None, 8, 10],
+        ])
+
+    def test_python(self):
+        self.assertEqual(indiceSimbolos.extraerSimbolos(PY, '.py'), [
+            ['clase', 'Servicio', None, 3, 7],
+            ['metodo', 'ejecutar', 'Servicio', 5, 7],
+            ['funcion', 'interna', 'ejecutar', 6, 7],
+            ['funcion', 'principal', None, 9, 10],
+        ])
+
+    def test_indice_incremental_y_busqueda(self):
+        self._escribir('app/Pedido.php', PHP)
+        self._escribir('app/carrito.js', JS)
+        self._escribir('app/roto.py', "def (:\n")
+        indice = indiceSimbolos.actualizarIndiceSimbolos(self.test_dir, self.rutaMeta, [], ['.php', '.js', '.py'])
+        self.assertEqual(indice['app/roto.py']['simbolos'], [])
+        encontrados = indiceSimbolos.buscarSimbolos(indice, 'Pedido::crear')
+        self.assertEqual(encontrados, [{'archivo': 'app/Pedido.php', 'tipo': 'metodo', 'nombre': 'crear',
+                                        'contenedor': 'Pedido', 'linea_inicio': 4, 'linea_fin': 7}])
+
+        analizadosAntes = indiceSimbolos.obtenerEstadisticas()['archivos_analizados']
+        self._escribir('app/carrito.js', "\n\n" + JS)
+        indice = indiceSimbolos.actualizarIndiceSimbolos(self.test_dir, self.rutaMeta, [], ['.php', '.js', '.py'])
+        self.assertEqual(indiceSimbolos.obtenerEstadisticas()['archivos_analizados'], analizadosAntes + 1)
+        self.assertEqual(indiceSimbolos.buscarSimbolos(indice, 'sumar')[0]['linea_inicio'], 10)
+
+        simbolos = indiceSimbolos.obtenerSimbolosArchivo(self.test_dir, 'app/Pedido.php', self.rutaMeta)
+        self.assertEqual(indiceSimbolos.simboloEnLinea(simbolos, 5)[1], 'crear')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import os
+import shutil
+import tempfile
+import logging
+from nucleo import lectorLineas
+from nucleo import aplicadorCambios
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(name)s - %(funcName)s: %(message)s')
+log_test = logging.getLogger(__name__)
+
+
+class TestLectorLineas(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def _escribir(self, rel, contenido):
+        ruta = os.path.join(self.test_dir, rel)
+        with open(ruta, 'w', encoding='utf-8', newline='') as f:
+            f.write(contenido)
+        return ruta
+
+    def _leer(self, ruta):
+        with open(ruta, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def test_conteo_igual_que_readlines(self):
+        for contenido in ("", "a", "a\n", "a\nb", "a\nb\n\n", "ñ\n€\n"):
+            ruta = self._escribir('f.txt', contenido)
+            lectorLineas.invalidar(ruta)
+            with open(ruta, 'r', encoding='utf-8') as f:
+                esperado = len(f.readlines())
+            self.assertEqual(lectorLineas.contarLineas(ruta), esperado, repr(contenido))
+
+    def test_leer_rango(self):
+        ruta = self._escribir('f.php', "uno\r\ndós\ntres\ncuatro")
+        self.assertEqual(lectorLineas.leerRangoLineas(ruta, 2, 3), "dós\ntres\n")
+        self.assertEqual(lectorLineas.leerRangoLineas(ruta, 1, 1), "uno\n")
+        self.assertEqual(lectorLineas.leerRangoLineas(ruta, 4, 4), "cuatro")
+        self.assertIsNone(lectorLineas.leerRangoLineas(ruta, 3, 5))
+        self.assertIsNone(lectorLineas.leerRangoLineas(os.path.join(self.test_dir, 'no.php'), 1, 1))
+
+    def test_cache_se_invalida_al_cambiar(self):
+        ruta = self._escribir('f.txt', "a\nb\n")
+        self.assertEqual(lectorLineas.contarLineas(ruta), 2)
+        aciertos = lectorLineas.obtenerEstadisticas()['aciertos_cache']
+        self.assertEqual(lectorLineas.contarLineas(ruta), 2)
+        self.assertEqual(lectorLineas.obtenerEstadisticas()['aciertos_cache'], aciertos + 1)
+        self._escribir('f.txt', "a\nb\nc\nd\n")
+        self.assertEqual(lectorLineas.contarLineas(ruta), 4)
+
+    def test_empalmar(self):
+        ruta = self._escribir('f.txt', "1\n2\n3\n4\n")
+        self.assertTrue(lectorLineas.empalmarLineas(ruta, 1, 3, "x\n"))
+        self.assertEqual(self._leer(ruta), "1\nx\n4\n")
+        self.assertEqual(lectorLineas.contarLineas(ruta), 3)
+        self.assertTrue(lectorLineas.empalmarLineas(ruta, 3, 3, "fin\n"))
+        self.assertEqual(self._leer(ruta), "1\nx\n4\nfin\n")
+        self.assertFalse(lectorLineas.empalmarLineas(ruta, 2, 9, ""))
+
+    def test_empalmar_respeta_crlf(self):
+        ruta = self._escribir('f.php', "1\r\n2\r\n3\r\n")
+        self.assertTrue(lectorLineas.empalmarLineas(ruta, 1, 2, "x\ny\n"))
+        self.assertTrue(lectorLineas.empalmarLineas(ruta, 0, 1, "cero\r\n"))  # Sin prefijo: se mira el sufijo
+        with open(ruta, 'rb') as f:
+            self.assertEqual(f.read(), b"cero\r\nx\r\ny\r\n3\r\n")
+        ruta = self._escribir('g.txt', "1\n2\n")
+        self.assertTrue(lectorLineas.empalmarLineas(ruta, 1, 2, "a\r\nb\n"))
+        with open(ruta, 'rb') as f:
+            self.assertEqual(f.read(), b"1\na\nb\n")
+
+    def test_aplicar_cambios_granulares_sobre_el_mismo_archivo(self):
+        self._escribir('app.php', "a\nb\nc\nd\n")
+        operaciones = {"modificaciones": [
+            {"tipo_operacion": "REEMPLAZAR_BLOQUE", "ruta_archivo": "app.php",
+             "linea_inicio": 2, "linea_fin": 3, "nuevo_contenido": "B\nC\nC2"},
+            {"tipo_operacion": "AGREGAR_BLOQUE", "ruta_archivo": "app.php",
+             "insertar_despues_de_linea": 0, "nuevo_contenido": "inicio"},
+            {"tipo_operacion": "ELIMINAR_BLOQUE", "ruta_archivo": "app.php",
+             "linea_inicio": 6, "linea_fin": 6},
+        ]}
+        exito, error = aplicadorCambios.aplicarCambiosGranulares(operaciones, self.test_dir)
+        self.assertTrue(exito, error)
+        self.assertEqual(self._leer(os.path.join(self.test_dir, 'app.php')), "inicio\na\nB\nC\nC2\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+import os
+import time
+import shutil
+import tempfile
+import logging
+import multiprocessing
+from unittest import mock
+from nucleo.limitadorTokens import LimitadorTokensPersistente, VentanaTokens
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(name)s - %(funcName)s: %(message)s')
+log_test = logging.getLogger(__name__)
+
+
+def _registrarEnOtroProceso(ruta, tokens):
+    LimitadorTokensPersistente(ruta, 1000).registrar(tokens, 'google')
+
+
+class TestLimitadorTokensPersistente(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.ruta = os.path.join(self.test_dir, 'limitador.sqlite3')
+        self.limitador = LimitadorTokensPersistente(self.ruta, 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_reserva_y_prediccion_de_espera(self):
+        ahora = time.time()
+        with mock.patch.object(time, 'time', return_value=ahora):
+            idReserva, espera = self.limitador.intentarReservar(600)
+            self.assertIsNotNone(idReserva)
+            self.assertEqual(espera, 0.0)
+            idReserva2, espera2 = self.limitador.intentarReservar(600)
+            self.assertIsNone(idReserva2)
+        # La primera reserva caduca 60s después de hacerse
+        with mock.patch.object(time, 'time', return_value=ahora + 20):
+            self.assertAlmostEqual(self.limitador.predecirEspera(600), 40.0, places=3)
+        with mock.patch.object(time, 'time', return_value=ahora + 61):
+            self.assertEqual(self.limitador.predecirEspera(600), 0.0)
+            self.assertEqual(self.limitador.tokensEnVentana(), 0)
+
+    def test_ajustar_reserva_con_uso_real(self):
+        idReserva, _ = self.limitador.intentarReservar(100)
+        self.limitador.ajustar(idReserva, 350)
+        self.assertEqual(self.limitador.tokensEnVentana(), 350)
+
+    def test_compartido_entre_procesos(self):
+        proceso = multiprocessing.Process(target=_registrarEnOtroProceso, args=(self.ruta, 900))
+        proceso.start()
+        proceso.join()
+        self.assertEqual(self.limitador.tokensEnVentana(), 900)
+        self.assertGreater(self.limitador.predecirEspera(200), 0)
+
+    def test_peticion_mayor_que_el_limite(self):
+        self.assertEqual(self.limitador.predecirEspera(5000), 0.0)
+        self.limitador.registrar(10)
+        self.assertGreater(self.limitador.predecirEspera(5000), 0)
+
+
+class TestVentanaTokens(unittest.TestCase):
+
+    def setUp(self):
+        self.ahora = 1000.0
+        self.parche = mock.patch.object(time, 'monotonic', side_effect=lambda: self.ahora)
+        self.parche.start()
+        self.ventana = VentanaTokens(1000)
+
+    def tearDown(self):
+        self.parche.stop()
+
+    def test_instante_exacto_en_que_cabe(self):
+        self.ventana.registrar(300)
+        self.ahora += 10
+        self.ventana.registrar(500)
+        self.ahora += 5
+        # Para 400 tokens basta con que caduque el primer consumo (t=1000 -> libre en t=1060)
+        self.assertAlmostEqual(self.ventana.predecirEspera(400), 45.0)
+        # Para 900 hace falta que caduquen los dos (t=1010 -> libre en t=1070)
+        self.assertAlmostEqual(self.ventana.predecirEspera(900), 55.0)
+        self.ahora += 45
+        self.assertEqual(self.ventana.tokensEnVentana(), 500)
+        self.assertEqual(self.ventana.predecirEspera(400), 0.0)
+
+    def test_espera_sin_recursion_y_metricas(self):
+        esperas = []
+
+        def dormir(segundos):
+            esperas.append(segundos)
+            self.ahora += segundos
+        self.ventana.registrar(900)
+        with mock.patch.object(time, 'sleep', side_effect=dormir):
+            self.ventana.esperarYReservar(200)
+            # Mayor que todo el presupuesto: pasa en cuanto la ventana queda vacía
+            self.ventana.esperarYReservar(5000)
+        self.assertEqual(esperas, [60.0, 60.0])
+        metricas = self.ventana.obtenerMetricas()
+        self.assertEqual(metricas['reservas'], 2)
+        self.assertEqual(metricas['reservas_con_espera'], 2)
+        self.assertEqual(metricas['peticiones_sobredimensionadas'], 1)
+        self.assertAlmostEqual(metricas['segundos_esperando'], 120.0)
+
+    def test_ajustar_reserva(self):
+        idReserva, _ = self.ventana.intentarReservar(100)
+        self.ventana.ajustar(idReserva, 40)
+        self.assertEqual(self.ventana.tokensEnVentana(), 40)
+
+
+# Para poder ejecutar desde la línea de comandos
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+import unittest
+import os
+import shutil
+import tempfile
+import logging
+from unittest import mock
+from nucleo import manejadorMision
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(name)s - %(funcName)s: %(message)s')
+log_test = logging.getLogger(__name__)
+
+MISION = """# Misión: RefactorPedidos
+
+**Metadatos de la Misión:**
+- **Nombre Clave:** RefactorPedidos
+- **Archivo Principal:** app/Pedido.php
+- **Archivos de Contexto (Generación):** Ninguno
+- **Archivos de Contexto (Ejecución):** [app/Base.php, /app/[Util].php]
+- **Razón (Paso 1.1):** Clase demasiado grande.
+- **Estado:** PENDIENTE
+
+## Tareas de Refactorización:
+---
+### Tarea T1: Extraer validación
+- **ID:** T1
+- **Estado:** COMPLETADA
+- **Descripción:** Mover la validación
+  a un método propio.
+- **Archivos Implicados Específicos:** app/Pedido.php
+- **Bloques de Código Objetivo:**
+  - **Archivo:** `app/Pedido.php`
+    - **Nombre Bloque:** Pedido::crear
+    - **Línea Inicio:** 3
+    - **Línea Fin:** 10
+  - **Archivo:** app/Otro.php
+    - **Nombre Bloque:** sin rango
+- **Intentos:** 0
+---
+### Tarea T2: Renombrar total
+- **ID:** T2
+- **Estado:** PENDIENTE
+- **Descripción:** Renombrar total() a calcularTotal().
+- **Archivos Implicados Específicos:** Ninguno
+- **Intentos:** 0
+"""
+
+
+class TestManejadorMision(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.rutaSidecar = manejadorMision.rutaSidecar(self.test_dir, "RefactorPedidos")
+        manejadorMision._memoria.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_parseo(self):
+        metadatos, tareas, hayPendientes = manejadorMision.parsear_mision_orion(MISION)
+        self.assertEqual(metadatos["nombre_clave"], "RefactorPedidos")
+        self.assertEqual(metadatos["archivos_contexto_generacion"], [])
+        self.assertEqual(metadatos["archivos_contexto_ejecucion"], ["app/Base.php", "app/Util.php"])
+        self.assertTrue(hayPendientes)
+        self.assertEqual([(t["id"], t["estado"]) for t in tareas], [("T1", "COMPLETADA"), ("T2", "PENDIENTE")])
+        self.assertEqual(tareas[0]["descripcion"], "Mover la validación\na un método propio.")
+        self.assertEqual(tareas[0]["bloques_codigo_objetivo"], [
+            {"archivo": "app/Pedido.php", "nombre_bloque": "Pedido::crear", "linea_inicio": 3, "linea_fin": 10}])
+        self.assertEqual(tareas[1]["archivos_implicados_especificos"], [])
+        self.assertEqual((tareas[1]["line_start_index"], tareas[1]["line_end_index"]), (27, 32))
+
+        # Las tareas devueltas son copias: modificarlas no altera el modelo memorizado
+        tareas[0]["bloques_codigo_objetivo"][0]["linea_inicio"] = 99
+        self.assertEqual(manejadorMision.parsear_mision_orion(MISION)[1][0]["bloques_codigo_objetivo"][0]["linea_inicio"], 3)
+
+    def test_id_discrepante_descarta_la_tarea(self):
+        contenido = MISION.replace("- **ID:** T2", "- **ID:** T9")
+        _, tareas, _ = manejadorMision.parsear_mision_orion(contenido)
+        self.assertEqual([t["id"] for t in tareas], ["T1"])
+
+    def test_sidecar_evita_reparsear(self):
+        manejadorMision.parsear_mision_orion(MISION, ruta_sidecar=self.rutaSidecar)
+        self.assertTrue(os.path.exists(self.rutaSidecar))
+        manejadorMision._memoria.clear()  # Como en una fase nueva
+        with mock.patch.object(manejadorMision, '_parsearMision', side_effect=AssertionError("reparseo")):
+            metadatos, tareas, _ = manejadorMision.parsear_mision_orion(MISION, ruta_sidecar=self.rutaSidecar)
+        self.assertEqual(metadatos["nombre_clave"], "RefactorPedidos")
+        self.assertEqual(len(tareas), 2)
+
+        # Si el markdown cambia, la huella no coincide y se vuelve a parsear
+        manejadorMision._memoria.clear()
+        parseosAntes = manejadorMision.obtenerEstadisticas()['parseos']
+        manejadorMision.parsear_mision_orion(MISION + "\n", ruta_sidecar=self.rutaSidecar)
+        self.assertEqual(manejadorMision.obtenerEstadisticas()['parseos'], parseosAntes + 1)
+
+    def test_marcar_tarea_sin_reparsear(self):
+        nuevo = manejadorMision.marcar_tarea_como_completada(MISION, "T2", "FALLIDA_TEMPORALMENTE",
+                                                             incrementar_intentos_si_fallida_temp=True)
+        self.assertIn("- **ID:** T2\n- **Estado:** FALLIDA_TEMPORALMENTE\n", nuevo)
+        self.assertTrue(nuevo.endswith("- **Intentos:** 1\n"))
+        parseosAntes = manejadorMision.obtenerEstadisticas()['parseos']
+        _, tareas, hayPendientes = manejadorMision.parsear_mision_orion(nuevo)
+        self.assertEqual(manejadorMision.obtenerEstadisticas()['parseos'], parseosAntes)
+        self.assertEqual((tareas[1]["estado"], tareas[1]["intentos"]), ("FALLIDA_TEMPORALMENTE", 1))
+        self.assertFalse(hayPendientes)
+
+        manejadorMision._memoria.clear()
+        self.assertEqual(manejadorMision.parsear_mision_orion(nuevo)[1], tareas)
+        self.assertEqual(manejadorMision.marcar_tarea_como_completada(MISION, "T7"), MISION)
+
+    def test_actualizacion_por_lotes_encadenada(self):
+        nuevo, mision = manejadorMision.actualizar_estados_tareas(
+            MISION, {"T1": "SALTADA", "T2": "FALLIDA_TEMPORALMENTE"}, incrementar_intentos_si_fallida_temp=True)
+        parseosAntes = manejadorMision.obtenerEstadisticas()['parseos']
+        # El modelo devuelto trae los offsets ya desplazados: la siguiente actualización no reparsea
+        nuevo, mision = manejadorMision.actualizar_estados_tareas(
+            nuevo, {"T1": "COMPLETADA", "T2": "FALLIDA_TEMPORALMENTE"}, incrementar_intentos_si_fallida_temp=True)
+        self.assertEqual(manejadorMision.obtenerEstadisticas()['parseos'], parseosAntes)
+        self.assertIn("- **ID:** T1\n- **Estado:** COMPLETADA\n", nuevo)
+        self.assertTrue(nuevo.endswith("- **Estado:** FALLIDA_TEMPORALMENTE\n- **Descripción:** Renombrar total() a calcularTotal().\n"
+                                       "- **Archivos Implicados Específicos:** Ninguno\n- **Intentos:** 2\n"))
+
+        manejadorMision._memoria.clear()
+        reparseada = manejadorMision.obtenerModeloMision(nuevo)
+        self.assertEqual(reparseada.aDiccionario(), mision.aDiccionario())
+        self.assertEqual(manejadorMision.actualizar_estados_tareas(MISION, {"T1": "INVENTADO"}), (None, None))
+
+    def test_planificador_prioridad_y_dependencias(self):
+        tareas = [manejadorMision.TareaMision(id="A", estado="PENDIENTE"),
+                  manejadorMision.TareaMision(id="B", estado="PENDIENTE", dependencias=["A"]),
+                  manejadorMision.TareaMision(id="C", estado="FALLIDA_TEMPORALMENTE", intentos=1),
+                  manejadorMision.TareaMision(id="D", estado="FALLIDA_TEMPORALMENTE", intentos=2, dependencias=["X"])]
+        planificador = manejadorMision.PlanificadorTareas(tareas, maxReintentos=2)
+        # Reintentos primero; D ya agotó sus intentos y su dependencia inexistente se ignora
+        self.assertEqual([t.id for t, _ in planificador.listas()], ["C", "A"])
+        self.assertEqual(planificador.bloqueadas(), ["B"])
+
+        planificador.actualizarEstado("C", "FALLIDA_TEMPORALMENTE", intentos=2)
+        self.assertEqual(planificador.siguiente(), (tareas[0], 0))
+        planificador.actualizarEstado("A", "COMPLETADA")
+        self.assertEqual(planificador.siguiente(), (tareas[1], 1))
+        planificador.actualizarEstado("A", "PENDIENTE")  # Volver atrás bloquea de nuevo a B
+        self.assertEqual([t.id for t, _ in planificador.listas()], ["A"])
+        self.assertEqual(planificador.estadoDe("C"), ("FALLIDA_TEMPORALMENTE", 2))
+        self.assertFalse(planificador.actualizarEstado("Z", "COMPLETADA"))
+
+    def test_proxima_tarea_con_limite_de_la_mision(self):
+        contenido = MISION.replace("- **Estado:** PENDIENTE\n\n", "- **Estado:** PENDIENTE\n- **Máximo Reintentos:** 1\n\n")
+        contenido = contenido.replace("- **ID:** T2\n- **Estado:** PENDIENTE", "- **ID:** T2\n- **Estado:** FALLIDA_TEMPORALMENTE")
+        contenido = contenido.replace("- **Archivos Implicados Específicos:** Ninguno\n- **Intentos:** 0",
+                                      "- **Archivos Implicados Específicos:** Ninguno\n- **Depende De:** [T1]\n- **Intentos:** 1")
+        metadatos, tareas, _ = manejadorMision.parsear_mision_orion(contenido)
+        self.assertEqual(metadatos["max_reintentos"], 1)
+        self.assertEqual(tareas[1]["dependencias"], ["T1"])
+        self.assertEqual(manejadorMision.obtener_proxima_tarea_pendiente(contenido), (None, -1))
+        tarea, indice = manejadorMision.obtener_proxima_tarea_pendiente(tareas, max_reintentos=2)
+        self.assertEqual((tarea["id"], indice), ("T2", 1))
+
+    def test_dependencias_inferidas_y_lote(self):
+        def tarea(id, *bloques, implicados=None, estado="PENDIENTE", dependencias=None):
+            return {"id": id, "estado": estado, "intentos": 0, "dependencias": dependencias or [],
+                    "archivos_implicados_especificos": implicados or [],
+                    "bloques_codigo_objetivo": [{"archivo": a, "linea_inicio": i, "linea_fin": f} for a, i, f in bloques]}
+        tareas = [tarea("A", ("app/Pedido.php", 10, 20)),
+                  tarea("B", ("app/Pedido.php", 30, 40)),
+                  tarea("C", ("app/Pedido.php", 15, 35)),
+                  tarea("D", ("web/main.js", 1, 5)),
+                  tarea("E", implicados=["/web/main.js"]),
+                  tarea("F", ("lib/util.py", 1, 9))]
+        self.assertEqual(manejadorMision.inferirDependencias(tareas), {0: [], 1: [], 2: [0, 1], 3: [], 4: [3], 5: []})
+
+        planificador = manejadorMision.PlanificadorTareas(tareas, inferirSolapes=True)
+        # B comparte archivo con A (aunque no rango): no se prepara desde el mismo contenido
+        self.assertEqual([t["id"] for t, _ in planificador.lote(5)], ["A", "D", "F"])
+        self.assertEqual([t["id"] for t, _ in planificador.lote(2)], ["A", "D"])
+        planificador.actualizarEstado("A", "COMPLETADA")
+        planificador.actualizarEstado("D", "FALLIDA_PERMANENTEMENTE")  # Ya no se ejecutará: deja de ordenar a E
+        self.assertEqual([t["id"] for t, _ in planificador.lote(5)], ["B", "E", "F"])
+
+        # Una arista inferida que cerraría un ciclo con una dependencia explícita se descarta
+        tareas[0]["dependencias"] = ["C"]
+        planificador = manejadorMision.PlanificadorTareas(tareas, inferirSolapes=True)
+        self.assertEqual([t["id"] for t, _ in planificador.listas()], ["B", "D", "F"])
+        self.assertEqual(planificador.lote(5)[0][0]["id"], "B")
+
+        # Ciclo mixto: T1 depende explícitamente de T3, T2 se solapa con T1 y T3 con T2
+        mixto = [tarea("T1", ("app/a.py", 1, 10), dependencias=["T3"]),
+                 tarea("T2", ("app/a.py", 5, 15), ("app/b.py", 1, 5)),
+                 tarea("T3", ("app/b.py", 3, 8))]
+        planificador = manejadorMision.PlanificadorTareas(mixto, inferirSolapes=True)
+        self.assertEqual([t["id"] for t, _ in planificador.lote(5)], ["T3"])
+        self.assertEqual(planificador.bloqueadas(), ["T1", "T2"])
+        planificador.actualizarEstado("T3", "COMPLETADA")
+        self.assertEqual([t["id"] for t, _ in planificador.lote(5)], ["T1"])
+
+        operaciones = [{"ruta_archivo": "./app/Pedido.php"}, {"ruta_archivo": "app/Otro.php"}, {"ruta_archivo": "app/Otro.php"}]
+        self.assertEqual(manejadorMision.rutasFueraDeTarea(tareas[0], operaciones), ["app/Otro.php"])
+        self.assertEqual(manejadorMision.rutasFueraDeTarea(tareas[4], [{"ruta_archivo": "web/main.js"}]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
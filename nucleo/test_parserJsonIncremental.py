@@ -0,0 +1,66 @@
+import unittest
+import json
+import logging
+from nucleo.parserJsonIncremental import ParserListaIncremental, RespuestaMalformadaError
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(name)s - %(funcName)s: %(message)s')
+log_test = logging.getLogger(__name__)
+
+
+RESPUESTA = {
+    "advertencia_ejecucion": None,
+    "modificaciones": [
+        {"tipo_operacion": "REEMPLAZAR_BLOQUE", "ruta_archivo": "app/a.php", "linea_inicio": 3, "linea_fin": 9,
+         "nuevo_contenido": "function f() {\n    return \"}]{[\\\\\";\n}\n"},
+        {"tipo_operacion": "ELIMINAR_BLOQUE", "ruta_archivo": "app/b.js", "linea_inicio": 1, "linea_fin": 2},
+    ],
+}
+
+
+class TestParserListaIncremental(unittest.TestCase):
+
+    def _alimentarPorTrozos(self, parser, texto, tam):
+        emitidos = []
+        for i in range(0, len(texto), tam):
+            emitidos.append(parser.alimentar(texto[i:i + tam]))
+        return emitidos
+
+    def test_emite_objetos_en_cuanto_se_completan(self):
+        texto = json.dumps(RESPUESTA, indent=2)
+        for tam in (1, 7, 64, len(texto)):
+            parser = ParserListaIncremental()
+            emitidos = self._alimentarPorTrozos(parser, texto, tam)
+            planos = [op for lote in emitidos for op in lote]
+            self.assertEqual(planos, RESPUESTA["modificaciones"], f"tam={tam}")
+            self.assertTrue(parser.lista_cerrada)
+            self.assertEqual(parser.texto_completo(), texto)
+
+    def test_el_primer_objeto_sale_antes_del_final(self):
+        texto = json.dumps(RESPUESTA)
+        corte = texto.index('{"tipo_operacion": "ELIMINAR_BLOQUE"')
+        parser = ParserListaIncremental()
+        self.assertEqual(parser.alimentar(texto[:corte]), [RESPUESTA["modificaciones"][0]])
+        self.assertEqual(parser.alimentar(texto[corte:]), [RESPUESTA["modificaciones"][1]])
+
+    def test_ignora_vallas_y_claves_en_cadenas(self):
+        texto = ('```json\n{"advertencia_ejecucion": "ver \\"modificaciones\\": [1]", '
+                 '"otra": {"modificaciones": [{"x": 1}]}, "modificaciones": [{"y": 2}]}\n```')
+        parser = ParserListaIncremental()
+        self.assertEqual(parser.alimentar(texto), [{"y": 2}])
+
+    def test_aborta_con_elemento_no_objeto(self):
+        parser = ParserListaIncremental()
+        parser.alimentar('{"modificaciones": [{"a": 1}, ')
+        with self.assertRaises(RespuestaMalformadaError):
+            parser.alimentar('"texto suelto"')
+
+    def test_aborta_con_objeto_invalido(self):
+        parser = ParserListaIncremental()
+        with self.assertRaises(RespuestaMalformadaError):
+            parser.alimentar('{"modificaciones": [{"a": 1,}]}')
+
+
+# Para poder ejecutar desde la línea de comandos
+if __name__ == '__main__':
+    unittest.main()
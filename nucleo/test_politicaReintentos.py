@@ -0,0 +1,82 @@
+import unittest
+import asyncio
+import logging
+from unittest import mock
+import google.api_core.exceptions
+from config import settings
+from nucleo import politicaReintentos
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(name)s - %(funcName)s: %(message)s')
+log_test = logging.getLogger(__name__)
+
+
+class TestPoliticaReintentos(unittest.TestCase):
+
+    def setUp(self):
+        self.parches = [
+            mock.patch.object(settings, 'IA_MAX_REINTENTOS', 2),
+            mock.patch.object(settings, 'IA_BACKOFF_BASE_SEGUNDOS', 0.001),
+            mock.patch.object(settings, 'IA_BACKOFF_MAX_SEGUNDOS', 0.01),
+            mock.patch.object(politicaReintentos, '_limiteFase', None),
+        ]
+        for p in self.parches:
+            p.start()
+        self.llamadas = []
+
+    def tearDown(self):
+        for p in reversed(self.parches):
+            p.stop()
+
+    def _llamadaQueFalla(self, errores):
+        """Devuelve una llamada que lanza los `errores` en orden y después tiene éxito."""
+        pendientes = list(errores)
+
+        async def llamada(api_provider, timeout):
+            self.llamadas.append(api_provider)
+            if pendientes:
+                raise pendientes.pop(0)
+            return ('{}', api_provider)
+        return llamada
+
+    def _ejecutar(self, llamada, proveedores=('google',), **kwargs):
+        return asyncio.run(politicaReintentos.ejecutarConReintentos(
+            llamada, list(proveedores), "test:", 300, **kwargs))
+
+    def test_reintenta_errores_transitorios(self):
+        llamada = self._llamadaQueFalla([google.api_core.exceptions.ServiceUnavailable("503")])
+        self.assertEqual(self._ejecutar(llamada), ('{}', 'google'))
+        self.assertEqual(self.llamadas, ['google', 'google'])
+
+    def test_no_reintenta_errores_permanentes(self):
+        llamada = self._llamadaQueFalla([google.api_core.exceptions.InvalidArgument("400")])
+        with self.assertRaises(google.api_core.exceptions.InvalidArgument):
+            self._ejecutar(llamada)
+        self.assertEqual(len(self.llamadas), 1)
+
+    def test_failover_tras_agotar_reintentos(self):
+        llamada = self._llamadaQueFalla([google.api_core.exceptions.ServiceUnavailable("503")] * 3)
+        self.assertEqual(self._ejecutar(llamada, ('google', 'openrouter')), ('{}', 'openrouter'))
+        self.assertEqual(self.llamadas, ['google'] * 3 + ['openrouter'])
+
+    def test_veto_de_reintento(self):
+        llamada = self._llamadaQueFalla([google.api_core.exceptions.ServiceUnavailable("503")])
+        with self.assertRaises(google.api_core.exceptions.ServiceUnavailable):
+            self._ejecutar(llamada, puedeReintentar=lambda: False)
+
+    def test_respeta_plazo_de_fase(self):
+        politicaReintentos.iniciarFase(politicaReintentos.MARGEN_FIN_FASE_SEGUNDOS - 1)
+        with self.assertRaises(TimeoutError):
+            self._ejecutar(self._llamadaQueFalla([]))
+        self.assertEqual(self.llamadas, [])
+
+    def test_espera_respeta_retry_after(self):
+        with mock.patch.object(settings, 'IA_BACKOFF_MAX_SEGUNDOS', 60):
+            self.assertGreaterEqual(politicaReintentos.calcularEspera(0, retryAfter=7), 7)
+        respuesta = mock.Mock(headers={'retry-after': '12'})
+        self.assertEqual(politicaReintentos.extraerRetryAfter(mock.Mock(response=respuesta)), 12.0)
+
+
+# Para poder ejecutar desde la línea de comandos
+if __name__ == '__main__':
+    unittest.main()
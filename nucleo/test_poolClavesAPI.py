@@ -0,0 +1,55 @@
+import unittest
+import time
+import logging
+from unittest import mock
+from config import settings
+from nucleo.poolClavesAPI import PoolClavesAPI
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(name)s - %(funcName)s: %(message)s')
+log_test = logging.getLogger(__name__)
+
+
+class TestPoolClavesAPI(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = PoolClavesAPI('google', ['clave-aaaa', 'clave-bbbb', 'clave-cccc'])
+
+    def test_elige_la_clave_menos_cargada(self):
+        primera = self.pool.seleccionar(1000)
+        segunda = self.pool.seleccionar(10)
+        tercera = self.pool.seleccionar(10)
+        self.assertEqual(len({primera, segunda, tercera}), 3)
+        # La que reservó 1000 tokens es la más cargada: no vuelve a salir
+        self.assertNotEqual(self.pool.seleccionar(10), primera)
+
+    def test_registrar_uso_corrige_la_reserva(self):
+        clave = self.pool.seleccionar(100)
+        self.pool.registrarUso(clave, 5000, tokensReservados=100)
+        stats = {s['clave']: s for s in self.pool.obtenerEstadisticas()}
+        self.assertEqual(stats[f"...{clave[-4:]}"]['tokens_ultimo_minuto'], 5000)
+
+    def test_ventana_de_un_minuto(self):
+        clave = self.pool.seleccionar(5000)
+        ahora = time.monotonic()
+        with mock.patch.object(time, 'monotonic', return_value=ahora + 61):
+            stats = {s['clave']: s for s in self.pool.obtenerEstadisticas()}
+        self.assertEqual(stats[f"...{clave[-4:]}"]['tokens_ultimo_minuto'], 0)
+
+    def test_cuota_agotada_enfria_la_clave(self):
+        with mock.patch.object(settings, 'API_KEY_ENFRIAMIENTO_SEGUNDOS', 60, create=True):
+            self.pool.marcarCuotaAgotada('clave-aaaa')
+            self.pool.marcarCuotaAgotada('clave-bbbb')
+            for _ in range(3):
+                self.assertEqual(self.pool.seleccionar(1000), 'clave-cccc')
+            # Con todas enfriadas se usa la que antes sale del enfriamiento
+            self.pool.marcarCuotaAgotada('clave-cccc')
+            self.assertEqual(self.pool.seleccionar(), 'clave-aaaa')
+
+    def test_pool_vacio(self):
+        self.assertIsNone(PoolClavesAPI('openrouter', []).seleccionar(10))
+
+
+# Para poder ejecutar desde la línea de comandos
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+import asyncio
+import logging
+from unittest import mock
+import google.api_core.exceptions
+from config import settings
+from nucleo import proveedoresIA
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(name)s - %(funcName)s: %(message)s')
+log_test = logging.getLogger(__name__)
+
+
+class TestProveedoresIA(unittest.TestCase):
+
+    def setUp(self):
+        """Límites de concurrencia pequeños, semáforos nuevos y un pool de claves simulado."""
+        self.pool = mock.Mock()
+        self.pool.seleccionar.return_value = 'clave-test'
+        self.enCurso = {'google': 0, 'openrouter': 0, 'total': 0}
+        self.maximos = {'google': 0, 'openrouter': 0, 'total': 0}
+        self.parches = [
+            mock.patch.object(settings, 'IA_MAX_CONCURRENCIA_GLOBAL', 3),
+            mock.patch.object(settings, 'IA_MAX_CONCURRENCIA_GOOGLE', 3),
+            mock.patch.object(settings, 'IA_MAX_CONCURRENCIA_OPENROUTER', 2),
+            mock.patch.object(proveedoresIA, '_semaforoGlobal', None),
+            mock.patch.object(proveedoresIA, '_semaforosProveedor', {}),
+            mock.patch.dict(proveedoresIA._estadisticas, {k: 0 for k in proveedoresIA._estadisticas}),
+            mock.patch.object(proveedoresIA.poolClavesAPI, 'obtenerPool', return_value=self.pool),
+            mock.patch.object(proveedoresIA, '_generarGeminiAsync', self._generadorFalso('google')),
+            mock.patch.object(proveedoresIA, '_generarOpenRouterAsync', self._generadorFalso('openrouter')),
+        ]
+        for p in self.parches:
+            p.start()
+
+    def tearDown(self):
+        for p in reversed(self.parches):
+            p.stop()
+
+    def _generadorFalso(self, proveedor):
+        async def _generar(modeloNombre, promptCompleto, configuracion, logPrefix, al_recibir_fragmento, timeout,
+                           apiKey=None):
+            if promptCompleto == 'error':
+                raise ValueError("fallo dentro de la corrutina")
+            if promptCompleto == 'cuota':
+                raise google.api_core.exceptions.ResourceExhausted("cuota agotada")
+            for clave in (proveedor, 'total'):
+                self.enCurso[clave] += 1
+                self.maximos[clave] = max(self.maximos[clave], self.enCurso[clave])
+            await asyncio.sleep(0.02)
+            for clave in (proveedor, 'total'):
+                self.enCurso[clave] -= 1
+            return {'texto': promptCompleto, 'tokens_prompt': 1, 'tokens_respuesta': 1, 'tokens_totales': 2}
+        return _generar
+
+    def _generarVarias(self, proveedores):
+        async def _todas():
+            return await asyncio.gather(*(
+                proveedoresIA.generarAsync(p, 'm', f"prompt {i}", {}, "test:") for i, p in enumerate(proveedores)))
+        return proveedoresIA.ejecutarSincrono(_todas())
+
+    def test_concurrencia_limitada_por_proveedor(self):
+        resultados = self._generarVarias(['openrouter'] * 6)
+        self.assertEqual([r['texto'] for r in resultados], [f"prompt {i}" for i in range(6)])
+        self.assertEqual(self.maximos['openrouter'], settings.IA_MAX_CONCURRENCIA_OPENROUTER)
+        stats = proveedoresIA.obtenerEstadisticas()
+        self.assertEqual((stats['llamadas'], stats['en_curso'], stats['maximo_simultaneo']), (6, 0, 2))
+        self.assertGreater(stats['esperas_por_limite'], 0)
+        self.assertEqual(self.pool.registrarUso.call_count, 6)
+
+    def test_concurrencia_limitada_globalmente(self):
+        self._generarVarias(['google', 'openrouter'] * 5)
+        self.assertEqual(self.maximos['total'], settings.IA_MAX_CONCURRENCIA_GLOBAL)
+        self.assertLessEqual(self.maximos['openrouter'], settings.IA_MAX_CONCURRENCIA_OPENROUTER)
+        self.assertEqual(proveedoresIA.obtenerEstadisticas()['maximo_simultaneo'], 3)
+
+    def test_excepcion_de_la_corrutina_llega_al_llamador_sincrono(self):
+        with self.assertRaises(ValueError):
+            proveedoresIA.ejecutarSincrono(proveedoresIA.generarAsync('google', 'm', 'error', {}, "test:"))
+        with self.assertRaises(google.api_core.exceptions.ResourceExhausted):
+            proveedoresIA.ejecutarSincrono(proveedoresIA.generarAsync('openrouter', 'm', 'cuota', {}, "test:"))
+        # La clave se marca según el tipo de error y el hueco de concurrencia se libera
+        self.pool.marcarCuotaAgotada.assert_called_once_with('clave-test')
+        self.pool.registrarUso.assert_not_called()
+        self.assertEqual(proveedoresIA.obtenerEstadisticas()['en_curso'], 0)
+        resultado = proveedoresIA.ejecutarSincrono(proveedoresIA.generarAsync('google', 'm', 'ok', {}, "test:"))
+        self.assertEqual(resultado['texto'], 'ok')
+
+        with self.assertRaises(ValueError):
+            proveedoresIA.ejecutarSincrono(proveedoresIA.generarAsync('otro', 'm', 'ok', {}, "test:"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,21 +8,36 @@ import argparse
 import subprocess
 import time
 import signal
+import threading
+import concurrent.futures
 import re  # Para parseo robusto de misionOrion.md
-from datetime import datetime, timedelta
+from datetime import datetime
 from config import settings
 from nucleo import manejadorGit
 from nucleo import analizadorCodigo
 from nucleo import aplicadorCambios
 from nucleo import manejadorHistorial
 from nucleo import manejadorMision
+from nucleo import clientesIA
+from nucleo import cacheRespuestasIA
+from nucleo import proveedoresIA
+from nucleo import poolClavesAPI
+from nucleo import politicaReintentos
+from nucleo import limitadorTokens
+from nucleo import lectorLineas
+from nucleo import anclajeBloques
+from nucleo import grafoDependencias
 
 # --- Nuevas Constantes y Variables Globales ---
 REGISTRO_ARCHIVOS_ANALIZADOS_PATH = os.path.join(
     settings.RUTACLON, ".orion_meta", "registro_archivos_analizados.json")
 TOKEN_LIMIT_PER_MINUTE = getattr(
     settings, 'TOKEN_LIMIT_PER_MINUTE', 250000)
-token_usage_window = []
+# Reserva hecha por gestionar_limite_tokens pendiente de ajustar en registrar_tokens_usados (por hilo)
+_reservas_tokens = threading.local()
+# Tokens registrados en este proceso (una fase), para el presupuesto de PRESUPUESTO_TOKENS_FASE
+_tokens_fase = {'consumidos': 0}
+_lock_tokens_fase = threading.Lock()
 
 # --- Archivo para persistir el estado de la misión activa ---
 ACTIVE_MISSION_STATE_FILE = os.path.join(
@@ -39,42 +54,47 @@ class TimeoutException(Exception):
 
 
 def gestionar_limite_tokens(tokens_a_usar_estimados: int, proveedor_api: str):
-    global token_usage_window
+    """
+    Espera hasta que los tokens estimados quepan en la ventana por minuto compartida entre
+    procesos y los reserva. registrar_tokens_usados() corrige después la reserva con el uso real.
+    """
     logPrefix = "gestionar_limite_tokens:"
-    ahora = datetime.now()
-    token_usage_window = [
-        (ts, count) for ts, count in token_usage_window if ahora - ts < timedelta(seconds=60)
-    ]
-    tokens_usados_en_ventana = sum(count for _, count in token_usage_window)
+    limitador = limitadorTokens.obtenerLimitador()
     logging.debug(
-        f"{logPrefix} Tokens usados en los últimos 60s: {tokens_usados_en_ventana}. A usar: {tokens_a_usar_estimados}")
-
-    if tokens_usados_en_ventana + tokens_a_usar_estimados > TOKEN_LIMIT_PER_MINUTE:
-        segundos_a_esperar = 60 - \
-            (ahora - token_usage_window[0][0]
-             ).total_seconds() if token_usage_window else 60
-        segundos_a_esperar = max(1, int(segundos_a_esperar) + 1)
-        logging.info(f"{logPrefix} Límite de tokens ({TOKEN_LIMIT_PER_MINUTE}/min) excedería. "
-                     f"Usados: {tokens_usados_en_ventana}. A usar: {tokens_a_usar_estimados}. "
-                     f"Pausando por {segundos_a_esperar} segundos...")
-        time.sleep(segundos_a_esperar)
-        return gestionar_limite_tokens(tokens_a_usar_estimados, proveedor_api)
+        f"{logPrefix} Tokens usados en los últimos 60s (todos los procesos): {limitador.tokensEnVentana()}. A usar: {tokens_a_usar_estimados}")
+    _reservas_tokens.pendiente = limitador.esperarYReservar(
+        tokens_a_usar_estimados, proveedor_api, logPrefix)
     logging.info(
         f"{logPrefix} OK para proceder con {tokens_a_usar_estimados} tokens (estimados).")
     return True
 
 
-def registrar_tokens_usados(tokens_usados: int):
-    global token_usage_window
-    token_usage_window.append((datetime.now(), tokens_usados))
-    ahora = datetime.now()
-    token_usage_window = [
-        (ts, count) for ts, count in token_usage_window if ahora - ts < timedelta(seconds=60)
-    ]
-    tokens_usados_en_ventana_actual = sum(
-        count for _, count in token_usage_window)
+def registrar_tokens_usados(tokens_usados):
+    """
+    Registra tokens consumidos en la ventana de límite por minuto.
+    Acepta un entero o el sobre 'uso_api' que devuelven las funciones de analizadorCodigo.
+    """
+    proveedor = None
+    if isinstance(tokens_usados, dict):
+        uso_api = tokens_usados
+        proveedor = uso_api.get('proveedor')
+        tokens_usados = int(uso_api.get("tokens_totales", 0) or 0)
+        logging.info(
+            f"registrar_tokens_usados: {uso_api.get('proveedor')} ({uso_api.get('modelo')}): "
+            f"{uso_api.get('tokens_prompt', 0)} prompt + {uso_api.get('tokens_respuesta', 0)} respuesta = {tokens_usados} tokens, "
+            f"latencia {uso_api.get('latencia_segundos', 0)}s"
+            f"{', desde cache' if uso_api.get('desde_cache') else ''}{', estimado' if uso_api.get('estimado') else ''}.")
+    with _lock_tokens_fase:
+        _tokens_fase['consumidos'] += tokens_usados
+    limitador = limitadorTokens.obtenerLimitador()
+    id_reserva = getattr(_reservas_tokens, 'pendiente', None)
+    _reservas_tokens.pendiente = None
+    if id_reserva is not None:
+        limitador.ajustar(id_reserva, tokens_usados)
+    else:
+        limitador.registrar(tokens_usados, proveedor)
     logging.debug(
-        f"Registrados {tokens_usados} tokens. Ventana actual ({TOKEN_LIMIT_PER_MINUTE}/min): {tokens_usados_en_ventana_actual} tokens usados.")
+        f"Registrados {tokens_usados} tokens. Ventana actual ({TOKEN_LIMIT_PER_MINUTE}/min): {limitador.tokensEnVentana()} tokens usados.")
 
 
 # --- Funciones para el registro de archivos analizados (NUEVO) ---
@@ -236,6 +256,12 @@ def orchestrarEjecucionScript(args):
         logging.warning(
             "signal.alarm no disponible. Timeout general no activo.")
 
+    # Los reintentos de llamadas a la IA no deben consumir el tiempo que queda hasta la alarma.
+    politicaReintentos.iniciarFase(settings.SCRIPT_EXECUTION_TIMEOUT_SECONDS)
+
+    if getattr(args, 'sin_cache_ia', False):
+        cacheRespuestasIA.establecerBypass(True)
+
     exit_code = 1
     try:
         # En lugar de un ciclo, ahora se ejecuta una "fase"
@@ -263,6 +289,18 @@ def orchestrarEjecucionScript(args):
         guardar_registro_archivos(cargar_registro_archivos())
         logging.info(
             "Registro de archivos analizados guardado al finalizar script.")
+        logging.info(
+            f"Estadísticas del pool de clientes IA: {clientesIA.obtenerEstadisticasPool()}")
+        logging.info(
+            f"Estadísticas de la cache de respuestas IA: {cacheRespuestasIA.obtenerEstadisticas()}")
+        logging.info(
+            f"Estadísticas de concurrencia de llamadas IA: {proveedoresIA.obtenerEstadisticas()}")
+        logging.info(
+            f"Estadísticas del pool de claves API: {poolClavesAPI.obtenerEstadisticas()}")
+        logging.info(
+            f"Estadísticas de reintentos IA: {politicaReintentos.obtenerEstadisticas()}")
+        logging.info(
+            f"Métricas del limitador de tokens: {limitadorTokens.obtenerLimitador().obtenerMetricas()}")
     return exit_code
 
 
@@ -363,7 +401,7 @@ def paso0_revisar_mision_local(ruta_repo: str, nombre_clave_mision_activa: str):
                 contenido_mision = f.read()
 
             metadatos, lista_tareas, hay_tareas_pendientes = manejadorMision.parsear_mision_orion(
-                contenido_mision)
+                contenido_mision, ruta_sidecar=manejadorMision.rutaSidecar(ruta_repo, nombre_clave_mision_activa))
 
             if not metadatos or not metadatos.get("nombre_clave"):
                 logging.warning(
@@ -423,8 +461,20 @@ def paso1_1_seleccion_y_decision_inicial(ruta_repo, api_provider, registro_archi
         guardar_registro_archivos(registro_archivos)
         return "reintentar_seleccion", None, None, None
 
-    estructura_proyecto = analizadorCodigo.generarEstructuraDirectorio(
-        ruta_repo, directorios_ignorados=settings.DIRECTORIOS_IGNORADOS, max_depth=5, incluir_archivos=True)
+    # Contexto determinista: los archivos más relacionados por imports/require/use
+    archivos_ctx_grafo_rel = grafoDependencias.seleccionarContexto(
+        ruta_repo, archivo_seleccionado_rel, settings.CONTEXTO_GRAFO_TOP_K,
+        presupuestoTokens=settings.PRESUPUESTO_TOKENS_CONTEXTO, api_provider=api_provider,
+        directoriosIgnorados=settings.DIRECTORIOS_IGNORADOS)
+
+    if settings.PRESUPUESTO_TOKENS_ESTRUCTURA:
+        # Detalle completo alrededor del archivo elegido; lo lejano se resume para caber en el presupuesto
+        estructura_proyecto = analizadorCodigo.generarEstructuraRelevante(
+            ruta_repo, [archivo_seleccionado_rel] + archivos_ctx_grafo_rel,
+            directorios_ignorados=settings.DIRECTORIOS_IGNORADOS, api_provider=api_provider)
+    else:
+        estructura_proyecto = analizadorCodigo.generarEstructuraDirectorio(
+            ruta_repo, directorios_ignorados=settings.DIRECTORIOS_IGNORADOS, max_depth=5, incluir_archivos=True)
 
     resultado_lectura = analizadorCodigo.leerArchivos(
         [ruta_archivo_seleccionado_abs], ruta_repo, api_provider=api_provider)
@@ -451,10 +501,11 @@ def paso1_1_seleccion_y_decision_inicial(ruta_repo, api_provider, registro_archi
     gestionar_limite_tokens(tokens_estimados, api_provider)
 
     decision_IA_paso1_1 = analizadorCodigo.solicitar_evaluacion_archivo(
-        archivo_seleccionado_rel, contenido_archivo, estructura_proyecto, api_provider, ""
+        archivo_seleccionado_rel, contenido_archivo, estructura_proyecto, api_provider, "",
+        archivos_relacionados=archivos_ctx_grafo_rel
     )
     registrar_tokens_usados(decision_IA_paso1_1.get(
-        "tokens_consumidos_api", tokens_estimados) if decision_IA_paso1_1 else tokens_estimados)
+        "uso_api") or tokens_estimados if decision_IA_paso1_1 else tokens_estimados)
 
     if not decision_IA_paso1_1 or not decision_IA_paso1_1.get("necesita_refactor"):
         logging.info(f"{logPrefix} IA decidió que '{archivo_seleccionado_rel}' no necesita refactor. Razón: {decision_IA_paso1_1.get('razonamiento', 'N/A') if decision_IA_paso1_1 else 'Error IA'}")
@@ -468,10 +519,11 @@ def paso1_1_seleccion_y_decision_inicial(ruta_repo, api_provider, registro_archi
         f"{logPrefix} IA decidió SÍ refactorizar '{archivo_seleccionado_rel}'. Razón: {decision_IA_paso1_1.get('razonamiento')}")
     archivos_ctx_sugeridos_rel = decision_IA_paso1_1.get(
         "archivos_contexto_sugeridos", [])
-    archivos_ctx_validados_rel = []
+    # Primero los del grafo (ordenados por relevancia); las sugerencias de la IA se añaden detrás
+    archivos_ctx_validados_rel = list(archivos_ctx_grafo_rel)
     if decision_IA_paso1_1.get("necesita_contexto_adicional"):
         for f_rel in archivos_ctx_sugeridos_rel:
-            if not f_rel or f_rel == archivo_seleccionado_rel:
+            if not f_rel or f_rel == archivo_seleccionado_rel or f_rel in archivos_ctx_validados_rel:
                 continue
             if os.path.exists(os.path.join(ruta_repo, f_rel)) and os.path.isfile(os.path.join(ruta_repo, f_rel)):
                 archivos_ctx_validados_rel.append(f_rel)
@@ -496,10 +548,21 @@ def paso1_2_generar_mision(ruta_repo, archivo_a_refactorizar_rel, archivos_conte
         ruta_repo, archivo_a_refactorizar_rel)]
     for f_rel in archivos_contexto_para_crear_mision_rel:
         archivos_para_leer_abs.append(os.path.join(ruta_repo, f_rel))
-    archivos_para_leer_abs_unicos = sorted(list(set(archivos_para_leer_abs)))
+    # Sin duplicados y con el archivo a refactorizar primero (obligatorio): el presupuesto solo recorta el contexto.
+    archivos_para_leer_abs_unicos = list(dict.fromkeys(archivos_para_leer_abs))
 
     resultado_lectura_ctx = analizadorCodigo.leerArchivos(
-        archivos_para_leer_abs_unicos, ruta_repo, api_provider=api_provider)
+        archivos_para_leer_abs_unicos, ruta_repo, api_provider=api_provider,
+        max_tokens=settings.PRESUPUESTO_TOKENS_CONTEXTO or None, obligatorios=1)
+    if os.path.normpath(archivo_a_refactorizar_rel).replace(os.sep, '/') not in resultado_lectura_ctx['archivos']:
+        logging.error(
+            f"{logPrefix} No se pudo leer '{archivo_a_refactorizar_rel}'; no se genera una misión sin su código.")
+        manejadorHistorial.guardarHistorial(manejadorHistorial.cargarHistorial() + [
+            manejadorHistorial.formatearEntradaHistorial(
+                outcome=f"PASO1.2_ERROR_LECTURA:{archivo_a_refactorizar_rel}", decision=decision_paso1_1,
+                error_message="Archivo a refactorizar no legible")
+        ])
+        return "error_generando_mision", None, None
     contexto_completo_para_mision = resultado_lectura_ctx['contenido']
     tokens_contexto_mision = resultado_lectura_ctx['tokens']
     tokens_estimados = 700 + tokens_contexto_mision  # 700 para prompt base
@@ -512,7 +575,7 @@ def paso1_2_generar_mision(ruta_repo, archivo_a_refactorizar_rel, archivos_conte
         archivos_contexto_generacion_rel_list=archivos_contexto_para_crear_mision_rel
     )
     registrar_tokens_usados(contenido_mision_generado_dict.get(
-        "tokens_consumidos_api", tokens_estimados) if contenido_mision_generado_dict else tokens_estimados)
+        "uso_api") or tokens_estimados if contenido_mision_generado_dict else tokens_estimados)
 
     if not contenido_mision_generado_dict or \
        not contenido_mision_generado_dict.get("nombre_clave_mision") or \
@@ -559,59 +622,22 @@ def paso1_2_generar_mision(ruta_repo, archivo_a_refactorizar_rel, archivos_conte
 
     logging.info(
         f"{logPrefix} Misión '{nombre_clave_mision}' generada y commiteada (archivo: {nombre_archivo_mision}).")
+    _, tareas_mision_generada, _ = manejadorMision.parsear_mision_orion(
+        contenido_markdown_mision, ruta_sidecar=manejadorMision.rutaSidecar(ruta_repo, nombre_clave_mision))
+    anclajeBloques.registrarAnclas(ruta_repo, nombre_clave_mision, tareas_mision_generada)
     manejadorHistorial.guardarHistorial(manejadorHistorial.cargarHistorial() + [
         manejadorHistorial.formatearEntradaHistorial(
             outcome=f"PASO1.2_MISION_GENERADA:{nombre_clave_mision}", result_details=f"Archivo: {nombre_archivo_mision}")
     ])
     return "mision_generada_ok", contenido_markdown_mision, nombre_clave_mision
 
-def paso2_ejecutar_tarea_mision(ruta_repo, nombre_rama_mision, api_provider, modo_automatico):
-    # Esta función ahora es llamada cuando ya se está en la rama de la misión.
-    # El contenido de la misión (metadatos, lista_tareas) se carga desde el archivo en la rama.
-    logPrefix = f"paso2_ejecutar_tarea_mision (Rama: {nombre_rama_mision}):"
-    logging.info(f"{logPrefix} Iniciando ejecución de tarea.")
-
-    # Nombre del archivo de misión dinámico
-    nombre_archivo_mision = f"{nombre_rama_mision}.md"
-
-    # Asegurar estar en la rama correcta (doble check)
-    if manejadorGit.obtener_rama_actual(ruta_repo) != nombre_rama_mision:
-        logging.warning(
-            f"{logPrefix} No se estaba en la rama '{nombre_rama_mision}'. Intentando cambiar...")
-        if not manejadorGit.cambiar_a_rama_existente(ruta_repo, nombre_rama_mision):
-            logging.error(
-                f"{logPrefix} No se pudo cambiar a rama '{nombre_rama_mision}'. Abortando tarea.")
-            return "error_critico_git", None
-
-    ruta_mision_actual_md = os.path.join(ruta_repo, nombre_archivo_mision)
-    contenido_mision_actual_md = ""
-    if os.path.exists(ruta_mision_actual_md):
-        with open(ruta_mision_actual_md, 'r', encoding='utf-8') as f:
-            contenido_mision_actual_md = f.read()
-    else:
-        logging.error(
-            f"{logPrefix} Archivo de misión '{nombre_archivo_mision}' no encontrado en la rama '{nombre_rama_mision}'. Abortando tarea.")
-        return "error_critico_mision_no_encontrada", None
-
-    metadatos_mision, lista_tareas_mision, _ = manejadorMision.parsear_mision_orion(
-        contenido_mision_actual_md)
-    if not metadatos_mision:
-        logging.error(
-            f"{logPrefix} Fallo al re-parsear '{nombre_archivo_mision}' desde la rama. Abortando tarea.")
-        return "error_critico_parseo_mision", contenido_mision_actual_md
-
-    tarea_actual_info, _ = manejadorMision.obtener_proxima_tarea_pendiente(
-        lista_tareas_mision)
-
-    if not tarea_actual_info:
-        logging.info(
-            f"{logPrefix} No se encontraron tareas pendientes en '{nombre_rama_mision}'. Considerada completada.")
-        return "mision_completada", contenido_mision_actual_md
-
+def _prepararEntradaTarea(ruta_repo, nombre_rama_mision, metadatos_mision, tarea_actual_info, contenido_mision_actual_md, api_provider):
+    """
+    Limpia las rutas de la tarea, re-ancla y lee sus bloques de código objetivo y estima los tokens
+    de la llamada de ejecución. Devuelve (bloques_codigo_input_para_ia, tokens_estimados).
+    """
+    logPrefix = "_prepararEntradaTarea:"
     tarea_id = tarea_actual_info.get("id", "N/A_ID")
-    tarea_titulo = tarea_actual_info.get("titulo", "N/A_Titulo")
-    logging.info(
-        f"{logPrefix} Tarea a ejecutar: ID '{tarea_id}', Título: '{tarea_titulo}'")
 
     # --- INICIO: Limpieza de rutas de archivo ---
     def limpiar_lista_rutas(lista_rutas_crudas, origen_rutas_log=""):
@@ -652,6 +678,11 @@ def paso2_ejecutar_tarea_mision(ruta_repo, nombre_rama_mision, api_provider, mod
     
     # --- Preparación de contexto para la IA ---
     bloques_codigo_objetivo_tarea = tarea_actual_info.get("bloques_codigo_objetivo", [])
+    if bloques_codigo_objetivo_tarea and settings.REANCLAJE_BLOQUES:
+        # Tareas previas de la misión pueden haber desplazado los rangos escritos al crearla
+        bloques_codigo_objetivo_tarea = anclajeBloques.reanclarBloques(
+            ruta_repo, nombre_rama_mision, tarea_id, bloques_codigo_objetivo_tarea)
+        tarea_actual_info["bloques_codigo_objetivo"] = bloques_codigo_objetivo_tarea
     bloques_codigo_input_para_ia = []
     rutas_archivos_para_leer_bloques = set() 
 
@@ -681,15 +712,13 @@ def paso2_ejecutar_tarea_mision(ruta_repo, nombre_rama_mision, api_provider, mod
                 # Si el archivo no existe, es posible que sea para creación.
                 # Se pasa un contenido vacío (o lista de líneas vacía).
                 logging.info(f"{logPrefix} Archivo '{ruta_abs_leer_bloque}' para bloque no existe. Se asume creación o se pasará vacío.")
-                contenido_archivos_bloques_leidos[ruta_abs_leer_bloque] = [] # Lista de líneas vacía
+                contenido_archivos_bloques_leidos[ruta_abs_leer_bloque] = 0 # Cero líneas
                 continue
-            try:
-                with open(ruta_abs_leer_bloque, 'r', encoding='utf-8') as f_bloque:
-                    contenido_crudo = f_bloque.read()
-                contenido_archivos_bloques_leidos[ruta_abs_leer_bloque] = contenido_crudo.splitlines(keepends=True) 
-            except Exception as e_leer_b:
-                logging.error(f"{logPrefix} Error leyendo archivo '{ruta_abs_leer_bloque}' para extraer bloques: {e_leer_b}")
-                contenido_archivos_bloques_leidos[ruta_abs_leer_bloque] = None # Marcar como no leído
+            # Solo se indexan los saltos de línea (mmap); el texto de cada bloque se lee después por rango
+            total_lineas_archivo = lectorLineas.contarLineas(ruta_abs_leer_bloque)
+            if total_lineas_archivo is None:
+                logging.error(f"{logPrefix} Error leyendo archivo '{ruta_abs_leer_bloque}' para extraer bloques.")
+            contenido_archivos_bloques_leidos[ruta_abs_leer_bloque] = total_lineas_archivo # None = no leído
 
     if bloques_codigo_objetivo_tarea: # No necesita 'and contenido_archivos_bloques_leidos' porque puede ser creación
         for bloque_info_md in bloques_codigo_objetivo_tarea:
@@ -700,7 +729,7 @@ def paso2_ejecutar_tarea_mision(ruta_repo, nombre_rama_mision, api_provider, mod
             
             ruta_abs_correspondiente = os.path.normpath(os.path.join(ruta_repo, ruta_rel))
 
-            if ruta_abs_correspondiente not in contenido_archivos_bloques_leidos:
+            if contenido_archivos_bloques_leidos.get(ruta_abs_correspondiente) is None:
                 # Esto puede pasar si _validar_y_normalizar_ruta falló antes para esta ruta_rel.
                 # O si la lectura del archivo falló (contenido_archivos_bloques_leidos[ruta_abs_correspondiente] es None).
                 if ruta_abs_correspondiente in contenido_archivos_bloques_leidos and contenido_archivos_bloques_leidos[ruta_abs_correspondiente] is None:
@@ -716,9 +745,9 @@ def paso2_ejecutar_tarea_mision(ruta_repo, nombre_rama_mision, api_provider, mod
                 logging.warning(f"{logPrefix} Archivo '{ruta_rel}' para bloque '{nombre_b}' no se pudo leer o no fue validado. Se envía con error a IA.")
                 continue
 
-            lineas_del_archivo = contenido_archivos_bloques_leidos[ruta_abs_correspondiente] # Puede ser [] si el archivo no existía
+            total_lineas = contenido_archivos_bloques_leidos[ruta_abs_correspondiente] # Puede ser 0 si el archivo no existía
             
-            if not (1 <= l_ini <= l_fin <= len(lineas_del_archivo) or (l_ini == 1 and l_fin == 1 and not lineas_del_archivo)): # Última condición para creación
+            if not (1 <= l_ini <= l_fin <= total_lineas or (l_ini == 1 and l_fin == 1 and not total_lineas)): # Última condición para creación
                 if l_ini == 1 and (l_fin == 1 or l_fin == 0) and not os.path.exists(ruta_abs_correspondiente): # l_fin 0 también es válido para IA en creación
                      bloques_codigo_input_para_ia.append({
                         "ruta_archivo": ruta_rel,
@@ -730,15 +759,18 @@ def paso2_ejecutar_tarea_mision(ruta_repo, nombre_rama_mision, api_provider, mod
                      logging.info(f"{logPrefix} Preparado bloque para CREACIÓN: Archivo '{ruta_rel}', Bloque '{nombre_b}' (L{l_ini}-{l_fin}).")
                 else:
                     logging.warning(f"{logPrefix} Rango de líneas [{l_ini}-{l_fin}] para bloque '{nombre_b}' en '{ruta_rel}' "
-                                    f"inválido o fuera de los límites (total líneas: {len(lineas_del_archivo)}). Se envía con error a IA.")
+                                    f"inválido o fuera de los límites (total líneas: {total_lineas}). Se envía con error a IA.")
                     bloques_codigo_input_para_ia.append({
                         "ruta_archivo": ruta_rel, "nombre_bloque": nombre_b,
                         "linea_inicio_original": l_ini, "linea_fin_original": l_fin,
-                        "contenido_actual_bloque": f"// ERROR: Rango de líneas [{l_ini}-{l_fin}] inválido para archivo con {len(lineas_del_archivo)} líneas."
+                        "contenido_actual_bloque": f"// ERROR: Rango de líneas [{l_ini}-{l_fin}] inválido para archivo con {total_lineas} líneas."
                     })
                 continue
             
-            contenido_bloque_extraido = "".join(lineas_del_archivo[l_ini-1:l_fin])
+            contenido_bloque_extraido = lectorLineas.leerRangoLineas(ruta_abs_correspondiente, l_ini, l_fin)
+            if contenido_bloque_extraido is None:
+                contenido_bloque_extraido = f"// ERROR: No se pudo leer el archivo '{ruta_rel}' para extraer este bloque."
+                logging.warning(f"{logPrefix} No se pudieron leer las líneas [{l_ini}-{l_fin}] de '{ruta_rel}' para bloque '{nombre_b}'. Se envía con error a IA.")
             bloques_codigo_input_para_ia.append({
                 "ruta_archivo": ruta_rel,
                 "nombre_bloque": nombre_b,
@@ -752,13 +784,14 @@ def paso2_ejecutar_tarea_mision(ruta_repo, nombre_rama_mision, api_provider, mod
     if archivos_principal_limpios: archivos_para_leer_contexto_general_rel.extend(archivos_principal_limpios)
     archivos_para_leer_contexto_general_rel.extend(archivos_ctx_ejecucion_limpios)
     archivos_para_leer_contexto_general_rel.extend(archivos_especificos_tarea_limpios)
-    archivos_para_leer_contexto_general_rel = sorted(list(set(archivos_para_leer_contexto_general_rel)))
+    archivos_para_leer_contexto_general_rel = list(dict.fromkeys(archivos_para_leer_contexto_general_rel))
     
     contexto_general_archivos_str = ""
     tokens_contexto_general = 0
     if archivos_para_leer_contexto_general_rel:
         archivos_abs_ctx_general = [os.path.join(ruta_repo, f_rel) for f_rel in archivos_para_leer_contexto_general_rel]
-        resultado_lectura_ctx_general = analizadorCodigo.leerArchivos(archivos_abs_ctx_general, ruta_repo, api_provider=api_provider)
+        resultado_lectura_ctx_general = analizadorCodigo.leerArchivos(archivos_abs_ctx_general, ruta_repo, api_provider=api_provider,
+                                                                      max_tokens=settings.PRESUPUESTO_TOKENS_CONTEXTO or None)
         contexto_general_archivos_str = resultado_lectura_ctx_general['contenido'] # No se usa en el prompt granular, pero sí para tokens
         tokens_contexto_general = resultado_lectura_ctx_general['tokens']
         logging.info(f"{logPrefix} Contexto general leído de {len(archivos_para_leer_contexto_general_rel)} archivo(s) para cálculo de tokens.")
@@ -768,16 +801,81 @@ def paso2_ejecutar_tarea_mision(ruta_repo, nombre_rama_mision, api_provider, mod
     tokens_mision_y_tarea_desc = analizadorCodigo.contarTokensTexto(contenido_mision_actual_md + tarea_actual_info.get('descripcion', ''), api_provider)
     tokens_bloques_objetivo = analizadorCodigo.contarTokensTexto(json.dumps(bloques_codigo_input_para_ia), api_provider)
     tokens_estimados = 800 + tokens_contexto_general + tokens_mision_y_tarea_desc + tokens_bloques_objetivo
+    return bloques_codigo_input_para_ia, tokens_estimados
+
+def paso2_ejecutar_tarea_mision(ruta_repo, nombre_rama_mision, api_provider, modo_automatico):
+    # Esta función ahora es llamada cuando ya se está en la rama de la misión.
+    # El contenido de la misión (metadatos, lista_tareas) se carga desde el archivo en la rama.
+    logPrefix = f"paso2_ejecutar_tarea_mision (Rama: {nombre_rama_mision}):"
+    logging.info(f"{logPrefix} Iniciando ejecución de tarea.")
+
+    # Nombre del archivo de misión dinámico
+    nombre_archivo_mision = f"{nombre_rama_mision}.md"
+
+    # Asegurar estar en la rama correcta (doble check)
+    if manejadorGit.obtener_rama_actual(ruta_repo) != nombre_rama_mision:
+        logging.warning(
+            f"{logPrefix} No se estaba en la rama '{nombre_rama_mision}'. Intentando cambiar...")
+        if not manejadorGit.cambiar_a_rama_existente(ruta_repo, nombre_rama_mision):
+            logging.error(
+                f"{logPrefix} No se pudo cambiar a rama '{nombre_rama_mision}'. Abortando tarea.")
+            return "error_critico_git", None
+
+    ruta_mision_actual_md = os.path.join(ruta_repo, nombre_archivo_mision)
+    contenido_mision_actual_md = ""
+    if os.path.exists(ruta_mision_actual_md):
+        with open(ruta_mision_actual_md, 'r', encoding='utf-8') as f:
+            contenido_mision_actual_md = f.read()
+    else:
+        logging.error(
+            f"{logPrefix} Archivo de misión '{nombre_archivo_mision}' no encontrado en la rama '{nombre_rama_mision}'. Abortando tarea.")
+        return "error_critico_mision_no_encontrada", None
+
+    ruta_sidecar_mision = manejadorMision.rutaSidecar(ruta_repo, nombre_rama_mision)
+    metadatos_mision, lista_tareas_mision, _ = manejadorMision.parsear_mision_orion(
+        contenido_mision_actual_md, ruta_sidecar=ruta_sidecar_mision)
+    if not metadatos_mision:
+        logging.error(
+            f"{logPrefix} Fallo al re-parsear '{nombre_archivo_mision}' desde la rama. Abortando tarea.")
+        return "error_critico_parseo_mision", contenido_mision_actual_md
+
+    tarea_actual_info, _ = manejadorMision.obtener_proxima_tarea_pendiente(
+        lista_tareas_mision, max_reintentos=metadatos_mision.get("max_reintentos"))
+
+    if not tarea_actual_info:
+        logging.info(
+            f"{logPrefix} No se encontraron tareas pendientes en '{nombre_rama_mision}'. Considerada completada.")
+        return "mision_completada", contenido_mision_actual_md
+
+    tarea_id = tarea_actual_info.get("id", "N/A_ID")
+    tarea_titulo = tarea_actual_info.get("titulo", "N/A_Titulo")
+    logging.info(
+        f"{logPrefix} Tarea a ejecutar: ID '{tarea_id}', Título: '{tarea_titulo}'")
+
+    bloques_codigo_input_para_ia, tokens_estimados = _prepararEntradaTarea(
+        ruta_repo, nombre_rama_mision, metadatos_mision, tarea_actual_info, contenido_mision_actual_md, api_provider)
 
     gestionar_limite_tokens(tokens_estimados, api_provider)
 
+    # Con STREAMING_IA cada operación se aplica en cuanto llega completa. Es equivalente a aplicarlas
+    # al final, porque aplicarCambiosGranulares también las procesa en orden, una tras otra.
+    estado_streaming = {"aplicadas": 0, "error": None}
+
+    def _aplicar_modificacion_en_streaming(op):
+        exito_op, msg_op = aplicadorCambios.aplicarCambiosGranulares({"modificaciones": [op]}, ruta_repo)
+        if not exito_op:
+            estado_streaming["error"] = msg_op or "Fallo aplicando operación recibida en streaming."
+            raise RuntimeError(estado_streaming["error"])
+        estado_streaming["aplicadas"] += 1
+
     resultado_ejecucion_tarea = analizadorCodigo.ejecutar_tarea_especifica_mision(
         tarea_actual_info, 
         contenido_mision_actual_md, 
         bloques_codigo_input_para_ia, 
-        api_provider
+        api_provider,
+        al_recibir_modificacion=_aplicar_modificacion_en_streaming if settings.STREAMING_IA else None
     )
-    registrar_tokens_usados(resultado_ejecucion_tarea.get("tokens_consumidos_api", tokens_estimados) if resultado_ejecucion_tarea else tokens_estimados)
+    registrar_tokens_usados(resultado_ejecucion_tarea.get("uso_api") or tokens_estimados if resultado_ejecucion_tarea else tokens_estimados)
 
     contenido_mision_post_tarea = contenido_mision_actual_md  
 
@@ -816,7 +914,13 @@ def paso2_ejecutar_tarea_mision(ruta_repo, nombre_rama_mision, api_provider, mod
     tiene_archivos_sobrescribir = isinstance(archivos_modificados_dict, dict) and bool(archivos_modificados_dict)
 
 
-    if adv and not tiene_modificaciones_granulares and not tiene_archivos_sobrescribir:
+    if estado_streaming["error"] or (estado_streaming["aplicadas"] and not tiene_modificaciones_granulares):
+        # Ya se tocaron archivos durante el streaming y la respuesta acabó siendo inválida: se trata como
+        # fallo de aplicación para que se descarten los cambios locales.
+        aplicador_usado = "granular_streaming"
+        exito_aplicar = False
+        msg_err_aplicar = estado_streaming["error"] or adv or "Respuesta inválida tras aplicar operaciones en streaming."
+    elif adv and not tiene_modificaciones_granulares and not tiene_archivos_sobrescribir:
         logging.warning(f"{logPrefix} IA advirtió: {adv}. Tarea no resultó en cambios propuestos. Marcando como SALTADA.")
         contenido_mision_post_tarea = manejadorMision.marcar_tarea_como_completada(
             contenido_mision_actual_md, tarea_id, "SALTADA")
@@ -833,15 +937,22 @@ def paso2_ejecutar_tarea_mision(ruta_repo, nombre_rama_mision, api_provider, mod
                 outcome=f"PASO2_TAREA_SALTADA_IA_ADV:{nombre_rama_mision}", decision=tarea_actual_info, 
                 result_details={"advertencia": adv, "aplicador_usado": aplicador_usado})
         ])
-        _, _, hay_pendientes_despues_salto = manejadorMision.parsear_mision_orion(contenido_mision_post_tarea)
+        _, _, hay_pendientes_despues_salto = manejadorMision.parsear_mision_orion(
+            contenido_mision_post_tarea, ruta_sidecar=ruta_sidecar_mision)
         return "mision_completada" if not hay_pendientes_despues_salto else "tarea_ejecutada_continuar_mision", contenido_mision_post_tarea
     
-    if tiene_modificaciones_granulares:
+    elif tiene_modificaciones_granulares:
         aplicador_usado = "granular"
         logging.info(f"{logPrefix} Respuesta de IA contiene 'modificaciones' ({len(resultado_ejecucion_tarea['modificaciones'])} ops). Usando aplicador granular.")
-        exito_aplicar, msg_err_aplicar = aplicadorCambios.aplicarCambiosGranulares(
-            resultado_ejecucion_tarea, ruta_repo
-        )
+        if estado_streaming["aplicadas"]:
+            logging.info(f"{logPrefix} {estado_streaming['aplicadas']} operación(es) ya aplicadas durante el streaming.")
+        ops_pendientes = resultado_ejecucion_tarea["modificaciones"][estado_streaming["aplicadas"]:]
+        if ops_pendientes:
+            exito_aplicar, msg_err_aplicar = aplicadorCambios.aplicarCambiosGranulares(
+                {**resultado_ejecucion_tarea, "modificaciones": ops_pendientes}, ruta_repo
+            )
+        else:
+            exito_aplicar, msg_err_aplicar = True, None
     elif tiene_archivos_sobrescribir:
         # --- INICIO MODIFICACIÓN C.3 ---
         aplicador_usado = "ninguno_protocolo_violado" 
@@ -951,9 +1062,165 @@ def paso2_ejecutar_tarea_mision(ruta_repo, nombre_rama_mision, api_provider, mod
             result_details=detalles_resultado_historial)
     ])
 
-    _, _, hay_pendientes_actualizada = manejadorMision.parsear_mision_orion(contenido_mision_post_tarea)
+    _, _, hay_pendientes_actualizada = manejadorMision.parsear_mision_orion(
+        contenido_mision_post_tarea, ruta_sidecar=ruta_sidecar_mision)
     return "mision_completada" if not hay_pendientes_actualizada else "tarea_ejecutada_continuar_mision", contenido_mision_post_tarea
 # --- Función Principal de Fase del Agente (MODIFICADO) ---
+def _aplicarResultadoTareaLote(ruta_repo, nombre_rama_mision, tarea, resultado):
+    """
+    Aplica y commitea la respuesta de la IA para una tarea de un lote (mismos casos que
+    paso2_ejecutar_tarea_mision). Devuelve (nuevo_estado, outcome_historial, mensaje_error).
+    """
+    logPrefix = f"_aplicarResultadoTareaLote ({tarea.get('id')}):"
+    if not resultado or not isinstance(resultado, dict):
+        logging.error(f"{logPrefix} IA no generó una respuesta de cambios válida (nula o no es dict). Respuesta: {resultado}")
+        return "FALLIDA_TEMPORALMENTE", "PASO2_ERROR_TAREA_IA_FORMATO", "IA no generó respuesta válida (nula o no dict)"
+
+    adv = resultado.get("advertencia_ejecucion")
+    modificaciones = resultado.get("modificaciones")
+    tiene_modificaciones_granulares = isinstance(modificaciones, list) and len(modificaciones) > 0
+    archivos_modificados_dict = resultado.get("archivos_modificados")
+    tiene_archivos_sobrescribir = isinstance(archivos_modificados_dict, dict) and bool(archivos_modificados_dict)
+
+    if tiene_modificaciones_granulares:
+        # El lote solo separa las tareas por sus archivos declarados: una operación sobre otro archivo
+        # podría cruzarse con otra tarea del lote preparada desde el mismo contenido original.
+        rutas_no_declaradas = manejadorMision.rutasFueraDeTarea(tarea, modificaciones)
+        if rutas_no_declaradas:
+            msg = f"Operaciones sobre archivos no declarados en la tarea (no permitido en lote): {rutas_no_declaradas}"
+            logging.error(f"{logPrefix} {msg}. No se aplica ningún cambio.")
+            return "FALLIDA_TEMPORALMENTE", "PASO2_APPLY_FAIL", msg
+        exito_aplicar, msg_err_aplicar = aplicadorCambios.aplicarCambiosGranulares(resultado, ruta_repo)
+        if not exito_aplicar:
+            logging.error(f"{logPrefix} Falló aplicación de cambios (granular): {msg_err_aplicar}")
+            # Las tareas anteriores del lote ya están commiteadas: solo se descarta esta
+            manejadorGit.descartarCambiosLocales(ruta_repo)
+            return "FALLIDA_TEMPORALMENTE", "PASO2_APPLY_FAIL", msg_err_aplicar
+        if adv:
+            logging.warning(f"{logPrefix} Advertencia de IA (aunque los cambios se aplicaron): {adv}")
+        commit_msg = f"Tarea ID {tarea.get('id')} ({(tarea.get('titulo') or '')[:50]}) completada (Misión {nombre_rama_mision})"
+        if not manejadorGit.hacerCommit(ruta_repo, commit_msg):
+            logging.warning(f"{logPrefix} No se realizó commit de los cambios de código para la tarea (quizás sin cambios efectivos).")
+        return "COMPLETADA", "PASO2_TAREA_OK", None
+    if adv and not tiene_archivos_sobrescribir:
+        logging.warning(f"{logPrefix} IA advirtió: {adv}. Tarea no resultó en cambios propuestos. Marcando como SALTADA.")
+        return "SALTADA", "PASO2_TAREA_SALTADA_IA_ADV", None
+    if tiene_archivos_sobrescribir:
+        logging.critical(f"{logPrefix} ADVERTENCIA SEVERA: IA violó protocolo granular. Devolvió 'archivos_modificados' en lugar de 'modificaciones'.")
+        return ("FALLIDA_TEMPORALMENTE", "PASO2_TAREA_FALLIDA_IA_PROTOCOLO_SOBRESCRITURA",
+                "IA devolvió 'archivos_modificados' en lugar de 'modificaciones'. No se aplicaron cambios.")
+    logging.error(f"{logPrefix} IA devolvió un diccionario sin formato de cambios reconocido. Respuesta: {resultado}")
+    return "FALLIDA_TEMPORALMENTE", "PASO2_ERROR_TAREA_IA_NO_CAMBIOS_RECONOCIDOS", "IA devolvió dict pero sin formato de cambios reconocido."
+
+
+def paso2_ejecutar_lote_tareas(ruta_repo, nombre_rama_mision, api_provider, modo_automatico, max_tareas):
+    """
+    Variante de paso2_ejecutar_tarea_mision para TAREAS_PARALELAS > 1. Elige hasta `max_tareas`
+    tareas listas e independientes (dependencias declaradas o inferidas por solape de bloques
+    cumplidas y sin archivos en común, ver manejadorMision.PlanificadorTareas.lote), lanza sus
+    llamadas a la IA a la vez y después aplica y commitea sus cambios uno a uno en el orden de la
+    misión. Los estados se escriben en el .md en una sola actualización al final. Devuelve lo mismo
+    que paso2_ejecutar_tarea_mision.
+    """
+    logPrefix = f"paso2_ejecutar_lote_tareas (Rama: {nombre_rama_mision}):"
+    nombre_archivo_mision = f"{nombre_rama_mision}.md"
+    ruta_mision_actual_md = os.path.join(ruta_repo, nombre_archivo_mision)
+
+    if manejadorGit.obtener_rama_actual(ruta_repo) != nombre_rama_mision:
+        if not manejadorGit.cambiar_a_rama_existente(ruta_repo, nombre_rama_mision):
+            logging.error(f"{logPrefix} No se pudo cambiar a rama '{nombre_rama_mision}'. Abortando lote.")
+            return "error_critico_git", None
+    if not os.path.exists(ruta_mision_actual_md):
+        logging.error(f"{logPrefix} Archivo de misión '{nombre_archivo_mision}' no encontrado. Abortando lote.")
+        return "error_critico_mision_no_encontrada", None
+    with open(ruta_mision_actual_md, 'r', encoding='utf-8') as f:
+        contenido_mision_actual_md = f.read()
+
+    ruta_sidecar_mision = manejadorMision.rutaSidecar(ruta_repo, nombre_rama_mision)
+    metadatos_mision, lista_tareas_mision, _ = manejadorMision.parsear_mision_orion(
+        contenido_mision_actual_md, ruta_sidecar=ruta_sidecar_mision)
+    if not metadatos_mision:
+        logging.error(f"{logPrefix} Fallo al parsear '{nombre_archivo_mision}'. Abortando lote.")
+        return "error_critico_parseo_mision", contenido_mision_actual_md
+
+    planificador = manejadorMision.PlanificadorTareas(
+        lista_tareas_mision, metadatos_mision.get("max_reintentos"), inferirSolapes=True)
+    lote = planificador.lote(max_tareas)
+    if len(lote) <= 1:
+        # Nada que paralelizar: el flujo de una tarea cubre también el caso de misión terminada
+        return paso2_ejecutar_tarea_mision(ruta_repo, nombre_rama_mision, api_provider, modo_automatico)
+    logging.info(f"{logPrefix} Ejecutando {len(lote)} tareas independientes a la vez: {[t.get('id') for t, _ in lote]}")
+
+    # Preparación secuencial (lee y re-ancla bloques sobre el árbol actual, igual para todas)
+    entradas = [_prepararEntradaTarea(ruta_repo, nombre_rama_mision, metadatos_mision, tarea,
+                                      contenido_mision_actual_md, api_provider) for tarea, _ in lote]
+
+    def _llamarIA(tarea, bloques_codigo_input_para_ia, tokens_estimados):
+        # La reserva de tokens es por hilo: se reserva y ajusta en el mismo hilo que hace la llamada
+        gestionar_limite_tokens(tokens_estimados, api_provider)
+        resultado = None
+        try:
+            resultado = analizadorCodigo.ejecutar_tarea_especifica_mision(
+                tarea, contenido_mision_actual_md, bloques_codigo_input_para_ia, api_provider)
+        except Exception as e:
+            logging.error(f"{logPrefix} Error en la llamada IA de la tarea '{tarea.get('id')}': {e}", exc_info=True)
+        registrar_tokens_usados(resultado.get("uso_api") or tokens_estimados if isinstance(resultado, dict) else tokens_estimados)
+        return resultado
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(lote)) as ejecutor:
+        futuros = [ejecutor.submit(_llamarIA, tarea, bloques, tokens)
+                   for (tarea, _), (bloques, tokens) in zip(lote, entradas)]
+        resultados = [futuro.result() for futuro in futuros]
+
+    # Aplicación y commit deterministas, en el orden de la misión. El estado de una tarea que
+    # commitea código se escribe en el .md justo después (como en paso2_ejecutar_tarea_mision), para
+    # que una caída a mitad de lote no la deje PENDIENTE sobre sus propios cambios. Los estados de las
+    # tareas que no tocaron código se acumulan y van en la siguiente actualización.
+    estado_md = {"contenido": contenido_mision_actual_md, "mision": None}
+    estados_nuevos = {}
+    estados_por_escribir = {}
+    entradas_historial = []
+
+    def _guardarEstados():
+        contenido_nuevo, mision_nueva = manejadorMision.actualizar_estados_tareas(
+            estado_md["contenido"], estados_por_escribir, incrementar_intentos_si_fallida_temp=True)
+        if not contenido_nuevo:
+            return False
+        try:
+            with open(ruta_mision_actual_md, 'w', encoding='utf-8') as f:
+                f.write(contenido_nuevo)
+        except Exception as e:
+            logging.error(f"{logPrefix} Error guardando {nombre_archivo_mision} durante el lote: {e}")
+            return False
+        resumen = ", ".join(f"{id_tarea} {estado}" for id_tarea, estado in estados_por_escribir.items())
+        if not manejadorGit.hacerCommitEspecifico(ruta_repo, f"Actualizar Misión '{nombre_rama_mision}': {resumen}", [nombre_archivo_mision]):
+            logging.error(f"{logPrefix} No se pudo commitear la actualización de {nombre_archivo_mision} ({resumen}).")
+        manejadorHistorial.guardarHistorial(manejadorHistorial.cargarHistorial() + entradas_historial)
+        estado_md["contenido"], estado_md["mision"] = contenido_nuevo, mision_nueva
+        estados_por_escribir.clear()
+        entradas_historial.clear()
+        return True
+
+    for (tarea, _), resultado in sorted(zip(lote, resultados), key=lambda par: par[0][1]):
+        nuevo_estado, outcome, mensaje_error = _aplicarResultadoTareaLote(ruta_repo, nombre_rama_mision, tarea, resultado)
+        estados_nuevos[tarea.get("id")] = estados_por_escribir[tarea.get("id")] = nuevo_estado
+        adv = resultado.get("advertencia_ejecucion") if isinstance(resultado, dict) else None
+        detalles = {"aplicador_usado": "granular_lote", "advertencia_ia": adv or "Ninguna"}
+        if nuevo_estado == "FALLIDA_TEMPORALMENTE":
+            detalles["respuesta_ia_raw"] = resultado
+        entradas_historial.append(manejadorHistorial.formatearEntradaHistorial(
+            outcome=f"{outcome}:{nombre_rama_mision}", decision=tarea, result_details=detalles, error_message=mensaje_error))
+        if nuevo_estado == "COMPLETADA" and not _guardarEstados():
+            return "error_critico_actualizando_mision", estado_md["contenido"]
+    if estados_por_escribir and not _guardarEstados():
+        return "error_critico_actualizando_mision", estado_md["contenido"]
+
+    contenido_mision_post_lote, mision_actualizada = estado_md["contenido"], estado_md["mision"]
+    if "FALLIDA_TEMPORALMENTE" in estados_nuevos.values():
+        return "tarea_fallida", contenido_mision_post_lote
+    hay_pendientes = mision_actualizada.hayPendientes if mision_actualizada else True
+    return "mision_completada" if not hay_pendientes else "tarea_ejecutada_continuar_mision", contenido_mision_post_lote
+
 def _intentarCrearMisionDesdeTodoMD(api_provider: str, modo_automatico: bool):
     logPrefix = "_intentarCrearMisionDesdeTodoMD:"
     if not modo_automatico:
@@ -975,13 +1242,14 @@ def _intentarCrearMisionDesdeTodoMD(api_provider: str, modo_automatico: bool):
             return False
         
         logging.info(f"{logPrefix} TODO.md con contenido. Intentando generar misión.")
-        tokens_estimados = 700 + analizadorCodigo.contarTokensTexto(contenido_todo_md, api_provider)
+        tokens_estimados = 700 + analizadorCodigo.contarTokensTexto(contenido_todo_md, api_provider) + \
+            settings.PRESUPUESTO_TOKENS_RECUPERACION  # Fragmentos de código recuperados para el prompt
         gestionar_limite_tokens(tokens_estimados, api_provider)
 
         mision_dict = analizadorCodigo.generar_contenido_mision_desde_texto_guia(
             settings.RUTACLON, contenido_todo_md, "TODO.md", api_provider
         )
-        registrar_tokens_usados(mision_dict.get("tokens_consumidos_api", tokens_estimados) if mision_dict else tokens_estimados)
+        registrar_tokens_usados(mision_dict.get("uso_api") or tokens_estimados if mision_dict else tokens_estimados)
 
         if not mision_dict or not mision_dict.get("nombre_clave_mision") or not mision_dict.get("contenido_markdown_mision"):
             logging.warning(f"{logPrefix} IA no generó misión válida desde TODO.md. Respuesta: {mision_dict}")
@@ -1112,7 +1380,8 @@ def _intentarCrearMisionDesdeTodoMD(api_provider: str, modo_automatico: bool):
 
         # Verificar si hay tareas pendientes después de la validación granular (que ya valida si lista_tareas_val existe y tiene elementos)
         # Si la validación granular pasó, y lista_tareas_val no era vacía, hay_pendientes debería ser true si alguna tarea está PENDIENTE.
-        _, _, hay_pendientes = manejadorMision.parsear_mision_orion(contenido_md) # Re-parsear por si acaso
+        _, _, hay_pendientes = manejadorMision.parsear_mision_orion(
+            contenido_md, ruta_sidecar=manejadorMision.rutaSidecar(settings.RUTACLON, nombre_clave)) # Ya en memoria; guarda el sidecar
         if not hay_pendientes: # Esto también cubriría el caso de que la validación granular pasara con lista_tareas_val vacía (lo cual no debería ocurrir por la lógica de validación)
             logging.error(f"{logPrefix} ERROR: Misión '{nombre_clave}' desde TODO.md generada SIN TAREAS PENDIENTES (o ninguna tarea en absoluto después de validación). Limpiando.")
             manejadorGit.cambiar_a_rama_existente(settings.RUTACLON, rama_base)
@@ -1132,6 +1401,7 @@ def _intentarCrearMisionDesdeTodoMD(api_provider: str, modo_automatico: bool):
             return False
 
         logging.info(f"{logPrefix} Misión '{nombre_clave}' generada, validada y commiteada desde TODO.md.")
+        anclajeBloques.registrarAnclas(settings.RUTACLON, nombre_clave, lista_tareas_val)
         guardar_estado_mision_activa(nombre_clave)
         manejadorHistorial.guardarHistorial(manejadorHistorial.cargarHistorial() + [
             manejadorHistorial.formatearEntradaHistorial(
@@ -1376,8 +1646,31 @@ def _crearNuevaMision(api_provider: str, modo_automatico: bool, registro_archivo
     # Su valor de retorno es el resultado final de nuestra fase de creación.
     return _intentarCrearMisionDesdeSeleccionArchivo(api_provider, modo_automatico, registro_archivos_analizados)
 
+def _motivoFinPresupuestoFase(inicio_fase, inicio_tareas, tareas_ejecutadas):
+    """
+    Motivo para no empezar otra tarea de la misión en esta fase, o None si queda presupuesto.
+    La siguiente tarea tiene que caber (según la duración media de las anteriores) antes del
+    presupuesto de tiempo y, en todo caso, antes de la alarma del timeout global.
+    """
+    if tareas_ejecutadas >= settings.MAX_TAREAS_POR_FASE:
+        return f"límite de {settings.MAX_TAREAS_POR_FASE} tarea(s) por fase"
+    ahora = time.monotonic()
+    media_por_tarea = (ahora - inicio_tareas) / tareas_ejecutadas
+    limite_segundos = min(settings.PRESUPUESTO_SEGUNDOS_FASE or settings.SCRIPT_EXECUTION_TIMEOUT_SECONDS,
+                          settings.SCRIPT_EXECUTION_TIMEOUT_SECONDS)
+    if ahora - inicio_fase + media_por_tarea > limite_segundos:
+        return (f"presupuesto de tiempo ({ahora - inicio_fase:.0f}s usados, ~{media_por_tarea:.0f}s por tarea, "
+                f"límite {limite_segundos}s)")
+    with _lock_tokens_fase:
+        tokens_consumidos = _tokens_fase['consumidos']
+    if settings.PRESUPUESTO_TOKENS_FASE and tokens_consumidos >= settings.PRESUPUESTO_TOKENS_FASE:
+        return f"presupuesto de tokens ({tokens_consumidos}/{settings.PRESUPUESTO_TOKENS_FASE})"
+    return None
+
+
 def ejecutarFaseDelAgente(api_provider: str, modo_automatico: bool):
     logPrefix = f"ejecutarFaseDelAgente({api_provider.upper()}):"
+    inicio_fase = time.monotonic()
     logging.info(f"{logPrefix} ===== INICIO FASE AGENTE =====")
     
     
@@ -1399,16 +1692,34 @@ def ejecutarFaseDelAgente(api_provider: str, modo_automatico: bool):
 
     # --- PROCESAR MISIÓN EXISTENTE (SI HAY) ---
     if nombre_clave_mision_activa:
-        estado_proc_mision, exito_fase_mision_existente = _procesarMisionExistente(
-            nombre_clave_mision_activa, api_provider, modo_automatico
-        )
+        # Con MAX_TAREAS_POR_FASE > 1 se encadenan tareas sin reiniciar el proceso. Cada vuelta deja
+        # el .md de la misión commiteado (y subido en modo automático) igual que una fase de una sola
+        # tarea, así que tras una caída la siguiente ejecución retoma desde la misma tarea.
+        inicio_tareas = time.monotonic()
+        tareas_ejecutadas = 0
+        while True:
+            estado_proc_mision, exito_fase_mision_existente = _procesarMisionExistente(
+                nombre_clave_mision_activa, api_provider, modo_automatico
+            )
+            if estado_proc_mision == "TAREA_FALLIDA_FIN_FASE" and settings.MAX_TAREAS_POR_FASE > 1:
+                logging.info(f"{logPrefix} Tarea fallida: fin de la fase; el reintento queda para la siguiente ejecución.")
+            if estado_proc_mision != "CONTINUAR_PROCESAMIENTO_MISION":
+                break
+            tareas_ejecutadas += 1
+            motivo_fin = _motivoFinPresupuestoFase(inicio_fase, inicio_tareas, tareas_ejecutadas)
+            if motivo_fin:
+                if settings.MAX_TAREAS_POR_FASE > 1:
+                    logging.info(f"{logPrefix} Fin de la fase tras {tareas_ejecutadas} tarea(s): {motivo_fin}.")
+                break
+            logging.info(
+                f"{logPrefix} Tarea {tareas_ejecutadas}/{settings.MAX_TAREAS_POR_FASE} de la fase terminada. Continuando con la misión '{nombre_clave_mision_activa}'.")
 
         if estado_proc_mision == "PROCEDER_A_CREAR_NUEVA_MISION":
             # La misión activa no era procesable, o se completó/finalizó y se limpió el estado.
             # _procesarMisionExistente ya se encargó de limpiar .active_mission y cambiar a RAMATRABAJO.
             logging.info(f"{logPrefix} Se procederá a crear una nueva misión.")
             # La ejecución continúa al bloque de creación de nueva misión.
-        elif estado_proc_mision in ["CONTINUAR_PROCESAMIENTO_MISION", "MISION_COMPLETADA_O_FINALIZADA"]:
+        elif estado_proc_mision in ["CONTINUAR_PROCESAMIENTO_MISION", "MISION_COMPLETADA_O_FINALIZADA", "TAREA_FALLIDA_FIN_FASE"]:
             # La misión activa fue procesada (tarea ejecutada, o misión completada).
             # El script debe detenerse para la siguiente fase o porque la misión terminó.
             return exito_fase_mision_existente  # Debería ser True
@@ -1546,8 +1857,12 @@ def _procesarMisionExistente(nombreClaveMisionActiva: str, proveedorApi: str, mo
     if resultadoPaso0 == "procesar_mision_existente":
         logging.info(
             f"{logPrefix} Misión '{nombreClaveMisionActiva}' confirmada en rama, procesando tarea.")
-        resultadoPaso2, _ = paso2_ejecutar_tarea_mision(
-            settings.RUTACLON, nombreClaveMisionActiva, proveedorApi, modoAutomatico)
+        if settings.TAREAS_PARALELAS > 1:
+            resultadoPaso2, _ = paso2_ejecutar_lote_tareas(
+                settings.RUTACLON, nombreClaveMisionActiva, proveedorApi, modoAutomatico, settings.TAREAS_PARALELAS)
+        else:
+            resultadoPaso2, _ = paso2_ejecutar_tarea_mision(
+                settings.RUTACLON, nombreClaveMisionActiva, proveedorApi, modoAutomatico)
 
         if resultadoPaso2 == "tarea_ejecutada_continuar_mision":
             logging.info(
@@ -1588,8 +1903,9 @@ def _procesarMisionExistente(nombreClaveMisionActiva: str, proveedorApi: str, mo
                     settings.RUTACLON, nombreClaveMisionActiva)
             # La fase se considera exitosa en términos de que el agente realizó su ciclo,
             # el script principal terminará y se reiniciará. La lógica de reintentos o manejo de fallos
-            # se aplicará en la siguiente ejecución al seleccionar la próxima tarea.
-            return "CONTINUAR_PROCESAMIENTO_MISION", True
+            # se aplicará en la siguiente ejecución al seleccionar la próxima tarea. Es un estado propio para
+            # que ejecutarFaseDelAgente no encadene el reintento en la misma fase (MAX_TAREAS_POR_FASE > 1).
+            return "TAREA_FALLIDA_FIN_FASE", True
 
         else:
             # Casos como: "error_critico_actualizando_mision", "error_critico_mision_no_encontrada", "error_critico_parseo_mision"
@@ -1631,6 +1947,8 @@ if __name__ == "__main__":
                         help="Utilizar OpenRouter como proveedor de IA.")
     parser.add_argument("--reset", action="store_true",
                         help="Formatea el estado del agente (borra misión activa, rama de misión local asociada, etc.) y sale.")
+    parser.add_argument("--sin-cache-ia", action="store_true",
+                        help="Ignora la cache de respuestas IA en disco (ni lee ni escribe).")
 
     args = parser.parse_args()
 